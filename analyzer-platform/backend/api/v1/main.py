@@ -6,20 +6,37 @@ import os
 import uuid
 from datetime import datetime
 from typing import List, Optional
-from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, status
+from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Query, status
 from fastapi.responses import JSONResponse, FileResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from core.database import get_db
-from services.html_parser import parse_analyzer_html_file
-from models.report import Melt, NetworkConnection, NetworkPort, RemoteHost
-from pydantic import BaseModel
-from services.report_deduplication import generate_report_hash, find_duplicate_reports, create_hash_based_filename
-from sqlalchemy import select, desc, or_, func
-import json
-from sqlalchemy.orm import selectinload
+from core.config import get_settings
+from core.database import cache_fill_session, get_db, get_read_db
+from core.redis_client import cache, invalidate_report_cache
+from services.html_parser import sniff_hostname
+from services.ingest_queue import (
+    enqueue_upload, get_dead_letters, get_ingest_queue_stats, get_upload_status, incoming_dir, redrive_dead_letters
+)
+from models.report import Melt, ReportHash
+from pydantic import BaseModel, Field
+from services.report_ingest import load_raw_data, upsert_parsed_report
+from services.reconciler import STATUS_FILE_MISSING, get_drift_report, storage_reconciler
+from services.changes import ChangeQueryError, get_host_timeline, get_report_changes
+from services.delta import (
+    DeltaError, compute_delta, forget_deleted_reports, get_host_latest_delta, get_previous_melt, get_recent_changes,
+    get_stored_delta, notify_delta_worker
+)
+from services.anomalies import ANOMALY_KINDS, AnomalyQueryError, get_findings
+from services.graph import GraphQueryError, get_endpoint_edges, get_host_edges, get_subgraph, retract_report_edges
+from services.metrics import SeriesQueryError, get_host_series
+from services.rules import RuleError, create_rule, get_alerts, get_rule, list_rules, rule_item, update_rule
+from services.port_index import PortIndexError, parse_port_key, port_index, refresh_hosts
+from services.summaries import get_report_summaries
+from services.search import SEARCH_TYPES, SearchQueryError, filter_connections, search
+from sqlalchemy import select, desc, func, delete
 
 # Создаем главный роутер
 api_router = APIRouter()
+settings = get_settings()
 
 # Pydantic модели для ответов
 class MeltSummary(BaseModel):
@@ -40,16 +57,22 @@ class MeltsList(BaseModel):
     melts: List[MeltSummary]
     total: int
 
-def serialize_datetime_for_json(obj):
-    """Сериализует datetime объекты для JSON"""
-    if isinstance(obj, datetime):
-        return obj.isoformat()
-    elif isinstance(obj, dict):
-        return {k: serialize_datetime_for_json(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [serialize_datetime_for_json(item) for item in obj]
-    else:
-        return obj
+class MeltIdsRequest(BaseModel):
+    ids: List[uuid.UUID] = Field(..., max_length=1000)
+
+class AlertRuleCreate(BaseModel):
+    name: str
+    definition: dict
+    severity: str = "warning"
+    enabled: bool = True
+    description: Optional[str] = None
+
+class AlertRuleUpdate(BaseModel):
+    name: Optional[str] = None
+    definition: Optional[dict] = None
+    severity: Optional[str] = None
+    enabled: Optional[bool] = None
+    description: Optional[str] = None
 
 def _format_os_name(os_name: str, os_version: str) -> str:
     """
@@ -79,215 +102,144 @@ async def root():
     return {"message": "Анализатор API v1", "version": "v0.0.1"}
 
 @api_router.get("/reports", response_model=MeltsList)
-async def get_melts(db: AsyncSession = Depends(get_db)):
-    """Получение списка всех отчетов из базы данных"""
-    print(f"🔍 [DEBUG] Начинаем получение отчетов из БД...")
+async def get_melts(
+    generated_from: Optional[datetime] = None,
+    generated_to: Optional[datetime] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Получение списка всех отчетов из базы данных
     
+    Фильтр по generated_at ограничивает чтение несколькими месячными секциями.
+    Запрос читает только ключи страницы; строки берутся из кэша сводок одним
+    MGET, промахи - одним запросом (services/summaries.py).
+    Файлы, не попавшие в БД, принимает фоновая сверка (services/reconciler.py).
+    """
     try:
-        # Получаем все отчеты из базы данных, сортируем по дате создания
-        print(f"🔍 [DEBUG] Выполняем запрос к БД...")
-        stmt = select(Melt).order_by(desc(Melt.generated_at))
-        result = await db.execute(stmt)
-        melts = result.scalars().all()
-        
-        print(f"🔍 [DEBUG] Получено {len(melts)} отчетов из БД")
-        
-        # Формируем список отчетов для ответа
-        melts_list = []
+        conditions = []
+        if generated_from:
+            conditions.append(Melt.generated_at >= generated_from)
+        if generated_to:
+            conditions.append(Melt.generated_at < generated_to)
+        
+        # Ключи отчетов, сортируем по дате создания
+        stmt = select(Melt.id, Melt.generated_at).where(*conditions).order_by(desc(Melt.generated_at))
+        if limit:
+            stmt = stmt.limit(limit).offset(offset)
+        page = (await db.execute(stmt)).fetchall()
+        
+        if limit:
+            total = (await db.execute(select(func.count(Melt.id)).where(*conditions))).scalar_one()
+        else:
+            total = len(page)
         
-        for i, melt in enumerate(melts):
-            print(f"🔍 [DEBUG] Обрабатываем отчёт {i+1}/{len(melts)}: {melt.hostname}")
-            print(f"🔍 [DEBUG] - ID: {melt.id}")
-            print(f"🔍 [DEBUG] - TCP порты: {melt.tcp_ports_count}")
-            print(f"🔍 [DEBUG] - UDP порты: {melt.udp_ports_count}")
-            print(f"🔍 [DEBUG] - Соединения: {melt.total_connections}")
-            print(f"🔍 [DEBUG] - HTML файл: {melt.html_file_path}")
-            
-            # Проверяем существование файла
-            file_exists = bool(melt.html_file_path and os.path.exists(melt.html_file_path))
-            print(f"🔍 [DEBUG] - Файл существует: {file_exists}")
-            
-            melt_summary = MeltSummary(
-                id=str(melt.id),
-                hostname=melt.hostname,
-                filename=os.path.basename(melt.html_file_path) if melt.html_file_path else "unknown.html",
-                generated_at=melt.generated_at.isoformat() if melt.generated_at else "",
-                os_name=melt.os_name or "Неизвестная ОС",
-                total_connections=melt.total_connections or 0,
-                file_size=melt.file_size or 0,
-                report_hash=melt.report_hash,
-                tcp_ports_count=int(melt.tcp_ports_count or 0),  # Принудительно int
-                udp_ports_count=int(melt.udp_ports_count or 0),  # Принудительно int
-                file_exists=file_exists,
-                processing_status=melt.processing_status or 'unknown'
-            )
-            
-            melts_list.append(melt_summary)
-            print(f"🔍 [DEBUG] ✅ Отчет {i+1} добавлен в список")
+        summaries = await get_report_summaries(
+            db, [row.id for row in page], [row.generated_at for row in page]
+        )
+        melts_list = [MeltSummary(**summary) for summary in summaries]
         
         print(f"📋 [SUCCESS] Возвращено {len(melts_list)} отчетов из базы данных")
         
-        # Если БД пуста, переходим к fallback
-        if len(melts_list) == 0:
-            print(f"⚠️ [WARNING] База данных пуста, переходим к fallback парсингу файлов...")
-            raise Exception("База данных пуста, нужен fallback")
-        
         return MeltsList(
             melts=melts_list,
-            total=len(melts_list)
+            total=total
         )
         
     except Exception as e:
         print(f"❌ [ERROR] Ошибка получения списка отчетов из БД: {e}")
-        print(f"🔍 [DEBUG] Тип ошибки: {type(e)}")
-        print(f"🔄 [FALLBACK] Переходим к получению отчетов из файловой системы...")
-        
-        # Fallback: получаем отчеты из файловой системы
-        try:
-            from services.html_parser import parse_analyzer_html_file
-            
-            uploads_dir = "uploads"
-            melts_list = []
-            
-            print(f"🔍 [FALLBACK] Проверяем папку {uploads_dir}...")
-            
-            if os.path.exists(uploads_dir):
-                html_files = [f for f in os.listdir(uploads_dir) if f.endswith('.html')]
-                print(f"🔍 [FALLBACK] Найдено HTML файлов: {len(html_files)}")
-                
-                for i, filename in enumerate(html_files[:50]):  # Ограничиваем количество
-                    file_path = os.path.join(uploads_dir, filename)
-                    
-                    print(f"🔍 [FALLBACK] Обрабатываем файл {i+1}/{min(len(html_files), 50)}: {filename}")
-                    
-                    try:
-                        # Получаем размер файла
-                        file_size = os.path.getsize(file_path)
-                        
-                        print(f"🔍 [FALLBACK] Начинаем парсинг файла {filename}, размер: {file_size}")
-                        
-                        # Быстро парсим основную информацию
-                        parsed_data = await parse_analyzer_html_file(file_path)
-                        
-                        print(f"🔍 [FALLBACK] Парсинг {filename}: найдено ключей {len(parsed_data.keys())}")
-                        print(f"🔍 [FALLBACK] Ключи: {list(parsed_data.keys())}")
-                        print(f"🔍 [FALLBACK] Тип ports: {type(parsed_data.get('ports', 'НЕТ'))}")
-                        if parsed_data.get('ports'):
-                            print(f"🔍 [FALLBACK] Количество портов: {len(parsed_data['ports'])}")
-                        
-                        # Вычисляем количество портов из парсеных данных
-                        tcp_ports_count = 0
-                        udp_ports_count = 0
-                        
-                        print(f"🔍 Парсинг портов из данных:")
-                        print(f"   parsed_data.keys(): {list(parsed_data.keys())}")
-                        
-                        # Пробуем разные способы получения портов
-                        if parsed_data.get("ports"):
-                            ports_data = parsed_data["ports"]
-                            print(f"🔍 [DEBUG] Файл {filename}: ports_data type={type(ports_data)}, content={ports_data}")
-                            
-                            # Если ports - это словарь с tcp/udp ключами
-                            if isinstance(ports_data, dict):
-                                tcp_ports_list = ports_data.get("tcp", [])
-                                udp_ports_list = ports_data.get("udp", [])
-                                tcp_ports_count = len(tcp_ports_list)
-                                udp_ports_count = len(udp_ports_list)
-                                print(f"🔍 [DEBUG] TCP: {tcp_ports_count}, UDP: {udp_ports_count}, total_ports: {tcp_ports_count + udp_ports_count}")
-                                if tcp_ports_list:
-                                    print(f"🔍 [DEBUG] первый TCP порт: {tcp_ports_list[0]}")
-                                if udp_ports_list:
-                                    print(f"🔍 [DEBUG] первый UDP порт: {udp_ports_list[0]}")
-                            
-                            # Если ports - это плоский список (новый формат API)
-                            elif isinstance(ports_data, list):
-                                print(f"🔍 [DEBUG] список портов: {len(ports_data)} элементов")
-                                for port in ports_data:
-                                    if isinstance(port, dict):
-                                        protocol = port.get('protocol', '').upper()
-                                        if protocol == 'TCP':
-                                            tcp_ports_count += 1
-                                        elif protocol == 'UDP':
-                                            udp_ports_count += 1
-                                print(f"🔍 [DEBUG] подсчитанные порты: TCP={tcp_ports_count}, UDP={udp_ports_count}")
-                        
-                        # Если не нашли в "ports", ищем в других местах
-                        if tcp_ports_count == 0 and udp_ports_count == 0:
-                            # Ищем в tcp_ports_count и udp_ports_count напрямую
-                            tcp_ports_count = parsed_data.get("tcp_ports_count", 0)
-                            udp_ports_count = parsed_data.get("udp_ports_count", 0)
-                            print(f"🔍 [DEBUG] fallback к прямым полям: TCP={tcp_ports_count}, UDP={udp_ports_count}")
-                        
-                        print(f"🚪 Итоговые порты: TCP={tcp_ports_count}, UDP={udp_ports_count}")
-                        
-                        # Используем дату из парсеных данных или время модификации файла
-                        generated_at = None
-                        if parsed_data.get("generated_at"):
-                            try:
-                                generated_at = datetime.fromisoformat(parsed_data["generated_at"].replace('Z', '+00:00')).isoformat()
-                            except Exception:
-                                pass
-                        
-                        if not generated_at and parsed_data.get("last_update"):
-                            try:
-                                if isinstance(parsed_data["last_update"], datetime):
-                                    generated_at = parsed_data["last_update"].isoformat()
-                                else:
-                                    generated_at = parsed_data["last_update"]
-                            except Exception:
-                                pass
-                        
-                        # Если не получилось из метаданных, используем время модификации файла
-                        if not generated_at:
-                            generated_at = datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat()
-                        
-                        # Форматируем ОС
-                        os_name = parsed_data.get('os_name', '')
-                        os_version = parsed_data.get('os_version', '')
-                        formatted_os = f"{os_name} {os_version}".strip() if os_name and os_name.lower() not in ['unknown', 'none', 'null', ''] else "Неизвестная ОС"
-                        
-                        melt_summary = MeltSummary(
-                            id=filename,  # Используем имя файла как ID
-                            hostname=parsed_data.get("hostname", "unknown"),
-                            filename=filename,
-                            generated_at=generated_at,
-                            os_name=formatted_os,
-                            total_connections=int(parsed_data.get("total_connections", 0)),
-                            file_size=file_size,
-                            tcp_ports_count=int(tcp_ports_count),  # Принудительно int
-                            udp_ports_count=int(udp_ports_count),  # Принудительно int
-                            report_hash=parsed_data.get("report_hash"),
-                            file_exists=True,
-                            processing_status="processed"
-                        )
-                        
-                        melts_list.append(melt_summary)
-                        print(f"✅ [FALLBACK] Файл {filename} успешно обработан")
-                        
-                    except Exception as parse_error:
-                        print(f"⚠️ [FALLBACK] Ошибка парсинга файла {filename}: {parse_error}")
-                        print(f"⚠️ [FALLBACK] Тип ошибки: {type(parse_error)}")
-                        import traceback
-                        print(f"⚠️ [FALLBACK] Трейс: {traceback.format_exc()}")
-                        continue
-            else:
-                print(f"❌ [FALLBACK] Папка {uploads_dir} не существует")
-            
-            print(f"📋 [FALLBACK] Возвращено {len(melts_list)} отчетов из файловой системы")
-            
-            return MeltsList(
-                melts=melts_list,
-                total=len(melts_list)
-            )
-            
-        except Exception as fallback_error:
-            print(f"❌ [FALLBACK] Ошибка fallback получения отчетов: {fallback_error}")
-            import traceback
-            print(f"❌ [FALLBACK] Трейс: {traceback.format_exc()}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Не удалось получить список отчетов"
-            )
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Не удалось получить список отчетов"
+        )
+
+@api_router.post("/reports/summaries", response_model=MeltsList)
+async def get_melts_batch(payload: MeltIdsRequest, db: AsyncSession = Depends(get_read_db)):
+    """
+    Сводки набора отчетов по ID (до 1000) в порядке запроса
+    
+    Один MGET к кэшу и не больше одного запроса к БД на весь набор.
+    """
+    try:
+        summaries = await get_report_summaries(db, payload.ids)
+        return MeltsList(
+            melts=[MeltSummary(**summary) for summary in summaries],
+            total=len(summaries)
+        )
+    except Exception as e:
+        print(f"❌ Ошибка получения сводок отчетов: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка получения сводок отчетов: {str(e)}"
+        )
+
+@api_router.get("/search")
+async def search_reports(
+    q: str,
+    types: Optional[List[str]] = Query(None, description="hosts, processes, addresses, ports"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=settings.SEARCH_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Поиск по хостам, процессам, адресам и портам
+    
+    Каждый тип возвращает свою страницу результатов и общее количество совпадений.
+    """
+    try:
+        return await search(db, q, types or SEARCH_TYPES, page, page_size)
+    except SearchQueryError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        print(f"❌ Ошибка поиска: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка поиска: {str(e)}"
+        )
+
+@api_router.get("/connections")
+async def get_connections(
+    remote_cidr: Optional[str] = Query(None, description="Подсеть удаленного адреса, например 10.0.0.0/8"),
+    local_cidr: Optional[str] = Query(None, description="Подсеть локального адреса"),
+    remote_ports: Optional[str] = Query(None, description="Порт или диапазон удаленного порта, например 1-1024"),
+    local_ports: Optional[str] = Query(None, description="Порт или диапазон локального порта"),
+    protocol: Optional[str] = None,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=settings.SEARCH_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Соединения всех отчетов по подсетям и диапазонам портов
+    
+    Например: кто обращается к 10.0.0.0/8 на порты 1-1024 -
+    ?remote_cidr=10.0.0.0/8&remote_ports=1-1024
+    """
+    try:
+        return await filter_connections(
+            db,
+            remote_cidr=remote_cidr,
+            local_cidr=local_cidr,
+            remote_ports=remote_ports,
+            local_ports=local_ports,
+            protocol=protocol,
+            page=page,
+            page_size=page_size
+        )
+    except SearchQueryError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        print(f"❌ Ошибка фильтрации соединений: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка фильтрации соединений: {str(e)}"
+        )
 
 @api_router.post("/reports/upload")
 async def melt(
@@ -306,15 +258,16 @@ async def melt(
     try:
         # Импортируем необходимые модули
         from services.html_parser import parse_analyzer_html_file
-        from models.report import Melt
-        from sqlalchemy import select
         
-        # Создаем папку uploads если её нет
-        uploads_dir = "uploads"
+        # Создаем папку загрузок если её нет (та же, что у сверки и очереди приема)
+        uploads_dir = settings.UPLOAD_DIR
         os.makedirs(uploads_dir, exist_ok=True)
         
-        # Сначала сохраняем файл во временное место для парсинга
         content = await file.read()
+        if settings.INGEST_QUEUE_ENABLED:
+            return await _enqueue_upload(file.filename, content)
+        
+        # Сначала сохраняем файл во временное место для парсинга
         temp_file_path = os.path.join(uploads_dir, f"temp_{uuid.uuid4()}.html")
         
         with open(temp_file_path, "wb") as f:
@@ -365,283 +318,61 @@ async def melt(
                     detail=f"Ошибка генерации хеша отчета: {str(hash_error)}"
                 )
         
-        # Проверяем наличие отчета с таким же хешем в базе данных
-        existing_melt = None
-        replaced_melt_info = None
-        
-        try:
-            stmt = select(Melt).where(Melt.report_hash == report_hash)
-            result = await db.execute(stmt)
-            existing_melt = result.scalar_one_or_none()
-
-            if existing_melt:
-                print(f"🔍 Найден существующий отчёт с хешем {report_hash}: ID={existing_melt.id}")
-                replaced_melt_info = {
-                    'id': str(existing_melt.id),
-                    'hostname': existing_melt.hostname,
-                    'generated_at': existing_melt.generated_at.isoformat() if existing_melt.generated_at else None,
-                    'file_path': existing_melt.html_file_path,
-                    'report_hash': existing_melt.report_hash
-                }
-                
-                # Удаляем старый файл отчета если он существует
-                if existing_melt.html_file_path and os.path.exists(existing_melt.html_file_path):
-                    try:
-                        os.remove(existing_melt.html_file_path)
-                        print(f"🗑️ Удалён старый файл отчёта: {existing_melt.html_file_path}")
-                    except Exception as e:
-                        print(f"⚠️ Ошибка удаления старого файла: {e}")
-                
-                # Удаляем запись из базы данных (каскадно удалятся связанные записи)
-                await db.delete(existing_melt)
-                await db.commit()
-                print(f"🗑️ Удален существующий отчет из БД")
-            
-        except Exception as db_error:
-            print(f"⚠️ Ошибка проверки дубликатов в БД: {db_error}")
-            # Продолжаем выполнение, но без проверки дубликатов в БД
-        
-        # Дополнительно проверяем дубликаты в файловой системе по имени файла с хешем
-        from services.report_deduplication import find_duplicate_reports, create_hash_based_filename
-        
-        file_duplicates = find_duplicate_reports(report_hash, uploads_dir)
-        removed_files_count = 0
+        # Имя файла на основе хеша: повторная загрузка того же отчета заменяет файл
+        from services.report_deduplication import create_hash_based_filename
         
-        for duplicate_path in file_duplicates:
-            if duplicate_path != temp_file_path:  # Не удаляем временный файл
-                try:
-                    os.remove(duplicate_path)
-                    removed_files_count += 1
-                    print(f"🗑️ Удален дублирующий файл: {os.path.basename(duplicate_path)}")
-                except Exception as e:
-                    print(f"⚠️ Ошибка удаления файла {duplicate_path}: {e}")
-        
-        # Создаем имя файла на основе хеша
         hash_based_filename = create_hash_based_filename(report_hash, file.filename)
         final_file_path = os.path.join(uploads_dir, hash_based_filename)
         
-        # Перемещаем временный файл в итоговое место
-        os.rename(temp_file_path, final_file_path)
-        
-        # Сохраняем информацию об отчете в базе данных
+        # Сохраняем отчет одной транзакцией: новый или замена дубликата по хешу
+        replaced_melt_info = None
         try:
-            # Извлекаем дату генерации из метаданных HTML или из header_info
-            report_generated_at = datetime.utcnow()  # По умолчанию
-            
-            # Пробуем получить дату из analyzer-generated-at метатега
-            if parsed_data.get("generated_at"):
-                try:
-                    # Дата в формате ISO (2024-12-25T10:30:45.123456)
-                    report_generated_at = datetime.fromisoformat(parsed_data["generated_at"].replace('Z', '+00:00'))
-                except Exception as date_parse_error:
-                    print(f"⚠️ Ошибка парсинга даты из метаданных: {date_parse_error}")
-            
-            # Если не получилось, пробуем из header_info
-            if not parsed_data.get("generated_at") and parsed_data.get("last_update"):
-                try:
-                    report_generated_at = parsed_data["last_update"]
-                except Exception:
-                    pass
-            
-            # Если и это не сработало, пробуем из first_run
-            if not parsed_data.get("generated_at") and not parsed_data.get("last_update") and parsed_data.get("first_run"):
-                try:
-                    report_generated_at = parsed_data["first_run"]
-                except Exception:
-                    pass
-            
-            print(f"📅 Дата отчета: {report_generated_at}")
-            
-            # Вычисляем количество портов из парсеных данных
-            tcp_ports_count = 0
-            udp_ports_count = 0
-            
-            print(f"🔍 Парсинг портов из данных:")
-            print(f"   parsed_data.keys(): {list(parsed_data.keys())}")
-            
-            # Пробуем разные способы получения портов
-            if parsed_data.get("ports"):
-                ports_data = parsed_data["ports"]
-                print(f"🔍 [DEBUG] Файл {file.filename}: ports_data type={type(ports_data)}, content={ports_data}")
-                
-                # Если ports - это словарь с tcp/udp ключами
-                if isinstance(ports_data, dict):
-                    tcp_ports_list = ports_data.get("tcp", [])
-                    udp_ports_list = ports_data.get("udp", [])
-                    tcp_ports_count = len(tcp_ports_list)
-                    udp_ports_count = len(udp_ports_list)
-                    print(f"🔍 [DEBUG] TCP: {tcp_ports_count}, UDP: {udp_ports_count}, total_ports: {tcp_ports_count + udp_ports_count}")
-                    if tcp_ports_list:
-                        print(f"🔍 [DEBUG] первый TCP порт: {tcp_ports_list[0]}")
-                    if udp_ports_list:
-                        print(f"🔍 [DEBUG] первый UDP порт: {udp_ports_list[0]}")
-                
-                # Если ports - это плоский список (новый формат API)
-                elif isinstance(ports_data, list):
-                    print(f"🔍 [DEBUG] список портов: {len(ports_data)} элементов")
-                    for port in ports_data:
-                        if isinstance(port, dict):
-                            protocol = port.get('protocol', '').upper()
-                            if protocol == 'TCP':
-                                tcp_ports_count += 1
-                            elif protocol == 'UDP':
-                                udp_ports_count += 1
-                    print(f"🔍 [DEBUG] подсчитанные порты: TCP={tcp_ports_count}, UDP={udp_ports_count}")
-            
-            # Если не нашли в "ports", ищем в других местах
-            if tcp_ports_count == 0 and udp_ports_count == 0:
-                # Ищем в tcp_ports_count и udp_ports_count напрямую
-                tcp_ports_count = parsed_data.get("tcp_ports_count", 0)
-                udp_ports_count = parsed_data.get("udp_ports_count", 0)
-                print(f"🔍 [DEBUG] fallback к прямым полям: TCP={tcp_ports_count}, UDP={udp_ports_count}")
-            
-            print(f"🚪 Итоговые порты: TCP={tcp_ports_count}, UDP={udp_ports_count}")
-            
-            # Сериализуем parsed_data для JSON поля
-            serialized_parsed_data = serialize_datetime_for_json(parsed_data)
-            
-            # Создаем новую запись Melt используя ID из HTML если есть
-            new_melt = Melt(
-                id=uuid.UUID(report_id) if report_id else None,  # Используем ID из HTML если есть
+            new_melt, replaced_melt_info = await upsert_parsed_report(
+                db,
+                parsed_data,
                 report_hash=report_hash,
-                hostname=hostname,
-                report_title=f"Отчет анализатора - {hostname}",
-                generated_at=report_generated_at,
-                os_name=parsed_data.get("os_name", ""),
-                os_version=parsed_data.get("os_version", ""),
-                html_file_path=final_file_path,
+                file_path=final_file_path,
                 file_size=len(content),
-                total_connections=parsed_data.get("total_connections", 0),
-                incoming_connections=parsed_data.get("incoming_connections", 0),
-                outgoing_connections=parsed_data.get("outgoing_connections", 0),
-                # Соединения по протоколам (из stat-card элементов)
-                tcp_connections=parsed_data.get("tcp_connections", 0),
-                udp_connections=parsed_data.get("udp_connections", 0),
-                icmp_connections=parsed_data.get("icmp_connections", 0),
-                unique_processes=parsed_data.get("unique_processes", 0),
-                unique_hosts=parsed_data.get("unique_hosts", 0),
-                # Порты (отдельно от соединений)
-                tcp_ports_count=tcp_ports_count,
-                udp_ports_count=udp_ports_count,
-                change_events_count=parsed_data.get("change_events_count", 0),
-                raw_data=serialized_parsed_data,
-                processing_status="processed"
+                report_id=report_id
             )
             
-            db.add(new_melt)
-            await db.flush()  # Получаем ID без коммита
-            
-            # Сохраняем связанные данные (соединения, порты) в той же транзакции
-            melt_db_id = new_melt.id
-            
-            # Сохраняем соединения в БД
-            connections_raw = parsed_data.get("connections", [])
-            if connections_raw:
-                print(f"🔗 Сохраняем {len(connections_raw)} соединений в БД...")
-                for i, conn in enumerate(connections_raw[:100]):  # Ограничиваем до 100 соединений
-                    try:
-                        # Парсим first_seen и last_seen
-                        first_seen = None
-                        last_seen = None
-                        
-                        if conn.get('first_seen'):
-                            try:
-                                first_seen = datetime.fromisoformat(conn['first_seen'].replace('Z', '+00:00'))
-                            except Exception:
-                                pass
-                        
-                        if conn.get('last_seen'):
-                            try:
-                                last_seen = datetime.fromisoformat(conn['last_seen'].replace('Z', '+00:00'))
-                            except Exception:
-                                pass
-                        
-                        # Определяем тип соединения
-                        connection_type = conn.get('connection_type', 'unknown')
-                        if not connection_type or connection_type == 'unknown':
-                            direction = conn.get('direction', '')
-                            if '📥' in direction or 'входящее' in direction.lower():
-                                connection_type = 'incoming'
-                            elif '📤' in direction or 'исходящее' in direction.lower():
-                                connection_type = 'outgoing'
-                            else:
-                                connection_type = 'unknown'
-                        
-                        db_connection = NetworkConnection(
-                            report_id=melt_db_id,
-                            connection_type=connection_type,
-                            local_address=conn.get('local_address', '')[:100],  # Ограничиваем длину
-                            remote_address=conn.get('remote_address', '')[:100],
-                            remote_hostname=conn.get('remote_hostname', '')[:255],
-                            process_name=conn.get('process_name', '')[:255],
-                            protocol=conn.get('protocol', 'unknown')[:10],
-                            first_seen=first_seen,
-                            last_seen=last_seen,
-                            packet_count=conn.get('packet_count', 0),
-                            connection_status='active'
-                        )
-                        db.add(db_connection)
-                        
-                    except Exception as conn_error:
-                        print(f"⚠️ Ошибка сохранения соединения {i}: {conn_error}")
-                        continue
-            
-            # Сохраняем порты в БД
-            ports_raw = parsed_data.get("ports", {})
-            if ports_raw:
-                print(f"🚪 Сохраняем порты в БД: TCP={len(ports_raw.get('tcp', []))}, UDP={len(ports_raw.get('udp', []))}")
-                
-                # TCP порты
-                for port_info in ports_raw.get('tcp', [])[:50]:  # Ограничиваем до 50 портов
-                    try:
-                        port_number = port_info.get('port_number') if isinstance(port_info, dict) else port_info
-                        if isinstance(port_number, int):
-                            db_port = NetworkPort(
-                                report_id=melt_db_id,
-                                port_number=port_number,
-                                protocol='tcp',
-                                description=port_info.get('description', f'TCP порт {port_number}')[:500] if isinstance(port_info, dict) else f'TCP порт {port_number}',
-                                service_name=port_info.get('service_name', '')[:100] if isinstance(port_info, dict) else '',
-                                status='listening'
-                            )
-                            db.add(db_port)
-                    except Exception as port_error:
-                        print(f"⚠️ Ошибка сохранения TCP порта: {port_error}")
-                        continue
-                
-                # UDP порты
-                for port_info in ports_raw.get('udp', [])[:50]:  # Ограничиваем до 50 портов
-                    try:
-                        port_number = port_info.get('port_number') if isinstance(port_info, dict) else port_info
-                        if isinstance(port_number, int):
-                            db_port = NetworkPort(
-                                report_id=melt_db_id,
-                                port_number=port_number,
-                                protocol='udp',
-                                description=port_info.get('description', f'UDP порт {port_number}')[:500] if isinstance(port_info, dict) else f'UDP порт {port_number}',
-                                service_name=port_info.get('service_name', '')[:100] if isinstance(port_info, dict) else '',
-                                status='listening'
-                            )
-                            db.add(db_port)
-                    except Exception as port_error:
-                        print(f"⚠️ Ошибка сохранения UDP порта: {port_error}")
-                        continue
-            
             # Коммитим все данные вместе
             await db.commit()
-            await db.refresh(new_melt)
+            notify_delta_worker()
+            try:
+                await refresh_hosts(db, [new_melt.hostname, (replaced_melt_info or {}).get("hostname")])
+            except Exception as index_error:
+                print(f"⚠️ Индекс портов не обновлен: {index_error}")
 
             final_melt_id = str(new_melt.id)
+            if replaced_melt_info:
+                print(f"🔁 Заменен существующий отчёт с хешем {report_hash}: ID={replaced_melt_info['id']}")
             print(f"✅ Отчёт и связанные данные сохранены в БД с ID: {final_melt_id}")
             
         except Exception as db_save_error:
             print(f"⚠️ Ошибка сохранения в БД: {db_save_error}")
-            # Если не удалось сохранить в БД, все равно возвращаем успех для файла
+            await db.rollback()
+            # Если не удалось сохранить в БД, все равно возвращаем успех для файла:
+            # файл останется в хранилище и будет переприят фоновой сверкой
             final_melt_id = report_id if report_id else report_hash  # Используем ID из HTML или хеш
         
+        # Файл занимает итоговое место только после коммита
+        os.replace(temp_file_path, final_file_path)
+        
+        if replaced_melt_info:
+            old_file_path = replaced_melt_info.get('file_path')
+            if old_file_path and os.path.abspath(old_file_path) != os.path.abspath(final_file_path) and os.path.exists(old_file_path):
+                try:
+                    os.remove(old_file_path)
+                    print(f"🗑️ Удалён старый файл отчёта: {old_file_path}")
+                except Exception as e:
+                    print(f"⚠️ Ошибка удаления старого файла: {e}")
+            await invalidate_report_cache(replaced_melt_info['id'])
+        await invalidate_report_cache(final_melt_id)
+        
         # Формируем ответ
         response_data = {
-            "message": f"Отчёт успешно загружен{' (заменён дубликат)' if existing_melt or removed_files_count > 0 else ''}",
+            "message": f"Отчёт успешно загружен{' (заменён дубликат)' if replaced_melt_info else ''}",
             "report_id": final_melt_id,
             "report_hash": report_hash,
             "filename": file.filename,
@@ -649,15 +380,12 @@ async def melt(
             "file_size": len(content),
             "hostname": hostname,
             "connections_count": parsed_data.get("total_connections", 0),
-            "is_replacement": bool(existing_melt or removed_files_count > 0),
+            "is_replacement": bool(replaced_melt_info),
             "deduplication_method": "html_metadata" if parsed_data.get("report_hash") else "generated_hash"
         }
         
-        if existing_melt:
+        if replaced_melt_info:
             response_data["replaced_melt"] = replaced_melt_info
-            
-        if removed_files_count > 0:
-            response_data["removed_file_duplicates"] = removed_files_count
         
         # Если использовали метаданные из HTML, добавляем информацию
         if parsed_data.get("report_hash"):
@@ -686,90 +414,73 @@ async def melt(
             detail=f"Ошибка загрузки отчета: {str(e)}"
         )
 
-@api_router.get("/reports/{report_id}/simple")
-async def get_report_details_simple(report_id: str):
-    """Получение детальной информации об отчете (упрощенная версия)"""
+async def _enqueue_upload(filename: str, content: bytes) -> JSONResponse:
+    """Сохраняет загрузку в общее хранилище и ставит ее в очередь приема (202)"""
+    upload_id = str(uuid.uuid4())
+    path = os.path.join(incoming_dir(), f"{upload_id}.html")
+    os.makedirs(incoming_dir(), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    
+    hostname = sniff_hostname(content)
     try:
-        print(f"🔍 Getting simple report details for ID: {report_id}")
-        
-        # Ищем HTML файл
-        uploads_dir = "uploads"
-        file_path = None
-        
-        print(f"🔍 Ищем файл в папке: {uploads_dir}")
-        print(f"🔍 Проверяем существование папки: {os.path.exists(uploads_dir)}")
-        
-        # Пробуем разные варианты имен файлов
-        if os.path.exists(uploads_dir):
-            available_files = os.listdir(uploads_dir)
-            print(f"🔍 Доступные файлы: {available_files}")
-            
-            for filename in available_files:
-                print(f"🔍 Проверяем файл: {filename}")
-                # Разные варианты поиска
-                if (filename.startswith(report_id[:8]) or 
-                    filename.startswith(report_id) or
-                    f"_{report_id[:8]}" in filename or
-                    f"_{report_id}" in filename or
-                    report_id[:8] in filename or
-                    report_id in filename) and filename.endswith('.html'):
-                    file_path = os.path.join(uploads_dir, filename)
-                    print(f"✅ Найден подходящий файл: {filename}")
-                    break
-        else:
-            print(f"❌ Папка {uploads_dir} не существует")
-        
-        if not file_path:
-            print(f"❌ Файл для ID {report_id} не найден")
-            return {"error": f"Report {report_id} not found"}
-        
-        print(f"✅ Found HTML file: {file_path}")
-        
-        # Извлекаем базовую информацию
-        hostname = "unknown"
-        os_name = "unknown"
-        file_size = os.path.getsize(file_path)
-        
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read(3000)
-                import re
-                
-                # Ищем hostname
-                hostname_match = re.search(r'<meta name="analyzer-hostname" content="([^"]+)"', content)
-                if hostname_match:
-                    hostname = hostname_match.group(1)
-                else:
-                    header_match = re.search(r'<strong>🖥️ Хост:</strong>\s*([^<]+)', content)
-                    if header_match:
-                        hostname = header_match.group(1).strip()
-                
-                # ОС
-                os_match = re.search(r'<strong>💻 ОС:</strong>\s*([^<]+)', content)
-                if os_match:
-                    os_name = os_match.group(1).strip()
-                
-        except Exception as e:
-            print(f"⚠️ Could not extract metadata: {e}")
-        
-        result = {
-            "id": report_id,
+        queued = await enqueue_upload(path, filename, len(content), hostname, upload_id)
+    except Exception:
+        os.remove(path)
+        raise
+    
+    print(f"📥 Отчет {filename} ({hostname}) поставлен в очередь приема: {upload_id}")
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={
+            "message": "Отчёт принят и поставлен в очередь обработки",
+            **queued,
+            "filename": filename,
+            "file_size": len(content),
             "hostname": hostname,
-            "os": {"name": os_name, "version": ""},
-            "file_size": file_size,
-            "status": "found"
+            "status_url": f"/api/v1/reports/uploads/{upload_id}",
         }
-        
-        print(f"✅ Returning simple report details for: {hostname}")
-        return result
-        
-    except Exception as e:
-        print(f"❌ Error in simple report details: {e}")
-        return {"error": str(e)}
+    )
+
+@api_router.get("/reports/uploads/{upload_id}")
+async def get_upload_status_endpoint(upload_id: str):
+    """Статус загрузки из очереди приема (queued, processing, retrying, done, failed)"""
+    upload_status = await get_upload_status(upload_id)
+    if upload_status is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Загрузка не найдена"
+        )
+    return upload_status
+
+@api_router.get("/reports/{report_id}/simple")
+async def get_report_details_simple(report_id: str, db: AsyncSession = Depends(get_read_db)):
+    """Получение детальной информации об отчете (упрощенная версия, только строка system_reports)"""
+    melt = await _get_melt_or_404(db, report_id)
+    return {
+        "id": str(melt.id),
+        "hostname": melt.hostname,
+        "os": {"name": melt.os_name or "unknown", "version": melt.os_version or ""},
+        "file_size": melt.file_size or 0,
+        "status": "found"
+    }
 
 @api_router.get("/reports/{report_id}")
-async def get_report_details(report_id: str, db: AsyncSession = Depends(get_db)):
-    """Получение детальной информации об отчете"""
+async def get_report_details(report_id: str):
+    """
+    Получение детальной информации об отчете
+    
+    Ответ кэшируется (reports/<id>); при загрузке и удалении отчета запись
+    сбрасывает invalidate_report_cache.
+    """
+    async def compute():
+        async with cache_fill_session() as session:
+            return await _load_report_details(report_id, session)
+    
+    return await cache.get_or_compute("reports", report_id, compute, ttl=settings.REPORT_DETAILS_CACHE_TTL)
+
+async def _load_report_details(report_id: str, db: AsyncSession) -> dict:
+    """Детальная информация об отчете из БД"""
     try:
         print(f"🔍 Getting report details for ID: {report_id}")
         
@@ -803,235 +514,146 @@ async def get_report_details(report_id: str, db: AsyncSession = Depends(get_db))
                 
         except ValueError:
             # Это не UUID - пропускаем поиск в БД
-            print(f"🔍 {report_id} не является UUID, ищем как имя файла")
+            print(f"🔍 {report_id} не является UUID")
         
         if not db_melt:
-            print(f"❌ Report not found in database: {report_id}")
-            # Если не найден в БД, попробуем поискать файл напрямую
-            uploads_dir = "uploads"
-            file_path = None
-            
-            if os.path.exists(uploads_dir):
-                # Если report_id выглядит как имя файла, ищем его точно
-                if report_id.endswith('.html'):
-                    potential_path = os.path.join(uploads_dir, report_id)
-                    if os.path.exists(potential_path):
-                        file_path = potential_path
-                        print(f"✅ Найден файл по точному имени: {file_path}")
-                
-                # Если не нашли точного совпадения, ищем по префиксу
-                if not file_path:
-                    for filename in os.listdir(uploads_dir):
-                        if (filename.startswith(report_id[:8]) or 
-                            filename.startswith(report_id) or
-                            report_id in filename) and filename.endswith('.html'):
-                            file_path = os.path.join(uploads_dir, filename)
-                            print(f"✅ Найден файл по префиксу: {file_path}")
-                            break
-            
-            if not file_path:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"Отчет с ID {report_id} не найден"
-                )
-        else:
-            # Используем filename из БД
-            uploads_dir = "uploads"
-            if db_melt.html_file_path:
-                file_path = db_melt.html_file_path
-            else:
-                # Пробуем построить путь из report_hash
-                filename = f"report_{db_melt.report_hash}.html"
-                file_path = os.path.join(uploads_dir, filename)
-        
-        if not os.path.exists(file_path):
-            print(f"❌ HTML file not found: {file_path}")
+            # Файлы без записи в БД принимает фоновая сверка - здесь их не ищем
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Файл отчета не найден: {file_path}"
+                detail=f"Отчет с ID {report_id} не найден"
             )
         
-        print(f"✅ Found HTML file: {file_path}")
-        
-        # Используем данные из БД если есть, иначе парсим HTML
-        if db_melt:
-            hostname = db_melt.hostname
-            os_name = db_melt.os_name or "unknown"
-            os_version = db_melt.os_version or ""
-            generated_at = db_melt.generated_at.isoformat() if db_melt.generated_at else datetime.now().isoformat()
-            report_hash = db_melt.report_hash or ""
-            file_size = db_melt.file_size or os.path.getsize(file_path)
+        # Данные отчета из БД
+        hostname = db_melt.hostname
+        os_name = db_melt.os_name or "unknown"
+        os_version = db_melt.os_version or ""
+        generated_at = db_melt.generated_at.isoformat() if db_melt.generated_at else datetime.now().isoformat()
+        report_hash = db_melt.report_hash or ""
+        file_size = db_melt.file_size or 0
+        
+        # Статистика из БД
+        total_connections = db_melt.total_connections or 0
+        tcp_connections = db_melt.tcp_connections or 0
+        udp_connections = db_melt.udp_connections or 0
+        icmp_connections = db_melt.icmp_connections or 0
+        listening_ports = (db_melt.tcp_ports_count or 0) + (db_melt.udp_ports_count or 0)
+        established_connections = (db_melt.incoming_connections or 0) + (db_melt.outgoing_connections or 0)
+        total_ports = (db_melt.tcp_ports_count or 0) + (db_melt.udp_ports_count or 0)
+        
+        # Получаем связанные данные
+        connections_data = []
+        for conn in db_melt.connections[:50]:  # Первые 50 соединений
+            connections_data.append({
+                "id": str(conn.id),
+                "type": conn.connection_type,
+                "local_address": conn.local_address,
+                "remote_address": conn.remote_address,
+                "remote_hostname": conn.remote_hostname,
+                "process": conn.process_name,
+                "protocol": conn.protocol,
+                "first_seen": conn.first_seen.isoformat() if conn.first_seen else None,
+                "last_seen": conn.last_seen.isoformat() if conn.last_seen else None,
+                "packet_count": conn.packet_count
+            })
+        
+        ports_data = []
+        for port in db_melt.ports[:100]:  # Первые 100 портов
+            ports_data.append({
+                "id": str(port.id),
+                "port_number": port.port_number,
+                "protocol": port.protocol,
+                "description": port.description,
+                "service_name": port.service_name,
+                "process": port.process_name,
+                "status": port.status
+            })
+        
+        # Если связанные данные пусты, пытаемся извлечь из raw_data
+        # (только старые отчеты: новые хранят соединения и порты лишь в дочерних таблицах)
+        raw_data = await load_raw_data(db, db_melt) if not connections_data and not ports_data else None
+        if raw_data:
+            print("📊 Связанные таблицы пусты, извлекаем данные из raw_data...")
             
-            # Статистика из БД
-            total_connections = db_melt.total_connections or 0
-            tcp_connections = db_melt.tcp_connections or 0
-            udp_connections = db_melt.udp_connections or 0
-            icmp_connections = db_melt.icmp_connections or 0
-            listening_ports = (db_melt.tcp_ports_count or 0) + (db_melt.udp_ports_count or 0)
-            established_connections = (db_melt.incoming_connections or 0) + (db_melt.outgoing_connections or 0)
-            total_ports = (db_melt.tcp_ports_count or 0) + (db_melt.udp_ports_count or 0)
+            # Извлекаем соединения из raw_data
+            if raw_data.get("connections"):
+                print(f"🔗 Найдено {len(raw_data['connections'])} соединений в raw_data")
+                for i, conn in enumerate(raw_data["connections"][:50]):
+                    connections_data.append({
+                        "id": f"raw_{i}",
+                        "type": conn.get('connection_type', 'unknown'),
+                        "local_address": conn.get('local_address', ''),
+                        "remote_address": conn.get('remote_address', ''),
+                        "remote_hostname": conn.get('remote_hostname', ''),
+                        "process": conn.get('process_name', ''),
+                        "protocol": conn.get('protocol', 'unknown'),
+                        "first_seen": conn.get('first_seen'),
+                        "last_seen": conn.get('last_seen'),
+                        "packet_count": conn.get('packet_count', 0)
+                    })
             
-            # Получаем связанные данные
-            connections_data = []
-            for conn in db_melt.connections[:50]:  # Первые 50 соединений
-                connections_data.append({
-                    "id": str(conn.id),
-                    "type": conn.connection_type,
-                    "local_address": conn.local_address,
-                    "remote_address": conn.remote_address,
-                    "remote_hostname": conn.remote_hostname,
-                    "process": conn.process_name,
-                    "protocol": conn.protocol,
-                    "first_seen": conn.first_seen.isoformat() if conn.first_seen else None,
-                    "last_seen": conn.last_seen.isoformat() if conn.last_seen else None,
-                    "packet_count": conn.packet_count
-                })
-            
-            ports_data = []
-            for port in db_melt.ports[:100]:  # Первые 100 портов
-                ports_data.append({
-                    "id": str(port.id),
-                    "port_number": port.port_number,
-                    "protocol": port.protocol,
-                    "description": port.description,
-                    "service_name": port.service_name,
-                    "process": port.process_name,
-                    "status": port.status
-                })
-            
-            # Если связанные данные пусты, пытаемся извлечь из raw_data
-            if not connections_data and not ports_data and db_melt.raw_data:
-                print("📊 Связанные таблицы пусты, извлекаем данные из raw_data...")
-                raw_data = db_melt.raw_data
+            # Извлекаем порты из raw_data
+            if raw_data.get("ports"):
+                ports_raw = raw_data["ports"]
                 
-                # Извлекаем соединения из raw_data
-                if raw_data.get("connections"):
-                    print(f"🔗 Найдено {len(raw_data['connections'])} соединений в raw_data")
-                    for i, conn in enumerate(raw_data["connections"][:50]):
-                        connections_data.append({
-                            "id": f"raw_{i}",
-                            "type": conn.get('connection_type', 'unknown'),
-                            "local_address": conn.get('local_address', ''),
-                            "remote_address": conn.get('remote_address', ''),
-                            "remote_hostname": conn.get('remote_hostname', ''),
-                            "process": conn.get('process_name', ''),
-                            "protocol": conn.get('protocol', 'unknown'),
-                            "first_seen": conn.get('first_seen'),
-                            "last_seen": conn.get('last_seen'),
-                            "packet_count": conn.get('packet_count', 0)
+                # TCP порты
+                tcp_ports = ports_raw.get("tcp", [])
+                print(f"🚪 Найдено {len(tcp_ports)} TCP портов в raw_data")
+                for i, port_info in enumerate(tcp_ports[:50]):
+                    port_number = port_info.get('port_number') if isinstance(port_info, dict) else port_info
+                    if isinstance(port_number, int):
+                        ports_data.append({
+                            "id": f"tcp_raw_{i}",
+                            "port_number": port_number,
+                            "protocol": "tcp",
+                            "description": port_info.get('description', f'TCP порт {port_number}') if isinstance(port_info, dict) else f'TCP порт {port_number}',
+                            "service_name": port_info.get('service_name', '') if isinstance(port_info, dict) else '',
+                            "process": port_info.get('process_name', '') if isinstance(port_info, dict) else '',
+                            "status": "listening"
                         })
                 
-                # Извлекаем порты из raw_data
-                if raw_data.get("ports"):
-                    ports_raw = raw_data["ports"]
-                    
-                    # TCP порты
-                    tcp_ports = ports_raw.get("tcp", [])
-                    print(f"🚪 Найдено {len(tcp_ports)} TCP портов в raw_data")
-                    for i, port_info in enumerate(tcp_ports[:50]):
-                        port_number = port_info.get('port_number') if isinstance(port_info, dict) else port_info
-                        if isinstance(port_number, int):
-                            ports_data.append({
-                                "id": f"tcp_raw_{i}",
-                                "port_number": port_number,
-                                "protocol": "tcp",
-                                "description": port_info.get('description', f'TCP порт {port_number}') if isinstance(port_info, dict) else f'TCP порт {port_number}',
-                                "service_name": port_info.get('service_name', '') if isinstance(port_info, dict) else '',
-                                "process": port_info.get('process_name', '') if isinstance(port_info, dict) else '',
-                                "status": "listening"
-                            })
-                    
-                    # UDP порты
-                    udp_ports = ports_raw.get("udp", [])
-                    print(f"🚪 Найдено {len(udp_ports)} UDP портов в raw_data")
-                    for i, port_info in enumerate(udp_ports[:50]):
-                        port_number = port_info.get('port_number') if isinstance(port_info, dict) else port_info
-                        if isinstance(port_number, int):
-                            ports_data.append({
-                                "id": f"udp_raw_{i}",
-                                "port_number": port_number,
-                                "protocol": "udp",
-                                "description": port_info.get('description', f'UDP порт {port_number}') if isinstance(port_info, dict) else f'UDP порт {port_number}',
-                                "service_name": port_info.get('service_name', '') if isinstance(port_info, dict) else '',
-                                "process": port_info.get('process_name', '') if isinstance(port_info, dict) else '',
-                                "status": "listening"
-                            })
-                
-                print(f"📊 Извлечено из raw_data: {len(connections_data)} соединений, {len(ports_data)} портов")
-            
-            remote_hosts_data = []
-            for host in db_melt.remote_hosts[:50]:  # Первые 50 хостов
-                remote_hosts_data.append({
-                    "id": str(host.id),
-                    "ip_address": host.ip_address,
-                    "hostname": host.hostname,
-                    "connection_count": host.connection_count,
-                    "first_seen": host.first_seen.isoformat() if host.first_seen else None,
-                    "last_seen": host.last_seen.isoformat() if host.last_seen else None,
-                    "country": host.country,
-                    "organization": host.organization
-                })
-            
-            network_interfaces_data = []
-            for interface in db_melt.network_interfaces[:20]:  # Первые 20 интерфейсов
-                network_interfaces_data.append({
-                    "id": str(interface.id),
-                    "name": interface.interface_name,
-                    "packets_in": interface.packets_in,
-                    "packets_out": interface.packets_out,
-                    "bytes_in": interface.bytes_in,
-                    "bytes_out": interface.bytes_out,
-                    "mtu": interface.mtu,
-                    "status": interface.status
-                })
-                
-        else:
-            # Fallback: парсим метаданные из HTML
-            hostname = "unknown"
-            os_name = "unknown"
-            os_version = ""
-            generated_at = datetime.now().isoformat()
-            report_hash = ""
-            file_size = os.path.getsize(file_path)
-            
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read(5000)
-                    import re
-                    
-                    # Ищем метаданные
-                    hostname_match = re.search(r'<meta name="analyzer-hostname" content="([^"]+)"', content)
-                    if hostname_match:
-                        hostname = hostname_match.group(1)
-                    
-                    # ОС
-                    os_match = re.search(r'<strong>💻 ОС:</strong>\s*([^<]+)', content)
-                    if os_match:
-                        os_full = os_match.group(1).strip()
-                        parts = os_full.split(' ', 1)
-                        os_name = parts[0]
-                        os_version = parts[1] if len(parts) > 1 else ""
-                    
-                    # Хеш отчета
-                    hash_match = re.search(r'<meta name="analyzer-report-hash" content="([^"]+)"', content)
-                    if hash_match:
-                        report_hash = hash_match.group(1)
-                    
-            except Exception as e:
-                print(f"⚠️ Could not extract metadata from HTML: {e}")
+                # UDP порты
+                udp_ports = ports_raw.get("udp", [])
+                print(f"🚪 Найдено {len(udp_ports)} UDP портов в raw_data")
+                for i, port_info in enumerate(udp_ports[:50]):
+                    port_number = port_info.get('port_number') if isinstance(port_info, dict) else port_info
+                    if isinstance(port_number, int):
+                        ports_data.append({
+                            "id": f"udp_raw_{i}",
+                            "port_number": port_number,
+                            "protocol": "udp",
+                            "description": port_info.get('description', f'UDP порт {port_number}') if isinstance(port_info, dict) else f'UDP порт {port_number}',
+                            "service_name": port_info.get('service_name', '') if isinstance(port_info, dict) else '',
+                            "process": port_info.get('process_name', '') if isinstance(port_info, dict) else '',
+                            "status": "listening"
+                        })
             
-            # Пустые данные для fallback
-            connections_data = []
-            ports_data = []
-            remote_hosts_data = []
-            network_interfaces_data = []
-            total_connections = 0
-            tcp_connections = 0
-            udp_connections = 0
-            icmp_connections = 0
-            listening_ports = 0
-            established_connections = 0
-            total_ports = 0
+            print(f"📊 Извлечено из raw_data: {len(connections_data)} соединений, {len(ports_data)} портов")
+        
+        remote_hosts_data = []
+        for host in sorted(db_melt.remote_hosts, key=lambda h: h.connection_count or 0, reverse=True)[:50]:  # 50 самых активных хостов
+            remote_hosts_data.append({
+                "id": str(host.id),
+                "ip_address": host.ip_address,
+                "hostname": host.hostname,
+                "connection_count": host.connection_count,
+                "first_seen": host.first_seen.isoformat() if host.first_seen else None,
+                "last_seen": host.last_seen.isoformat() if host.last_seen else None,
+                "country": host.country,
+                "organization": host.organization
+            })
+        
+        network_interfaces_data = []
+        for interface in db_melt.network_interfaces[:20]:  # Первые 20 интерфейсов
+            network_interfaces_data.append({
+                "id": str(interface.id),
+                "name": interface.interface_name,
+                "packets_in": interface.packets_in,
+                "packets_out": interface.packets_out,
+                "bytes_in": interface.bytes_in,
+                "bytes_out": interface.bytes_out,
+                "mtu": interface.mtu,
+                "status": interface.status
+            })
         
         result = {
             "id": report_id,
@@ -1060,8 +682,9 @@ async def get_report_details(report_id: str, db: AsyncSession = Depends(get_db))
             "total_ports": total_ports,
             # Информация о файле
             "file_size": file_size,
-            "created_at": datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat(),
-            "report_hash": report_hash
+            "created_at": db_melt.created_at.isoformat() if db_melt.created_at else generated_at,
+            "report_hash": report_hash,
+            "file_exists": db_melt.processing_status != STATUS_FILE_MISSING
         }
         
         print(f"✅ Returning detailed report for: {hostname} ({len(connections_data)} connections, {len(ports_data)} ports)")
@@ -1079,7 +702,7 @@ async def get_report_details(report_id: str, db: AsyncSession = Depends(get_db))
         )
 
 @api_router.get("/reports/{report_id}/download")
-async def download_report(report_id: str, db: AsyncSession = Depends(get_db)):
+async def download_report(report_id: str, db: AsyncSession = Depends(get_read_db)):
     """Скачивание HTML файла отчета"""
     try:
         print(f"🔍 Download request for report ID: {report_id}")
@@ -1088,80 +711,28 @@ async def download_report(report_id: str, db: AsyncSession = Depends(get_db)):
         from sqlalchemy import select
         from models.report import Melt
         
-        result = await db.execute(select(Melt).where(Melt.id == report_id))
+        try:
+            report_uuid = uuid.UUID(report_id)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Отчет с ID {report_id} не найден"
+            )
+        
+        result = await db.execute(select(Melt).where(Melt.id == report_uuid))
         db_melt = result.scalar_one_or_none()
         
-        file_path = None
-        original_filename = None
+        if not db_melt or not db_melt.html_file_path:
+            print(f"❌ Отчет не найден в БД: {report_id}")
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Отчет с ID {report_id} не найден"
+            )
         
-        if db_melt:
-            # Используем путь из базы данных
-            if db_melt.html_file_path and os.path.exists(db_melt.html_file_path):
-                file_path = db_melt.html_file_path
-                original_filename = os.path.basename(file_path)
-                print(f"✅ Файл найден через БД: {file_path}")
-            else:
-                # Пытаемся найти файл по хешу
-                report_hash = db_melt.report_hash
-                uploads_dir = "uploads"
-                
-                for filename in os.listdir(uploads_dir):
-                    if filename.startswith(report_hash) and filename.endswith('.html'):
-                        file_path = os.path.join(uploads_dir, filename)
-                        original_filename = filename
-                        print(f"✅ Файл найден по хешу: {file_path}")
-                        break
-        
-        if not file_path:
-            # Fallback: поиск файла напрямую в uploads
-            uploads_dir = "uploads"
-            
-            file_found = False
-            
-            # Если report_id выглядит как имя файла, ищем его точно
-            if report_id.endswith('.html'):
-                file_path = os.path.join(uploads_dir, report_id)
-                if os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                        file_found = True
-                        print(f"🗑️ Удален файл по точному имени: {report_id}")
-                    except Exception as e:
-                        print(f"⚠️ Ошибка удаления файла {report_id}: {e}")
-            
-            # Если не нашли точного совпадения, пробуем другие варианты
-            if not file_found:
-                possible_files = [
-                    f"{report_id}.html",
-                    f"report_{report_id}.html"
-                ]
-                
-                for filename in possible_files:
-                    file_path = os.path.join(uploads_dir, filename)
-                    if os.path.exists(file_path):
-                        try:
-                            os.remove(file_path)
-                            file_found = True
-                            print(f"🗑️ Удален файл (без записи в БД): {filename}")
-                            break
-                        except Exception as e:
-                            print(f"⚠️ Ошибка удаления файла {filename}: {e}")
-            
-            # Ищем по частичному совпадению имени файла
-            if not file_found and os.path.exists(uploads_dir):
-                for filename in os.listdir(uploads_dir):
-                    if report_id in filename and filename.endswith('.html'):
-                        file_path = os.path.join(uploads_dir, filename)
-                        try:
-                            os.remove(file_path)
-                            file_found = True
-                            print(f"🗑️ Удален файл (частичное совпадение): {filename}")
-                            break
-                        except Exception as e:
-                            print(f"⚠️ Ошибка удаления файла {filename}: {e}")
-        
-        if not file_path:
-            print(f"❌ Файл не найден для ID: {report_id}")
+        # Пропажу файла фиксирует фоновая сверка, поиск по хранилищу не выполняем
+        file_path = db_melt.html_file_path
+        if db_melt.processing_status == STATUS_FILE_MISSING or not os.path.exists(file_path):
+            print(f"❌ Файл отчета отсутствует в хранилище: {file_path}")
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Файл отчета не найден для ID: {report_id}"
@@ -1221,34 +792,536 @@ async def download_report(report_id: str, db: AsyncSession = Depends(get_db)):
             detail=f"Ошибка скачивания отчета: {str(e)}"
         )
 
-@api_router.delete("/reports/{report_id}")
-async def delete_report(report_id: str, db: AsyncSession = Depends(get_db)):
-    """Удаление отчета по ID или хешу"""
+async def _get_melt_or_404(db: AsyncSession, report_id: str) -> Melt:
+    """Отчет по UUID или 404"""
     try:
-        from sqlalchemy import select, or_
-        from models.report import Melt
-        import uuid
-        
-        # Пытаемся найти отчет по ID или по хешу
-        stmt = None
-        
-        # Проверяем, является ли report_id UUID
-        try:
-            uuid_obj = uuid.UUID(report_id)
-            # Это UUID - ищем по ID
-            stmt = select(Melt).where(Melt.id == uuid_obj)
-        except ValueError:
-            # Это не UUID - ищем по хешу или имени файла
-            stmt = select(Melt).where(
-                or_(
-                    Melt.report_hash == report_id,
-                    Melt.html_file_path.contains(report_id)
+        report_uuid = uuid.UUID(report_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Отчет с ID {report_id} не найден"
+        )
+    
+    melt = (await db.execute(select(Melt).where(Melt.id == report_uuid))).scalar_one_or_none()
+    if not melt:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Отчет с ID {report_id} не найден"
+        )
+    return melt
+
+@api_router.get("/reports/{report_id}/changes")
+async def get_report_changes_endpoint(
+    report_id: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    categories: Optional[List[str]] = Query(None, description="connections, ports, network"),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    История изменений отчета, от новых к старым
+    
+    Следующая страница запрашивается с cursor из next_cursor предыдущей.
+    """
+    try:
+        melt = await _get_melt_or_404(db, report_id)
+        return await get_report_changes(db, melt, since, until, categories, limit, cursor)
+    except ChangeQueryError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Ошибка получения истории изменений: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка получения истории изменений: {str(e)}"
+        )
+
+@api_router.get("/reports/{report_id}/delta")
+async def get_report_delta(
+    report_id: str,
+    against: Optional[str] = Query(None, description="ID отчета-базы; по умолчанию - предыдущий отчет хоста"),
+    limit: Optional[int] = Query(None, ge=1, le=10000, description="Элементов в каждом списке секции"),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Добавленные, удаленные и измененные соединения, порты, процессы и
+    интерфейсы отчета относительно отчета against того же хоста
+    """
+    try:
+        melt = await _get_melt_or_404(db, report_id)
+        if against:
+            base = await _get_melt_or_404(db, against)
+        else:
+            # Дельта относительно предыдущего отчета обычно уже вычислена воркером
+            stored = await get_stored_delta(db, melt)
+            if stored is not None and limit in (None, stored.get("limit")):
+                return stored
+            base = await get_previous_melt(db, melt)
+            if base is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Нет более раннего отчета хоста {melt.hostname} для сравнения"
                 )
-            )
-        
-        if stmt is None:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
+        return await compute_delta(db, melt, base, limit)
+    except DeltaError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Ошибка сравнения отчетов: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка сравнения отчетов: {str(e)}"
+        )
+
+@api_router.get("/hosts/{hostname}/delta")
+async def get_host_delta(hostname: str, db: AsyncSession = Depends(get_read_db)):
+    """
+    Дельта самого свежего отчета хоста относительно предыдущего (Delta View)
+    """
+    try:
+        result = await get_host_latest_delta(db, hostname)
+        if result is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Дельта для хоста {hostname} еще не вычислена"
+            )
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Ошибка получения дельты хоста: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка получения дельты хоста: {str(e)}"
+        )
+
+@api_router.get("/deltas/recent")
+async def get_recent_deltas(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Последние изменения парка: хосты, чей свежий отчет отличается от предыдущего
+    """
+    try:
+        return await get_recent_changes(db, limit, cursor)
+    except DeltaError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        print(f"❌ Ошибка получения последних изменений: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка получения последних изменений: {str(e)}"
+        )
+
+def _require_port_index() -> None:
+    """503, пока индекс портов не прогрет"""
+    if not port_index.ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Индекс портов еще не построен"
+        )
+
+@api_router.get("/ports/query")
+async def query_port_exposure(
+    all: Optional[List[str]] = Query(None, description="Порты, которые хост слушает все: 22 или udp/53"),
+    any: Optional[List[str]] = Query(None, description="Хотя бы один из портов"),
+    none: Optional[List[str]] = Query(None, description="Ни одного из портов"),
+    limit: int = Query(100, ge=1, le=10000),
+    offset: int = Query(0, ge=0)
+):
+    """
+    Хосты парка по набору портов их последних отчетов, например all=22&none=443
+    """
+    _require_port_index()
+    try:
+        bitmap = port_index.query(
+            [parse_port_key(p) for p in all or []],
+            [parse_port_key(p) for p in any or []],
+            [parse_port_key(p) for p in none or []],
+        )
+    except PortIndexError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    return {
+        "total": bitmap.bit_count(),
+        "hosts": port_index.hostnames(bitmap, offset, limit),
+        "offset": offset,
+        "limit": limit,
+    }
+
+@api_router.get("/ports/{port}/hosts")
+async def get_port_hosts(
+    port: int,
+    protocol: str = Query("tcp", description="tcp или udp"),
+    limit: int = Query(100, ge=1, le=10000),
+    offset: int = Query(0, ge=0)
+):
+    """
+    Хосты, последний отчет которых показывает открытый порт
+    """
+    _require_port_index()
+    try:
+        key = parse_port_key(f"{protocol}/{port}")
+    except PortIndexError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    bitmap = port_index.hosts_bitmap(key)
+    return {
+        "port": f"{key[0]}/{key[1]}",
+        "total": bitmap.bit_count(),
+        "hosts": port_index.hostnames(bitmap, offset, limit),
+        "offset": offset,
+        "limit": limit,
+    }
+
+@api_router.get("/hosts/{hostname}/ports")
+async def get_host_ports(hostname: str):
+    """
+    Открытые порты хоста по его последнему отчету (из индекса портов)
+    """
+    _require_port_index()
+    result = port_index.host_ports(hostname)
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Хост {hostname} не найден в индексе портов"
+        )
+    return result
+
+@api_router.get("/hosts/{hostname}/series")
+async def get_host_series_endpoint(
+    hostname: str,
+    metric: str = Query(..., description="total_connections, tcp_ports_count, ..."),
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    step: Optional[str] = Query(None, description="Шаг: 1h, 6h, 1d, 1w; по умолчанию - не больше SERIES_MAX_POINTS точек"),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Ряд числового показателя хоста (min, max, последнее значение на шаг)
+    """
+    try:
+        return await get_host_series(db, hostname, metric, from_, to, step)
+    except SeriesQueryError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        print(f"❌ Ошибка получения ряда показателя: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка получения ряда показателя: {str(e)}"
+        )
+
+@api_router.get("/graph/hosts/{hostname}/edges")
+async def get_graph_host_edges(
+    hostname: str,
+    since: Optional[datetime] = Query(None, description="Только ребра, виденные после"),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Удаленные конечные точки хоста (список смежности графа связей)
+    """
+    try:
+        return await get_host_edges(db, hostname, limit, cursor, since)
+    except GraphQueryError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        print(f"❌ Ошибка получения ребер хоста: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка получения ребер хоста: {str(e)}"
+        )
+
+@api_router.get("/graph/endpoints/{ip}/edges")
+async def get_graph_endpoint_edges(
+    ip: str,
+    since: Optional[datetime] = Query(None, description="Только ребра, виденные после"),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Хосты парка, связанные с удаленным IP (список смежности графа связей)
+    """
+    try:
+        return await get_endpoint_edges(db, ip, limit, cursor, since)
+    except GraphQueryError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        print(f"❌ Ошибка получения ребер конечной точки: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка получения ребер конечной точки: {str(e)}"
+        )
+
+@api_router.get("/graph/subgraph")
+async def get_graph_subgraph(
+    node: str = Query(..., description="host:<имя> или ip:<адрес>"),
+    depth: int = Query(1, ge=1, le=4),
+    max_nodes: int = Query(200, ge=1, le=settings.GRAPH_MAX_NODES),
+    min_reports: int = Query(1, ge=1, description="Ребра, встреченные не менее чем в N отчетах"),
+    since: Optional[datetime] = Query(None, description="Только ребра, виденные после"),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Подграф связей вокруг хоста или IP
+    """
+    try:
+        return await get_subgraph(db, node, depth, max_nodes, since, min_reports)
+    except GraphQueryError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        print(f"❌ Ошибка построения подграфа: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка построения подграфа: {str(e)}"
+        )
+
+@api_router.get("/anomalies")
+async def get_anomalies(
+    hostname: Optional[str] = None,
+    kinds: Optional[List[str]] = Query(None, description=", ".join(ANOMALY_KINDS)),
+    since: Optional[datetime] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Находки относительно базовых линий хостов, от новых к старым
+    
+    Следующая страница запрашивается с cursor из next_cursor предыдущей.
+    """
+    try:
+        return await get_findings(db, hostname, kinds, since, limit, cursor)
+    except AnomalyQueryError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        print(f"❌ Ошибка получения находок: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка получения находок: {str(e)}"
+        )
+
+@api_router.get("/rules")
+async def get_rules(db: AsyncSession = Depends(get_read_db)):
+    """Все правила оповещений"""
+    try:
+        return {"rules": await list_rules(db)}
+    except Exception as e:
+        print(f"❌ Ошибка получения правил: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка получения правил: {str(e)}"
+        )
+
+@api_router.post("/rules", status_code=status.HTTP_201_CREATED)
+async def post_rule(payload: AlertRuleCreate, db: AsyncSession = Depends(get_db)):
+    """
+    Создание правила оповещения
+    
+    Правило применяется к отчетам, принятым после создания.
+    """
+    try:
+        rule = await create_rule(
+            db, payload.name, payload.definition, payload.severity, payload.enabled, payload.description
+        )
+        await db.commit()
+        return rule_item(rule)
+    except RuleError as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        await db.rollback()
+        print(f"❌ Ошибка создания правила: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка создания правила: {str(e)}"
+        )
+
+@api_router.get("/rules/{rule_id}")
+async def get_rule_by_id(rule_id: int, db: AsyncSession = Depends(get_read_db)):
+    """Правило оповещения по ID"""
+    rule = await get_rule(db, rule_id)
+    if rule is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Правило не найдено"
+        )
+    return rule_item(rule)
+
+@api_router.put("/rules/{rule_id}")
+async def put_rule(rule_id: int, payload: AlertRuleUpdate, db: AsyncSession = Depends(get_db)):
+    """Изменение правила оповещения (переданные поля)"""
+    try:
+        rule = await get_rule(db, rule_id)
+        if rule is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Правило не найдено"
+            )
+        rule = await update_rule(db, rule, payload.model_dump(exclude_unset=True))
+        await db.commit()
+        return rule_item(rule)
+    except HTTPException:
+        raise
+    except RuleError as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        await db.rollback()
+        print(f"❌ Ошибка изменения правила: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка изменения правила: {str(e)}"
+        )
+
+@api_router.delete("/rules/{rule_id}")
+async def delete_rule(rule_id: int, db: AsyncSession = Depends(get_db)):
+    """Удаление правила; сохраненные оповещения остаются"""
+    try:
+        rule = await get_rule(db, rule_id)
+        if rule is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Правило не найдено"
+            )
+        await db.delete(rule)
+        await db.commit()
+        return {"message": "Правило удалено", "id": rule_id}
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        print(f"❌ Ошибка удаления правила: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка удаления правила: {str(e)}"
+        )
+
+@api_router.get("/alerts")
+async def get_rule_alerts(
+    rule_id: Optional[int] = None,
+    hostname: Optional[str] = None,
+    since: Optional[datetime] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Срабатывания правил оповещений, от новых к старым
+    
+    Следующая страница запрашивается с cursor из next_cursor предыдущей.
+    """
+    try:
+        return await get_alerts(db, rule_id, hostname, since, limit, cursor)
+    except RuleError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        print(f"❌ Ошибка получения оповещений: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка получения оповещений: {str(e)}"
+        )
+
+@api_router.get("/hosts/{hostname}/changes")
+async def get_host_changes(
+    hostname: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    categories: Optional[List[str]] = Query(None, description="connections, ports, network"),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Сводная лента изменений хоста по всем отчетам (без повторов)
+    """
+    try:
+        return await get_host_timeline(db, hostname, since, until, categories, limit, cursor)
+    except ChangeQueryError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        print(f"❌ Ошибка получения ленты изменений: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка получения ленты изменений: {str(e)}"
+        )
+
+@api_router.delete("/reports/{report_id}")
+async def delete_report(report_id: str, db: AsyncSession = Depends(get_db)):
+    """Удаление отчета по ID или хешу"""
+    try:
+        from sqlalchemy import select, or_
+        from models.report import Melt
+        import uuid
+        
+        # Пытаемся найти отчет по ID или по хешу
+        stmt = None
+        
+        # Проверяем, является ли report_id UUID
+        try:
+            uuid_obj = uuid.UUID(report_id)
+            # Это UUID - ищем по ID
+            stmt = select(Melt).where(Melt.id == uuid_obj)
+        except ValueError:
+            # Это не UUID - ищем по хешу или имени файла
+            stmt = select(Melt).where(
+                or_(
+                    Melt.report_hash == report_id,
+                    Melt.html_file_path.contains(report_id)
+                )
+            )
+        
+        if stmt is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Неверный формат ID отчета"
             )
         
@@ -1256,64 +1329,12 @@ async def delete_report(report_id: str, db: AsyncSession = Depends(get_db)):
         report = result.scalar_one_or_none()
         
         if not report:
-            # Fallback: пытаемся найти файл в файловой системе
-            uploads_dir = "uploads"
-            
-            file_found = False
-            
-            # Если report_id выглядит как имя файла, ищем его точно
-            if report_id.endswith('.html'):
-                file_path = os.path.join(uploads_dir, report_id)
-                if os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                        file_found = True
-                        print(f"🗑️ Удален файл по точному имени: {report_id}")
-                    except Exception as e:
-                        print(f"⚠️ Ошибка удаления файла {report_id}: {e}")
-            
-            # Если не нашли точного совпадения, пробуем другие варианты
-            if not file_found:
-                possible_files = [
-                    f"{report_id}.html",
-                    f"report_{report_id}.html"
-                ]
-                
-                for filename in possible_files:
-                    file_path = os.path.join(uploads_dir, filename)
-                    if os.path.exists(file_path):
-                        try:
-                            os.remove(file_path)
-                            file_found = True
-                            print(f"🗑️ Удален файл (без записи в БД): {filename}")
-                            break
-                        except Exception as e:
-                            print(f"⚠️ Ошибка удаления файла {filename}: {e}")
-            
-            # Ищем по частичному совпадению имени файла
-            if not file_found and os.path.exists(uploads_dir):
-                for filename in os.listdir(uploads_dir):
-                    if report_id in filename and filename.endswith('.html'):
-                        file_path = os.path.join(uploads_dir, filename)
-                        try:
-                            os.remove(file_path)
-                            file_found = True
-                            print(f"🗑️ Удален файл (частичное совпадение): {filename}")
-                            break
-                        except Exception as e:
-                            print(f"⚠️ Ошибка удаления файла {filename}: {e}")
-            
-            if file_found:
-                return {
-                    "message": "Файл отчета удален",
-                    "report_id": report_id,
-                    "note": "Запись в базе данных не найдена"
-                }
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Отчет не найден"
-                )
+            # Файлы без записи в БД не удаляются по имени от клиента -
+            # их находит и принимает в БД фоновая сверка
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Отчет не найден"
+            )
         
         # Сохраняем информацию об удаляемом отчете
         deleted_report_info = {
@@ -1324,19 +1345,31 @@ async def delete_report(report_id: str, db: AsyncSession = Depends(get_db)):
             "file_size": report.file_size or 0
         }
         
-        # Удаляем файл отчета, если он существует
+        html_file_path = report.html_file_path
+        
+        # Удаляем запись из базы данных (каскадно удалятся связанные записи);
+        # вклад отчета в граф парка вычитается по его соединениям до удаления
+        await retract_report_edges(db, report.hostname, report.id, report.generated_at)
+        await db.execute(delete(ReportHash).where(ReportHash.report_hash == report.report_hash))
+        await db.delete(report)
+        await forget_deleted_reports(db, [report.id])
+        await db.commit()
+        await invalidate_report_cache(deleted_report_info["id"])
+        
+        # Файл удаляется только после коммита: при ошибке коммита строка
+        # остается со своим файлом
         file_deleted = False
-        if report.html_file_path and os.path.exists(report.html_file_path):
+        if html_file_path and os.path.exists(html_file_path):
             try:
-                os.remove(report.html_file_path)
+                os.remove(html_file_path)
                 file_deleted = True
-                print(f"🗑️ Удален файл отчета: {report.html_file_path}")
+                print(f"🗑️ Удален файл отчета: {html_file_path}")
             except Exception as e:
                 print(f"⚠️ Ошибка удаления файла: {e}")
-        
-        # Удаляем запись из базы данных (каскадно удалятся связанные записи)
-        await db.delete(report)
-        await db.commit()
+        try:
+            await refresh_hosts(db, [deleted_report_info["hostname"]])
+        except Exception as index_error:
+            print(f"⚠️ Индекс портов не обновлен: {index_error}")
         
         print(f"✅ Отчет удален: ID={report.id}, hostname={report.hostname}")
         
@@ -1360,160 +1393,122 @@ async def api_health():
     """Проверка здоровья API"""
     return {"status": "healthy", "api_version": "v1"}
 
-@api_router.get("/reports/stats/summary")
-async def get_melts_summary(db: AsyncSession = Depends(get_db)):
-    """Получение общей статистики по отчетам"""
+@api_router.get("/maintenance/retention")
+async def get_retention_status():
+    """Прогресс и метрики пропускной способности движка хранения"""
+    from services.retention import retention_engine
+
+    return retention_engine.get_metrics()
+
+@api_router.post("/maintenance/retention/run")
+async def run_retention(days: Optional[int] = None):
+    """Внеочередной запуск очистки устаревших отчетов"""
     try:
-        print(f"🔍 [DEBUG] Начинаем подсчет статистики...")
-        
-        # Сначала пытаемся получить данные из базы данных
-        try:
-            from sqlalchemy import select, func
-            from models.report import Melt
-            
-            print(f"🔍 [DEBUG] Пытаемся получить статистику из БД...")
-            
-            # Получаем агрегированную статистику из БД
-            stmt = select(
-                func.count(Melt.id).label('total_reports'),
-                func.sum(Melt.total_connections).label('total_connections'),
-                func.sum(Melt.tcp_ports_count).label('tcp_ports'),
-                func.sum(Melt.udp_ports_count).label('udp_ports'),
-                func.sum(Melt.unique_hosts).label('unique_hosts')
+        from services.retention import run_retention_once
+
+        summary = await run_retention_once(days)
+        if summary is None:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Очистка уже выполняется другим воркером"
             )
-            
-            result = await db.execute(stmt)
-            stats_row = result.first()
-            
-            if stats_row and stats_row.total_reports and stats_row.total_reports > 0:
-                # Есть данные в БД
-                total_melts = int(stats_row.total_reports or 0)
-                total_connections = int(stats_row.total_connections or 0)
-                tcp_ports = int(stats_row.tcp_ports or 0)
-                udp_ports = int(stats_row.udp_ports or 0)
-                total_ports = tcp_ports + udp_ports
-                unique_hosts = int(stats_row.unique_hosts or 0)
-                
-                print(f"✅ [DEBUG] Статистика из БД:")
-                print(f"   📊 Отчетов: {total_reports}")
-                print(f"   🔗 Соединений: {total_connections}")
-                print(f"   🚪 TCP портов: {tcp_ports}")
-                print(f"   🚪 UDP портов: {udp_ports}")
-                print(f"   🚪 Всего портов: {total_ports}")
-                print(f"   🌐 Уникальных хостов: {unique_hosts}")
-                
-                return {
-                    "total_reports": total_reports,
-                    "total_connections": total_connections,
-                    "total_ports": total_ports,
-                    "unique_hosts": unique_hosts
-                }
-            else:
-                print(f"⚠️ [DEBUG] БД пуста или нет валидных данных, переходим к файлам...")
-                raise Exception("БД пуста, используем fallback")
-                
-        except Exception as db_error:
-            print(f"⚠️ [DEBUG] Ошибка получения статистики из БД: {db_error}")
-            print(f"🔄 [FALLBACK] Переходим к подсчету из файлов...")
-        
-        # Fallback: считаем статистику из файлов
-        uploads_dir = "uploads"
-        if not os.path.exists(uploads_dir):
-            print(f"🔍 [DEBUG] Папка uploads не существует")
-            return {
-                "total_reports": 0,
-                "total_connections": 0,
-                "total_ports": 0,
-                "unique_hosts": 0
-            }
-        
-        total_melts = 0
-        total_connections = 0
-        total_ports = 0
-        unique_hosts_set = set()  # Используем set для уникальных хостов
-        
-        html_files = [f for f in os.listdir(uploads_dir) if f.endswith('.html')]
-        print(f"🔍 [FALLBACK] Найдено HTML файлов: {len(html_files)}")
+
+        return summary
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Ошибка запуска очистки: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка запуска очистки: {str(e)}"
+        )
+
+@api_router.get("/maintenance/reconcile")
+async def get_reconcile_status():
+    """Отчет о расхождениях между хранилищем файлов и БД"""
+    return await get_drift_report()
+
+@api_router.post("/maintenance/reconcile/run")
+async def run_reconcile_step():
+    """Внеочередной шаг сверки хранилища и БД в текущем воркере"""
+    try:
+        return await storage_reconciler.step()
+    except Exception as e:
+        print(f"❌ Ошибка сверки: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка сверки: {str(e)}"
+        )
+
+@api_router.get("/maintenance/ingest")
+async def get_ingest_status(dead_letters: int = Query(20, ge=0, le=1000)):
+    """Состояние очереди приема: глубина потоков, воркеры, недоставленные сообщения"""
+    try:
+        queue_stats = await get_ingest_queue_stats()
+        queue_stats["dead_letter_samples"] = await get_dead_letters(dead_letters) if dead_letters else []
+        return queue_stats
+    except Exception as e:
+        print(f"❌ Ошибка получения состояния очереди приема: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка получения состояния очереди приема: {str(e)}"
+        )
+
+@api_router.post("/maintenance/ingest/redrive")
+async def redrive_ingest(limit: int = Query(100, ge=1, le=10000)):
+    """Возвращает недоставленные сообщения в очередь приема"""
+    try:
+        return await redrive_dead_letters(limit)
+    except Exception as e:
+        print(f"❌ Ошибка повторной отправки в очередь приема: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка повторной отправки в очередь приема: {str(e)}"
+        )
+
+@api_router.get("/reports/stats/summary")
+async def get_melts_summary():
+    """Получение общей статистики по отчетам (агрегаты из БД, кэш stats/summary)"""
+    async def compute():
+        async with cache_fill_session() as session:
+            return await _load_melts_summary(session)
+    
+    return await cache.get_or_compute("stats", "summary", compute, ttl=settings.STATS_SUMMARY_CACHE_TTL)
+
+async def _load_melts_summary(db: AsyncSession) -> dict:
+    """Агрегаты по всем отчетам"""
+    try:
+        # Получаем агрегированную статистику из БД
+        stmt = select(
+            func.count(Melt.id).label('total_reports'),
+            func.sum(Melt.total_connections).label('total_connections'),
+            func.sum(Melt.tcp_ports_count).label('tcp_ports'),
+            func.sum(Melt.udp_ports_count).label('udp_ports'),
+            func.sum(Melt.unique_hosts).label('unique_hosts')
+        )
         
-        for filename in html_files:
-            total_reports += 1
-            try:
-                file_path = os.path.join(uploads_dir, filename)
-                parsed_data = await parse_analyzer_html_file(file_path)
-                
-                # Соединения
-                connections_count = parsed_data.get("total_connections", 0)
-                total_connections += connections_count
-                
-                # Правильно считаем порты из структуры {tcp: [...], udp: [...]}
-                ports_data = parsed_data.get("ports", {})
-                file_tcp_ports = 0
-                file_udp_ports = 0
-                
-                if isinstance(ports_data, dict):
-                    file_tcp_ports = len(ports_data.get("tcp", []))
-                    file_udp_ports = len(ports_data.get("udp", []))
-                elif isinstance(ports_data, list):
-                    # Fallback для старого формата
-                    for port in ports_data:
-                        if isinstance(port, dict):
-                            protocol = port.get('protocol', '').upper()
-                            if protocol == 'TCP':
-                                file_tcp_ports += 1
-                            elif protocol == 'UDP':
-                                file_udp_ports += 1
-                else:
-                    # Ищем в прямых полях
-                    file_tcp_ports = parsed_data.get("tcp_ports_count", 0)
-                    file_udp_ports = parsed_data.get("udp_ports_count", 0)
-                
-                file_total_ports = file_tcp_ports + file_udp_ports
-                total_ports += file_total_ports
-                
-                # Уникальные хосты из соединений
-                connections_data = parsed_data.get("connections", [])
-                for conn in connections_data:
-                    remote_addr = conn.get("remote_address", "")
-                    if remote_addr and remote_addr != "*:*" and ":" in remote_addr:
-                        # Извлекаем IP из адреса вида "192.168.1.1:80"
-                        remote_ip = remote_addr.split(":")[0]
-                        if remote_ip and remote_ip not in ["*", "0.0.0.0", "127.0.0.1"]:
-                            unique_hosts_set.add(remote_ip)
-                
-                # Также добавляем удаленные хосты из отдельной секции
-                remote_hosts_data = parsed_data.get("remote_hosts", [])
-                for host in remote_hosts_data:
-                    ip = host.get("ip_address", "") if isinstance(host, dict) else str(host)
-                    if ip and ip not in ["*", "0.0.0.0", "127.0.0.1"]:
-                        unique_hosts_set.add(ip)
-                
-                print(f"🔍 [FALLBACK] {filename}: connections={connections_count}, TCP={file_tcp_ports}, UDP={file_udp_ports}, total_ports={file_total_ports}")
-                
-            except Exception as e:
-                # Игнорируем ошибки парсинга для статистики
-                print(f"⚠️ Ошибка парсинга {filename} для статистики: {e}")
-                continue
+        result = await db.execute(stmt)
+        stats_row = result.first()
         
-        unique_hosts_count = len(unique_hosts_set)
+        total_reports = int(stats_row.total_reports or 0) if stats_row else 0
+        total_connections = int(stats_row.total_connections or 0) if stats_row else 0
+        tcp_ports = int(stats_row.tcp_ports or 0) if stats_row else 0
+        udp_ports = int(stats_row.udp_ports or 0) if stats_row else 0
+        unique_hosts = int(stats_row.unique_hosts or 0) if stats_row else 0
         
-        print(f"📊 [FALLBACK] Итоговая статистика:")
-        print(f"   📊 Отчетов: {total_reports}")
-        print(f"   🔗 Соединений: {total_connections}")
-        print(f"   🚪 Всего портов: {total_ports}")
-        print(f"   🌐 Уникальных хостов: {unique_hosts_count}")
+        print(f"📊 Статистика из БД: отчетов={total_reports}, соединений={total_connections}, портов={tcp_ports + udp_ports}")
         
         return {
             "total_reports": total_reports,
             "total_connections": total_connections,
-            "total_ports": total_ports,
-            "unique_hosts": unique_hosts_count
+            "total_ports": tcp_ports + udp_ports,
+            "unique_hosts": unique_hosts
         }
         
     except Exception as e:
         print(f"❌ [ERROR] Ошибка получения статистики: {e}")
-        import traceback
-        print(f"❌ [ERROR] Трейс: {traceback.format_exc()}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Ошибка получения статистики: {str(e)}"
-        ) 
\ No newline at end of file
+        )
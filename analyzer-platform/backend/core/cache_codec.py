@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Кодеки значений кэша Redis
+
+Каждая запись начинается с двухбайтового заголовка: маркер и байт
+формата (младшие биты - кодек, старший - признак сжатия zlib). Чтение
+выполняет одно декодирование по заголовку, без перебора форматов.
+
+- JSON (orjson) - словари, списки и скаляры из JSON-типов; самый частый
+  случай (ответы API, дельты, снимки).
+- msgpack - значения с типами вне JSON (datetime, date, UUID, set,
+  Decimal, IP-адреса, bytes); типы восстанавливаются при чтении.
+- TEXT / BYTES - строки и байты как есть.
+
+Pickle не используется: из Redis он медленный и небезопасен. Значение,
+которое нельзя закодировать, не кэшируется (CacheCodecError).
+"""
+
+import datetime as dt
+import ipaddress
+import json
+import uuid
+import zlib
+from decimal import Decimal
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - стандартный json медленнее, но совместим
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - без msgpack типизированные значения не кэшируются
+    msgpack = None
+
+from core.config import get_settings
+
+settings = get_settings()
+
+_MAGIC = 0xC7
+FORMAT_JSON = 0x01
+FORMAT_MSGPACK = 0x02
+FORMAT_TEXT = 0x03
+FORMAT_BYTES = 0x04
+_COMPRESSED = 0x80
+
+# Коды расширений msgpack для типов вне JSON
+_EXT_DATETIME = 1
+_EXT_DATE = 2
+_EXT_UUID = 3
+_EXT_SET = 4
+_EXT_DECIMAL = 5
+_EXT_IP = 6
+
+_JSON_TYPES = (dict, list, int, float, bool, type(None))
+
+
+class CacheCodecError(ValueError):
+    """Значение нельзя закодировать или запись кэша повреждена"""
+
+
+class _NotJson(Exception):
+    """Значение содержит типы вне JSON - кодируется msgpack"""
+
+
+def _reject(value: Any) -> Any:
+    raise _NotJson()
+
+
+def _msgpack_default(value: Any) -> Any:
+    if isinstance(value, dt.datetime):
+        return msgpack.ExtType(_EXT_DATETIME, value.isoformat().encode())
+    if isinstance(value, dt.date):
+        return msgpack.ExtType(_EXT_DATE, value.isoformat().encode())
+    if isinstance(value, uuid.UUID):
+        return msgpack.ExtType(_EXT_UUID, value.bytes)
+    if isinstance(value, (set, frozenset)):
+        return msgpack.ExtType(_EXT_SET, msgpack.packb(list(value), default=_msgpack_default, use_bin_type=True))
+    if isinstance(value, Decimal):
+        return msgpack.ExtType(_EXT_DECIMAL, str(value).encode())
+    if isinstance(value, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+        return msgpack.ExtType(_EXT_IP, value.packed)
+    raise TypeError(f"Тип {type(value).__name__} не поддерживается кэшем")
+
+
+def _msgpack_ext_hook(code: int, data: bytes) -> Any:
+    if code == _EXT_DATETIME:
+        return dt.datetime.fromisoformat(data.decode())
+    if code == _EXT_DATE:
+        return dt.date.fromisoformat(data.decode())
+    if code == _EXT_UUID:
+        return uuid.UUID(bytes=data)
+    if code == _EXT_SET:
+        return set(msgpack.unpackb(data, ext_hook=_msgpack_ext_hook, raw=False, strict_map_key=False))
+    if code == _EXT_DECIMAL:
+        return Decimal(data.decode())
+    if code == _EXT_IP:
+        return ipaddress.ip_address(data)
+    return msgpack.ExtType(code, data)
+
+
+def _encode_json(value: Any) -> bytes:
+    """
+    JSON без потери типов: datetime, нестроковые ключи и прочее вне JSON
+    вызывают _NotJson
+
+    UUID orjson сериализует сам, без default - он возвращается строкой,
+    как и раньше; ключам кэша и ответам API этого достаточно.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, default=_reject, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            raise _NotJson()
+    return json.dumps(value, ensure_ascii=False, default=_reject).encode()
+
+
+def _decode_json(data: Any) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(bytes(data))
+
+
+def encode(value: Any) -> bytes:
+    """
+    Кодирует значение в запись кэша с заголовком формата
+
+    Raises:
+        CacheCodecError: Тип значения не поддерживается
+    """
+    if isinstance(value, bytes):
+        fmt, payload = FORMAT_BYTES, value
+    elif isinstance(value, str):
+        fmt, payload = FORMAT_TEXT, value.encode()
+    else:
+        try:
+            if not isinstance(value, _JSON_TYPES):
+                raise _NotJson()
+            fmt, payload = FORMAT_JSON, _encode_json(value)
+        except _NotJson:
+            if msgpack is None:
+                raise CacheCodecError(f"Для типа {type(value).__name__} нужен msgpack")
+            try:
+                fmt, payload = FORMAT_MSGPACK, msgpack.packb(value, default=_msgpack_default, use_bin_type=True)
+            except (TypeError, ValueError, OverflowError) as e:
+                raise CacheCodecError(str(e))
+        except (TypeError, ValueError) as e:
+            raise CacheCodecError(str(e))
+
+    if len(payload) >= settings.CACHE_COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(payload, settings.CACHE_COMPRESS_LEVEL)
+        if len(compressed) < len(payload):
+            return bytes((_MAGIC, fmt | _COMPRESSED)) + compressed
+    return bytes((_MAGIC, fmt)) + payload
+
+
+def decode(data: bytes) -> Any:
+    """
+    Декодирует запись кэша по заголовку
+
+    Записи без заголовка (до введения кодеков) читаются только как JSON.
+
+    Raises:
+        CacheCodecError: Запись повреждена или формат неизвестен
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    try:
+        if len(data) < 2 or data[0] != _MAGIC:
+            return _decode_json(data)
+
+        fmt, payload = data[1], memoryview(data)[2:]
+        if fmt & _COMPRESSED:
+            fmt, payload = fmt & ~_COMPRESSED, zlib.decompress(payload)
+
+        if fmt == FORMAT_JSON:
+            return _decode_json(payload)
+        if fmt == FORMAT_MSGPACK:
+            if msgpack is None:
+                raise CacheCodecError("Запись msgpack, но msgpack не установлен")
+            return msgpack.unpackb(payload, ext_hook=_msgpack_ext_hook, raw=False, strict_map_key=False)
+        if fmt == FORMAT_TEXT:
+            return bytes(payload).decode()
+        if fmt == FORMAT_BYTES:
+            return bytes(payload)
+    except CacheCodecError:
+        raise
+    except Exception as e:
+        raise CacheCodecError(f"Поврежденная запись кэша: {e}")
+    raise CacheCodecError(f"Неизвестный формат записи кэша: {fmt}")
@@ -45,6 +45,13 @@ class Settings(BaseSettings):
     DB_POOL_TIMEOUT: int = 30
     DB_POOL_RECYCLE: int = 3600
     
+    # Реплики для чтения (пусто - все запросы идут в основную БД)
+    POSTGRES_REPLICA_HOSTS: str = ""  # host[:port] через запятую, учетные данные как у основной БД
+    DB_REPLICA_POOL_SIZE: int = 20
+    DB_REPLICA_POOL_MAX_OVERFLOW: int = 30
+    DB_REPLICA_MAX_LAG_SECONDS: float = 5.0  # Реплика с большим отставанием не используется
+    DB_REPLICA_CHECK_INTERVAL_SECONDS: int = 5  # Как часто измерять отставание
+    
     # Redis настройки
     REDIS_HOST: str = "localhost"
     REDIS_PORT: int = 6379
@@ -55,6 +62,25 @@ class Settings(BaseSettings):
     # Настройки кэширования
     CACHE_TTL: int = 3600  # 1 час
     CACHE_PREFIX: str = "analyzer:"
+    CACHE_COMPRESS_MIN_BYTES: int = 1024  # Записи кэша больше этого размера сжимаются zlib
+    CACHE_COMPRESS_LEVEL: int = 1  # Быстрое сжатие: JSON отчетов сжимается в разы и на уровне 1
+    CACHE_GENERATION_REFRESH_SECONDS: float = 1.0  # Как долго воркер доверяет своему поколению категории
+    CACHE_SCAN_BATCH: int = 500  # Ключей за одну команду SCAN
+    CACHE_INDEX_PRUNE_EVERY: int = 100  # Записей категории между чистками истекших ключей индекса
+    CACHE_LOCAL_ENABLED: bool = True  # Локальный LRU воркера перед Redis
+    CACHE_LOCAL_MAX_ENTRIES: int = 10_000
+    CACHE_LOCAL_MAX_BYTES: int = 64 * 1024 * 1024  # По размеру закодированных записей
+    CACHE_LOCAL_MAX_ENTRY_BYTES: int = 1024 * 1024  # Крупнее - только в Redis
+    CACHE_LOCAL_TTL_SECONDS: float = 30.0  # Страховка на случай пропущенного сообщения инвалидации
+    CACHE_INVALIDATION_RETRY_SECONDS: float = 5.0
+    CACHE_STALE_TTL_SECONDS: int = 300  # Сколько после мягкого срока отдается устаревшее значение
+    CACHE_EARLY_REFRESH_BETA: float = 1.0  # >1 - раньше обновлять популярные записи (XFetch)
+    CACHE_LOCK_TIMEOUT_SECONDS: float = 30.0  # Блокировка пересчета записи между воркерами
+    CACHE_LOCK_WAIT_SECONDS: float = 5.0  # Дольше ждать чужой пересчет не имеет смысла - считаем сами
+    CACHE_LOCK_POLL_SECONDS: float = 0.05
+    STATS_SUMMARY_CACHE_TTL: int = 60
+    REPORT_DETAILS_CACHE_TTL: int = 600
+    SUMMARY_CACHE_TTL: int = 3600  # Строки списка отчетов (services/summaries.py)
     
     # Файловые настройки
     UPLOAD_DIR: str = "uploads"
@@ -74,13 +100,96 @@ class Settings(BaseSettings):
     ANALYZER_REPORTS_DIR: str = "reports"
     AUTO_IMPORT_REPORTS: bool = True
     REPORT_CLEANUP_DAYS: int = 90
-    
+
+    # Настройки движка хранения (retention)
+    RETENTION_ENABLED: bool = True
+    RETENTION_INTERVAL_SECONDS: int = 3600  # Как часто запускать очистку
+    RETENTION_BATCH_SIZE: int = 500  # Отчетов в одной транзакции
+    RETENTION_BATCH_PAUSE_MS: int = 50  # Пауза между пачками (сглаживает WAL)
+    RETENTION_ARCHIVE_DIR: Optional[str] = None  # Если задан - файлы переносятся сюда, а не удаляются
+    RETENTION_FILE_CONCURRENCY: int = 8  # Параллельных операций с файлами
+    PARTITION_PREMAKE_MONTHS: int = 3  # На сколько месяцев вперед создавать секции
+
+    # Настройки фоновой сверки хранилища и БД
+    RECONCILE_ENABLED: bool = True
+    RECONCILE_INTERVAL_SECONDS: int = 30  # Пауза между шагами сверки
+    RECONCILE_BATCH_SIZE: int = 500  # Файлов и строк за один шаг
+    RECONCILE_REINGEST_CONCURRENCY: int = 2  # Параллельных переприемов файлов
+
+    # Настройки приема отчетов
+    INTERN_CACHE_SIZE: int = 100_000  # Значений справочника в кэше воркера (на справочник)
+    INGEST_INSERT_CHUNK: int = 1000  # Строк соединений/портов в одной команде INSERT
+
+    # Распределенный прием отчетов через Redis Streams (services/ingest_queue.py)
+    INGEST_QUEUE_ENABLED: bool = False  # Загрузка ставится в очередь, а не обрабатывается в запросе
+    INGEST_API_WORKER: bool = True  # Воркер API тоже разбирает очередь (без отдельных ingest_worker.py)
+    INGEST_PARTITIONS: int = 16  # Потоков очереди; отчеты одного хоста всегда в одном потоке
+    INGEST_LEASE_MS: int = 15_000  # Аренда потока воркером; не продленная - переходит другому
+    INGEST_HEARTBEAT_SECONDS: float = 5.0  # Продление аренд и перераспределение потоков
+    INGEST_BLOCK_MS: int = 2000  # Ожидание новых сообщений в XREADGROUP
+    INGEST_CLAIM_IDLE_MS: int = 60_000  # Сообщение чужого потребителя без подтверждения дольше - забирается
+    INGEST_MAX_ATTEMPTS: int = 5  # Попыток на сообщение, после - в поток недоставленных
+    INGEST_RETRY_BASE_SECONDS: float = 2.0  # Пауза перед повтором, удваивается с каждой попыткой
+    INGEST_RETRY_MAX_SECONDS: float = 60.0
+    INGEST_DEAD_MAXLEN: int = 10_000  # Сообщений в потоке недоставленных (приблизительно)
+    INGEST_STATUS_TTL: int = 86400  # Сколько хранится статус загрузки
+
+    # Настройки поиска
+    SEARCH_MIN_QUERY_LENGTH: int = 3  # Минимум для trigram поиска
+    SEARCH_MAX_DIMENSION_MATCHES: int = 1000  # Значений справочника на один запрос
+    SEARCH_MAX_PAGE_SIZE: int = 200
+    SEARCH_CACHE_TTL: int = 300  # 5 минут
+
+    # Настройки сравнения отчетов
+    DELTA_MAX_ITEMS: int = 500  # Элементов в каждом списке (added/removed/changed) секции
+    DELTA_CACHE_TTL: int = 86400  # Ключ включает версии отчетов, поэтому TTL большой
+    DELTA_FINGERPRINT_CACHE_SIZE: int = 32  # Канонических форм отчетов в кэше воркера
+    DELTA_PRECOMPUTE_ENABLED: bool = True  # Фоновое вычисление дельт после приема отчетов
+    DELTA_POLL_INTERVAL_SECONDS: int = 5  # Пауза между проверками очереди дельт
+    DELTA_MAX_ATTEMPTS: int = 5  # Попыток на отчет, после - запись остается в очереди с ошибкой
+
+    # Индекс открытых портов парка (в памяти воркера)
+    PORT_INDEX_ENABLED: bool = True
+    PORT_INDEX_SYNC_INTERVAL_SECONDS: int = 10  # Подтягивание хостов, обновленных другими воркерами
+    PORT_INDEX_REBUILD_INTERVAL_SECONDS: int = 3600  # Полная перестройка и новый снимок
+    PORT_INDEX_SNAPSHOT_TTL: int = 86400
+    PORT_INDEX_BATCH_SIZE: int = 1000  # Отчетов в одном запросе портов при сборке
+
+    # Временные ряды показателей хостов
+    SERIES_MAX_POINTS: int = 500  # Точек ряда при автоматическом выборе шага
+    SERIES_HOURLY_RETENTION_DAYS: int = 90  # Часовые корзины старше удаляются, суточные остаются
+
+    # Граф связей парка
+    GRAPH_MAX_NODES: int = 1000  # Предел узлов подграфа
+    GRAPH_MAX_EDGES_PER_NODE: int = 20  # Ребер подграфа на узел (в среднем)
+
+    # Обнаружение аномалий по базовой линии хоста
+    ANOMALY_MIN_BASELINE_REPORTS: int = 3  # До этого числа отчетов линия только обучается
+    ANOMALY_BASELINE_DECAY_DAYS: int = 30  # Элемент, не виденный дольше, снова считается новым
+    ANOMALY_BASELINE_MAX_ENTRIES: int = 50_000  # Элементов одного вида в линии хоста
+    ANOMALY_MAX_FINDINGS_PER_REPORT: int = 200
+
+    # Пользовательские правила оповещений
+    RULES_SAMPLES_PER_ALERT: int = 5  # Примеров совпадений в оповещении
+    RULES_MAX_ENABLED: int = 10_000
+
     @property
     def database_url(self) -> str:
         """Формирует URL для подключения к базе данных"""
         password = self.POSTGRES_PASSWORD.get_secret_value()
         return f"postgresql+asyncpg://{self.POSTGRES_USER}:{password}@{self.POSTGRES_SERVER}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
     
+    @property
+    def replica_database_urls(self) -> List[str]:
+        """URL реплик для чтения из POSTGRES_REPLICA_HOSTS"""
+        password = self.POSTGRES_PASSWORD.get_secret_value()
+        urls = []
+        for host in filter(None, (h.strip() for h in self.POSTGRES_REPLICA_HOSTS.split(","))):
+            if ":" not in host:
+                host = f"{host}:{self.POSTGRES_PORT}"
+            urls.append(f"postgresql+asyncpg://{self.POSTGRES_USER}:{password}@{host}/{self.POSTGRES_DB}")
+        return urls
+    
     @property
     def redis_url_computed(self) -> str:
         """Формирует URL для подключения к Redis"""
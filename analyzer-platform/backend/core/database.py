@@ -1,10 +1,19 @@
 #!/usr/bin/env python3
 """
 Модуль работы с базой данных PostgreSQL
+
+Запись и чтение сразу после записи идут в основную БД (get_db). Тяжелые
+запросы только на чтение (get_read_db) распределяются по репликам из
+POSTGRES_REPLICA_HOSTS; реплика с отставанием больше
+DB_REPLICA_MAX_LAG_SECONDS или недоступная исключается до следующей
+проверки, а при отсутствии подходящих реплик чтение идет в основную БД.
 """
 
+import asyncio
+import itertools
 import logging
-from typing import AsyncGenerator, Optional
+from datetime import datetime
+from typing import Any, AsyncGenerator, Dict, List, Optional
 from contextlib import asynccontextmanager
 
 from sqlalchemy.ext.asyncio import (
@@ -13,6 +22,7 @@ from sqlalchemy.ext.asyncio import (
     async_sessionmaker,
     AsyncEngine
 )
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy import text
 
@@ -24,26 +34,58 @@ logger = logging.getLogger(__name__)
 async_engine: Optional[AsyncEngine] = None
 async_session_factory: Optional[async_sessionmaker[AsyncSession]] = None
 
+# Реплики для чтения: движки, фабрики сессий и состояние (отставание, доступность)
+replica_engines: List[AsyncEngine] = []
+replica_session_factories: List[async_sessionmaker[AsyncSession]] = []
+replica_state: List[Dict[str, Any]] = []
+
+# Куда направлены сессии get_read_db
+read_routing_stats: Dict[str, int] = {"replica": 0, "primary_fallback": 0}
+_replica_cursor = itertools.count()
+
+# Отставание реплики в секундах; 0 - если приемник WAL подключен к основной
+# БД и все полученные WAL уже применены (иначе простаивающая основная БД
+# выглядела бы как растущее отставание). При отключенном приемнике
+# receive_lsn не растет, поэтому отставание считается по времени последней
+# примененной транзакции. Статус приемника виден только с pg_read_all_stats,
+# без этой роли проверяется лишь наличие процесса приемника.
+# NULL - реплика еще ничего не применила, считается неготовой
+REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+            AND EXISTS (
+                SELECT 1 FROM pg_stat_wal_receiver
+                WHERE COALESCE(status, 'streaming') = 'streaming'
+            ) THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
 
 class Base(DeclarativeBase):
     """Базовый класс для всех моделей SQLAlchemy"""
     pass
 
 
-async def create_database_engine() -> AsyncEngine:
+async def create_database_engine(
+    url: Optional[str] = None,
+    pool_size: Optional[int] = None,
+    max_overflow: Optional[int] = None
+) -> AsyncEngine:
     """
-    Создает асинхронный движок базы данных
+    Создает асинхронный движок базы данных (по умолчанию - основной БД)
     """
     settings = get_settings()
     
     # Создаем асинхронный движок
     engine = create_async_engine(
-        settings.database_url,
+        url or settings.database_url,
         echo=settings.DEBUG,
         future=True,
         # Настройки пула соединений для asyncio
-        pool_size=settings.DB_POOL_SIZE,
-        max_overflow=settings.DB_POOL_MAX_OVERFLOW,
+        pool_size=pool_size or settings.DB_POOL_SIZE,
+        max_overflow=max_overflow if max_overflow is not None else settings.DB_POOL_MAX_OVERFLOW,
         pool_timeout=settings.DB_POOL_TIMEOUT,
         pool_recycle=settings.DB_POOL_RECYCLE,
         pool_pre_ping=True,
@@ -52,6 +94,43 @@ async def create_database_engine() -> AsyncEngine:
     return engine
 
 
+def _create_session_factory(engine: AsyncEngine) -> async_sessionmaker[AsyncSession]:
+    """Фабрика сессий для движка"""
+    return async_sessionmaker(
+        bind=engine,
+        class_=AsyncSession,
+        expire_on_commit=False,
+        autoflush=True,
+        autocommit=False
+    )
+
+
+async def init_replicas() -> None:
+    """Создает движки реплик для чтения и сразу измеряет их отставание"""
+    settings = get_settings()
+    
+    for url in settings.replica_database_urls:
+        engine = await create_database_engine(
+            url,
+            pool_size=settings.DB_REPLICA_POOL_SIZE,
+            max_overflow=settings.DB_REPLICA_POOL_MAX_OVERFLOW
+        )
+        replica_engines.append(engine)
+        replica_session_factories.append(_create_session_factory(engine))
+        replica_state.append({
+            "host": f"{engine.url.host}:{engine.url.port}",
+            "healthy": False,
+            "lag_seconds": None,
+            "checked_at": None,
+            "error": None,
+        })
+    
+    if replica_engines:
+        await check_replica_lag()
+        healthy = sum(1 for state in replica_state if state["healthy"])
+        print(f"✅ Реплики для чтения: {healthy}/{len(replica_engines)} доступны")
+
+
 async def init_db() -> None:
     """
     Инициализация базы данных
@@ -63,24 +142,18 @@ async def init_db() -> None:
         async_engine = await create_database_engine()
         
         # Создаем фабрику сессий
-        async_session_factory = async_sessionmaker(
-            bind=async_engine,
-            class_=AsyncSession,
-            expire_on_commit=False,
-            autoflush=True,
-            autocommit=False
-        )
+        async_session_factory = _create_session_factory(async_engine)
         
-        # Проверяем соединение
-        async with async_engine.begin() as conn:
-            await conn.execute(text("SELECT 1"))
+        # Проверяем соединение и версию схемы одним запросом.
+        # Схему создают и обновляют миграции (alembic upgrade head), не воркеры
+        from core.migrations import check_schema_version
         
-        # Создаем таблицы
-        async with async_engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
+        state = await check_schema_version(async_engine)
         
         print("✅ База данных PostgreSQL инициализирована")
-        print("✅ Таблицы созданы/проверены")
+        print(f"✅ Версия схемы: {state['current_revision'] or 'нет'} (ожидается {state['expected_revision']})")
+        
+        await init_replicas()
         
     except Exception as e:
         print(f"❌ Ошибка инициализации БД: {e}")
@@ -93,11 +166,29 @@ async def close_db() -> None:
     """
     global async_engine
     
+    for engine in replica_engines:
+        await engine.dispose()
+    replica_engines.clear()
+    replica_session_factories.clear()
+    replica_state.clear()
+    
     if async_engine:
         await async_engine.dispose()
         print("✅ Соединение с БД закрыто")
 
 
+async def _session_scope(factory: async_sessionmaker[AsyncSession]) -> AsyncGenerator[AsyncSession, None]:
+    """Сессия фабрики с откатом при ошибке"""
+    async with factory() as session:
+        try:
+            yield session
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
+
+
 async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
     """
     Получение сессии базы данных для dependency injection
@@ -105,14 +196,122 @@ async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
     if not async_session_factory:
         raise RuntimeError("База данных не инициализирована")
     
-    async with async_session_factory() as session:
+    async for session in _session_scope(async_session_factory):
+        yield session
+
+
+async def _measure_replica_lag(engine: AsyncEngine) -> Optional[float]:
+    """Отставание одной реплики в секундах"""
+    async with engine.connect() as conn:
+        lag = (await conn.execute(REPLICA_LAG_SQL)).scalar()
+    return float(lag) if lag is not None else None
+
+
+async def check_replica_lag() -> None:
+    """Обновляет отставание и доступность всех реплик"""
+    settings = get_settings()
+    
+    for engine, state in zip(replica_engines, replica_state):
         try:
-            yield session
-        except Exception:
-            await session.rollback()
+            lag = await asyncio.wait_for(_measure_replica_lag(engine), timeout=settings.DB_POOL_TIMEOUT)
+            state.update({
+                "healthy": lag is not None and lag <= settings.DB_REPLICA_MAX_LAG_SECONDS,
+                "lag_seconds": lag,
+                "error": None,
+            })
+        except Exception as e:
+            state.update({"healthy": False, "lag_seconds": None, "error": str(e)})
+        state["checked_at"] = datetime.utcnow().isoformat()
+        
+        if not state["healthy"]:
+            reason = state["error"] or f"отставание {state['lag_seconds']}с"
+            logger.warning(f"⚠️ Реплика {state['host']} исключена из чтения: {reason}")
+
+
+async def replica_lag_loop() -> None:
+    """Фоновая проверка отставания реплик"""
+    settings = get_settings()
+    
+    while True:
+        await asyncio.sleep(settings.DB_REPLICA_CHECK_INTERVAL_SECONDS)
+        try:
+            await check_replica_lag()
+        except asyncio.CancelledError:
             raise
-        finally:
-            await session.close()
+        except Exception as e:
+            logger.error(f"❌ Ошибка проверки реплик: {e}")
+
+
+def _pick_replica() -> Optional[int]:
+    """Индекс следующей доступной реплики (по кругу) или None"""
+    healthy = [i for i, state in enumerate(replica_state) if state["healthy"]]
+    if not healthy:
+        return None
+    return healthy[next(_replica_cursor) % len(healthy)]
+
+
+async def get_read_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    FastAPI dependency для запросов только на чтение
+
+    Сессия реплики с допустимым отставанием, иначе - основной БД. Ошибка
+    соединения исключает реплику до следующей проверки отставания.
+    """
+    if not async_session_factory:
+        raise RuntimeError("База данных не инициализирована")
+    
+    index = _pick_replica()
+    if index is None:
+        read_routing_stats["primary_fallback"] += 1
+        async for session in _session_scope(async_session_factory):
+            yield session
+        return
+    
+    read_routing_stats["replica"] += 1
+    try:
+        async for session in _session_scope(replica_session_factories[index]):
+            yield session
+    except DBAPIError as e:
+        if e.connection_invalidated:
+            replica_state[index].update({"healthy": False, "error": str(e)})
+        raise
+
+
+@asynccontextmanager
+async def cache_fill_session() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Сессия заполнения записи кэша при промахе
+
+    Всегда основная БД: запись живет весь TTL, и прочитанные с отстающей
+    реплики 404 или устаревшие данные отдавались бы до ее истечения, хотя
+    инвалидация после записи уже прошла. Промахи редки, поэтому нагрузка
+    на основную БД от них невелика.
+    """
+    async for session in get_db_session():
+        yield session
+
+
+def _pool_stats(engine: AsyncEngine) -> Dict[str, int]:
+    """Заполнение пула соединений движка"""
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    }
+
+
+def get_pool_metrics() -> Dict[str, Any]:
+    """Метрики пулов основной БД и реплик, маршрутизация чтения"""
+    return {
+        "primary": _pool_stats(async_engine) if async_engine else None,
+        "replicas": [
+            {**state, "pool": _pool_stats(engine)}
+            for engine, state in zip(replica_engines, replica_state)
+        ],
+        "read_routing": dict(read_routing_stats),
+    }
 
 
 async def get_db_health() -> bool:
@@ -186,8 +385,9 @@ async def get_db_info() -> dict:
                 "database_size": database_size,
                 "active_connections": active_connections,
                 "total_connections": total_connections,
-                "pool_size": settings.DB_POOL_SIZE,
-                "max_overflow": settings.DB_POOL_MAX_OVERFLOW
+                "pool_size": get_settings().DB_POOL_SIZE,
+                "max_overflow": get_settings().DB_POOL_MAX_OVERFLOW,
+                "pools": get_pool_metrics()
             }
             
     except Exception as e:
@@ -215,38 +415,20 @@ async def execute_migration(migration_sql: str) -> bool:
         return False
 
 
-async def cleanup_old_data(days: int = 90) -> int:
+async def cleanup_old_data(days: Optional[int] = None) -> int:
     """
     Очищает старые данные (старше указанного количества дней)
+
+    Удаление выполняется пачками движком хранения вместе с HTML файлами
     """
     try:
         if not async_session_factory:
             raise RuntimeError("База данных не инициализирована")
         
-        from models.report import Melt
-        from datetime import datetime, timedelta
-        
-        cutoff_date = datetime.utcnow() - timedelta(days=days)
-        deleted_count = 0
-        
-        async with async_session_factory() as session:
-            # Удаляем старые отчеты (каскадно удалятся связанные данные)
-            result = await session.execute(
-                text("""
-                    DELETE FROM system_reports 
-                    WHERE created_at < :cutoff_date
-                    RETURNING id
-                """),
-                {"cutoff_date": cutoff_date}
-            )
-            
-            deleted_rows = result.fetchall()
-            deleted_count = len(deleted_rows)
-            
-            await session.commit()
+        from services.retention import retention_engine
         
-        logger.info(f"🧹 Очищено {deleted_count} старых отчетов (старше {days} дней)")
-        return deleted_count
+        summary = await retention_engine.run(days)
+        return summary["reports_deleted"]
         
     except Exception as e:
         logger.error(f"❌ Ошибка очистки старых данных: {e}")
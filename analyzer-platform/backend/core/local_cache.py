@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Локальный (в процессе воркера) уровень кэша перед Redis
+
+LRU с ограничением по числу записей, суммарному размеру и TTL. Хранятся
+уже декодированные значения, поэтому горячее чтение не выходит из
+процесса и не декодирует запись заново. Значения из кэша только для
+чтения: вызывающий код не должен их изменять.
+
+Согласованность между воркерами обеспечивает CacheManager: изменения
+рассылаются через pub/sub Redis, и каждый воркер вытесняет свою копию.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from core.config import get_settings
+
+settings = get_settings()
+
+MISSING = object()
+
+
+class LocalCache:
+    """LRU записей "ключ Redis -> (значение, размер, момент истечения)" """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None
+    ):
+        self.max_entries = max_entries or settings.CACHE_LOCAL_MAX_ENTRIES
+        self.max_bytes = max_bytes or settings.CACHE_LOCAL_MAX_BYTES
+        self.ttl = ttl or settings.CACHE_LOCAL_TTL_SECONDS
+        self._entries: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Растет при каждом вытеснении по инвалидации: значение, прочитанное
+        # из Redis до инвалидации, не должно попасть в кэш после нее
+        self.epoch = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Any:
+        """Значение или MISSING (None - допустимое значение кэша)"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[2] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self._remove(key)
+        self.misses += 1
+        return MISSING
+
+    def set(self, key: str, value: Any, size: int, ttl: Optional[float] = None) -> None:
+        if size > settings.CACHE_LOCAL_MAX_ENTRY_BYTES:
+            # Крупные значения (снимки, выгрузки) читаются редко - только из Redis
+            self._remove(key)
+            return
+        self._remove(key)
+        ttl = min(ttl, self.ttl) if ttl else self.ttl
+        self._entries[key] = (value, size, time.monotonic() + ttl)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def _remove(self, key: str) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._bytes -= entry[1]
+        return True
+
+    def discard(self, key: str) -> bool:
+        self.epoch += 1
+        return self._remove(key)
+
+    def discard_prefix(self, prefix: str) -> int:
+        """Вытесняет записи с общим префиксом ключа (категория и поколение)"""
+        self.epoch += 1
+        keys = [key for key in self._entries if key.startswith(prefix)]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def clear(self) -> None:
+        self.epoch += 1
+        self._entries.clear()
+        self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Версионирование схемы базы данных
+
+Миграции выполняются отдельной командой (alembic upgrade head), а воркеры API
+при старте только сверяют версию схемы одним запросом к alembic_version.
+Здесь же - помощники для ревизий: выполнение SQL скриптов и онлайн-построение
+индексов (CREATE INDEX CONCURRENTLY) в том числе на секционированных таблицах.
+"""
+
+import logging
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+ALEMBIC_INI = BACKEND_DIR / "alembic.ini"
+MIGRATIONS_DIR = BACKEND_DIR / "migrations"
+SQL_DIR = MIGRATIONS_DIR / "sql"
+
+# Ключ advisory lock: параллельные запуски alembic upgrade выполняются по очереди
+MIGRATION_LOCK_KEY = 726_004
+
+# Состояние схемы, определенное при старте воркера
+schema_state: Dict[str, Any] = {
+    "current_revision": None,
+    "expected_revision": None,
+    "ready": False,
+    "checked_at": None,
+}
+
+
+@lru_cache()
+def get_expected_revision() -> Optional[str]:
+    """Head ревизия из каталога миграций (без обращения к БД)"""
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+
+    config = Config(str(ALEMBIC_INI))
+    config.set_main_option("script_location", str(MIGRATIONS_DIR))
+    return ScriptDirectory.from_config(config).get_current_head()
+
+
+async def check_schema_version(engine) -> Dict[str, Any]:
+    """
+    Сверяет версию схемы БД с ожидаемой
+
+    Один запрос к alembic_version; он же подтверждает доступность БД.
+    Несовпадение не останавливает воркер, но /health/ready возвращает 503.
+    """
+    expected = get_expected_revision()
+
+    async with engine.connect() as conn:
+        try:
+            current = (await conn.execute(text("SELECT version_num FROM alembic_version"))).scalar()
+        except Exception:
+            # Таблицы нет - миграции еще не применялись
+            await conn.rollback()
+            current = None
+
+    schema_state.update({
+        "current_revision": current,
+        "expected_revision": expected,
+        "ready": current is not None and current == expected,
+        "checked_at": datetime.utcnow().isoformat(),
+    })
+
+    if not schema_state["ready"]:
+        logger.warning(
+            f"⚠️ Схема БД {current or 'не создана'}, ожидается {expected}: выполните 'alembic upgrade head'"
+        )
+
+    return schema_state
+
+
+def split_sql_statements(sql: str) -> List[str]:
+    """
+    Делит SQL скрипт на отдельные команды
+
+    Учитывает строки, комментарии и dollar-quoting ($$ ... $$) в DO блоках.
+    """
+    statements = []
+    current = []
+    i = 0
+    length = len(sql)
+    dollar_tag = None
+    in_string = False
+
+    while i < length:
+        char = sql[i]
+
+        if dollar_tag:
+            if sql.startswith(dollar_tag, i):
+                current.append(dollar_tag)
+                i += len(dollar_tag)
+                dollar_tag = None
+                continue
+        elif in_string:
+            if char == "'":
+                in_string = False
+        elif sql.startswith("--", i):
+            end = sql.find("\n", i)
+            i = length if end == -1 else end
+            continue
+        elif char == "'":
+            in_string = True
+        elif char == "$":
+            end = sql.find("$", i + 1)
+            tag = sql[i:end + 1] if end != -1 else ""
+            if tag and (tag == "$$" or tag[1:-1].replace("_", "").isalnum()):
+                dollar_tag = tag
+                current.append(tag)
+                i = end + 1
+                continue
+        elif char == ";":
+            statement = "".join(current).strip()
+            if statement:
+                statements.append(statement)
+            current = []
+            i += 1
+            continue
+
+        current.append(char)
+        i += 1
+
+    statement = "".join(current).strip()
+    if statement:
+        statements.append(statement)
+
+    return statements
+
+
+def execute_sql_file(filename: str) -> None:
+    """Выполняет SQL скрипт из migrations/sql в транзакции текущей ревизии"""
+    from alembic import op
+
+    bind = op.get_bind()
+    for statement in split_sql_statements((SQL_DIR / filename).read_text(encoding="utf-8")):
+        bind.exec_driver_sql(statement)
+
+
+def _partitions_of(bind, table: str) -> List[str]:
+    """Непосредственные секции таблицы"""
+    rows = bind.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:table)
+        ORDER BY c.relname
+    """), {"table": table})
+    return [row.relname for row in rows]
+
+
+def create_child_partitions(table: str, parent: str = "system_reports") -> None:
+    """
+    Секции новой дочерней таблицы отчетов для всех существующих месяцев parent
+
+    Имена и границы задает services/partitioning.py, который создает и
+    последующие месяцы и удаляет их при очистке.
+    """
+    from alembic import op
+    from services.partitioning import month_partition_ddl, partition_month
+
+    for partition in _partitions_of(op.get_bind(), parent):
+        month = partition_month(partition)
+        if month is not None:
+            op.execute(month_partition_ddl(table, month))
+
+
+def _create_index_concurrently(bind, name: str, table: str, definition: str) -> None:
+    """CREATE INDEX CONCURRENTLY с пересозданием индекса, оставшегося INVALID после сбоя"""
+    valid = bind.execute(text("""
+        SELECT i.indisvalid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = :name
+    """), {"name": name}).scalar()
+
+    if valid is False:
+        bind.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+    if valid is not True:
+        bind.exec_driver_sql(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON "{table}" {definition}')
+
+
+def create_index_concurrently(
+    name: str,
+    table: str,
+    columns: Sequence[str],
+    using: Optional[str] = None,
+    where: Optional[str] = None
+) -> None:
+    """
+    Строит индекс без блокировки записи
+
+    Для секционированной таблицы индекс создается на родителе как ON ONLY,
+    каждая секция индексируется CONCURRENTLY и присоединяется к нему.
+    Новые секции получают индекс автоматически.
+    Вызывается из upgrade() ревизии вне ее транзакции (autocommit_block).
+    """
+    from alembic import op
+
+    definition = f"{'USING ' + using + ' ' if using else ''}({', '.join(columns)})"
+    if where:
+        definition += f" WHERE {where}"
+
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        partitions = _partitions_of(bind, table)
+
+        if not partitions:
+            _create_index_concurrently(bind, name, table, definition)
+            return
+
+        bind.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS "{name}" ON ONLY "{table}" {definition}')
+
+        for partition in partitions:
+            # Имя индекса секции: {name}_{суффикс секции}, например idx_x_p202501
+            partition_index = f"{name}_{partition.rsplit('_', 1)[-1]}"[:63]
+            _create_index_concurrently(bind, partition_index, partition, definition)
+
+            attached = bind.execute(text("""
+                SELECT 1
+                FROM pg_inherits i
+                WHERE i.inhrelid = to_regclass(:child) AND i.inhparent = to_regclass(:parent)
+            """), {"child": partition_index, "parent": name}).scalar()
+            if not attached:
+                bind.exec_driver_sql(f'ALTER INDEX "{name}" ATTACH PARTITION "{partition_index}"')
+
+
+def drop_index_concurrently(name: str) -> None:
+    """
+    Удаляет индекс без блокировки записи (для downgrade)
+
+    Индекс секционированной таблицы CONCURRENTLY удалить нельзя - он
+    удаляется обычным DROP вместе с индексами секций.
+    """
+    from alembic import op
+
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        kind = bind.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"), {"name": name}).scalar()
+        if kind == "I":
+            bind.exec_driver_sql(f'DROP INDEX IF EXISTS "{name}"')
+        elif kind is not None:
+            bind.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
@@ -3,13 +3,19 @@
 Redis клиент и кэш-менеджер для веб-платформы анализатора
 """
 
-import json
+import asyncio
 import logging
-from typing import Any, Dict, List, Optional, Union
+import math
+import random
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
 from datetime import datetime, timedelta
 
 import redis.asyncio as redis
+from core.cache_codec import CacheCodecError, decode, encode
 from core.config import get_settings
+from core.local_cache import MISSING, LocalCache
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -20,6 +26,14 @@ settings = get_settings()
 # Глобальная переменная для Redis клиента
 redis_client: Optional[redis.Redis] = None
 
+# Снятие блокировки пересчета только ее владельцем
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
 
 async def init_redis() -> None:
     """
@@ -112,15 +126,59 @@ async def get_redis_info() -> Dict[str, Any]:
 class CacheManager:
     """
     Менеджер кэша для работы с отчетами анализатора
+
+    Ключ записи включает поколение категории: {prefix}{category}:{gen}:{key}.
+    Категория сбрасывается увеличением поколения (один INCR) - старые записи
+    становятся недостижимыми и истекают по своему TTL, KEYS не нужен.
+
+    Для каждого поколения ведется индекс записей (sorted set: ключ -> время
+    истечения), по нему статистика считает живые записи без перебора ключей.
+
+    Два уровня: перед Redis стоит локальный LRU воркера (core/local_cache.py).
+    Запись, удаление и сброс категории рассылаются в канал pub/sub
+    {prefix}invalidate, и остальные воркеры вытесняют свои копии
+    (cache_invalidation_loop). Локальный уровень и доверие к своему
+    поколению категории действуют только пока подписка активна - тогда
+    горячее чтение не обращается к Redis; без подписки поколение
+    перечитывается раз в CACHE_GENERATION_REFRESH_SECONDS.
     """
     
     def __init__(self):
         self.prefix = settings.CACHE_PREFIX
         self.default_ttl = settings.CACHE_TTL
+        self.channel = f"{self.prefix}invalidate"
+        self.instance_id = uuid.uuid4().hex
+        self.local: Optional[LocalCache] = LocalCache() if settings.CACHE_LOCAL_ENABLED else None
+        self.listening = False
+        self.redis_hits = 0
+        self.redis_misses = 0
+        self._generations: Dict[str, Tuple[int, float]] = {}
+        self._writes: Dict[str, int] = {}
+        self._inflight: Dict[Tuple[str, str, str], "asyncio.Future"] = {}
+        self.recompute_stats: Dict[str, int] = {
+            "computed": 0, "coalesced": 0, "lock_waits": 0, "stale_served": 0, "early_refreshes": 0,
+        }
+    
+    def _generation_key(self, category: str) -> str:
+        return f"{self.prefix}_gen:{category}"
     
-    def _make_key(self, category: str, key: str) -> str:
+    def _index_key(self, category: str, generation: int) -> str:
+        return f"{self.prefix}_index:{category}:{generation}"
+    
+    def _make_key(self, category: str, key: str, generation: int) -> str:
         """Создает ключ для кэша"""
-        return f"{self.prefix}{category}:{key}"
+        return f"{self.prefix}{category}:{generation}:{key}"
+    
+    async def _generation(self, category: str) -> int:
+        """Текущее поколение категории (с кэшем в воркере)"""
+        cached = self._generations.get(category)
+        now = time.monotonic()
+        if cached and (self.listening or now - cached[1] < settings.CACHE_GENERATION_REFRESH_SECONDS):
+            return cached[0]
+        value = await redis_client.get(self._generation_key(category))
+        generation = int(value) if value else 0
+        self._generations[category] = (generation, now)
+        return generation
     
     async def set(
         self,
@@ -138,28 +196,45 @@ class CacheManager:
             key: Ключ
             value: Значение для сохранения
             ttl: Время жизни в секундах
-            serialize: Нужно ли сериализовать значение
+            serialize: Нужно ли сериализовать значение (core/cache_codec.py);
+                иначе value - готовые bytes/str
         """
         try:
             if not redis_client:
                 return False
             
-            cache_key = self._make_key(category, key)
+            generation = await self._generation(category)
+            cache_key = self._make_key(category, key, generation)
+            index_key = self._index_key(category, generation)
             ttl = ttl or self.default_ttl
             
-            if serialize:
-                if isinstance(value, (dict, list)):
-                    serialized_value = json.dumps(value, ensure_ascii=False, default=str)
-                else:
-                    serialized_value = pickle.dumps(value)
-            else:
-                serialized_value = value
+            serialized_value = encode(value) if serialize else value
             
-            await redis_client.setex(cache_key, ttl, serialized_value)
+            # Запись и индекс одним обращением; индекс живет не меньше своих записей
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.setex(cache_key, ttl, serialized_value)
+            pipe.zadd(index_key, {key: time.time() + ttl})
+            pipe.expire(index_key, ttl, nx=True)
+            pipe.expire(index_key, ttl, gt=True)
+            writes = self._writes[category] = self._writes.get(category, 0) + 1
+            if writes % settings.CACHE_INDEX_PRUNE_EVERY == 0:
+                pipe.zremrangebyscore(index_key, "-inf", time.time())
+            if self.local is not None:
+                pipe.publish(self.channel, self._message("del", cache_key))
+            await pipe.execute()
             
-            logger.debug(f"📦 Кэш сохранен: {cache_key} (TTL: {ttl}s)")
+            if self.local is not None:
+                if serialize and self.listening:
+                    self.local.set(cache_key, value, len(serialized_value), ttl)
+                else:
+                    self.local.discard(cache_key)
+            
+            logger.debug(f"📦 Кэш сохранен: {cache_key} (TTL: {ttl}s, {len(serialized_value)} байт)")
             return True
             
+        except CacheCodecError as e:
+            logger.warning(f"⚠️ Значение не кэшируется ({category}:{key}): {e}")
+            return False
         except Exception as e:
             logger.error(f"❌ Ошибка сохранения в кэш: {e}")
             return False
@@ -182,24 +257,32 @@ class CacheManager:
             if not redis_client:
                 return None
             
-            cache_key = self._make_key(category, key)
+            cache_key = self._make_key(category, key, await self._generation(category))
+            local = self.local if deserialize and self.listening else None
+            if local is not None:
+                local_value = local.get(cache_key)
+                if local_value is not MISSING:
+                    return local_value
+                epoch = local.epoch
+            
             value = await redis_client.get(cache_key)
             
             if value is None:
+                self.redis_misses += 1
                 logger.debug(f"🔍 Кэш промах: {cache_key}")
                 return None
+            self.redis_hits += 1
             
             if deserialize:
                 try:
-                    # Пробуем JSON
-                    return json.loads(value)
-                except (json.JSONDecodeError, TypeError):
-                    try:
-                        # Пробуем pickle
-                        return pickle.loads(value)
-                    except Exception:
-                        # Возвращаем как есть
-                        return value
+                    decoded = decode(value)
+                except CacheCodecError as e:
+                    # Поврежденная или чужая запись - считаем промахом
+                    logger.warning(f"⚠️ Некорректная запись кэша {cache_key}: {e}")
+                    return None
+                if local is not None and local.epoch == epoch:
+                    local.set(cache_key, decoded, len(value))
+                return decoded
             else:
                 return value
             
@@ -213,8 +296,15 @@ class CacheManager:
             if not redis_client:
                 return False
             
-            cache_key = self._make_key(category, key)
-            result = await redis_client.delete(cache_key)
+            generation = await self._generation(category)
+            cache_key = self._make_key(category, key, generation)
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.delete(cache_key)
+            pipe.zrem(self._index_key(category, generation), key)
+            if self.local is not None:
+                self.local.discard(cache_key)
+                pipe.publish(self.channel, self._message("del", cache_key))
+            result = (await pipe.execute())[0]
             
             logger.debug(f"🗑️ Кэш удален: {cache_key}")
             return bool(result)
@@ -229,7 +319,7 @@ class CacheManager:
             if not redis_client:
                 return False
             
-            cache_key = self._make_key(category, key)
+            cache_key = self._make_key(category, key, await self._generation(category))
             result = await redis_client.exists(cache_key)
             
             return bool(result)
@@ -238,39 +328,400 @@ class CacheManager:
             logger.error(f"❌ Ошибка проверки существования в кэше: {e}")
             return False
     
+    async def get_many(self, category: str, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Значения набора ключей категории: локальный уровень, затем один MGET
+        
+        Возвращает только найденные ключи.
+        """
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, Any] = {}
+        try:
+            if not redis_client or not keys:
+                return found
+            
+            generation = await self._generation(category)
+            local = self.local if self.listening else None
+            missing = []
+            for key in keys:
+                cache_key = self._make_key(category, key, generation)
+                if local is not None:
+                    value = local.get(cache_key)
+                    if value is not MISSING:
+                        found[key] = value
+                        continue
+                missing.append((key, cache_key))
+            if not missing:
+                return found
+            
+            epoch = local.epoch if local is not None else None
+            values = await redis_client.mget([cache_key for _, cache_key in missing])
+            for (key, cache_key), value in zip(missing, values):
+                if value is None:
+                    self.redis_misses += 1
+                    continue
+                self.redis_hits += 1
+                try:
+                    decoded = decode(value)
+                except CacheCodecError as e:
+                    logger.warning(f"⚠️ Некорректная запись кэша {cache_key}: {e}")
+                    continue
+                found[key] = decoded
+                if local is not None and local.epoch == epoch:
+                    local.set(cache_key, decoded, len(value))
+            
+            logger.debug(f"🔍 Кэш {category}: {len(found)} из {len(keys)} ключей")
+            return found
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка пакетного получения из кэша: {e}")
+            return found
+    
+    async def set_many(self, category: str, values: Dict[str, Any], ttl: Optional[int] = None) -> bool:
+        """Сохраняет набор значений одним конвейером (запись, индекс, инвалидация)"""
+        try:
+            if not redis_client or not values:
+                return False
+            
+            generation = await self._generation(category)
+            index_key = self._index_key(category, generation)
+            ttl = ttl or self.default_ttl
+            expires_at = time.time() + ttl
+            
+            encoded = {}
+            for key, value in values.items():
+                try:
+                    encoded[key] = encode(value)
+                except CacheCodecError as e:
+                    logger.warning(f"⚠️ Значение не кэшируется ({category}:{key}): {e}")
+            if not encoded:
+                return False
+            
+            cache_keys = {key: self._make_key(category, key, generation) for key in encoded}
+            pipe = redis_client.pipeline(transaction=False)
+            for key, payload in encoded.items():
+                pipe.setex(cache_keys[key], ttl, payload)
+            pipe.zadd(index_key, {key: expires_at for key in encoded})
+            pipe.expire(index_key, ttl, nx=True)
+            pipe.expire(index_key, ttl, gt=True)
+            if self.local is not None:
+                pipe.publish(self.channel, self._message("delmany", "\n".join(cache_keys.values())))
+            await pipe.execute()
+            
+            if self.local is not None:
+                for key, payload in encoded.items():
+                    if self.listening:
+                        self.local.set(cache_keys[key], values[key], len(payload), ttl)
+                    else:
+                        self.local.discard(cache_keys[key])
+            
+            logger.debug(f"📦 Кэш {category}: сохранено {len(encoded)} ключей (TTL: {ttl}s)")
+            return True
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка пакетного сохранения в кэш: {e}")
+            return False
+    
+    async def delete_many(self, category: str, keys: Iterable[str]) -> int:
+        """Удаляет набор ключей категории одним конвейером"""
+        keys = list(dict.fromkeys(keys))
+        try:
+            if not redis_client or not keys:
+                return 0
+            
+            generation = await self._generation(category)
+            cache_keys = [self._make_key(category, key, generation) for key in keys]
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.delete(*cache_keys)
+            pipe.zrem(self._index_key(category, generation), *keys)
+            if self.local is not None:
+                for cache_key in cache_keys:
+                    self.local.discard(cache_key)
+                pipe.publish(self.channel, self._message("delmany", "\n".join(cache_keys)))
+            deleted = (await pipe.execute())[0]
+            
+            logger.debug(f"🗑️ Кэш {category}: удалено {deleted} ключей")
+            return int(deleted)
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка пакетного удаления из кэша: {e}")
+            return 0
+    
     async def clear_category(self, category: str) -> int:
-        """Очищает все ключи в категории"""
+        """
+        Сбрасывает категорию увеличением поколения
+        
+        Записи прежнего поколения истекают по TTL. Возвращает число
+        сброшенных живых записей (по индексу поколения).
+        """
         try:
             if not redis_client:
                 return 0
             
-            pattern = self._make_key(category, "*")
-            keys = await redis_client.keys(pattern)
+            generation = int(await redis_client.incr(self._generation_key(category)))
+            self._generations[category] = (generation, time.monotonic())
             
-            if keys:
-                deleted = await redis_client.delete(*keys)
-                logger.info(f"🧹 Очищена категория кэша {category}: {deleted} ключей")
-                return deleted
+            old_index = self._index_key(category, generation - 1)
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.zcount(old_index, time.time(), "+inf")
+            pipe.unlink(old_index)
+            pipe.publish(self.channel, self._message("gen", f"{category}|{generation}"))
+            cleared = (await pipe.execute())[0]
+            if self.local is not None:
+                self.local.discard_prefix(f"{self.prefix}{category}:")
             
-            return 0
+            logger.info(f"🧹 Сброшена категория кэша {category}: {cleared} записей, поколение {generation}")
+            return int(cleared)
             
         except Exception as e:
             logger.error(f"❌ Ошибка очистки категории кэша: {e}")
             return 0
     
-    async def get_keys(self, category: str) -> List[str]:
-        """Получает все ключи в категории"""
+    def _lock_key(self, category: str, key: str) -> str:
+        return f"{self.prefix}_lock:{category}:{key}"
+    
+    async def _acquire_lock(self, category: str, key: str) -> Optional[str]:
+        """Блокировка пересчета записи между воркерами (SET NX PX); токен или None"""
+        if not redis_client:
+            return ""
+        token = uuid.uuid4().hex
         try:
-            if not redis_client:
-                return []
+            acquired = await redis_client.set(
+                self._lock_key(category, key), token, nx=True,
+                px=int(settings.CACHE_LOCK_TIMEOUT_SECONDS * 1000)
+            )
+        except Exception as e:
+            # Redis недоступен - считаем без блокировки, как без кэша
+            logger.warning(f"⚠️ Блокировка пересчета {category}:{key} недоступна: {e}")
+            return ""
+        return token if acquired else None
+    
+    async def _release_lock(self, category: str, key: str, token: str) -> None:
+        """Снимает только свою блокировку (она могла истечь и достаться другому)"""
+        if not redis_client or not token:
+            return
+        try:
+            await redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, self._lock_key(category, key), token)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось снять блокировку пересчета {category}:{key}: {e}")
+    
+    async def _compute_and_store(
+        self,
+        category: str,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        ttl: int,
+        stale_ttl: int
+    ) -> Any:
+        """Вычисляет значение и сохраняет его с мягким сроком и длительностью расчета"""
+        started = time.monotonic()
+        value = await compute()
+        duration = time.monotonic() - started
+        self.recompute_stats["computed"] += 1
+        await self.set(category, key, {
+            "value": value,
+            "fresh_until": time.time() + ttl,
+            "compute_seconds": round(duration, 4),
+        }, ttl + stale_ttl)
+        return value
+    
+    async def _compute_exclusive(
+        self,
+        category: str,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        ttl: int,
+        stale_ttl: int
+    ) -> Any:
+        """
+        Пересчет записи, которой нет в кэше, одним воркером
+        
+        Без блокировки воркер ждет, пока значение появится в Redis, и по
+        истечении CACHE_LOCK_WAIT_SECONDS считает сам - зависший держатель
+        блокировки не должен останавливать запросы.
+        """
+        token = await self._acquire_lock(category, key)
+        if token is None:
+            self.recompute_stats["lock_waits"] += 1
+            deadline = time.monotonic() + settings.CACHE_LOCK_WAIT_SECONDS
+            while time.monotonic() < deadline:
+                await asyncio.sleep(settings.CACHE_LOCK_POLL_SECONDS)
+                envelope = await self.get(category, key)
+                if isinstance(envelope, dict) and "value" in envelope:
+                    return envelope["value"]
+            token = await self._acquire_lock(category, key) or ""
+        try:
+            return await self._compute_and_store(category, key, compute, ttl, stale_ttl)
+        finally:
+            await self._release_lock(category, key, token)
+    
+    async def _refresh(
+        self,
+        category: str,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        ttl: int,
+        stale_ttl: int
+    ) -> None:
+        """Фоновое обновление записи; если ее уже обновляет другой воркер - ничего не делает"""
+        token = await self._acquire_lock(category, key)
+        if token is None:
+            return
+        try:
+            await self._compute_and_store(category, key, compute, ttl, stale_ttl)
+        except Exception as e:
+            logger.warning(f"⚠️ Фоновое обновление кэша {category}:{key} не удалось: {e}")
+        finally:
+            await self._release_lock(category, key, token)
+    
+    def _single_flight(self, flight_key: Tuple[str, str, str], factory: Callable[[], Awaitable[Any]]) -> "asyncio.Future":
+        """Одна задача пересчета записи на процесс; остальные запросы ждут ее"""
+        task = self._inflight.get(flight_key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[flight_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(flight_key, None))
+        else:
+            self.recompute_stats["coalesced"] += 1
+        return task
+    
+    async def get_or_compute(
+        self,
+        category: str,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        ttl: Optional[int] = None,
+        stale_ttl: Optional[int] = None
+    ) -> Any:
+        """
+        Значение из кэша или результат compute() с защитой от лавины пересчетов
+        
+        - Промах: пересчитывает один запрос на процесс (общая задача) и один
+          воркер на кластер (блокировка Redis), остальные ждут результат.
+        - Запись старше ttl, но моложе ttl + stale_ttl, отдается сразу, а
+          обновляется в фоне (stale-while-revalidate).
+        - Свежая запись обновляется в фоне заранее с вероятностью, растущей
+          к концу срока и с длительностью расчета (XFetch), поэтому истечение
+          популярной записи не совпадает с пиком запросов.
+        
+        compute не должен зависеть от сессии запроса: фоновое обновление
+        выполняется после ответа. Записи этого метода хранят обертку со
+        сроком - читать их нужно им же, а не get().
+        """
+        ttl = ttl or self.default_ttl
+        stale_ttl = settings.CACHE_STALE_TTL_SECONDS if stale_ttl is None else stale_ttl
+        
+        envelope = await self.get(category, key)
+        if isinstance(envelope, dict) and "value" in envelope:
+            remaining = envelope.get("fresh_until", 0) - time.time()
+            compute_seconds = envelope.get("compute_seconds") or 0.0
+            early = compute_seconds * settings.CACHE_EARLY_REFRESH_BETA * -math.log(1.0 - random.random())
+            if remaining - early > 0:
+                return envelope["value"]
             
-            pattern = self._make_key(category, "*")
-            keys = await redis_client.keys(pattern)
+            self.recompute_stats["stale_served" if remaining <= 0 else "early_refreshes"] += 1
+            self._single_flight(
+                ("refresh", category, key), lambda: self._refresh(category, key, compute, ttl, stale_ttl)
+            )
+            return envelope["value"]
+        
+        task = self._single_flight(
+            ("compute", category, key), lambda: self._compute_exclusive(category, key, compute, ttl, stale_ttl)
+        )
+        # Отмена одного запроса не должна отменять общий пересчет
+        return await asyncio.shield(task)
+    
+    def _message(self, op: str, payload: str) -> str:
+        return f"{self.instance_id}|{op}|{payload}"
+    
+    def handle_invalidation(self, message: Union[bytes, str]) -> None:
+        """Применяет сообщение канала инвалидации от другого воркера"""
+        if isinstance(message, bytes):
+            message = message.decode('utf-8')
+        origin, op, payload = message.split("|", 2)
+        if origin == self.instance_id:
+            return
+        
+        if op == "del":
+            if self.local is not None:
+                self.local.discard(payload)
+        elif op == "delmany":
+            if self.local is not None:
+                for cache_key in payload.split("\n"):
+                    self.local.discard(cache_key)
+        elif op == "gen":
+            category, generation = payload.rsplit("|", 1)
+            cached = self._generations.get(category)
+            if cached is None or int(generation) > cached[0]:
+                self._generations[category] = (int(generation), time.monotonic())
+            if self.local is not None:
+                self.local.discard_prefix(f"{self.prefix}{category}:")
+    
+    def reset_local(self) -> None:
+        """Сбрасывает локальный уровень и поколения (сообщения могли быть пропущены)"""
+        if self.local is not None:
+            self.local.clear()
+        self._generations.clear()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Попадания по уровням кэша этого воркера"""
+        redis_lookups = self.redis_hits + self.redis_misses
+        return {
+            "local": self.local.get_stats() if self.local is not None else {"enabled": False},
+            "redis": {
+                "hits": self.redis_hits,
+                "misses": self.redis_misses,
+                "hit_rate": round(self.redis_hits / redis_lookups, 4) if redis_lookups else None,
+            },
+            "invalidation_subscribed": self.listening,
+            "recompute": dict(self.recompute_stats, inflight=len(self._inflight)),
+        }
+    
+    async def count_keys(self, category: str) -> int:
+        """Число живых записей текущего поколения категории (без перебора ключей)"""
+        try:
+            if not redis_client:
+                return 0
             
-            # Убираем префикс из ключей
-            prefix_len = len(self._make_key(category, ""))
-            clean_keys = [key.decode('utf-8')[prefix_len:] for key in keys]
+            index_key = self._index_key(category, await self._generation(category))
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.zremrangebyscore(index_key, "-inf", time.time())
+            pipe.zcard(index_key)
+            _, count = await pipe.execute()
+            return int(count)
             
+        except Exception as e:
+            logger.error(f"❌ Ошибка подсчета ключей категории: {e}")
+            return 0
+    
+    async def iter_keys(self, category: str) -> AsyncIterator[List[str]]:
+        """
+        Ключи текущего поколения категории пачками SCAN
+        
+        Каждая пачка - отдельная короткая команда, Redis не блокируется
+        на всем пространстве ключей, как при KEYS.
+        """
+        if not redis_client:
+            return
+        
+        prefix = self._make_key(category, "", await self._generation(category))
+        prefix_len = len(prefix)
+        cursor = 0
+        while True:
+            cursor, keys = await redis_client.scan(
+                cursor, match=f"{prefix}*", count=settings.CACHE_SCAN_BATCH
+            )
+            if keys:
+                yield [key.decode('utf-8')[prefix_len:] for key in keys]
+            if cursor == 0:
+                break
+    
+    async def get_keys(self, category: str) -> List[str]:
+        """Получает все ключи в категории"""
+        try:
+            clean_keys: List[str] = []
+            async for batch in self.iter_keys(category):
+                clean_keys.extend(batch)
             return clean_keys
             
         except Exception as e:
@@ -282,6 +733,49 @@ class CacheManager:
 cache = CacheManager()
 
 
+async def cache_invalidation_loop() -> None:
+    """
+    Подписка воркера на канал инвалидации локального уровня кэша
+    
+    При (пере)подключении локальный уровень сбрасывается: сообщения, пока
+    подписки не было, потеряны.
+    """
+    while True:
+        pubsub = None
+        try:
+            if redis_client is None:
+                await asyncio.sleep(settings.CACHE_INVALIDATION_RETRY_SECONDS)
+                continue
+            
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            await pubsub.subscribe(cache.channel)
+            cache.reset_local()
+            cache.listening = True
+            logger.info(f"📡 Подписка на инвалидацию кэша: {cache.channel}")
+            
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message and message.get("type") == "message":
+                    try:
+                        cache.handle_invalidation(message["data"])
+                    except ValueError as e:
+                        logger.warning(f"⚠️ Некорректное сообщение инвалидации: {e}")
+        
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ Подписка на инвалидацию кэша прервана: {e}")
+        finally:
+            cache.listening = False
+            if pubsub is not None:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+        
+        await asyncio.sleep(settings.CACHE_INVALIDATION_RETRY_SECONDS)
+
+
 # Специализированные функции для работы с отчетами
 async def cache_report_data(report_id: str, data: dict, ttl: Optional[int] = None) -> bool:
     """Кэширует данные отчета"""
@@ -303,19 +797,31 @@ async def get_cached_report_stats(hostname: str) -> Optional[dict]:
     return await cache.get("stats", hostname)
 
 
-async def cache_search_results(query_hash: str, results: list, ttl: int = 300) -> bool:
+async def cache_search_results(query_hash: str, results: Union[list, dict], ttl: int = 300) -> bool:
     """Кэширует результаты поиска на 5 минут"""
     return await cache.set("search", query_hash, results, ttl)
 
 
-async def get_cached_search_results(query_hash: str) -> Optional[list]:
+async def get_cached_search_results(query_hash: str) -> Optional[Union[list, dict]]:
     """Получает результаты поиска из кэша"""
     return await cache.get("search", query_hash)
 
 
+async def cache_delta(pair_key: str, delta: dict, ttl: Optional[int] = None) -> bool:
+    """Кэширует дельту пары отчетов"""
+    return await cache.set("delta", pair_key, delta, ttl or settings.DELTA_CACHE_TTL)
+
+
+async def get_cached_delta(pair_key: str) -> Optional[dict]:
+    """Получает дельту пары отчетов из кэша"""
+    return await cache.get("delta", pair_key)
+
+
 async def invalidate_report_cache(report_id: str) -> None:
     """Инвалидирует кэш для конкретного отчета"""
     await cache.delete("reports", report_id)
+    await cache.delete("summaries", report_id)
+    await cache.delete("stats", "summary")  # Агрегаты по всем отчетам
     await cache.clear_category("search")  # Очищаем поиск
 
 
@@ -325,9 +831,11 @@ async def get_cache_statistics() -> dict:
         stats = {}
         
         # Статистика по категориям
-        for category in ["reports", "stats", "search", "connections"]:
-            keys = await cache.get_keys(category)
-            stats[category] = len(keys)
+        for category in ["reports", "summaries", "stats", "search", "connections", "delta"]:
+            stats[category] = await cache.count_keys(category)
+        
+        # Попадания по уровням кэша этого воркера
+        stats["tiers"] = cache.get_stats()
         
         # Общая информация о Redis
         redis_info = await get_redis_info()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Отдельный воркер приема отчетов из очереди Redis Streams
+
+Запуск: python ingest_worker.py (из каталога backend, с теми же настройками,
+что у API, и с тем же общим UPLOAD_DIR). Пропускная способность приема
+растет добавлением процессов на любых узлах: потоки очереди делятся между
+живыми воркерами автоматически. SIGTERM/SIGINT - мягкая остановка: текущие
+сообщения дорабатываются, аренды потоков снимаются.
+"""
+
+import asyncio
+import logging
+import signal
+
+from core.config import get_settings
+from core.database import init_db, close_db
+from core.redis_client import init_redis, close_redis
+from services.ingest_queue import ingest_worker_loop
+
+settings = get_settings()
+
+
+async def main() -> None:
+    print("🚀 Запуск воркера приема отчетов...")
+    await init_db()
+    await init_redis()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await ingest_worker_loop(stop)
+    finally:
+        await close_redis()
+        await close_db()
+        print("👋 Воркер приема отчетов остановлен")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=settings.LOG_LEVEL,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    asyncio.run(main())
@@ -19,9 +19,16 @@ import logging
 
 # Импорты внутренних модулей
 from core.config import get_settings
-from core.database import init_db, close_db, get_db_health, get_table_stats
-from core.redis_client import init_redis, close_redis, get_redis_health
+from core import database
+from core.database import init_db, close_db, get_db_health, get_pool_metrics, replica_lag_loop
+from core.migrations import schema_state
+from core.redis_client import cache, cache_invalidation_loop, init_redis, close_redis, get_redis_health
 from api.v1.main import api_router
+from services.retention import retention_loop
+from services.reconciler import reconcile_loop
+from services.delta import delta_loop
+from services.port_index import port_index, port_index_loop
+from services.ingest_queue import ingest_worker_loop
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -42,20 +49,6 @@ async def lifespan(app: FastAPI):
     try:
         print("🔍 [DEBUG] Инициализируем соединение с БД...")
         await init_db()
-        print("✅ База данных PostgreSQL инициализирована")
-        
-        # Проверяем здоровье БД
-        print("🔍 [DEBUG] Проверяем соединение с БД...")
-        db_health = await get_db_health()
-        print(f"🔍 [DEBUG] Статус БД: {'✅ Здоровая' if db_health else '❌ Недоступна'}")
-        
-        # Проверяем таблицы в БД
-        try:
-            table_stats = await get_table_stats()
-            print(f"🔍 [DEBUG] Статистика таблиц БД: {table_stats}")
-        except Exception as table_error:
-            print(f"⚠️ [DEBUG] Не удалось получить статистику таблиц: {table_error}")
-        
     except Exception as e:
         print(f"❌ Ошибка инициализации БД: {e}")
         print(f"🔍 [DEBUG] Тип ошибки БД: {type(e)}")
@@ -81,6 +74,30 @@ async def lifespan(app: FastAPI):
         print(f"🔍 [DEBUG] Трейс ошибки Redis: {traceback.format_exc()}")
         raise
     
+    # Фоновые задачи обслуживания
+    background_tasks = []
+    if settings.RETENTION_ENABLED:
+        background_tasks.append(asyncio.create_task(retention_loop()))
+        print(f"🧹 Очистка отчетов старше {settings.REPORT_CLEANUP_DAYS} дней запланирована")
+    if settings.RECONCILE_ENABLED:
+        background_tasks.append(asyncio.create_task(reconcile_loop()))
+        print("🔍 Фоновая сверка хранилища и БД запущена")
+    if settings.DELTA_PRECOMPUTE_ENABLED:
+        background_tasks.append(asyncio.create_task(delta_loop()))
+        print("🔀 Фоновое вычисление дельт отчетов запущено")
+    if settings.PORT_INDEX_ENABLED:
+        background_tasks.append(asyncio.create_task(port_index_loop()))
+        print("🗺️ Индекс открытых портов парка прогревается")
+    if settings.CACHE_LOCAL_ENABLED:
+        background_tasks.append(asyncio.create_task(cache_invalidation_loop()))
+        print("📡 Локальный уровень кэша и подписка на инвалидацию запущены")
+    if settings.INGEST_QUEUE_ENABLED and settings.INGEST_API_WORKER:
+        background_tasks.append(asyncio.create_task(ingest_worker_loop()))
+        print("📥 Воркер очереди приема отчетов запущен")
+    if database.replica_engines:
+        background_tasks.append(asyncio.create_task(replica_lag_loop()))
+        print(f"📖 Чтение распределяется по {len(database.replica_engines)} репликам")
+    
     print("🎉 Веб-платформа анализатора запущена успешно!")
     
     yield
@@ -88,6 +105,10 @@ async def lifespan(app: FastAPI):
     # Shutdown
     print("🛑 Остановка веб-платформы анализатора...")
     
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    
     try:
         await close_redis()
         print("✅ Redis соединение закрыто")
@@ -163,8 +184,8 @@ def create_application() -> FastAPI:
     )
     
     # Статические файлы (для загруженных отчетов)
-    if os.path.exists("uploads"):
-        app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+    if os.path.exists(settings.UPLOAD_DIR):
+        app.mount("/uploads", StaticFiles(directory=settings.UPLOAD_DIR), name="uploads")
     
     # Статические файлы frontend
     frontend_path = "../frontend"
@@ -184,7 +205,42 @@ def create_application() -> FastAPI:
     elif settings.ENVIRONMENT == "production" and os.path.exists("../frontend/dist"):
         app.mount("/", StaticFiles(directory="../frontend/dist", html=True), name="frontend")
     
-    # Health check endpoint
+    # Health check endpoints
+    @app.get("/health/live", tags=["health"])
+    async def liveness_check():
+        """
+        Liveness: процесс жив и обрабатывает запросы (без обращения к БД и Redis)
+        """
+        return {"status": "alive", "timestamp": datetime.utcnow().isoformat()}
+    
+    @app.get("/health/ready", tags=["health"])
+    async def readiness_check():
+        """
+        Readiness: БД и Redis доступны, схема БД соответствует коду
+        """
+        db_status = await get_db_health()
+        redis_status = await get_redis_health()
+        schema_ready = schema_state["ready"]
+        
+        ready = db_status and redis_status and schema_ready
+        
+        return JSONResponse(
+            status_code=200 if ready else 503,
+            content={
+                "status": "ready" if ready else "not_ready",
+                "timestamp": datetime.utcnow().isoformat(),
+                "services": {
+                    "database": "healthy" if db_status else "unhealthy",
+                    "redis": "healthy" if redis_status else "unhealthy",
+                    "schema": {
+                        "status": "current" if schema_ready else "outdated",
+                        "revision": schema_state["current_revision"],
+                        "expected_revision": schema_state["expected_revision"]
+                    }
+                }
+            }
+        )
+    
     @app.get("/health", tags=["health"])
     async def health_check():
         """
@@ -197,13 +253,45 @@ def create_application() -> FastAPI:
         
         return {
             "status": status,
+            "ready": status == "healthy" and schema_state["ready"],
             "timestamp": datetime.utcnow().isoformat(),
             "services": {
                 "database": "healthy" if db_status else "unhealthy",
-                "redis": "healthy" if redis_status else "unhealthy"
+                "redis": "healthy" if redis_status else "unhealthy",
+                "schema_revision": schema_state["current_revision"]
             }
         }
     
+    @app.get("/health/db", tags=["health"])
+    async def database_pools():
+        """
+        Пулы соединений основной БД и реплик, отставание реплик и маршрутизация чтения
+        """
+        return {
+            "timestamp": datetime.utcnow().isoformat(),
+            **get_pool_metrics()
+        }
+    
+    @app.get("/health/port-index", tags=["health"])
+    async def port_index_state():
+        """
+        Состояние индекса открытых портов этого воркера
+        """
+        return {
+            "timestamp": datetime.utcnow().isoformat(),
+            **port_index.stats()
+        }
+    
+    @app.get("/health/cache", tags=["health"])
+    async def cache_tiers():
+        """
+        Попадания локального уровня кэша и Redis для этого воркера
+        """
+        return {
+            "timestamp": datetime.utcnow().isoformat(),
+            **cache.get_stats()
+        }
+    
     # App info endpoint
     @app.get("/api/v1/app/info", tags=["app"])
     async def get_app_info():
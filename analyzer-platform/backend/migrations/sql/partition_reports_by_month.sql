@@ -0,0 +1,285 @@
+-- Migration: Range partitioning of system_reports and child tables by month of generated_at
+-- Date: 2025-01-15
+-- Description: Перевод отчетов и дочерних таблиц на помесячные секции.
+--              Дочерние таблицы получают копию ключа секционирования (report_generated_at)
+--              и составной внешний ключ ON DELETE CASCADE, поэтому срок хранения
+--              применяется удалением целых секций без мертвых кортежей.
+--              Глобальная уникальность report_hash переносится в таблицу report_hashes.
+-- Requires: PostgreSQL 12+, поля report_hash и tcp/udp/icmp_connections
+-- Применяется ревизией 0001_baseline в транзакции Alembic
+
+-- Старые таблицы переносим в отдельную схему вместе с их индексами и ограничениями
+CREATE SCHEMA analyzer_legacy;
+
+ALTER TABLE system_reports SET SCHEMA analyzer_legacy;
+ALTER TABLE IF EXISTS network_connections SET SCHEMA analyzer_legacy;
+ALTER TABLE IF EXISTS network_ports SET SCHEMA analyzer_legacy;
+ALTER TABLE IF EXISTS remote_hosts SET SCHEMA analyzer_legacy;
+ALTER TABLE IF EXISTS change_history SET SCHEMA analyzer_legacy;
+ALTER TABLE IF EXISTS network_interfaces SET SCHEMA analyzer_legacy;
+ALTER TABLE IF EXISTS report_files SET SCHEMA analyzer_legacy;
+
+-- Секционированные таблицы
+CREATE TABLE system_reports (
+    id UUID NOT NULL,
+    generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    report_hash VARCHAR(64) NOT NULL,
+    hostname VARCHAR(255) NOT NULL,
+    report_title VARCHAR(500) NOT NULL,
+    os_name VARCHAR(255),
+    os_version VARCHAR(255),
+    first_run TIMESTAMP WITHOUT TIME ZONE,
+    last_update TIMESTAMP WITHOUT TIME ZONE,
+    total_measurements INTEGER,
+    html_file_path VARCHAR(1000),
+    yaml_file_path VARCHAR(1000),
+    json_file_path VARCHAR(1000),
+    total_connections INTEGER,
+    incoming_connections INTEGER,
+    outgoing_connections INTEGER,
+    tcp_connections INTEGER,
+    udp_connections INTEGER,
+    icmp_connections INTEGER,
+    unique_processes INTEGER,
+    unique_hosts INTEGER,
+    tcp_ports_count INTEGER,
+    udp_ports_count INTEGER,
+    change_events_count INTEGER,
+    raw_data JSON,
+    changes_summary JSON,
+    file_size INTEGER,
+    processing_status VARCHAR(50),
+    created_at TIMESTAMP WITHOUT TIME ZONE,
+    updated_at TIMESTAMP WITHOUT TIME ZONE,
+    PRIMARY KEY (id, generated_at)
+) PARTITION BY RANGE (generated_at);
+
+CREATE INDEX idx_reports_created_at ON system_reports (created_at);
+CREATE INDEX ix_system_reports_report_hash ON system_reports (report_hash);
+CREATE INDEX ix_system_reports_hostname ON system_reports (hostname);
+CREATE INDEX idx_reports_hostname_date ON system_reports (hostname, generated_at);
+
+CREATE TABLE change_history (
+    id UUID NOT NULL,
+    report_id UUID NOT NULL,
+    report_generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    measurement_id INTEGER,
+    change_timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    is_first_run BOOLEAN,
+    changed_categories VARCHAR[],
+    change_details JSON,
+    PRIMARY KEY (id, report_generated_at),
+    FOREIGN KEY (report_id, report_generated_at) REFERENCES system_reports (id, generated_at) ON DELETE CASCADE ON UPDATE CASCADE
+) PARTITION BY RANGE (report_generated_at);
+
+CREATE INDEX idx_changes_report_timestamp ON change_history (report_id, change_timestamp);
+
+CREATE TABLE network_connections (
+    id UUID NOT NULL,
+    report_id UUID NOT NULL,
+    report_generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    connection_type VARCHAR(20),
+    local_address VARCHAR(100),
+    remote_address VARCHAR(100),
+    remote_hostname VARCHAR(255),
+    process_name VARCHAR(255),
+    protocol VARCHAR(10),
+    first_seen TIMESTAMP WITHOUT TIME ZONE,
+    last_seen TIMESTAMP WITHOUT TIME ZONE,
+    packet_count INTEGER,
+    connection_status VARCHAR(50),
+    bytes_sent INTEGER,
+    bytes_received INTEGER,
+    PRIMARY KEY (id, report_generated_at),
+    FOREIGN KEY (report_id, report_generated_at) REFERENCES system_reports (id, generated_at) ON DELETE CASCADE ON UPDATE CASCADE
+) PARTITION BY RANGE (report_generated_at);
+
+CREATE INDEX idx_connections_report_protocol ON network_connections (report_id, protocol);
+
+CREATE TABLE network_interfaces (
+    id UUID NOT NULL,
+    report_id UUID NOT NULL,
+    report_generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    interface_name VARCHAR(100) NOT NULL,
+    packets_in INTEGER,
+    packets_out INTEGER,
+    bytes_in INTEGER,
+    bytes_out INTEGER,
+    mtu INTEGER,
+    status VARCHAR(20),
+    mac_address VARCHAR(17),
+    ip_addresses VARCHAR[],
+    PRIMARY KEY (id, report_generated_at),
+    FOREIGN KEY (report_id, report_generated_at) REFERENCES system_reports (id, generated_at) ON DELETE CASCADE ON UPDATE CASCADE
+) PARTITION BY RANGE (report_generated_at);
+
+CREATE TABLE network_ports (
+    id UUID NOT NULL,
+    report_id UUID NOT NULL,
+    report_generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    port_number INTEGER NOT NULL,
+    protocol VARCHAR(10) NOT NULL,
+    description TEXT,
+    service_name VARCHAR(100),
+    status VARCHAR(20),
+    process_name VARCHAR(255),
+    PRIMARY KEY (id, report_generated_at),
+    FOREIGN KEY (report_id, report_generated_at) REFERENCES system_reports (id, generated_at) ON DELETE CASCADE ON UPDATE CASCADE
+) PARTITION BY RANGE (report_generated_at);
+
+CREATE INDEX idx_ports_report_port ON network_ports (report_id, port_number);
+
+CREATE TABLE remote_hosts (
+    id UUID NOT NULL,
+    report_id UUID NOT NULL,
+    report_generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    ip_address VARCHAR(45) NOT NULL,
+    hostname VARCHAR(255),
+    connection_count INTEGER,
+    first_seen TIMESTAMP WITHOUT TIME ZONE,
+    last_seen TIMESTAMP WITHOUT TIME ZONE,
+    country VARCHAR(100),
+    organization VARCHAR(255),
+    is_local BOOLEAN,
+    PRIMARY KEY (id, report_generated_at),
+    FOREIGN KEY (report_id, report_generated_at) REFERENCES system_reports (id, generated_at) ON DELETE CASCADE ON UPDATE CASCADE
+) PARTITION BY RANGE (report_generated_at);
+
+CREATE INDEX idx_hosts_report_ip ON remote_hosts (report_id, ip_address);
+
+CREATE TABLE report_files (
+    id UUID NOT NULL,
+    report_id UUID NOT NULL,
+    report_generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    filename VARCHAR(500) NOT NULL,
+    file_path VARCHAR(1000) NOT NULL,
+    file_type VARCHAR(10) NOT NULL,
+    file_size INTEGER,
+    content_hash VARCHAR(64),
+    uploaded_at TIMESTAMP WITHOUT TIME ZONE,
+    processed_at TIMESTAMP WITHOUT TIME ZONE,
+    PRIMARY KEY (id, report_generated_at),
+    FOREIGN KEY (report_id, report_generated_at) REFERENCES system_reports (id, generated_at) ON DELETE CASCADE ON UPDATE CASCADE
+) PARTITION BY RANGE (report_generated_at);
+
+-- Реестр хешей: уникальность report_hash по всем секциям
+CREATE TABLE IF NOT EXISTS report_hashes (
+    report_hash VARCHAR(64) NOT NULL,
+    report_id UUID NOT NULL,
+    generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    PRIMARY KEY (report_hash)
+);
+
+CREATE INDEX IF NOT EXISTS ix_report_hashes_generated_at ON report_hashes (generated_at);
+
+-- Секции для всех месяцев с данными и на PARTITION_PREMAKE_MONTHS (3) месяца вперед
+DO $$
+DECLARE
+    m DATE;
+    last_month DATE;
+    t TEXT;
+BEGIN
+    SELECT date_trunc('month', COALESCE(min(generated_at), now()))::date,
+           GREATEST(date_trunc('month', COALESCE(max(generated_at), now())),
+                    date_trunc('month', now()) + interval '3 months')::date
+    INTO m, last_month
+    FROM analyzer_legacy.system_reports;
+
+    WHILE m <= last_month LOOP
+        FOREACH t IN ARRAY ARRAY['system_reports', 'change_history', 'network_connections',
+                                 'network_interfaces', 'network_ports', 'remote_hosts', 'report_files'] LOOP
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                t || '_p' || to_char(m, 'YYYYMM'), t, m, (m + interval '1 month')::date
+            );
+        END LOOP;
+        m := (m + interval '1 month')::date;
+    END LOOP;
+END $$;
+
+-- Перенос данных
+INSERT INTO system_reports (
+    id, generated_at, report_hash, hostname, report_title, os_name, os_version,
+    first_run, last_update, total_measurements, html_file_path, yaml_file_path, json_file_path,
+    total_connections, incoming_connections, outgoing_connections,
+    tcp_connections, udp_connections, icmp_connections,
+    unique_processes, unique_hosts, tcp_ports_count, udp_ports_count, change_events_count,
+    raw_data, changes_summary, file_size, processing_status, created_at, updated_at
+)
+SELECT
+    id, generated_at, report_hash, hostname, report_title, os_name, os_version,
+    first_run, last_update, total_measurements, html_file_path, yaml_file_path, json_file_path,
+    total_connections, incoming_connections, outgoing_connections,
+    tcp_connections, udp_connections, icmp_connections,
+    unique_processes, unique_hosts, tcp_ports_count, udp_ports_count, change_events_count,
+    raw_data, changes_summary, file_size, processing_status, created_at, updated_at
+FROM analyzer_legacy.system_reports;
+
+INSERT INTO report_hashes (report_hash, report_id, generated_at)
+SELECT DISTINCT ON (report_hash) report_hash, id, generated_at
+FROM analyzer_legacy.system_reports
+ORDER BY report_hash, created_at DESC NULLS LAST;
+
+INSERT INTO network_connections (
+    id, report_id, report_generated_at, connection_type, local_address, remote_address,
+    remote_hostname, process_name, protocol, first_seen, last_seen, packet_count,
+    connection_status, bytes_sent, bytes_received
+)
+SELECT
+    c.id, c.report_id, r.generated_at, c.connection_type, c.local_address, c.remote_address,
+    c.remote_hostname, c.process_name, c.protocol, c.first_seen, c.last_seen, c.packet_count,
+    c.connection_status, c.bytes_sent, c.bytes_received
+FROM analyzer_legacy.network_connections c
+JOIN analyzer_legacy.system_reports r ON r.id = c.report_id;
+
+INSERT INTO network_ports (
+    id, report_id, report_generated_at, port_number, protocol, description,
+    service_name, status, process_name
+)
+SELECT
+    p.id, p.report_id, r.generated_at, p.port_number, p.protocol, p.description,
+    p.service_name, p.status, p.process_name
+FROM analyzer_legacy.network_ports p
+JOIN analyzer_legacy.system_reports r ON r.id = p.report_id;
+
+INSERT INTO remote_hosts (
+    id, report_id, report_generated_at, ip_address, hostname, connection_count,
+    first_seen, last_seen, country, organization, is_local
+)
+SELECT
+    h.id, h.report_id, r.generated_at, h.ip_address, h.hostname, h.connection_count,
+    h.first_seen, h.last_seen, h.country, h.organization, h.is_local
+FROM analyzer_legacy.remote_hosts h
+JOIN analyzer_legacy.system_reports r ON r.id = h.report_id;
+
+INSERT INTO change_history (
+    id, report_id, report_generated_at, measurement_id, change_timestamp,
+    is_first_run, changed_categories, change_details
+)
+SELECT
+    ch.id, ch.report_id, r.generated_at, ch.measurement_id, ch.change_timestamp,
+    ch.is_first_run, ch.changed_categories, ch.change_details
+FROM analyzer_legacy.change_history ch
+JOIN analyzer_legacy.system_reports r ON r.id = ch.report_id;
+
+INSERT INTO network_interfaces (
+    id, report_id, report_generated_at, interface_name, packets_in, packets_out,
+    bytes_in, bytes_out, mtu, status, mac_address, ip_addresses
+)
+SELECT
+    i.id, i.report_id, r.generated_at, i.interface_name, i.packets_in, i.packets_out,
+    i.bytes_in, i.bytes_out, i.mtu, i.status, i.mac_address, i.ip_addresses
+FROM analyzer_legacy.network_interfaces i
+JOIN analyzer_legacy.system_reports r ON r.id = i.report_id;
+
+INSERT INTO report_files (
+    id, report_id, report_generated_at, filename, file_path, file_type,
+    file_size, content_hash, uploaded_at, processed_at
+)
+SELECT
+    f.id, f.report_id, r.generated_at, f.filename, f.file_path, f.file_type,
+    f.file_size, f.content_hash, f.uploaded_at, f.processed_at
+FROM analyzer_legacy.report_files f
+JOIN analyzer_legacy.system_reports r ON r.id = f.report_id;
+
+DROP SCHEMA analyzer_legacy CASCADE;
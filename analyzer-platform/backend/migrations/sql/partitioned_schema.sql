@@ -0,0 +1,177 @@
+-- Migration: Initial partitioned schema
+-- Date: 2025-01-20
+-- Description: Схема для новой базы: отчеты и дочерние таблицы секционированы
+--              по месяцу generated_at, реестр report_hashes хранит уникальность хешей.
+-- Применяется ревизией 0001_baseline, если system_reports еще не существует
+
+-- Секционированные таблицы
+CREATE TABLE IF NOT EXISTS system_reports (
+    id UUID NOT NULL,
+    generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    report_hash VARCHAR(64) NOT NULL,
+    hostname VARCHAR(255) NOT NULL,
+    report_title VARCHAR(500) NOT NULL,
+    os_name VARCHAR(255),
+    os_version VARCHAR(255),
+    first_run TIMESTAMP WITHOUT TIME ZONE,
+    last_update TIMESTAMP WITHOUT TIME ZONE,
+    total_measurements INTEGER,
+    html_file_path VARCHAR(1000),
+    yaml_file_path VARCHAR(1000),
+    json_file_path VARCHAR(1000),
+    total_connections INTEGER,
+    incoming_connections INTEGER,
+    outgoing_connections INTEGER,
+    tcp_connections INTEGER,
+    udp_connections INTEGER,
+    icmp_connections INTEGER,
+    unique_processes INTEGER,
+    unique_hosts INTEGER,
+    tcp_ports_count INTEGER,
+    udp_ports_count INTEGER,
+    change_events_count INTEGER,
+    raw_data JSON,
+    changes_summary JSON,
+    file_size INTEGER,
+    processing_status VARCHAR(50),
+    created_at TIMESTAMP WITHOUT TIME ZONE,
+    updated_at TIMESTAMP WITHOUT TIME ZONE,
+    PRIMARY KEY (id, generated_at)
+) PARTITION BY RANGE (generated_at);
+
+CREATE INDEX IF NOT EXISTS idx_reports_created_at ON system_reports (created_at);
+CREATE INDEX IF NOT EXISTS ix_system_reports_report_hash ON system_reports (report_hash);
+CREATE INDEX IF NOT EXISTS ix_system_reports_hostname ON system_reports (hostname);
+CREATE INDEX IF NOT EXISTS idx_reports_hostname_date ON system_reports (hostname, generated_at);
+
+CREATE TABLE IF NOT EXISTS change_history (
+    id UUID NOT NULL,
+    report_id UUID NOT NULL,
+    report_generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    measurement_id INTEGER,
+    change_timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    is_first_run BOOLEAN,
+    changed_categories VARCHAR[],
+    change_details JSON,
+    PRIMARY KEY (id, report_generated_at),
+    FOREIGN KEY (report_id, report_generated_at) REFERENCES system_reports (id, generated_at) ON DELETE CASCADE ON UPDATE CASCADE
+) PARTITION BY RANGE (report_generated_at);
+
+CREATE INDEX IF NOT EXISTS idx_changes_report_timestamp ON change_history (report_id, change_timestamp);
+
+CREATE TABLE IF NOT EXISTS network_connections (
+    id UUID NOT NULL,
+    report_id UUID NOT NULL,
+    report_generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    connection_type VARCHAR(20),
+    local_address VARCHAR(100),
+    remote_address VARCHAR(100),
+    remote_hostname VARCHAR(255),
+    process_name VARCHAR(255),
+    protocol VARCHAR(10),
+    first_seen TIMESTAMP WITHOUT TIME ZONE,
+    last_seen TIMESTAMP WITHOUT TIME ZONE,
+    packet_count INTEGER,
+    connection_status VARCHAR(50),
+    bytes_sent INTEGER,
+    bytes_received INTEGER,
+    PRIMARY KEY (id, report_generated_at),
+    FOREIGN KEY (report_id, report_generated_at) REFERENCES system_reports (id, generated_at) ON DELETE CASCADE ON UPDATE CASCADE
+) PARTITION BY RANGE (report_generated_at);
+
+CREATE INDEX IF NOT EXISTS idx_connections_report_protocol ON network_connections (report_id, protocol);
+
+CREATE TABLE IF NOT EXISTS network_interfaces (
+    id UUID NOT NULL,
+    report_id UUID NOT NULL,
+    report_generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    interface_name VARCHAR(100) NOT NULL,
+    packets_in INTEGER,
+    packets_out INTEGER,
+    bytes_in INTEGER,
+    bytes_out INTEGER,
+    mtu INTEGER,
+    status VARCHAR(20),
+    mac_address VARCHAR(17),
+    ip_addresses VARCHAR[],
+    PRIMARY KEY (id, report_generated_at),
+    FOREIGN KEY (report_id, report_generated_at) REFERENCES system_reports (id, generated_at) ON DELETE CASCADE ON UPDATE CASCADE
+) PARTITION BY RANGE (report_generated_at);
+
+CREATE TABLE IF NOT EXISTS network_ports (
+    id UUID NOT NULL,
+    report_id UUID NOT NULL,
+    report_generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    port_number INTEGER NOT NULL,
+    protocol VARCHAR(10) NOT NULL,
+    description TEXT,
+    service_name VARCHAR(100),
+    status VARCHAR(20),
+    process_name VARCHAR(255),
+    PRIMARY KEY (id, report_generated_at),
+    FOREIGN KEY (report_id, report_generated_at) REFERENCES system_reports (id, generated_at) ON DELETE CASCADE ON UPDATE CASCADE
+) PARTITION BY RANGE (report_generated_at);
+
+CREATE INDEX IF NOT EXISTS idx_ports_report_port ON network_ports (report_id, port_number);
+
+CREATE TABLE IF NOT EXISTS remote_hosts (
+    id UUID NOT NULL,
+    report_id UUID NOT NULL,
+    report_generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    ip_address VARCHAR(45) NOT NULL,
+    hostname VARCHAR(255),
+    connection_count INTEGER,
+    first_seen TIMESTAMP WITHOUT TIME ZONE,
+    last_seen TIMESTAMP WITHOUT TIME ZONE,
+    country VARCHAR(100),
+    organization VARCHAR(255),
+    is_local BOOLEAN,
+    PRIMARY KEY (id, report_generated_at),
+    FOREIGN KEY (report_id, report_generated_at) REFERENCES system_reports (id, generated_at) ON DELETE CASCADE ON UPDATE CASCADE
+) PARTITION BY RANGE (report_generated_at);
+
+CREATE INDEX IF NOT EXISTS idx_hosts_report_ip ON remote_hosts (report_id, ip_address);
+
+CREATE TABLE IF NOT EXISTS report_files (
+    id UUID NOT NULL,
+    report_id UUID NOT NULL,
+    report_generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    filename VARCHAR(500) NOT NULL,
+    file_path VARCHAR(1000) NOT NULL,
+    file_type VARCHAR(10) NOT NULL,
+    file_size INTEGER,
+    content_hash VARCHAR(64),
+    uploaded_at TIMESTAMP WITHOUT TIME ZONE,
+    processed_at TIMESTAMP WITHOUT TIME ZONE,
+    PRIMARY KEY (id, report_generated_at),
+    FOREIGN KEY (report_id, report_generated_at) REFERENCES system_reports (id, generated_at) ON DELETE CASCADE ON UPDATE CASCADE
+) PARTITION BY RANGE (report_generated_at);
+
+-- Реестр хешей: уникальность report_hash по всем секциям
+CREATE TABLE IF NOT EXISTS report_hashes (
+    report_hash VARCHAR(64) NOT NULL,
+    report_id UUID NOT NULL,
+    generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    PRIMARY KEY (report_hash)
+);
+
+CREATE INDEX IF NOT EXISTS ix_report_hashes_generated_at ON report_hashes (generated_at);
+
+-- Секции текущего месяца и PARTITION_PREMAKE_MONTHS (3) месяцев вперед,
+-- дальше секции создает services/partitioning.py
+DO $$
+DECLARE
+    m DATE := date_trunc('month', now())::date;
+    t TEXT;
+BEGIN
+    WHILE m <= (date_trunc('month', now()) + interval '3 months')::date LOOP
+        FOREACH t IN ARRAY ARRAY['system_reports', 'change_history', 'network_connections',
+                                 'network_interfaces', 'network_ports', 'remote_hosts', 'report_files'] LOOP
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                t || '_p' || to_char(m, 'YYYYMM'), t, m, (m + interval '1 month')::date
+            );
+        END LOOP;
+        m := (m + interval '1 month')::date;
+    END LOOP;
+END $$;
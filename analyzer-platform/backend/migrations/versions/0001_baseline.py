@@ -0,0 +1,72 @@
+"""Baseline: partitioned reports schema
+
+Приводит базу к секционированной схеме из любого исходного состояния:
+- пустая база - создается схема (sql/partitioned_schema.sql);
+- старая несекционированная база - добавляются поля report_hash и
+  tcp/udp/icmp_connections (бывшие add_report_hash.sql и apply_migration.py),
+  затем данные переносятся в секции (sql/partition_reports_by_month.sql);
+- база, уже созданная create_all с секциями, - только фиксируется версия.
+
+Revision ID: 0001
+Revises:
+Create Date: 2025-01-20
+"""
+
+from alembic import op
+from sqlalchemy import text
+
+from core.migrations import execute_sql_file
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    relkind = bind.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass('public.system_reports')")
+    ).scalar()
+
+    if relkind is None:
+        execute_sql_file("partitioned_schema.sql")
+        return
+
+    if relkind == "p":
+        return
+
+    # Несекционированная база: недостающие поля старых ручных миграций
+    op.execute("ALTER TABLE system_reports ADD COLUMN IF NOT EXISTS report_hash VARCHAR(64)")
+    op.execute("""
+        UPDATE system_reports
+        SET report_hash = SUBSTR(MD5(hostname || COALESCE(created_at::text, '')), 1, 16)
+        WHERE report_hash IS NULL
+    """)
+    op.execute("ALTER TABLE system_reports ALTER COLUMN report_hash SET NOT NULL")
+    for column in ("tcp_connections", "udp_connections", "icmp_connections"):
+        op.execute(f"ALTER TABLE system_reports ADD COLUMN IF NOT EXISTS {column} INTEGER DEFAULT 0")
+        op.execute(f"""
+            UPDATE system_reports
+            SET {column} = COALESCE((raw_data->>'{column}')::integer, 0)
+            WHERE raw_data IS NOT NULL AND COALESCE({column}, 0) = 0
+        """)
+
+    execute_sql_file("partition_reports_by_month.sql")
+
+
+def downgrade() -> None:
+    # Обратно к пустой базе: дочерние таблицы раньше system_reports (их FK
+    # ссылаются на нее), секции удаляются вместе с родительскими таблицами.
+    # Несекционированная база, из которой пришла ревизия, не восстанавливается
+    for table in (
+        "report_files",
+        "remote_hosts",
+        "network_ports",
+        "network_interfaces",
+        "network_connections",
+        "change_history",
+        "report_hashes",
+        "system_reports",
+    ):
+        op.execute(f"DROP TABLE IF EXISTS {table} CASCADE")
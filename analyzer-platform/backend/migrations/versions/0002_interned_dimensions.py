@@ -0,0 +1,83 @@
+"""Interned dimension tables for processes, endpoints and port descriptions
+
+Повторяющиеся строки соединений и портов выносятся в справочники с
+целочисленными ключами: process_name, remote_hostname, local/remote_address
+и description. Существующие строки переводятся на ключи в этой же ревизии.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-01-22
+"""
+
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+# Справочник -> (длина значения, [(таблица фактов, старая колонка, новая колонка)])
+DIMENSIONS = {
+    "dim_process_names": (255, [
+        ("network_connections", "process_name", "process_name_id"),
+        ("network_ports", "process_name", "process_name_id"),
+    ]),
+    "dim_hostnames": (255, [
+        ("network_connections", "remote_hostname", "remote_hostname_id"),
+    ]),
+    "dim_addresses": (100, [
+        ("network_connections", "local_address", "local_address_id"),
+        ("network_connections", "remote_address", "remote_address_id"),
+    ]),
+    "dim_port_descriptions": (500, [
+        ("network_ports", "description", "description_id"),
+    ]),
+}
+
+
+def upgrade() -> None:
+    for dimension, (length, columns) in DIMENSIONS.items():
+        op.execute(f"""
+            CREATE TABLE IF NOT EXISTS {dimension} (
+                id SERIAL PRIMARY KEY,
+                value VARCHAR({length}) NOT NULL UNIQUE
+            )
+        """)
+
+        for table, old_column, new_column in columns:
+            op.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {new_column} INTEGER REFERENCES {dimension} (id)")
+
+            # Заполняем справочник и переводим строки на ключи
+            op.execute(f"""
+                INSERT INTO {dimension} (value)
+                SELECT DISTINCT LEFT({old_column}, {length})
+                FROM {table}
+                WHERE {old_column} IS NOT NULL AND {old_column} <> ''
+                ON CONFLICT (value) DO NOTHING
+            """)
+            op.execute(f"""
+                UPDATE {table} t
+                SET {new_column} = d.id
+                FROM {dimension} d
+                WHERE d.value = LEFT(t.{old_column}, {length})
+            """)
+
+    for _, (_, columns) in DIMENSIONS.items():
+        for table, old_column, _ in columns:
+            op.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS {old_column}")
+
+
+def downgrade() -> None:
+    for dimension, (length, columns) in DIMENSIONS.items():
+        for table, old_column, new_column in columns:
+            column_type = "TEXT" if old_column == "description" else f"VARCHAR({length})"
+            op.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {old_column} {column_type}")
+            op.execute(f"""
+                UPDATE {table} t
+                SET {old_column} = d.value
+                FROM {dimension} d
+                WHERE d.id = t.{new_column}
+            """)
+            op.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS {new_column}")
+
+        op.execute(f"DROP TABLE IF EXISTS {dimension}")
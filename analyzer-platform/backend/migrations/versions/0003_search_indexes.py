@@ -0,0 +1,41 @@
+"""Search indexes: trigram on hostnames, processes and addresses, btree on ports
+
+Индексы для /api/v1/search. Текстовый поиск по процессам и адресам идет по
+маленьким справочникам (trigram), затем по btree ключам в таблицах фактов.
+Все индексы строятся CONCURRENTLY, без блокировки приема отчетов.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-01-24
+"""
+
+from alembic import op
+
+from core.migrations import create_index_concurrently, drop_index_concurrently
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+# (имя, таблица, колонки, метод)
+INDEXES = [
+    ("idx_reports_hostname_trgm", "system_reports", ["hostname gin_trgm_ops"], "gin"),
+    ("idx_dim_process_names_trgm", "dim_process_names", ["value gin_trgm_ops"], "gin"),
+    ("idx_dim_addresses_trgm", "dim_addresses", ["value gin_trgm_ops"], "gin"),
+    ("idx_connections_process_name_id", "network_connections", ["process_name_id"], None),
+    ("idx_connections_remote_address_id", "network_connections", ["remote_address_id"], None),
+    ("idx_ports_port_number", "network_ports", ["port_number"], None),
+]
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    for name, table, columns, using in INDEXES:
+        create_index_concurrently(name, table, columns, using=using)
+
+
+def downgrade() -> None:
+    for name, _, _, _ in reversed(INDEXES):
+        drop_index_concurrently(name)
@@ -0,0 +1,93 @@
+"""Typed inet/port columns for connection endpoints
+
+Адреса соединений разбираются на local_ip/remote_ip (inet) и
+local_port/remote_port (integer). Индексы GiST (inet_ops) обслуживают
+фильтры по подсетям (<<=), btree - диапазоны портов. Существующие строки
+заполняются по справочнику dim_addresses: каждое значение разбирается
+один раз тем же кодом, что и при приеме (services/endpoints.py).
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-01-27
+"""
+
+from alembic import op
+from sqlalchemy import text
+
+from core.migrations import create_index_concurrently, drop_index_concurrently
+from services.endpoints import parse_endpoint
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+COLUMNS = [
+    ("local_ip", "INET"),
+    ("local_port", "INTEGER"),
+    ("remote_ip", "INET"),
+    ("remote_port", "INTEGER"),
+]
+
+# (имя, таблица, колонки, метод)
+INDEXES = [
+    ("idx_connections_remote_ip", "network_connections", ["remote_ip inet_ops"], "gist"),
+    ("idx_connections_local_ip", "network_connections", ["local_ip inet_ops"], "gist"),
+    ("idx_connections_remote_port", "network_connections", ["remote_port"], None),
+    ("idx_connections_local_port", "network_connections", ["local_port"], None),
+]
+
+BACKFILL_CHUNK = 5000
+
+
+def _backfill() -> None:
+    """Заполняет новые колонки через временную таблицу разобранных адресов"""
+    bind = op.get_bind()
+
+    op.execute("""
+        CREATE TEMPORARY TABLE tmp_address_endpoints (
+            id INTEGER PRIMARY KEY,
+            ip INET,
+            port INTEGER
+        ) ON COMMIT DROP
+    """)
+
+    parsed = []
+    for row in bind.execute(text("SELECT id, value FROM dim_addresses")):
+        ip, port = parse_endpoint(row.value)
+        if ip is not None or port is not None:
+            parsed.append({"id": row.id, "ip": str(ip) if ip is not None else None, "port": port})
+
+    for start in range(0, len(parsed), BACKFILL_CHUNK):
+        bind.execute(
+            text("INSERT INTO tmp_address_endpoints (id, ip, port) VALUES (:id, CAST(:ip AS inet), :port)"),
+            parsed[start:start + BACKFILL_CHUNK]
+        )
+
+    op.execute("ANALYZE tmp_address_endpoints")
+    op.execute("""
+        UPDATE network_connections c
+        SET local_ip = (SELECT e.ip FROM tmp_address_endpoints e WHERE e.id = c.local_address_id),
+            local_port = (SELECT e.port FROM tmp_address_endpoints e WHERE e.id = c.local_address_id),
+            remote_ip = (SELECT e.ip FROM tmp_address_endpoints e WHERE e.id = c.remote_address_id),
+            remote_port = (SELECT e.port FROM tmp_address_endpoints e WHERE e.id = c.remote_address_id)
+        WHERE c.local_address_id IS NOT NULL OR c.remote_address_id IS NOT NULL
+    """)
+
+
+def upgrade() -> None:
+    for column, column_type in COLUMNS:
+        op.execute(f"ALTER TABLE network_connections ADD COLUMN IF NOT EXISTS {column} {column_type}")
+
+    _backfill()
+
+    for name, table, columns, using in INDEXES:
+        create_index_concurrently(name, table, columns, using=using)
+
+
+def downgrade() -> None:
+    for name, _, _, _ in reversed(INDEXES):
+        drop_index_concurrently(name)
+
+    for column, _ in reversed(COLUMNS):
+        op.execute(f"ALTER TABLE network_connections DROP COLUMN IF EXISTS {column}")
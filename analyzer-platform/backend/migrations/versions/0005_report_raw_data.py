@@ -0,0 +1,57 @@
+"""Move raw_data out of system_reports into report_raw_data
+
+Сырые данные анализатора переносятся в отдельную таблицу 1:1 (JSONB,
+сжатие TOAST), секционированную так же, как остальные дочерние таблицы.
+Списки, сводки и поиск дубликатов больше не читают и не распаковывают их.
+
+Старые отчеты переносятся без потерь (кроме отладочного raw_html): их
+соединения и порты в дочерних таблицах могли быть усечены при приеме.
+Новые отчеты соединения и порты в raw_data не дублируют.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2025-01-29
+"""
+
+from alembic import op
+
+from core.migrations import create_child_partitions
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS report_raw_data (
+            report_id UUID NOT NULL,
+            report_generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            data JSONB NOT NULL,
+            PRIMARY KEY (report_id, report_generated_at),
+            FOREIGN KEY (report_id, report_generated_at) REFERENCES system_reports (id, generated_at)
+                ON DELETE CASCADE ON UPDATE CASCADE
+        ) PARTITION BY RANGE (report_generated_at)
+    """)
+    create_child_partitions("report_raw_data")
+
+    op.execute("""
+        INSERT INTO report_raw_data (report_id, report_generated_at, data)
+        SELECT id, generated_at, raw_data::jsonb - 'raw_html'
+        FROM system_reports
+        WHERE raw_data IS NOT NULL
+        ON CONFLICT DO NOTHING
+    """)
+    op.execute("ALTER TABLE system_reports DROP COLUMN IF EXISTS raw_data")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE system_reports ADD COLUMN IF NOT EXISTS raw_data JSON")
+    op.execute("""
+        UPDATE system_reports r
+        SET raw_data = d.data::json
+        FROM report_raw_data d
+        WHERE d.report_id = r.id AND d.report_generated_at = r.generated_at
+    """)
+    op.execute("DROP TABLE IF EXISTS report_raw_data")
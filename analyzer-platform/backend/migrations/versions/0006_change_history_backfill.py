@@ -0,0 +1,67 @@
+"""Backfill change_history from report_raw_data
+
+История изменений теперь записывается при приеме отчета. Для уже принятых
+отчетов строки change_history восстанавливаются из сохраненных сырых
+данных, после чего копия истории из report_raw_data удаляется.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2025-01-31
+"""
+
+from alembic import op
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        INSERT INTO change_history (
+            id, report_id, report_generated_at, measurement_id, change_timestamp,
+            is_first_run, changed_categories, change_details
+        )
+        SELECT
+            gen_random_uuid(),
+            d.report_id,
+            d.report_generated_at,
+            (c.item->>'measurement_id')::integer,
+            (c.item->>'change_timestamp')::timestamp,
+            COALESCE((c.item->>'is_first_run')::boolean, false),
+            ARRAY(SELECT jsonb_array_elements_text(COALESCE(c.item->'changed_categories', '[]'::jsonb))),
+            to_json(NULLIF(c.item->>'change_details', ''))
+        FROM report_raw_data d
+        CROSS JOIN LATERAL jsonb_array_elements(d.data->'change_history') AS c(item)
+        WHERE jsonb_typeof(d.data->'change_history') = 'array'
+          AND c.item->>'change_timestamp' IS NOT NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM change_history h
+              WHERE h.report_id = d.report_id AND h.report_generated_at = d.report_generated_at
+          )
+    """)
+    op.execute("""
+        UPDATE report_raw_data
+        SET data = data - 'change_history'
+        WHERE data ? 'change_history'
+    """)
+
+
+def downgrade() -> None:
+    op.execute("""
+        UPDATE report_raw_data d
+        SET data = d.data || jsonb_build_object('change_history', h.items)
+        FROM (
+            SELECT report_id, report_generated_at, jsonb_agg(jsonb_build_object(
+                'measurement_id', measurement_id,
+                'change_timestamp', change_timestamp,
+                'is_first_run', is_first_run,
+                'changed_categories', to_jsonb(changed_categories),
+                'change_details', change_details::jsonb
+            ) ORDER BY change_timestamp) AS items
+            FROM change_history
+            GROUP BY report_id, report_generated_at
+        ) h
+        WHERE h.report_id = d.report_id AND h.report_generated_at = d.report_generated_at
+    """)
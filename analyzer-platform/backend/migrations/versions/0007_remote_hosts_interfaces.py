@@ -0,0 +1,103 @@
+"""Precomputed remote_hosts and network_interfaces
+
+remote_hosts и network_interfaces теперь заполняются при приеме отчета.
+Счетчики интерфейсов переводятся в BIGINT (байты превышают int32).
+Для уже принятых отчетов агрегаты хостов строятся по network_connections
+(remote_ip из ревизии 0004), интерфейсы - из report_raw_data, после чего
+копия интерфейсов из сырых данных удаляется.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2025-02-03
+"""
+
+from alembic import op
+
+from services.endpoints import LOCAL_NETWORKS
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+COUNTERS = ("packets_in", "packets_out", "bytes_in", "bytes_out")
+
+
+def upgrade() -> None:
+    for column in COUNTERS:
+        op.execute(f"ALTER TABLE network_interfaces ALTER COLUMN {column} TYPE BIGINT")
+
+    is_local = " OR ".join(f"c.remote_ip <<= '{network}'::cidr" for network in LOCAL_NETWORKS)
+    op.execute(f"""
+        INSERT INTO remote_hosts (
+            id, report_id, report_generated_at, ip_address, hostname,
+            connection_count, first_seen, last_seen, is_local
+        )
+        SELECT
+            gen_random_uuid(),
+            c.report_id,
+            c.report_generated_at,
+            host(c.remote_ip),
+            mode() WITHIN GROUP (ORDER BY h.value),
+            count(*),
+            min(COALESCE(c.first_seen, c.last_seen)),
+            max(COALESCE(c.last_seen, c.first_seen)),
+            bool_or({is_local})
+        FROM network_connections c
+        LEFT JOIN dim_hostnames h ON h.id = c.remote_hostname_id
+        WHERE c.remote_ip IS NOT NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM remote_hosts r
+              WHERE r.report_id = c.report_id AND r.report_generated_at = c.report_generated_at
+          )
+        GROUP BY c.report_id, c.report_generated_at, c.remote_ip
+    """)
+
+    op.execute("""
+        INSERT INTO network_interfaces (
+            id, report_id, report_generated_at, interface_name,
+            packets_in, packets_out, bytes_in, bytes_out
+        )
+        SELECT
+            gen_random_uuid(),
+            d.report_id,
+            d.report_generated_at,
+            LEFT(i.item->>'interface_name', 100),
+            COALESCE((i.item->>'packets_in')::bigint, 0),
+            COALESCE((i.item->>'packets_out')::bigint, 0),
+            COALESCE((i.item->>'bytes_in')::bigint, 0),
+            COALESCE((i.item->>'bytes_out')::bigint, 0)
+        FROM report_raw_data d
+        CROSS JOIN LATERAL jsonb_array_elements(d.data->'network_interfaces') AS i(item)
+        WHERE jsonb_typeof(d.data->'network_interfaces') = 'array'
+          AND COALESCE(i.item->>'interface_name', '') <> ''
+          AND NOT EXISTS (
+              SELECT 1 FROM network_interfaces n
+              WHERE n.report_id = d.report_id AND n.report_generated_at = d.report_generated_at
+          )
+    """)
+    op.execute("""
+        UPDATE report_raw_data
+        SET data = data - 'network_interfaces'
+        WHERE data ? 'network_interfaces'
+    """)
+
+
+def downgrade() -> None:
+    op.execute("""
+        UPDATE report_raw_data d
+        SET data = d.data || jsonb_build_object('network_interfaces', n.items)
+        FROM (
+            SELECT report_id, report_generated_at, jsonb_agg(jsonb_build_object(
+                'interface_name', interface_name,
+                'packets_in', packets_in,
+                'packets_out', packets_out,
+                'bytes_in', bytes_in,
+                'bytes_out', bytes_out
+            )) AS items
+            FROM network_interfaces
+            GROUP BY report_id, report_generated_at
+        ) n
+        WHERE n.report_id = d.report_id AND n.report_generated_at = d.report_generated_at
+    """)
+    # Счетчики остаются BIGINT: обратное сужение может не вместить значения
@@ -0,0 +1,87 @@
+"""Precomputed per-host deltas
+
+host_deltas - дельта отчета относительно предыдущего отчета хоста
+(секционирована как остальные дочерние таблицы), host_latest_deltas -
+указатель на дельту свежего отчета хоста, delta_queue - очередь фонового
+вычисления. Для уже принятых отчетов в очередь ставится последний отчет
+каждого хоста, чтобы указатели появились сразу после запуска воркеров.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2025-02-05
+"""
+
+from alembic import op
+
+from core.migrations import create_child_partitions
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS host_deltas (
+            report_id UUID NOT NULL,
+            report_generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            hostname VARCHAR(255) NOT NULL,
+            against_report_id UUID,
+            against_generated_at TIMESTAMP WITHOUT TIME ZONE,
+            total_changes INTEGER NOT NULL DEFAULT 0,
+            summary JSON,
+            delta JSONB,
+            computed_at TIMESTAMP WITHOUT TIME ZONE,
+            PRIMARY KEY (report_id, report_generated_at),
+            FOREIGN KEY (report_id, report_generated_at) REFERENCES system_reports (id, generated_at)
+                ON DELETE CASCADE ON UPDATE CASCADE
+        ) PARTITION BY RANGE (report_generated_at)
+    """)
+    create_child_partitions("host_deltas")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_host_deltas_hostname_date ON host_deltas (hostname, report_generated_at)"
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS idx_host_deltas_against ON host_deltas (against_report_id)")
+
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS host_latest_deltas (
+            hostname VARCHAR(255) PRIMARY KEY,
+            report_id UUID NOT NULL,
+            report_generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            against_report_id UUID,
+            total_changes INTEGER NOT NULL DEFAULT 0,
+            summary JSON,
+            updated_at TIMESTAMP WITHOUT TIME ZONE
+        )
+    """)
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_host_latest_deltas_changed
+        ON host_latest_deltas (report_generated_at DESC, hostname)
+        WHERE total_changes > 0
+    """)
+
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS delta_queue (
+            report_id UUID PRIMARY KEY,
+            report_generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            enqueued_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_delta_queue_enqueued_at ON delta_queue (enqueued_at)")
+
+    op.execute("""
+        INSERT INTO delta_queue (report_id, report_generated_at)
+        SELECT DISTINCT ON (hostname) id, generated_at
+        FROM system_reports
+        ORDER BY hostname, generated_at DESC
+        ON CONFLICT DO NOTHING
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS delta_queue")
+    op.execute("DROP TABLE IF EXISTS host_latest_deltas")
+    op.execute("DROP TABLE IF EXISTS host_deltas")
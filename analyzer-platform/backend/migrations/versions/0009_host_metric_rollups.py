@@ -0,0 +1,69 @@
+"""Hourly and daily rollups of host metrics
+
+host_metric_rollups хранит min, max и последнее значение числовых
+показателей отчетов в часовых и суточных корзинах хоста. Для уже
+принятых отчетов корзины строятся по system_reports.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2025-02-07
+"""
+
+from alembic import op
+
+from services.metrics import SERIES_METRICS
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+_RESOLUTIONS = ("hour", "day")
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS host_metric_rollups (
+            hostname VARCHAR(255) NOT NULL,
+            metric VARCHAR(50) NOT NULL,
+            resolution VARCHAR(10) NOT NULL,
+            bucket_start TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            min_value INTEGER NOT NULL,
+            max_value INTEGER NOT NULL,
+            last_value INTEGER NOT NULL,
+            last_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            samples INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (hostname, metric, resolution, bucket_start)
+        )
+    """)
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_host_metric_rollups_resolution_bucket
+        ON host_metric_rollups (resolution, bucket_start)
+    """)
+
+    metrics = ", ".join(f"('{metric}', r.{metric})" for metric in SERIES_METRICS)
+    for resolution in _RESOLUTIONS:
+        op.execute(f"""
+            INSERT INTO host_metric_rollups (
+                hostname, metric, resolution, bucket_start,
+                min_value, max_value, last_value, last_at, samples
+            )
+            SELECT
+                r.hostname,
+                m.metric,
+                '{resolution}',
+                date_trunc('{resolution}', r.generated_at),
+                min(COALESCE(m.value, 0)),
+                max(COALESCE(m.value, 0)),
+                (array_agg(COALESCE(m.value, 0) ORDER BY r.generated_at DESC))[1],
+                max(r.generated_at),
+                count(*)
+            FROM system_reports r
+            CROSS JOIN LATERAL (VALUES {metrics}) AS m(metric, value)
+            GROUP BY r.hostname, m.metric, date_trunc('{resolution}', r.generated_at)
+            ON CONFLICT DO NOTHING
+        """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS host_metric_rollups")
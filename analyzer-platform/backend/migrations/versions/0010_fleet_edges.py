@@ -0,0 +1,69 @@
+"""Aggregated fleet communication graph
+
+fleet_edges - ребра хост -> удаленная конечная точка (IP, порт сервиса,
+протокол, направление) с первым/последним появлением, числом отчетов,
+соединений и суммой пакетов. Для уже принятых отчетов ребра строятся
+одним проходом по network_connections.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2025-02-10
+"""
+
+from alembic import op
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS fleet_edges (
+            hostname VARCHAR(255) NOT NULL,
+            remote_ip INET NOT NULL,
+            port INTEGER NOT NULL,
+            protocol VARCHAR(10) NOT NULL,
+            direction VARCHAR(10) NOT NULL,
+            process_name_id INTEGER REFERENCES dim_process_names (id),
+            first_seen TIMESTAMP WITHOUT TIME ZONE,
+            last_seen TIMESTAMP WITHOUT TIME ZONE,
+            last_report_at TIMESTAMP WITHOUT TIME ZONE,
+            report_count INTEGER NOT NULL DEFAULT 0,
+            connection_count BIGINT NOT NULL DEFAULT 0,
+            packet_total BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (hostname, remote_ip, port, protocol, direction)
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS idx_fleet_edges_remote_ip ON fleet_edges (remote_ip, hostname)")
+    op.execute("CREATE INDEX IF NOT EXISTS idx_fleet_edges_last_seen ON fleet_edges (last_seen)")
+
+    op.execute("""
+        INSERT INTO fleet_edges (
+            hostname, remote_ip, port, protocol, direction, process_name_id,
+            first_seen, last_seen, last_report_at, report_count, connection_count, packet_total
+        )
+        SELECT
+            r.hostname,
+            c.remote_ip,
+            COALESCE(CASE WHEN c.connection_type = 'incoming' THEN c.local_port ELSE c.remote_port END, 0),
+            lower(COALESCE(c.protocol, 'unknown')),
+            CASE WHEN c.connection_type = 'incoming' THEN 'incoming' ELSE 'outgoing' END,
+            (array_agg(c.process_name_id ORDER BY r.generated_at DESC) FILTER (WHERE c.process_name_id IS NOT NULL))[1],
+            min(COALESCE(c.first_seen, c.last_seen, r.generated_at)),
+            max(COALESCE(c.last_seen, c.first_seen, r.generated_at)),
+            max(r.generated_at),
+            count(DISTINCT c.report_id),
+            count(*),
+            COALESCE(sum(c.packet_count), 0)
+        FROM network_connections c
+        JOIN system_reports r ON r.id = c.report_id AND r.generated_at = c.report_generated_at
+        WHERE c.remote_ip IS NOT NULL
+        GROUP BY 1, 2, 3, 4, 5
+        ON CONFLICT DO NOTHING
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS fleet_edges")
@@ -0,0 +1,63 @@
+"""Host baselines and anomaly findings
+
+host_baselines - известные хосту порты, конечные точки и процессы с днем
+последнего появления; anomaly_findings - новые элементы отчетов
+относительно линии (секционирована как остальные дочерние таблицы).
+Линии наполняются с новыми отчетами: первые ANOMALY_MIN_BASELINE_REPORTS
+отчетов хоста только обучают ее.
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2025-02-12
+"""
+
+from alembic import op
+
+from core.migrations import create_child_partitions
+
+revision = "0011"
+down_revision = "0010"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS host_baselines (
+            hostname VARCHAR(255) PRIMARY KEY,
+            ports JSONB NOT NULL DEFAULT '{}'::jsonb,
+            endpoints JSONB NOT NULL DEFAULT '{}'::jsonb,
+            processes JSONB NOT NULL DEFAULT '{}'::jsonb,
+            reports_seen INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP WITHOUT TIME ZONE
+        )
+    """)
+
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS anomaly_findings (
+            id UUID NOT NULL,
+            report_id UUID NOT NULL,
+            report_generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            hostname VARCHAR(255) NOT NULL,
+            kind VARCHAR(20) NOT NULL,
+            value VARCHAR(255) NOT NULL,
+            details JSON,
+            detected_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (id, report_generated_at),
+            FOREIGN KEY (report_id, report_generated_at) REFERENCES system_reports (id, generated_at)
+                ON DELETE CASCADE ON UPDATE CASCADE
+        ) PARTITION BY RANGE (report_generated_at)
+    """)
+    create_child_partitions("anomaly_findings")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_anomaly_findings_detected ON anomaly_findings (detected_at, id)"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_anomaly_findings_hostname_detected "
+        "ON anomaly_findings (hostname, detected_at)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS anomaly_findings")
+    op.execute("DROP TABLE IF EXISTS host_baselines")
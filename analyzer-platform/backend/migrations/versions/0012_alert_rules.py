@@ -0,0 +1,61 @@
+"""Alert rules and rule alerts
+
+alert_rules - пользовательские правила оповещений (services/rules.py);
+rule_alerts - срабатывания правил на отчетах (секционирована как
+остальные дочерние таблицы). Правила применяются к отчетам, принятым
+после их создания.
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2025-02-14
+"""
+
+from alembic import op
+
+from core.migrations import create_child_partitions
+
+revision = "0012"
+down_revision = "0011"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS alert_rules (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            description TEXT,
+            severity VARCHAR(20) NOT NULL DEFAULT 'warning',
+            enabled BOOLEAN NOT NULL DEFAULT TRUE,
+            definition JSONB NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE,
+            updated_at TIMESTAMP WITHOUT TIME ZONE
+        )
+    """)
+
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS rule_alerts (
+            id UUID NOT NULL,
+            report_id UUID NOT NULL,
+            report_generated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            rule_id INTEGER NOT NULL,
+            rule_name VARCHAR(255) NOT NULL,
+            severity VARCHAR(20) NOT NULL,
+            hostname VARCHAR(255) NOT NULL,
+            details JSON,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (id, report_generated_at),
+            FOREIGN KEY (report_id, report_generated_at) REFERENCES system_reports (id, generated_at)
+                ON DELETE CASCADE ON UPDATE CASCADE
+        ) PARTITION BY RANGE (report_generated_at)
+    """)
+    create_child_partitions("rule_alerts")
+    op.execute("CREATE INDEX IF NOT EXISTS idx_rule_alerts_created ON rule_alerts (created_at, id)")
+    op.execute("CREATE INDEX IF NOT EXISTS idx_rule_alerts_rule_created ON rule_alerts (rule_id, created_at)")
+    op.execute("CREATE INDEX IF NOT EXISTS idx_rule_alerts_hostname_created ON rule_alerts (hostname, created_at)")
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS rule_alerts")
+    op.execute("DROP TABLE IF EXISTS alert_rules")
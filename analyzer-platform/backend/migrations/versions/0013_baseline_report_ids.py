@@ -0,0 +1,28 @@
+"""Reports already merged into host baselines
+
+host_baselines.report_ids - отчеты, уже учтенные в линии: ключ отчета ->
+день отчета (затухает вместе с элементами). Повторный прием того же
+отчета (замена по хешу) не пополняет линию второй раз и не теряет его
+находки.
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2025-02-17
+"""
+
+from alembic import op
+
+revision = "0013"
+down_revision = "0012"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "ALTER TABLE host_baselines ADD COLUMN IF NOT EXISTS report_ids JSONB NOT NULL DEFAULT '{}'::jsonb"
+    )
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE host_baselines DROP COLUMN IF EXISTS report_ids")
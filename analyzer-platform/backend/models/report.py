@@ -6,31 +6,55 @@
 
 from datetime import datetime
 from typing import List, Optional, Dict, Any
-from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, Boolean, ForeignKey, Float
+from sqlalchemy import BigInteger, Column, Integer, String, DateTime, Text, JSON, Boolean, ForeignKey, ForeignKeyConstraint, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, Session
-from sqlalchemy.dialects.postgresql import UUID, ARRAY
+from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy.dialects.postgresql import UUID, ARRAY, INET, JSONB
 import uuid
 
 from core.database import Base
 
 
+def _report_partition_args(*constraints) -> tuple:
+    """
+    Аргументы таблицы, секционированной по месяцу generated_at отчета
+
+    Дочерние таблицы хранят копию ключа секционирования (report_generated_at)
+    и ссылаются на отчет составным внешним ключом, поэтому их секции
+    совпадают с секциями system_reports и удаляются вместе с ними.
+    """
+    return (
+        ForeignKeyConstraint(
+            ["report_id", "report_generated_at"],
+            ["system_reports.id", "system_reports.generated_at"],
+            ondelete="CASCADE",
+            onupdate="CASCADE",
+        ),
+        *constraints,
+        {"postgresql_partition_by": "RANGE (report_generated_at)"},
+    )
+
+
 class Melt(Base):
     """
     Основная модель отчета системы - соответствует структуре HTML отчета
+    Таблица секционирована по месяцам generated_at (см. services/partitioning.py)
     """
     __tablename__ = "system_reports"
+    __table_args__ = {"postgresql_partition_by": "RANGE (generated_at)"}
     
-    # Основные поля
+    # Основные поля (ключ секционирования входит в первичный ключ)
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    generated_at = Column(DateTime, primary_key=True, default=datetime.utcnow, nullable=False)
     
-    # Уникальный хеш отчета для предотвращения дублирования
-    report_hash = Column(String(64), unique=True, index=True, nullable=False)
+    # Хеш отчета для предотвращения дублирования
+    # Глобальная уникальность обеспечивается таблицей report_hashes
+    report_hash = Column(String(64), index=True, nullable=False)
     
     # Метаданные отчета (из header HTML)
     hostname = Column(String(255), nullable=False, index=True)
     report_title = Column(String(500), nullable=False)
-    generated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     
     # Информация о системе (из header-info HTML)
     os_name = Column(String(255))
@@ -61,7 +85,7 @@ class Melt(Base):
     change_events_count = Column(Integer, default=0)
     
     # JSON поля для сложных данных
-    raw_data = Column(JSON)  # Полные сырые данные из анализатора
+    # Сырые данные анализатора - в отдельной таблице report_raw_data (ReportRawData)
     changes_summary = Column(JSON)  # Суммарная информация об изменениях
     
     # Технические поля
@@ -71,33 +95,100 @@ class Melt(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Связи с другими таблицами
-    connections = relationship("NetworkConnection", back_populates="report", cascade="all, delete-orphan")
-    ports = relationship("NetworkPort", back_populates="report", cascade="all, delete-orphan")
-    remote_hosts = relationship("RemoteHost", back_populates="report", cascade="all, delete-orphan")
-    change_history = relationship("ChangeHistory", back_populates="report", cascade="all, delete-orphan")
-    network_interfaces = relationship("NetworkInterface", back_populates="report", cascade="all, delete-orphan")
+    connections = relationship("NetworkConnection", back_populates="report", cascade="all, delete-orphan", passive_deletes=True)
+    ports = relationship("NetworkPort", back_populates="report", cascade="all, delete-orphan", passive_deletes=True)
+    remote_hosts = relationship("RemoteHost", back_populates="report", cascade="all, delete-orphan", passive_deletes=True)
+    change_history = relationship("ChangeHistory", back_populates="report", cascade="all, delete-orphan", passive_deletes=True)
+    network_interfaces = relationship("NetworkInterface", back_populates="report", cascade="all, delete-orphan", passive_deletes=True)
+    # Загружается только явно (selectinload или services.report_ingest.load_raw_data)
+    raw = relationship("ReportRawData", back_populates="report", uselist=False, lazy="raise",
+                       cascade="all, delete-orphan", passive_deletes=True)
     
     def __repr__(self):
         return f"<Melt(hostname='{self.hostname}', generated_at='{self.generated_at}')>"
 
 
+class ProcessName(Base):
+    """
+    Справочник имен процессов
+
+    Строковые значения, повторяющиеся в тысячах отчетов, хранятся один раз,
+    а строки соединений и портов ссылаются на них целочисленным ключом
+    (см. services/interning.py).
+    """
+    __tablename__ = "dim_process_names"
+    
+    id = Column(Integer, primary_key=True)
+    value = Column(String(255), nullable=False, unique=True)
+    
+    def __repr__(self):
+        return f"<ProcessName(id={self.id}, value='{self.value}')>"
+
+
+class RemoteHostname(Base):
+    """
+    Справочник имен удаленных хостов
+    """
+    __tablename__ = "dim_hostnames"
+    
+    id = Column(Integer, primary_key=True)
+    value = Column(String(255), nullable=False, unique=True)
+    
+    def __repr__(self):
+        return f"<RemoteHostname(id={self.id}, value='{self.value}')>"
+
+
+class NetworkAddress(Base):
+    """
+    Справочник сетевых адресов (локальных и удаленных, вида ip:port)
+    """
+    __tablename__ = "dim_addresses"
+    
+    id = Column(Integer, primary_key=True)
+    value = Column(String(100), nullable=False, unique=True)
+    
+    def __repr__(self):
+        return f"<NetworkAddress(id={self.id}, value='{self.value}')>"
+
+
+class PortDescription(Base):
+    """
+    Справочник описаний портов ("TCP порт 443" и т.п.)
+    """
+    __tablename__ = "dim_port_descriptions"
+    
+    id = Column(Integer, primary_key=True)
+    value = Column(String(500), nullable=False, unique=True)
+    
+    def __repr__(self):
+        return f"<PortDescription(id={self.id}, value='{self.value}')>"
+
+
 class NetworkConnection(Base):
     """
     Сетевые соединения - соответствует connections секции HTML
     """
     __tablename__ = "network_connections"
+    __table_args__ = _report_partition_args()
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    report_id = Column(UUID(as_uuid=True), ForeignKey("system_reports.id"), nullable=False)
+    report_id = Column(UUID(as_uuid=True), nullable=False)
+    report_generated_at = Column(DateTime, primary_key=True)  # Ключ секционирования
     
     # Данные соединения (из connections-table HTML)
     connection_type = Column(String(20))  # incoming, outgoing
-    local_address = Column(String(100))
-    remote_address = Column(String(100))
-    remote_hostname = Column(String(255))
-    process_name = Column(String(255))
+    local_address_id = Column(Integer, ForeignKey("dim_addresses.id"))
+    remote_address_id = Column(Integer, ForeignKey("dim_addresses.id"))
+    remote_hostname_id = Column(Integer, ForeignKey("dim_hostnames.id"))
+    process_name_id = Column(Integer, ForeignKey("dim_process_names.id"))
     protocol = Column(String(10))  # tcp, udp, icmp
     
+    # Адреса, разобранные на IP и порт (services/endpoints.py) - для CIDR и диапазонов портов
+    local_ip = Column(INET)
+    local_port = Column(Integer)
+    remote_ip = Column(INET)
+    remote_port = Column(Integer)
+    
     # Временные метки (из HTML отчета)
     first_seen = Column(DateTime)
     last_seen = Column(DateTime)
@@ -111,6 +202,17 @@ class NetworkConnection(Base):
     # Связь с отчетом
     report = relationship("Melt", back_populates="connections")
     
+    # Значения из справочников (только чтение, запись - через services/interning.py)
+    local_address_ref = relationship("NetworkAddress", foreign_keys=[local_address_id], lazy="joined")
+    remote_address_ref = relationship("NetworkAddress", foreign_keys=[remote_address_id], lazy="joined")
+    remote_hostname_ref = relationship("RemoteHostname", lazy="joined")
+    process_name_ref = relationship("ProcessName", lazy="joined")
+    
+    local_address = association_proxy("local_address_ref", "value")
+    remote_address = association_proxy("remote_address_ref", "value")
+    remote_hostname = association_proxy("remote_hostname_ref", "value")
+    process_name = association_proxy("process_name_ref", "value")
+    
     def __repr__(self):
         return f"<NetworkConnection(local='{self.local_address}', remote='{self.remote_address}')>"
 
@@ -120,23 +222,32 @@ class NetworkPort(Base):
     Сетевые порты - соответствует ports секции HTML
     """
     __tablename__ = "network_ports"
+    __table_args__ = _report_partition_args()
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    report_id = Column(UUID(as_uuid=True), ForeignKey("system_reports.id"), nullable=False)
+    report_id = Column(UUID(as_uuid=True), nullable=False)
+    report_generated_at = Column(DateTime, primary_key=True)  # Ключ секционирования
     
     # Данные порта (из ports-grid HTML)
     port_number = Column(Integer, nullable=False)
     protocol = Column(String(10), nullable=False)  # tcp, udp
-    description = Column(Text)  # Описание порта из get_port_description
+    description_id = Column(Integer, ForeignKey("dim_port_descriptions.id"))  # Описание порта из get_port_description
     service_name = Column(String(100))  # Имя сервиса
     
     # Статус порта
     status = Column(String(20), default="listening")  # listening, closed, filtered
-    process_name = Column(String(255))
+    process_name_id = Column(Integer, ForeignKey("dim_process_names.id"))
     
     # Связь с отчетом
     report = relationship("Melt", back_populates="ports")
     
+    # Значения из справочников (только чтение)
+    description_ref = relationship("PortDescription", lazy="joined")
+    process_name_ref = relationship("ProcessName", lazy="joined")
+    
+    description = association_proxy("description_ref", "value")
+    process_name = association_proxy("process_name_ref", "value")
+    
     def __repr__(self):
         return f"<NetworkPort(port={self.port_number}, protocol='{self.protocol}')>"
 
@@ -146,9 +257,11 @@ class RemoteHost(Base):
     Удаленные хосты - соответствует remote hosts данным из HTML
     """
     __tablename__ = "remote_hosts"
+    __table_args__ = _report_partition_args()
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    report_id = Column(UUID(as_uuid=True), ForeignKey("system_reports.id"), nullable=False)
+    report_id = Column(UUID(as_uuid=True), nullable=False)
+    report_generated_at = Column(DateTime, primary_key=True)  # Ключ секционирования
     
     # Данные хоста
     ip_address = Column(String(45), nullable=False)  # IPv4/IPv6
@@ -176,9 +289,11 @@ class ChangeHistory(Base):
     История изменений - соответствует changes секции HTML
     """
     __tablename__ = "change_history"
+    __table_args__ = _report_partition_args()
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    report_id = Column(UUID(as_uuid=True), ForeignKey("system_reports.id"), nullable=False)
+    report_id = Column(UUID(as_uuid=True), nullable=False)
+    report_generated_at = Column(DateTime, primary_key=True)  # Ключ секционирования
     
     # Данные изменения (из changes-timeline HTML)
     measurement_id = Column(Integer)
@@ -201,18 +316,20 @@ class NetworkInterface(Base):
     Сетевые интерфейсы - соответствует network stats секции HTML
     """
     __tablename__ = "network_interfaces"
+    __table_args__ = _report_partition_args()
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    report_id = Column(UUID(as_uuid=True), ForeignKey("system_reports.id"), nullable=False)
+    report_id = Column(UUID(as_uuid=True), nullable=False)
+    report_generated_at = Column(DateTime, primary_key=True)  # Ключ секционирования
     
     # Данные интерфейса (из interface-card HTML)
     interface_name = Column(String(100), nullable=False)
     
-    # Статистика пакетов (из interface-stats HTML)
-    packets_in = Column(Integer, default=0)
-    packets_out = Column(Integer, default=0)
-    bytes_in = Column(Integer, default=0)
-    bytes_out = Column(Integer, default=0)
+    # Статистика пакетов (из interface-stats HTML), счетчики превышают int32
+    packets_in = Column(BigInteger, default=0)
+    packets_out = Column(BigInteger, default=0)
+    bytes_in = Column(BigInteger, default=0)
+    bytes_out = Column(BigInteger, default=0)
     
     # Дополнительная информация
     mtu = Column(Integer)
@@ -232,9 +349,11 @@ class ReportFile(Base):
     Файлы отчетов - для управления загруженными файлами
     """
     __tablename__ = "report_files"
+    __table_args__ = _report_partition_args()
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    report_id = Column(UUID(as_uuid=True), ForeignKey("system_reports.id"), nullable=False)
+    report_id = Column(UUID(as_uuid=True), nullable=False)
+    report_generated_at = Column(DateTime, primary_key=True)  # Ключ секционирования
     
     # Информация о файле
     filename = Column(String(500), nullable=False)
@@ -248,12 +367,254 @@ class ReportFile(Base):
     processed_at = Column(DateTime)
     
     # Связь с отчетом
-    report = relationship("Melt", foreign_keys=[report_id])
+    report = relationship("Melt")
     
     def __repr__(self):
         return f"<ReportFile(filename='{self.filename}', type='{self.file_type}')>"
 
 
+class ReportRawData(Base):
+    """
+    Сырые данные анализатора (1:1 с отчетом)
+
+    Вынесены из system_reports, чтобы списки и сводки читали только узкие
+    строки. Соединения и порты здесь не дублируются - они лежат в
+    network_connections и network_ports.
+    """
+    __tablename__ = "report_raw_data"
+    __table_args__ = _report_partition_args()
+    
+    report_id = Column(UUID(as_uuid=True), primary_key=True)
+    report_generated_at = Column(DateTime, primary_key=True)  # Ключ секционирования
+    data = Column(JSONB, nullable=False)
+    
+    report = relationship("Melt", back_populates="raw")
+    
+    def __repr__(self):
+        return f"<ReportRawData(report_id='{self.report_id}')>"
+
+
+class ReportHash(Base):
+    """
+    Реестр хешей отчетов - глобальная уникальность report_hash
+
+    Уникальный индекс на секционированной таблице обязан включать ключ
+    секционирования, поэтому дедупликация опирается на эту небольшую таблицу.
+    """
+    __tablename__ = "report_hashes"
+    
+    report_hash = Column(String(64), primary_key=True)
+    report_id = Column(UUID(as_uuid=True), nullable=False)
+    generated_at = Column(DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f"<ReportHash(hash='{self.report_hash}', report_id='{self.report_id}')>"
+
+
+class HostDelta(Base):
+    """
+    Дельта отчета относительно предыдущего отчета того же хоста
+
+    Вычисляется фоновым воркером (services/delta.py) после приема отчета.
+    delta - ответ /reports/{id}/delta с ограниченными списками, summary -
+    точные счетчики по секциям. Для первого отчета хоста against_* пусты.
+    """
+    __tablename__ = "host_deltas"
+    __table_args__ = _report_partition_args()
+    
+    report_id = Column(UUID(as_uuid=True), primary_key=True)
+    report_generated_at = Column(DateTime, primary_key=True)  # Ключ секционирования
+    hostname = Column(String(255), nullable=False)
+    against_report_id = Column(UUID(as_uuid=True))
+    against_generated_at = Column(DateTime)
+    
+    total_changes = Column(Integer, nullable=False, default=0)
+    summary = Column(JSON)
+    delta = Column(JSONB)
+    computed_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<HostDelta(hostname='{self.hostname}', changes={self.total_changes})>"
+
+
+class HostLatestDelta(Base):
+    """
+    Указатель на дельту самого свежего отчета хоста
+
+    Одна строка на хост: Delta View хоста и лента последних изменений
+    парка читаются отсюда без вычислений.
+    """
+    __tablename__ = "host_latest_deltas"
+    
+    hostname = Column(String(255), primary_key=True)
+    report_id = Column(UUID(as_uuid=True), nullable=False)
+    report_generated_at = Column(DateTime, nullable=False)
+    against_report_id = Column(UUID(as_uuid=True))
+    total_changes = Column(Integer, nullable=False, default=0)
+    summary = Column(JSON)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<HostLatestDelta(hostname='{self.hostname}', report_id='{self.report_id}')>"
+
+
+class DeltaQueue(Base):
+    """
+    Очередь отчетов, для которых нужно (пере)вычислить дельту
+
+    Запись добавляется в транзакции приема отчета, поэтому не теряется
+    при перезапуске; воркеры разбирают очередь через SKIP LOCKED.
+    """
+    __tablename__ = "delta_queue"
+    
+    report_id = Column(UUID(as_uuid=True), primary_key=True)
+    report_generated_at = Column(DateTime, nullable=False)
+    enqueued_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    
+    def __repr__(self):
+        return f"<DeltaQueue(report_id='{self.report_id}', attempts={self.attempts})>"
+
+
+class HostMetricRollup(Base):
+    """
+    Часовые и суточные корзины числовых показателей хоста
+
+    Строки не ссылаются на отчеты и переживают их удаление: суточные
+    корзины - долгосрочная история хоста (services/metrics.py).
+    """
+    __tablename__ = "host_metric_rollups"
+    
+    hostname = Column(String(255), primary_key=True)
+    metric = Column(String(50), primary_key=True)
+    resolution = Column(String(10), primary_key=True)  # hour, day
+    bucket_start = Column(DateTime, primary_key=True)
+    
+    min_value = Column(Integer, nullable=False)
+    max_value = Column(Integer, nullable=False)
+    last_value = Column(Integer, nullable=False)
+    last_at = Column(DateTime, nullable=False)
+    samples = Column(Integer, nullable=False, default=1)
+    
+    def __repr__(self):
+        return f"<HostMetricRollup(hostname='{self.hostname}', metric='{self.metric}', bucket='{self.bucket_start}')>"
+
+
+class FleetEdge(Base):
+    """
+    Ребро графа связей парка: хост -> удаленная конечная точка
+
+    Агрегат соединений всех отчетов хоста (services/graph.py). Порт -
+    порт сервиса (удаленный для исходящих, локальный для входящих).
+    """
+    __tablename__ = "fleet_edges"
+    
+    hostname = Column(String(255), primary_key=True)
+    remote_ip = Column(INET, primary_key=True)
+    port = Column(Integer, primary_key=True)  # 0 - соединение без порта (ICMP)
+    protocol = Column(String(10), primary_key=True)
+    direction = Column(String(10), primary_key=True)  # incoming, outgoing
+    
+    process_name_id = Column(Integer, ForeignKey("dim_process_names.id"))  # Процесс из последнего отчета
+    first_seen = Column(DateTime)
+    last_seen = Column(DateTime)
+    last_report_at = Column(DateTime)
+    report_count = Column(Integer, nullable=False, default=0)
+    connection_count = Column(BigInteger, nullable=False, default=0)
+    packet_total = Column(BigInteger, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<FleetEdge(hostname='{self.hostname}', remote='{self.remote_ip}:{self.port}')>"
+
+
+class HostBaseline(Base):
+    """
+    Базовая линия хоста для обнаружения аномалий (services/anomalies.py)
+
+    ports, endpoints, processes - ключ элемента -> день последнего
+    появления (date.toordinal()); устаревшие элементы забываются.
+    report_ids - отчеты, уже учтенные в линии (ключ отчета -> день отчета).
+    """
+    __tablename__ = "host_baselines"
+    
+    hostname = Column(String(255), primary_key=True)
+    ports = Column(JSONB, nullable=False, default=dict)
+    endpoints = Column(JSONB, nullable=False, default=dict)
+    processes = Column(JSONB, nullable=False, default=dict)
+    report_ids = Column(JSONB, nullable=False, default=dict)
+    reports_seen = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<HostBaseline(hostname='{self.hostname}', reports={self.reports_seen})>"
+
+
+class AnomalyFinding(Base):
+    """
+    Находка: новый порт, конечная точка или процесс относительно базовой линии
+    """
+    __tablename__ = "anomaly_findings"
+    __table_args__ = _report_partition_args()
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    report_id = Column(UUID(as_uuid=True), nullable=False)
+    report_generated_at = Column(DateTime, primary_key=True)  # Ключ секционирования
+    
+    hostname = Column(String(255), nullable=False)
+    kind = Column(String(20), nullable=False)  # new_port, new_endpoint, new_process
+    value = Column(String(255), nullable=False)
+    details = Column(JSON)
+    detected_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<AnomalyFinding(hostname='{self.hostname}', kind='{self.kind}', value='{self.value}')>"
+
+
+class AlertRule(Base):
+    """
+    Пользовательское правило оповещения (services/rules.py)
+
+    definition - нормализованное JSON определение: тип (port, connection,
+    metric), условия и необязательные шаблоны хостов.
+    """
+    __tablename__ = "alert_rules"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(255), nullable=False)
+    description = Column(Text)
+    severity = Column(String(20), nullable=False, default="warning")
+    enabled = Column(Boolean, nullable=False, default=True)
+    definition = Column(JSONB, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<AlertRule(id={self.id}, name='{self.name}')>"
+
+
+class RuleAlert(Base):
+    """
+    Срабатывание правила на отчете; details - примеры совпадений
+    """
+    __tablename__ = "rule_alerts"
+    __table_args__ = _report_partition_args()
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    report_id = Column(UUID(as_uuid=True), nullable=False)
+    report_generated_at = Column(DateTime, primary_key=True)  # Ключ секционирования
+    
+    rule_id = Column(Integer, nullable=False)  # Без внешнего ключа: оповещения переживают удаление правила
+    rule_name = Column(String(255), nullable=False)
+    severity = Column(String(20), nullable=False)
+    hostname = Column(String(255), nullable=False)
+    details = Column(JSON)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<RuleAlert(rule_id={self.rule_id}, hostname='{self.hostname}')>"
+
+
 # Индексы для оптимизации запросов
 from sqlalchemy import Index
 
@@ -263,4 +624,40 @@ Index('idx_reports_created_at', Melt.created_at)
 Index('idx_connections_report_protocol', NetworkConnection.report_id, NetworkConnection.protocol)
 Index('idx_ports_report_port', NetworkPort.report_id, NetworkPort.port_number)
 Index('idx_hosts_report_ip', RemoteHost.report_id, RemoteHost.ip_address)
-Index('idx_changes_report_timestamp', ChangeHistory.report_id, ChangeHistory.change_timestamp) 
\ No newline at end of file
+Index('idx_changes_report_timestamp', ChangeHistory.report_id, ChangeHistory.change_timestamp)
+
+# Индексы поиска (/api/v1/search), миграция 0003
+Index('idx_reports_hostname_trgm', Melt.hostname, postgresql_using='gin', postgresql_ops={'hostname': 'gin_trgm_ops'})
+Index('idx_dim_process_names_trgm', ProcessName.value, postgresql_using='gin', postgresql_ops={'value': 'gin_trgm_ops'})
+Index('idx_dim_addresses_trgm', NetworkAddress.value, postgresql_using='gin', postgresql_ops={'value': 'gin_trgm_ops'})
+Index('idx_connections_process_name_id', NetworkConnection.process_name_id)
+Index('idx_connections_remote_address_id', NetworkConnection.remote_address_id)
+Index('idx_ports_port_number', NetworkPort.port_number)
+
+# Фильтры по подсетям и диапазонам портов (/api/v1/connections), миграция 0004
+Index('idx_connections_remote_ip', NetworkConnection.remote_ip, postgresql_using='gist', postgresql_ops={'remote_ip': 'inet_ops'})
+Index('idx_connections_local_ip', NetworkConnection.local_ip, postgresql_using='gist', postgresql_ops={'local_ip': 'inet_ops'})
+Index('idx_connections_remote_port', NetworkConnection.remote_port)
+Index('idx_connections_local_port', NetworkConnection.local_port)
+
+# Предвычисленные дельты хостов, миграция 0008
+Index('idx_host_deltas_hostname_date', HostDelta.hostname, HostDelta.report_generated_at)
+Index('idx_host_deltas_against', HostDelta.against_report_id)
+Index('idx_host_latest_deltas_changed', HostLatestDelta.report_generated_at.desc(), HostLatestDelta.hostname,
+      postgresql_where=HostLatestDelta.total_changes > 0)
+
+# Часовые корзины удаляются retention по bucket_start, миграция 0009
+Index('idx_host_metric_rollups_resolution_bucket', HostMetricRollup.resolution, HostMetricRollup.bucket_start)
+
+# Граф связей парка, миграция 0010
+Index('idx_fleet_edges_remote_ip', FleetEdge.remote_ip, FleetEdge.hostname)
+Index('idx_fleet_edges_last_seen', FleetEdge.last_seen)
+
+# Находки аномалий, миграция 0011
+Index('idx_anomaly_findings_detected', AnomalyFinding.detected_at, AnomalyFinding.id)
+Index('idx_anomaly_findings_hostname_detected', AnomalyFinding.hostname, AnomalyFinding.detected_at)
+
+# Оповещения правил, миграция 0012
+Index('idx_rule_alerts_created', RuleAlert.created_at, RuleAlert.id)
+Index('idx_rule_alerts_rule_created', RuleAlert.rule_id, RuleAlert.created_at)
+Index('idx_rule_alerts_hostname_created', RuleAlert.hostname, RuleAlert.created_at)
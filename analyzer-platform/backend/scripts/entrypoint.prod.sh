@@ -46,11 +46,15 @@ create_directories() {
 }
 
 # Функция для миграций базы данных
+# Миграции - разовая команда деплоя (entrypoint.prod.sh migrate или сервис
+# migrate в compose), а не шаг запуска каждого контейнера: реплики не
+# соревнуются за них, а долгие CONCURRENTLY/backfill ревизии не задерживают
+# старт и проверки здоровья. Приложение только сверяет версию схемы
+# (check_schema_version), /health/ready отвечает 503, пока схема отстает.
 run_migrations() {
     echo "🔄 Запуск миграций базы данных..."
     
-    # Здесь можно добавить команды для миграций
-    # python -m alembic upgrade head
+    cd /app && alembic upgrade head
     
     echo "✅ Миграции выполнены!"
 }
@@ -97,8 +101,13 @@ main() {
     create_directories
     setup_logging
     wait_for_db
+    
+    if [ "$1" = "migrate" ]; then
+        run_migrations
+        exit 0
+    fi
+    
     wait_for_redis
-    run_migrations
     
     echo "✅ Инициализация завершена!"
     echo "🚀 Запуск приложения..."
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Обнаружение аномалий по базовой линии хоста
+
+Базовая линия (host_baselines) - компактные множества известных хосту
+портов, удаленных конечных точек и процессов: ключ -> день последнего
+появления. Каждый принятый отчет сравнивается с ней в транзакции приема:
+новые элементы становятся находками (anomaly_findings), затем линия
+пополняется. Стоимость проверки зависит от размера отчета и линии, а не
+от числа предыдущих отчетов.
+
+Затухание: элемент, не встречавшийся DECAY дней, забывается, и его
+возвращение снова считается новым. Пока у хоста меньше
+ANOMALY_MIN_BASELINE_REPORTS отчетов, линия только обучается.
+
+Линия помнит учтенные отчеты (report_ids): повторный прием того же
+отчета не пополняет ее второй раз и не увеличивает reports_seen, а
+находки первой проверки остаются в силе.
+"""
+
+import logging
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+from sqlalchemy import desc, insert, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import get_settings
+from models.report import AnomalyFinding, HostBaseline, ProcessName
+from services.changes import ChangeQueryError, decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+KIND_NEW_PORT = "new_port"
+KIND_NEW_ENDPOINT = "new_endpoint"
+KIND_NEW_PROCESS = "new_process"
+ANOMALY_KINDS = (KIND_NEW_PORT, KIND_NEW_ENDPOINT, KIND_NEW_PROCESS)
+
+# Колонка host_baselines для каждого вида находок
+_BASELINE_COLUMNS = {
+    KIND_NEW_PORT: "ports",
+    KIND_NEW_ENDPOINT: "endpoints",
+    KIND_NEW_PROCESS: "processes",
+}
+
+
+class AnomalyQueryError(ValueError):
+    """Некорректные параметры выборки находок"""
+
+
+def observe_report(
+    connection_values: Sequence[Dict[str, Any]],
+    port_values: Sequence[Dict[str, Any]]
+) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Наблюдаемые элементы отчета: вид -> ключ -> детали
+
+    Порты - открытые порты отчета; конечные точки - адрес и порт
+    исходящих соединений (клиенты входящих соединений меняются постоянно
+    и покрываются новыми портами); процессы - из соединений и портов.
+    """
+    observed: Dict[str, Dict[str, Dict[str, Any]]] = {kind: {} for kind in ANOMALY_KINDS}
+    ports, endpoints, processes = (observed[kind] for kind in ANOMALY_KINDS)
+
+    for row in port_values:
+        key = f"{(row.get('protocol') or 'tcp').lower()}/{row['port_number']}"
+        ports.setdefault(key, {"process_name_id": row.get("process_name_id"), "service_name": row.get("service_name")})
+        if row.get("process_name_id"):
+            processes.setdefault(str(row["process_name_id"]), {"port": key})
+
+    for row in connection_values:
+        if row.get("process_name_id"):
+            processes.setdefault(str(row["process_name_id"]), {})
+        if row.get("connection_type") != "outgoing" or not row.get("remote_ip"):
+            continue
+        protocol = (row.get("protocol") or "unknown").lower()
+        ip = str(row["remote_ip"])
+        host = f"[{ip}]" if ":" in ip else ip
+        key = f"{host}:{row.get('remote_port') or 0}/{protocol}"
+        endpoints.setdefault(key, {"process_name_id": row.get("process_name_id")})
+
+    return observed
+
+
+async def _lock_baseline(db: AsyncSession, hostname: str) -> HostBaseline:
+    """Базовая линия хоста под блокировкой строки до конца транзакции"""
+    await db.execute(
+        pg_insert(HostBaseline)
+        .values(hostname=hostname, ports={}, endpoints={}, processes={}, report_ids={}, reports_seen=0)
+        .on_conflict_do_nothing(index_elements=[HostBaseline.hostname])
+    )
+    return (await db.execute(
+        select(HostBaseline)
+        .where(HostBaseline.hostname == hostname)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    )).scalar_one()
+
+
+def _decayed(known: Dict[str, int], today: int) -> Dict[str, int]:
+    """Забывает элементы старше срока и оставляет не больше ANOMALY_BASELINE_MAX_ENTRIES самых свежих"""
+    horizon = today - settings.ANOMALY_BASELINE_DECAY_DAYS
+    kept = {key: day for key, day in known.items() if day >= horizon}
+    limit = settings.ANOMALY_BASELINE_MAX_ENTRIES
+    if len(kept) > limit:
+        kept = dict(sorted(kept.items(), key=lambda item: item[1], reverse=True)[:limit])
+    return kept
+
+
+def merge_into_baseline(
+    baseline: HostBaseline,
+    report_id: uuid.UUID,
+    generated_at: datetime,
+    observed: Dict[str, Dict[str, Dict[str, Any]]]
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Сравнивает наблюдения отчета с линией и пополняет ее (без обращений к БД)
+
+    Returns:
+        Новые элементы отчета или None, если отчет уже учтен в линии
+    """
+    report_key = str(report_id)
+    if report_key in (baseline.report_ids or {}):
+        return None
+
+    today = generated_at.toordinal()
+    mature = (baseline.reports_seen or 0) >= settings.ANOMALY_MIN_BASELINE_REPORTS
+
+    findings: List[Dict[str, Any]] = []
+    for kind, column in _BASELINE_COLUMNS.items():
+        known = _decayed(dict(getattr(baseline, column) or {}), today)
+        if mature:
+            for key in sorted(observed[kind].keys() - known.keys()):
+                findings.append({"kind": kind, "value": key, "details": observed[kind][key]})
+        for key in observed[kind]:
+            known[key] = max(known.get(key, today), today)
+        setattr(baseline, column, known)
+
+    report_ids = _decayed(dict(baseline.report_ids or {}), today)
+    report_ids[report_key] = today
+    baseline.report_ids = report_ids
+    baseline.reports_seen = (baseline.reports_seen or 0) + 1
+    baseline.updated_at = datetime.utcnow()
+    return findings
+
+
+async def evaluate_report(
+    db: AsyncSession,
+    report_id: uuid.UUID,
+    generated_at: datetime,
+    hostname: str,
+    connection_values: Sequence[Dict[str, Any]],
+    port_values: Sequence[Dict[str, Any]]
+) -> int:
+    """
+    Сравнивает отчет с базовой линией хоста, сохраняет находки и пополняет линию
+
+    Вызывается в транзакции приема отчета. День отчета (а не текущее время)
+    задает свежесть элементов. Отчет, уже учтенный в линии (повторный прием,
+    замена по хешу), пропускается: линия не меняется, прежние находки
+    отчета остаются.
+
+    Returns:
+        Число сохраненных находок
+    """
+    observed = observe_report(connection_values, port_values)
+    baseline = await _lock_baseline(db, hostname)
+    findings = merge_into_baseline(baseline, report_id, generated_at, observed)
+    if findings is None:
+        logger.debug(f"🔁 Отчет {report_id} уже учтен в базовой линии хоста {hostname}")
+        return 0
+
+    if len(findings) > settings.ANOMALY_MAX_FINDINGS_PER_REPORT:
+        logger.warning(
+            f"⚠️ Хост {hostname}: {len(findings)} новых элементов, сохраняются первые "
+            f"{settings.ANOMALY_MAX_FINDINGS_PER_REPORT}"
+        )
+        findings = findings[:settings.ANOMALY_MAX_FINDINGS_PER_REPORT]
+
+    # Имена процессов - только для новых процессов
+    process_ids = {int(f["value"]) for f in findings if f["kind"] == KIND_NEW_PROCESS}
+    names: Dict[int, str] = {}
+    if process_ids:
+        names = dict((await db.execute(
+            select(ProcessName.id, ProcessName.value).where(ProcessName.id.in_(process_ids))
+        )).fetchall())
+
+    detected_at = datetime.utcnow()
+    rows = []
+    for finding in findings:
+        value = finding["value"]
+        if finding["kind"] == KIND_NEW_PROCESS:
+            value = names.get(int(value), value)
+        rows.append({
+            "id": uuid.uuid4(),
+            "report_id": report_id,
+            "report_generated_at": generated_at,
+            "hostname": hostname,
+            "kind": finding["kind"],
+            "value": value[:255],
+            "details": {k: v for k, v in finding["details"].items() if v is not None},
+            "detected_at": detected_at,
+        })
+    if rows:
+        await db.execute(insert(AnomalyFinding), rows)
+        logger.info(f"🚨 Хост {hostname}: {len(rows)} находок относительно базовой линии")
+    return len(rows)
+
+
+def _finding_item(row) -> Dict[str, Any]:
+    return {
+        "id": str(row.id),
+        "report_id": str(row.report_id),
+        "hostname": row.hostname,
+        "kind": row.kind,
+        "value": row.value,
+        "details": row.details,
+        "detected_at": row.detected_at.isoformat(),
+        "report_generated_at": row.report_generated_at.isoformat(),
+    }
+
+
+async def get_findings(
+    db: AsyncSession,
+    hostname: Optional[str] = None,
+    kinds: Optional[Sequence[str]] = None,
+    since: Optional[datetime] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """Находки от новых к старым, страницы по ключу (detected_at, id)"""
+    kinds = [k.strip().lower() for k in kinds or [] if k.strip()]
+    unknown = set(kinds) - set(ANOMALY_KINDS)
+    if unknown:
+        raise AnomalyQueryError(f"Неизвестные виды находок: {', '.join(sorted(unknown))}")
+
+    conditions = []
+    if hostname:
+        conditions.append(AnomalyFinding.hostname == hostname)
+    if kinds:
+        conditions.append(AnomalyFinding.kind.in_(kinds))
+    if since:
+        conditions.append(AnomalyFinding.detected_at >= since)
+    if cursor:
+        try:
+            timestamp, key = decode_cursor(cursor)
+            key = uuid.UUID(key)
+        except (ChangeQueryError, ValueError):
+            raise AnomalyQueryError("Некорректный курсор")
+        conditions.append(tuple_(AnomalyFinding.detected_at, AnomalyFinding.id) < tuple_(timestamp, key))
+
+    rows = (await db.execute(
+        select(AnomalyFinding)
+        .where(*conditions)
+        .order_by(desc(AnomalyFinding.detected_at), desc(AnomalyFinding.id))
+        .limit(limit + 1)
+    )).scalars().all()
+
+    page, has_more = rows[:limit], len(rows) > limit
+    return {
+        "items": [_finding_item(row) for row in page],
+        "next_cursor": encode_cursor(page[-1].detected_at, page[-1].id) if has_more else None,
+    }
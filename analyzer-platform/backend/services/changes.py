@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+История изменений отчетов
+
+Строки change_history записываются при приеме отчета (services/report_ingest.py).
+Здесь - выборки для API: изменения одного отчета и сводная лента хоста.
+Страницы выдаются по ключу (keyset): курсор содержит последний
+(change_timestamp, ключ) страницы, поэтому глубина страницы не влияет на
+стоимость запроса.
+"""
+
+import base64
+import json
+import logging
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+from sqlalchemy import desc, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.report import ChangeHistory, Melt
+
+logger = logging.getLogger(__name__)
+
+# Категории, которые выделяет парсер (AnalyzerHTMLParser._extract_change_history)
+CHANGE_CATEGORIES = ("connections", "ports", "network")
+
+
+class ChangeQueryError(ValueError):
+    """Некорректные параметры выборки изменений"""
+
+
+def encode_cursor(timestamp: datetime, key: Any) -> str:
+    """Курсор следующей страницы"""
+    payload = json.dumps([timestamp.isoformat(), str(key)])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    (change_timestamp, ключ) из курсора
+
+    Raises:
+        ChangeQueryError: Курсор поврежден
+    """
+    try:
+        timestamp, key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(timestamp), key
+    except Exception:
+        raise ChangeQueryError("Некорректный курсор")
+
+
+def _validate_categories(categories: Optional[Sequence[str]]) -> List[str]:
+    """Проверяет фильтр категорий"""
+    categories = [c.strip().lower() for c in categories or [] if c.strip()]
+    unknown = set(categories) - set(CHANGE_CATEGORIES)
+    if unknown:
+        raise ChangeQueryError(f"Неизвестные категории: {', '.join(sorted(unknown))}")
+    return categories
+
+
+def _filters(since: Optional[datetime], until: Optional[datetime], categories: List[str]) -> list:
+    """Условия по времени и категориям"""
+    if since and until and since > until:
+        raise ChangeQueryError("Начало периода позже конца")
+
+    conditions = []
+    if since:
+        conditions.append(ChangeHistory.change_timestamp >= since)
+    if until:
+        conditions.append(ChangeHistory.change_timestamp <= until)
+    if categories:
+        conditions.append(ChangeHistory.changed_categories.overlap(categories))
+    return conditions
+
+
+def _change_item(row) -> Dict[str, Any]:
+    """Изменение в ответе API"""
+    return {
+        "measurement_id": row.measurement_id,
+        "change_timestamp": row.change_timestamp.isoformat(),
+        "is_first_run": bool(row.is_first_run),
+        "changed_categories": list(row.changed_categories or []),
+        "change_details": row.change_details,
+    }
+
+
+async def get_report_changes(
+    db: AsyncSession,
+    melt: Melt,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    categories: Optional[Sequence[str]] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Изменения одного отчета, от новых к старым
+
+    Выборка ограничена секцией отчета и идет по индексу
+    idx_changes_report_timestamp (report_id, change_timestamp).
+    """
+    conditions = [
+        ChangeHistory.report_id == melt.id,
+        ChangeHistory.report_generated_at == melt.generated_at,
+        *_filters(since, until, _validate_categories(categories)),
+    ]
+    if cursor:
+        timestamp, key = decode_cursor(cursor)
+        try:
+            key = uuid.UUID(key)
+        except ValueError:
+            raise ChangeQueryError("Некорректный курсор")
+        conditions.append(tuple_(ChangeHistory.change_timestamp, ChangeHistory.id) < tuple_(timestamp, key))
+
+    rows = (await db.execute(
+        select(
+            ChangeHistory.id,
+            ChangeHistory.measurement_id,
+            ChangeHistory.change_timestamp,
+            ChangeHistory.is_first_run,
+            ChangeHistory.changed_categories,
+            ChangeHistory.change_details,
+        )
+        .where(*conditions)
+        .order_by(desc(ChangeHistory.change_timestamp), desc(ChangeHistory.id))
+        .limit(limit + 1)
+    )).fetchall()
+
+    page, has_more = rows[:limit], len(rows) > limit
+    return {
+        "report_id": str(melt.id),
+        "hostname": melt.hostname,
+        "items": [_change_item(row) for row in page],
+        "next_cursor": encode_cursor(page[-1].change_timestamp, page[-1].id) if has_more else None,
+    }
+
+
+async def get_host_timeline(
+    db: AsyncSession,
+    hostname: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    categories: Optional[Sequence[str]] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Сводная лента изменений хоста по всем его отчетам
+
+    Кумулятивные отчеты повторяют историю предыдущих, поэтому изменение
+    (change_timestamp, measurement_id) выдается один раз - из самого
+    свежего отчета, который его содержит.
+    """
+    measurement_key = func.coalesce(ChangeHistory.measurement_id, -1)
+    conditions = [
+        Melt.hostname == hostname,
+        *_filters(since, until, _validate_categories(categories)),
+    ]
+    if cursor:
+        timestamp, key = decode_cursor(cursor)
+        try:
+            key = int(key)
+        except ValueError:
+            raise ChangeQueryError("Некорректный курсор")
+        conditions.append(tuple_(ChangeHistory.change_timestamp, measurement_key) < tuple_(timestamp, key))
+
+    rows = (await db.execute(
+        select(
+            ChangeHistory.measurement_id,
+            ChangeHistory.change_timestamp,
+            ChangeHistory.is_first_run,
+            ChangeHistory.changed_categories,
+            ChangeHistory.change_details,
+            ChangeHistory.report_id,
+            measurement_key.label("measurement_key"),
+        )
+        .join(Melt, (Melt.id == ChangeHistory.report_id) & (Melt.generated_at == ChangeHistory.report_generated_at))
+        .where(*conditions)
+        .distinct(ChangeHistory.change_timestamp, measurement_key)
+        .order_by(desc(ChangeHistory.change_timestamp), desc(measurement_key), desc(ChangeHistory.report_generated_at))
+        .limit(limit + 1)
+    )).fetchall()
+
+    page, has_more = rows[:limit], len(rows) > limit
+    return {
+        "hostname": hostname,
+        "items": [{**_change_item(row), "report_id": str(row.report_id)} for row in page],
+        "next_cursor": encode_cursor(page[-1].change_timestamp, page[-1].measurement_key) if has_more else None,
+    }
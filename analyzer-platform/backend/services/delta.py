@@ -0,0 +1,596 @@
+#!/usr/bin/env python3
+"""
+Дельта между двумя отчетами одного хоста
+
+Каждый отчет сводится к канонической форме: для соединений, портов,
+процессов и интерфейсов - словарь "ключ идентичности -> значимые атрибуты",
+где ключ и атрибуты - кортежи целых ключей справочников, IP и портов.
+Добавленные, удаленные и измененные элементы получаются операциями над
+множествами ключей (dict views), без построчного сравнения.
+
+Каноническая форма строится один раз на отчет узкой выборкой без ORM и
+держится в LRU кэше воркера; готовые дельты кэшируются в Redis по паре
+хешей отчетов (с версией updated_at - замена отчета меняет ключ).
+
+Дельта относительно предыдущего отчета хоста вычисляется заранее:
+прием отчета ставит его в delta_queue, фоновый воркер (delta_loop)
+сохраняет результат в host_deltas и обновляет указатель host_latest_deltas.
+"""
+
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import delete, desc, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core import database
+from core.config import get_settings
+from core.redis_client import cache_delta, get_cached_delta
+from models.report import (
+    DeltaQueue, HostDelta, HostLatestDelta, Melt, NetworkConnection, NetworkInterface, NetworkPort,
+    PortDescription, ProcessName, RemoteHostname
+)
+from services.changes import ChangeQueryError, decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+DELTA_SECTIONS = ("connections", "ports", "processes", "interfaces")
+
+
+class DeltaError(ValueError):
+    """Отчеты нельзя сравнить"""
+
+
+class MeltFingerprint:
+    """
+    Каноническая форма отчета для сравнения
+
+    connections: (протокол, направление, процесс, local_ip, local_port, remote_ip, remote_port)
+        -> (удаленное имя хоста, статус). Эфемерный порт стороны-инициатора
+        в ключ не входит: исходящее соединение остается тем же при смене
+        локального порта.
+    ports: (протокол, порт) -> (процесс, сервис, статус, описание)
+    processes: процесс -> кортеж прослушиваемых портов
+    interfaces: имя -> (mtu, статус, MAC, адреса)
+    """
+
+    __slots__ = ("connections", "ports", "processes", "interfaces")
+
+    def __init__(self):
+        self.connections: Dict[tuple, tuple] = {}
+        self.ports: Dict[tuple, tuple] = {}
+        self.processes: Dict[int, tuple] = {}
+        self.interfaces: Dict[str, tuple] = {}
+
+
+def _connection_key(row) -> tuple:
+    """Ключ соединения без эфемерного порта"""
+    direction = row.connection_type or "unknown"
+    local_port = None if direction == "outgoing" else row.local_port
+    remote_port = None if direction == "incoming" else row.remote_port
+    return (
+        (row.protocol or "").lower(),
+        direction,
+        row.process_name_id,
+        str(row.local_ip) if row.local_ip is not None else None,
+        local_port,
+        str(row.remote_ip) if row.remote_ip is not None else None,
+        remote_port,
+    )
+
+
+async def build_fingerprint(db: AsyncSession, melt: Melt) -> MeltFingerprint:
+    """Каноническая форма отчета (по одной узкой выборке на таблицу)"""
+    fingerprint = MeltFingerprint()
+    partition = (melt.id, melt.generated_at)
+
+    connections = await db.execute(
+        select(
+            NetworkConnection.protocol,
+            NetworkConnection.connection_type,
+            NetworkConnection.process_name_id,
+            NetworkConnection.local_ip,
+            NetworkConnection.local_port,
+            NetworkConnection.remote_ip,
+            NetworkConnection.remote_port,
+            NetworkConnection.remote_hostname_id,
+            NetworkConnection.connection_status,
+        ).where(NetworkConnection.report_id == partition[0], NetworkConnection.report_generated_at == partition[1])
+    )
+    fingerprint.connections = {
+        _connection_key(row): (row.remote_hostname_id, row.connection_status)
+        for row in connections
+    }
+
+    ports = await db.execute(
+        select(
+            NetworkPort.protocol,
+            NetworkPort.port_number,
+            NetworkPort.process_name_id,
+            NetworkPort.service_name,
+            NetworkPort.status,
+            NetworkPort.description_id,
+        ).where(NetworkPort.report_id == partition[0], NetworkPort.report_generated_at == partition[1])
+    )
+    listening: Dict[int, set] = defaultdict(set)
+    for row in ports:
+        protocol = (row.protocol or "").lower()
+        fingerprint.ports[(protocol, row.port_number)] = (
+            row.process_name_id, row.service_name or None, row.status, row.description_id
+        )
+        if row.process_name_id:
+            listening[row.process_name_id].add((protocol, row.port_number))
+
+    # Процессы - из соединений и портов, атрибут - прослушиваемые порты
+    process_ids = {key[2] for key in fingerprint.connections if key[2]} | set(listening)
+    fingerprint.processes = {pid: tuple(sorted(listening.get(pid, ()))) for pid in process_ids}
+
+    interfaces = await db.execute(
+        select(
+            NetworkInterface.interface_name,
+            NetworkInterface.mtu,
+            NetworkInterface.status,
+            NetworkInterface.mac_address,
+            NetworkInterface.ip_addresses,
+        ).where(NetworkInterface.report_id == partition[0], NetworkInterface.report_generated_at == partition[1])
+    )
+    fingerprint.interfaces = {
+        row.interface_name: (row.mtu, row.status, row.mac_address, tuple(sorted(row.ip_addresses or ())))
+        for row in interfaces
+    }
+
+    return fingerprint
+
+
+class FingerprintCache:
+    """LRU кэш канонических форм в воркере (ключ - хеш и версия отчета)"""
+
+    def __init__(self, max_entries: Optional[int] = None):
+        self.max_entries = max_entries or settings.DELTA_FINGERPRINT_CACHE_SIZE
+        self._entries: "OrderedDict[str, MeltFingerprint]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, db: AsyncSession, melt: Melt) -> MeltFingerprint:
+        key = melt_version_key(melt)
+        fingerprint = self._entries.get(key)
+        if fingerprint is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return fingerprint
+
+        self.misses += 1
+        fingerprint = await build_fingerprint(db, melt)
+        self._entries[key] = fingerprint
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return fingerprint
+
+
+fingerprint_cache = FingerprintCache()
+
+
+def melt_version_key(melt: Melt) -> str:
+    """
+    Хеш отчета с версией: замена отчета с тем же хешем дает новый ключ
+
+    Версия - updated_at с микросекундами: две замены в одну секунду
+    различаются.
+    """
+    version = melt.updated_at.isoformat() if melt.updated_at else "0"
+    return f"{melt.report_hash}@{version}"
+
+
+def _diff(before: Dict[Any, tuple], after: Dict[Any, tuple]) -> Tuple[list, list, list]:
+    """Добавленные, удаленные и измененные ключи (операции над множествами)"""
+    added = after.keys() - before.keys()
+    removed = before.keys() - after.keys()
+    changed = [key for key in after.keys() & before.keys() if after[key] != before[key]]
+    return list(added), list(removed), changed
+
+
+def _limited(keys: Iterable, limit: int) -> Tuple[list, bool]:
+    """Детерминированно упорядоченные первые limit ключей"""
+    ordered = sorted(keys, key=repr)
+    return ordered[:limit], len(ordered) > limit
+
+
+async def _dimension_values(db: AsyncSession, model, ids: set) -> Dict[int, str]:
+    """Значения справочника для ключей, попавших в ответ"""
+    ids = {i for i in ids if i}
+    if not ids:
+        return {}
+    return dict((await db.execute(select(model.id, model.value).where(model.id.in_(ids)))).fetchall())
+
+
+async def compute_delta(db: AsyncSession, melt: Melt, against: Melt, limit: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Изменения отчета melt относительно более раннего (или любого) отчета against
+
+    Raises:
+        DeltaError: Отчеты разных хостов или одинаковые
+    """
+    if melt.hostname != against.hostname:
+        raise DeltaError("Сравниваются только отчеты одного хоста")
+    if melt.id == against.id:
+        raise DeltaError("Отчет сравнивается сам с собой")
+
+    limit = limit or settings.DELTA_MAX_ITEMS
+    cache_key = f"{melt_version_key(against)}:{melt_version_key(melt)}:{limit}"
+    cached = await get_cached_delta(cache_key)
+    if cached is not None:
+        return cached
+
+    before = await fingerprint_cache.get(db, against)
+    after = await fingerprint_cache.get(db, melt)
+
+    raw: Dict[str, Dict[str, Any]] = {}
+    summary: Dict[str, Dict[str, int]] = {}
+    truncated = False
+    for section in DELTA_SECTIONS:
+        added, removed, changed = _diff(getattr(before, section), getattr(after, section))
+        summary[section] = {"added": len(added), "removed": len(removed), "changed": len(changed)}
+        raw[section] = {}
+        for name, keys in (("added", added), ("removed", removed), ("changed", changed)):
+            raw[section][name], cut = _limited(keys, limit)
+            truncated = truncated or cut
+
+    # Значения справочников - одним запросом на справочник для всего ответа
+    process_ids, hostname_ids, description_ids = set(), set(), set()
+    for section in ("connections", "ports", "processes"):
+        for name in ("added", "removed", "changed"):
+            for key in raw[section][name]:
+                for fp in (before, after):
+                    value = getattr(fp, section).get(key)
+                    if section == "connections":
+                        process_ids.add(key[2])
+                        if value:
+                            hostname_ids.add(value[0])
+                    elif section == "ports":
+                        if value:
+                            process_ids.add(value[0])
+                            description_ids.add(value[3])
+                    else:
+                        process_ids.add(key)
+
+    processes = await _dimension_values(db, ProcessName, process_ids)
+    hostnames = await _dimension_values(db, RemoteHostname, hostname_ids)
+    descriptions = await _dimension_values(db, PortDescription, description_ids)
+
+    def connection_item(key: tuple, value: Optional[tuple]) -> Dict[str, Any]:
+        return {
+            "protocol": key[0],
+            "connection_type": key[1],
+            "process_name": processes.get(key[2]),
+            "local_ip": key[3],
+            "local_port": key[4],
+            "remote_ip": key[5],
+            "remote_port": key[6],
+            "remote_hostname": hostnames.get(value[0]) if value else None,
+            "status": value[1] if value else None,
+        }
+
+    def port_item(key: tuple, value: Optional[tuple]) -> Dict[str, Any]:
+        return {
+            "protocol": key[0],
+            "port_number": key[1],
+            "process_name": processes.get(value[0]) if value else None,
+            "service_name": value[1] if value else None,
+            "status": value[2] if value else None,
+            "description": descriptions.get(value[3]) if value else None,
+        }
+
+    def process_item(key: int, value: Optional[tuple]) -> Dict[str, Any]:
+        return {
+            "process_name": processes.get(key),
+            "listening_ports": [f"{protocol}/{port}" for protocol, port in value or ()],
+        }
+
+    def interface_item(key: str, value: Optional[tuple]) -> Dict[str, Any]:
+        return {
+            "interface_name": key,
+            "mtu": value[0] if value else None,
+            "status": value[1] if value else None,
+            "mac_address": value[2] if value else None,
+            "ip_addresses": list(value[3]) if value else [],
+        }
+
+    renderers = {
+        "connections": connection_item,
+        "ports": port_item,
+        "processes": process_item,
+        "interfaces": interface_item,
+    }
+
+    result: Dict[str, Any] = {
+        "report_id": str(melt.id),
+        "against": str(against.id),
+        "hostname": melt.hostname,
+        "generated_at": melt.generated_at.isoformat(),
+        "against_generated_at": against.generated_at.isoformat(),
+        "summary": summary,
+        "truncated": truncated,
+        "limit": limit,
+    }
+    for section, render in renderers.items():
+        old, new = getattr(before, section), getattr(after, section)
+        result[section] = {
+            "added": [render(key, new[key]) for key in raw[section]["added"]],
+            "removed": [render(key, old[key]) for key in raw[section]["removed"]],
+            "changed": [
+                {"before": render(key, old[key]), "after": render(key, new[key])}
+                for key in raw[section]["changed"]
+            ],
+        }
+
+    await cache_delta(cache_key, result)
+    return result
+
+
+async def get_previous_melt(db: AsyncSession, melt: Melt) -> Optional[Melt]:
+    """Предыдущий отчет того же хоста (база сравнения по умолчанию)"""
+    result = await db.execute(
+        select(Melt)
+        .where(Melt.hostname == melt.hostname, Melt.generated_at < melt.generated_at)
+        .order_by(Melt.generated_at.desc())
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
+
+def get_fingerprint_cache_stats() -> Dict[str, int]:
+    """Статистика кэша канонических форм"""
+    return {
+        "entries": len(fingerprint_cache._entries),
+        "hits": fingerprint_cache.hits,
+        "misses": fingerprint_cache.misses,
+    }
+
+
+# Предвычисленные дельты
+
+_queue_wakeup = asyncio.Event()
+
+
+def notify_delta_worker() -> None:
+    """Будит воркер дельт этого процесса (после коммита приема отчета)"""
+    _queue_wakeup.set()
+
+
+async def store_host_delta(db: AsyncSession, melt: Melt) -> Optional[Dict[str, Any]]:
+    """Вычисляет дельту отчета относительно предыдущего отчета хоста и сохраняет ее"""
+    previous = await get_previous_melt(db, melt)
+    delta = await compute_delta(db, melt, previous) if previous is not None else None
+    summary = delta["summary"] if delta else None
+    total_changes = sum(sum(counts.values()) for counts in summary.values()) if summary else 0
+    now = datetime.utcnow()
+
+    row = {
+        "report_id": melt.id,
+        "report_generated_at": melt.generated_at,
+        "hostname": melt.hostname,
+        "against_report_id": previous.id if previous else None,
+        "against_generated_at": previous.generated_at if previous else None,
+        "total_changes": total_changes,
+        "summary": summary,
+        "delta": delta,
+        "computed_at": now,
+    }
+    delta_insert = pg_insert(HostDelta).values(**row)
+    await db.execute(delta_insert.on_conflict_do_update(
+        index_elements=[HostDelta.report_id, HostDelta.report_generated_at],
+        set_={key: delta_insert.excluded[key] for key in row if key not in ("report_id", "report_generated_at")}
+    ))
+
+    # Указатель двигается только вперед: поздно обработанный старый отчет его не перетирает
+    pointer = {
+        "hostname": melt.hostname,
+        "report_id": melt.id,
+        "report_generated_at": melt.generated_at,
+        "against_report_id": row["against_report_id"],
+        "total_changes": total_changes,
+        "summary": summary,
+        "updated_at": now,
+    }
+    pointer_insert = pg_insert(HostLatestDelta).values(**pointer)
+    await db.execute(pointer_insert.on_conflict_do_update(
+        index_elements=[HostLatestDelta.hostname],
+        set_={key: pointer_insert.excluded[key] for key in pointer if key != "hostname"},
+        where=HostLatestDelta.report_generated_at <= pointer_insert.excluded.report_generated_at
+    ))
+    return delta
+
+
+async def process_delta_queue(batch_size: int = 50) -> int:
+    """
+    Вычисляет дельты из очереди, по одной транзакции на отчет
+
+    Записи захватываются FOR UPDATE SKIP LOCKED, поэтому несколько воркеров
+    разбирают очередь параллельно. Ошибка увеличивает attempts; записи,
+    исчерпавшие DELTA_MAX_ATTEMPTS, остаются в очереди для разбора.
+    """
+    processed = 0
+    for _ in range(batch_size):
+        async with database.async_session_factory() as session:
+            item = (await session.execute(
+                select(DeltaQueue)
+                .where(DeltaQueue.attempts < settings.DELTA_MAX_ATTEMPTS)
+                .order_by(DeltaQueue.enqueued_at)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )).scalar_one_or_none()
+            if item is None:
+                break
+
+            report_id = item.report_id
+            try:
+                melt = (await session.execute(
+                    select(Melt).where(Melt.id == report_id, Melt.generated_at == item.report_generated_at)
+                )).scalar_one_or_none()
+                if melt is not None:
+                    await store_host_delta(session, melt)
+                await session.execute(delete(DeltaQueue).where(DeltaQueue.report_id == report_id))
+                await session.commit()
+                processed += 1
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"❌ Ошибка вычисления дельты отчета {report_id}: {e}")
+                await session.execute(
+                    update(DeltaQueue)
+                    .where(DeltaQueue.report_id == report_id)
+                    .values(attempts=DeltaQueue.attempts + 1, last_error=str(e)[:1000])
+                )
+                await session.commit()
+    return processed
+
+
+async def delta_loop() -> None:
+    """Фоновое вычисление дельт после приема отчетов"""
+    while True:
+        try:
+            processed = await process_delta_queue()
+            if processed:
+                logger.info(f"🔀 Вычислено дельт отчетов: {processed}")
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка фонового вычисления дельт: {e}")
+
+        try:
+            await asyncio.wait_for(_queue_wakeup.wait(), timeout=settings.DELTA_POLL_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _queue_wakeup.clear()
+
+
+async def forget_deleted_reports(db: AsyncSession, report_ids: Iterable[Any]) -> int:
+    """
+    Убирает из очереди и указателей дельт удаленные отчеты (в транзакции вызывающего)
+
+    Внешних ключей у delta_queue и host_latest_deltas нет. Указатель,
+    смотревший на удаленный отчет, переводится на самую свежую оставшуюся
+    дельту хоста (host_deltas удаляются вместе с отчетами) или удаляется,
+    если дельт у хоста не осталось.
+
+    Returns:
+        Число пересчитанных или удаленных указателей
+    """
+    report_ids = [uuid.UUID(str(report_id)) for report_id in report_ids]
+    if not report_ids:
+        return 0
+
+    await db.execute(delete(DeltaQueue).where(DeltaQueue.report_id.in_(report_ids)))
+    hostnames = (await db.execute(
+        delete(HostLatestDelta)
+        .where(HostLatestDelta.report_id.in_(report_ids))
+        .returning(HostLatestDelta.hostname)
+    )).scalars().all()
+    if not hostnames:
+        return 0
+
+    latest = (
+        select(
+            HostDelta.hostname,
+            HostDelta.report_id,
+            HostDelta.report_generated_at,
+            HostDelta.against_report_id,
+            HostDelta.total_changes,
+            HostDelta.summary,
+            HostDelta.computed_at,
+        )
+        .where(HostDelta.hostname.in_(hostnames))
+        .distinct(HostDelta.hostname)
+        .order_by(HostDelta.hostname, desc(HostDelta.report_generated_at))
+    )
+    await db.execute(
+        pg_insert(HostLatestDelta)
+        .from_select(
+            ["hostname", "report_id", "report_generated_at", "against_report_id", "total_changes", "summary", "updated_at"],
+            latest
+        )
+        .on_conflict_do_nothing(index_elements=[HostLatestDelta.hostname])
+    )
+    return len(hostnames)
+
+
+async def get_stored_delta(db: AsyncSession, melt: Melt) -> Optional[Dict[str, Any]]:
+    """Предвычисленная дельта отчета относительно предыдущего отчета хоста"""
+    return (await db.execute(
+        select(HostDelta.delta)
+        .where(HostDelta.report_id == melt.id, HostDelta.report_generated_at == melt.generated_at)
+    )).scalar_one_or_none()
+
+
+async def get_host_latest_delta(db: AsyncSession, hostname: str) -> Optional[Dict[str, Any]]:
+    """Дельта самого свежего отчета хоста (по указателю)"""
+    row = (await db.execute(
+        select(HostLatestDelta.report_id, HostLatestDelta.report_generated_at, HostDelta.delta)
+        .join(HostDelta, tuple_(HostDelta.report_id, HostDelta.report_generated_at)
+              == tuple_(HostLatestDelta.report_id, HostLatestDelta.report_generated_at))
+        .where(HostLatestDelta.hostname == hostname)
+    )).one_or_none()
+    if row is None:
+        return None
+    return {
+        "hostname": hostname,
+        "report_id": str(row.report_id),
+        "generated_at": row.report_generated_at.isoformat(),
+        "first_report": row.delta is None,
+        "delta": row.delta,
+    }
+
+
+async def get_recent_changes(db: AsyncSession, limit: int = 50, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Хосты парка, последний отчет которых что-то изменил, от свежих к старым
+
+    Одна строка на хост из host_latest_deltas, страницы по ключу
+    (report_generated_at, hostname) через частичный индекс.
+    """
+    conditions = [HostLatestDelta.total_changes > 0]
+    if cursor:
+        try:
+            timestamp, hostname = decode_cursor(cursor)
+        except ChangeQueryError as e:
+            raise DeltaError(str(e))
+        conditions.append(
+            tuple_(HostLatestDelta.report_generated_at, HostLatestDelta.hostname) < tuple_(timestamp, hostname)
+        )
+
+    rows = (await db.execute(
+        select(
+            HostLatestDelta.hostname,
+            HostLatestDelta.report_id,
+            HostLatestDelta.report_generated_at,
+            HostLatestDelta.against_report_id,
+            HostLatestDelta.total_changes,
+            HostLatestDelta.summary,
+        )
+        .where(*conditions)
+        .order_by(desc(HostLatestDelta.report_generated_at), desc(HostLatestDelta.hostname))
+        .limit(limit + 1)
+    )).fetchall()
+
+    page, has_more = rows[:limit], len(rows) > limit
+    return {
+        "items": [
+            {
+                "hostname": row.hostname,
+                "report_id": str(row.report_id),
+                "against": str(row.against_report_id) if row.against_report_id else None,
+                "generated_at": row.report_generated_at.isoformat(),
+                "total_changes": row.total_changes,
+                "summary": row.summary,
+            }
+            for row in page
+        ],
+        "next_cursor": encode_cursor(page[-1].report_generated_at, page[-1].hostname) if has_more else None,
+    }
+
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Разбор сетевых адресов соединений на IP и порт
+
+Отчеты содержат адреса в формате netstat/ss/lsof: "10.0.0.5:443",
+"[2001:db8::1]:22", "*:53", "::1.631", "fe80::1%eth0:546". Разбор через
+rsplit(':') ломает IPv6, поэтому адрес проверяется модулем ipaddress.
+Результат хранится в колонках inet/integer и индексируется (миграция 0004).
+"""
+
+import ipaddress
+from typing import Optional, Tuple, Union
+
+IPAddress = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+# Адреса "любой" (wildcard) без конкретного IP
+_WILDCARD_HOSTS = {"", "*", "0.0.0.0", "::", "[::]"}
+
+# Локальные сети: частные, loopback, link-local (тот же список в миграции 0007)
+LOCAL_NETWORKS = tuple(ipaddress.ip_network(net) for net in (
+    "10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16", "127.0.0.0/8", "169.254.0.0/16",
+    "::1/128", "fc00::/7", "fe80::/10",
+))
+
+
+def _parse_port(value: str) -> Optional[int]:
+    """Номер порта 0-65535 или None ("*", имя сервиса и т.п.)"""
+    if not value.isdigit():
+        return None
+    port = int(value)
+    return port if port <= 65535 else None
+
+
+def parse_ip(value: Optional[str]) -> Optional[IPAddress]:
+    """
+    IP адрес без порта
+
+    Зона IPv6 (%eth0) отбрасывается - тип inet в PostgreSQL ее не хранит.
+    IPv4-mapped адреса (::ffff:10.0.0.1) приводятся к IPv4, чтобы попадать
+    в IPv4 CIDR фильтры.
+    """
+    if not value:
+        return None
+    host = value.strip().strip("[]").split("%", 1)[0]
+    if host in _WILDCARD_HOSTS:
+        return None
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        return None
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+        return ip.ipv4_mapped
+    return ip
+
+
+def _is_host(value: str) -> bool:
+    """Часть адреса до порта: IP или wildcard"""
+    host = value.strip("[]")
+    return host in _WILDCARD_HOSTS or parse_ip(host) is not None
+
+
+def parse_endpoint(address: Optional[str]) -> Tuple[Optional[IPAddress], Optional[int]]:
+    """
+    Делит адрес соединения на IP и порт
+
+    Адреса соединений в отчетах всегда содержат порт, поэтому для IPv6 без
+    скобок ("::1:631") последний сегмент считается портом, если остаток -
+    корректный адрес. Адрес без порта разбирается целиком.
+
+    Returns:
+        (ip, port); отсутствующая или нераспознанная часть - None
+    """
+    if not address:
+        return None, None
+    address = address.strip()
+
+    # [IPv6]:port
+    if address.startswith("["):
+        host, _, rest = address[1:].partition("]")
+        return parse_ip(host), _parse_port(rest.lstrip(":."))
+
+    # host:port, для IPv6 в стиле BSD netstat - host.port
+    for separator in (":", "."):
+        host, sep, port = address.rpartition(separator)
+        if not sep or (separator == "." and ":" not in host):
+            continue
+        if (port == "*" or _parse_port(port) is not None) and _is_host(host):
+            return parse_ip(host), _parse_port(port)
+
+    return parse_ip(address), None
+
+
+def split_endpoint(address: Optional[str]) -> Tuple[Optional[str], Optional[int]]:
+    """parse_endpoint со строковым IP (для JSON данных отчета)"""
+    ip, port = parse_endpoint(address)
+    return (str(ip) if ip is not None else None), port
+
+
+def is_local_ip(ip: Optional[IPAddress]) -> bool:
+    """Адрес из локальных сетей (LOCAL_NETWORKS)"""
+    return ip is not None and any(ip in network for network in LOCAL_NETWORKS if network.version == ip.version)
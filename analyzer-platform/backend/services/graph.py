@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Граф связей парка: хост -> удаленная конечная точка
+
+fleet_edges агрегирует соединения всех отчетов по ребру (хост, удаленный
+IP, порт сервиса, протокол, направление): первое и последнее появление,
+число отчетов с ребром, число соединений и сумма пакетов. Ребра
+обновляются пачками при приеме отчета, поэтому графовые запросы читают
+агрегаты, а не network_connections.
+
+Порт ребра - порт сервиса: удаленный для исходящих соединений, локальный
+для входящих (эфемерный порт клиента не порождает новых ребер).
+"""
+
+import base64
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import cast, delete, func, or_, select, text, tuple_
+from sqlalchemy.dialects.postgresql import INET, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import get_settings
+from models.report import FleetEdge, ProcessName
+from services.endpoints import parse_ip
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+NODE_HOST = "host"
+NODE_IP = "ip"
+
+_EDGE_KEY = ("direction", "remote_ip", "port", "protocol")
+
+
+class GraphQueryError(ValueError):
+    """Некорректные параметры запроса к графу"""
+
+
+def _edge_key(row: Dict[str, Any]) -> Optional[tuple]:
+    """Ключ ребра для строки соединения (None - соединение без удаленного IP)"""
+    if not row.get("remote_ip"):
+        return None
+    incoming = row.get("connection_type") == "incoming"
+    port = row.get("local_port") if incoming else row.get("remote_port")
+    return (
+        "incoming" if incoming else "outgoing",
+        row["remote_ip"],
+        port or 0,
+        (row.get("protocol") or "unknown").lower(),
+    )
+
+
+def aggregate_edges(connection_values: Sequence[Dict[str, Any]]) -> Dict[tuple, Dict[str, Any]]:
+    """Вклад одного отчета в ребра графа (за один проход по соединениям)"""
+    edges: Dict[tuple, Dict[str, Any]] = {}
+    for row in connection_values:
+        key = _edge_key(row)
+        if key is None:
+            continue
+        edge = edges.get(key)
+        if edge is None:
+            edge = edges[key] = {
+                "connections": 0, "packets": 0, "first_seen": None, "last_seen": None,
+                "process_name_id": row.get("process_name_id"),
+            }
+        edge["connections"] += 1
+        edge["packets"] += row.get("packet_count") or 0
+        first_seen = row.get("first_seen") or row.get("last_seen")
+        last_seen = row.get("last_seen") or row.get("first_seen")
+        if first_seen and (edge["first_seen"] is None or first_seen < edge["first_seen"]):
+            edge["first_seen"] = first_seen
+        if last_seen and (edge["last_seen"] is None or last_seen > edge["last_seen"]):
+            edge["last_seen"] = last_seen
+    return edges
+
+
+async def apply_report_edges(
+    db: AsyncSession,
+    hostname: str,
+    generated_at: datetime,
+    connection_values: Sequence[Dict[str, Any]]
+) -> int:
+    """Добавляет вклад отчета в fleet_edges пачками INSERT ... ON CONFLICT"""
+    edges = aggregate_edges(connection_values)
+    rows = [
+        {
+            "hostname": hostname,
+            **dict(zip(_EDGE_KEY, key)),
+            "process_name_id": edge["process_name_id"],
+            "first_seen": edge["first_seen"] or generated_at,
+            "last_seen": edge["last_seen"] or generated_at,
+            "last_report_at": generated_at,
+            "report_count": 1,
+            "connection_count": edge["connections"],
+            "packet_total": edge["packets"],
+        }
+        for key, edge in edges.items()
+    ]
+
+    chunk_size = settings.INGEST_INSERT_CHUNK
+    for start in range(0, len(rows), chunk_size):
+        edge_insert = pg_insert(FleetEdge).values(rows[start:start + chunk_size])
+        excluded = edge_insert.excluded
+        await db.execute(edge_insert.on_conflict_do_update(
+            index_elements=[FleetEdge.hostname, FleetEdge.remote_ip, FleetEdge.port, FleetEdge.protocol, FleetEdge.direction],
+            set_={
+                "report_count": FleetEdge.report_count + 1,
+                "connection_count": FleetEdge.connection_count + excluded.connection_count,
+                "packet_total": FleetEdge.packet_total + excluded.packet_total,
+                "first_seen": func.least(FleetEdge.first_seen, excluded.first_seen),
+                "last_seen": func.greatest(FleetEdge.last_seen, excluded.last_seen),
+                "last_report_at": func.greatest(FleetEdge.last_report_at, excluded.last_report_at),
+                "process_name_id": func.coalesce(excluded.process_name_id, FleetEdge.process_name_id),
+            }
+        ))
+    return len(rows)
+
+
+async def retract_report_edges(db: AsyncSession, hostname: str, report_id, generated_at: datetime) -> None:
+    """
+    Вычитает вклад сохраненного отчета (перед его заменой)
+
+    Счетчики уменьшаются по его строкам network_connections, ребра без
+    отчетов удаляются. Границы first_seen/last_seen не сужаются.
+    """
+    await db.execute(text("""
+        UPDATE fleet_edges e
+        SET report_count = e.report_count - 1,
+            connection_count = e.connection_count - s.connections,
+            packet_total = e.packet_total - s.packets
+        FROM (
+            SELECT
+                CASE WHEN c.connection_type = 'incoming' THEN 'incoming' ELSE 'outgoing' END AS direction,
+                c.remote_ip,
+                COALESCE(CASE WHEN c.connection_type = 'incoming' THEN c.local_port ELSE c.remote_port END, 0) AS port,
+                lower(COALESCE(c.protocol, 'unknown')) AS protocol,
+                count(*) AS connections,
+                COALESCE(sum(c.packet_count), 0) AS packets
+            FROM network_connections c
+            WHERE c.report_id = :report_id
+              AND c.report_generated_at = :generated_at
+              AND c.remote_ip IS NOT NULL
+            GROUP BY 1, 2, 3, 4
+        ) s
+        WHERE e.hostname = :hostname
+          AND e.remote_ip = s.remote_ip
+          AND e.port = s.port
+          AND e.protocol = s.protocol
+          AND e.direction = s.direction
+    """), {"report_id": report_id, "generated_at": generated_at, "hostname": hostname})
+    await db.execute(delete(FleetEdge).where(FleetEdge.hostname == hostname, FleetEdge.report_count <= 0))
+
+
+# Выборки
+
+def encode_edge_cursor(values: Sequence[Any]) -> str:
+    """Курсор страницы ребер"""
+    payload = json.dumps([str(v) if not isinstance(v, int) else v for v in values])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_edge_cursor(cursor: str, size: int) -> list:
+    """
+    Значения ключа из курсора
+
+    Raises:
+        GraphQueryError: Курсор поврежден
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise GraphQueryError("Некорректный курсор")
+    if not isinstance(values, list) or len(values) != size:
+        raise GraphQueryError("Некорректный курсор")
+    return values
+
+
+def parse_node(node: str) -> Tuple[str, str]:
+    """
+    Узел графа из "host:<имя>" или "ip:<адрес>"
+
+    Raises:
+        GraphQueryError: Некорректный узел
+    """
+    kind, _, value = node.partition(":")
+    kind, value = kind.strip().lower(), value.strip()
+    if kind == NODE_HOST and value:
+        return NODE_HOST, value
+    if kind == NODE_IP:
+        ip = parse_ip(value)
+        if ip is None:
+            raise GraphQueryError(f"Некорректный IP адрес: {value}")
+        return NODE_IP, str(ip)
+    raise GraphQueryError("Узел задается как host:<имя> или ip:<адрес>")
+
+
+_EDGE_COLUMNS = (
+    FleetEdge.hostname,
+    FleetEdge.remote_ip,
+    FleetEdge.port,
+    FleetEdge.protocol,
+    FleetEdge.direction,
+    FleetEdge.first_seen,
+    FleetEdge.last_seen,
+    FleetEdge.report_count,
+    FleetEdge.connection_count,
+    FleetEdge.packet_total,
+    ProcessName.value.label("process_name"),
+)
+
+
+def _edge_item(row) -> Dict[str, Any]:
+    return {
+        "hostname": row.hostname,
+        "remote_ip": str(row.remote_ip),
+        "port": row.port,
+        "protocol": row.protocol,
+        "direction": row.direction,
+        "process_name": row.process_name,
+        "first_seen": row.first_seen.isoformat() if row.first_seen else None,
+        "last_seen": row.last_seen.isoformat() if row.last_seen else None,
+        "report_count": row.report_count,
+        "connection_count": row.connection_count,
+        "packet_total": row.packet_total,
+    }
+
+
+def _edge_select(since: Optional[datetime]):
+    query = select(*_EDGE_COLUMNS).outerjoin(ProcessName, ProcessName.id == FleetEdge.process_name_id)
+    if since:
+        query = query.where(FleetEdge.last_seen >= since)
+    return query
+
+
+async def get_host_edges(
+    db: AsyncSession,
+    hostname: str,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """Список смежности хоста: его удаленные конечные точки, по ключу ребра"""
+    order = (FleetEdge.remote_ip, FleetEdge.port, FleetEdge.protocol, FleetEdge.direction)
+    query = _edge_select(since).where(FleetEdge.hostname == hostname)
+    if cursor:
+        remote_ip, port, protocol, direction = decode_edge_cursor(cursor, 4)
+        query = query.where(tuple_(*order) > tuple_(cast(remote_ip, INET), port, protocol, direction))
+
+    rows = (await db.execute(query.order_by(*order).limit(limit + 1))).fetchall()
+    page, has_more = rows[:limit], len(rows) > limit
+    last = page[-1] if page else None
+    return {
+        "node": f"{NODE_HOST}:{hostname}",
+        "items": [_edge_item(row) for row in page],
+        "next_cursor": encode_edge_cursor(
+            [str(last.remote_ip), last.port, last.protocol, last.direction]
+        ) if has_more else None,
+    }
+
+
+async def get_endpoint_edges(
+    db: AsyncSession,
+    ip: str,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """Список смежности удаленного IP: хосты парка, связанные с ним"""
+    address = parse_ip(ip)
+    if address is None:
+        raise GraphQueryError(f"Некорректный IP адрес: {ip}")
+
+    order = (FleetEdge.hostname, FleetEdge.port, FleetEdge.protocol, FleetEdge.direction)
+    query = _edge_select(since).where(FleetEdge.remote_ip == cast(str(address), INET))
+    if cursor:
+        hostname, port, protocol, direction = decode_edge_cursor(cursor, 4)
+        query = query.where(tuple_(*order) > tuple_(hostname, port, protocol, direction))
+
+    rows = (await db.execute(query.order_by(*order).limit(limit + 1))).fetchall()
+    page, has_more = rows[:limit], len(rows) > limit
+    last = page[-1] if page else None
+    return {
+        "node": f"{NODE_IP}:{address}",
+        "items": [_edge_item(row) for row in page],
+        "next_cursor": encode_edge_cursor(
+            [last.hostname, last.port, last.protocol, last.direction]
+        ) if has_more else None,
+    }
+
+
+async def get_subgraph(
+    db: AsyncSession,
+    node: str,
+    depth: int = 1,
+    max_nodes: int = 200,
+    since: Optional[datetime] = None,
+    min_reports: int = 1
+) -> Dict[str, Any]:
+    """
+    Подграф вокруг узла: обход в ширину по агрегированным ребрам
+
+    Граф двудольный (хосты и удаленные IP); каждый уровень обхода - один
+    запрос по индексу хоста или IP. Обход останавливается на depth уровнях
+    или max_nodes узлах (truncated=true).
+    """
+    kind, value = parse_node(node)
+    max_edges = max_nodes * settings.GRAPH_MAX_EDGES_PER_NODE
+
+    nodes: Dict[str, Dict[str, Any]] = {f"{kind}:{value}": {"id": f"{kind}:{value}", "type": kind, "depth": 0}}
+    edges: Dict[tuple, Dict[str, Any]] = {}
+    frontier = {kind: {value}, NODE_HOST if kind == NODE_IP else NODE_IP: set()}
+    truncated = False
+
+    for level in range(1, depth + 1):
+        hosts, ips = frontier.get(NODE_HOST, set()), frontier.get(NODE_IP, set())
+        if not hosts and not ips:
+            break
+
+        conditions = []
+        if hosts:
+            conditions.append(FleetEdge.hostname.in_(hosts))
+        if ips:
+            conditions.append(FleetEdge.remote_ip.in_([cast(ip, INET) for ip in ips]))
+        query = (
+            _edge_select(since)
+            .where(or_(*conditions), FleetEdge.report_count >= min_reports)
+            .order_by(FleetEdge.report_count.desc())
+            .limit(max_edges - len(edges) + 1)
+        )
+        rows = (await db.execute(query)).fetchall()
+
+        next_frontier = {NODE_HOST: set(), NODE_IP: set()}
+        for row in rows:
+            if len(edges) >= max_edges:
+                truncated = True
+                break
+            host_id, ip_id = f"{NODE_HOST}:{row.hostname}", f"{NODE_IP}:{row.remote_ip}"
+            for node_id, node_type, node_value in ((host_id, NODE_HOST, row.hostname), (ip_id, NODE_IP, str(row.remote_ip))):
+                if node_id not in nodes:
+                    if len(nodes) >= max_nodes:
+                        truncated = True
+                        break
+                    nodes[node_id] = {"id": node_id, "type": node_type, "depth": level}
+                    next_frontier[node_type].add(node_value)
+            if host_id not in nodes or ip_id not in nodes:
+                continue
+            key = (row.hostname, str(row.remote_ip), row.port, row.protocol, row.direction)
+            edges.setdefault(key, {"source": host_id, "target": ip_id, **_edge_item(row)})
+        frontier = next_frontier
+        if truncated:
+            break
+
+    return {
+        "center": f"{kind}:{value}",
+        "depth": depth,
+        "nodes": list(nodes.values()),
+        "edges": list(edges.values()),
+        "truncated": truncated,
+    }
@@ -4,8 +4,10 @@
 Точно воспроизводит структуру HTML отчетов, сгенерированных анализатором
 """
 
+import asyncio
 import os
 import re
+import html
 import json
 import hashlib
 from datetime import datetime
@@ -15,6 +17,7 @@ import logging
 from bs4 import BeautifulSoup, Tag
 
 from core.config import get_settings
+from services.endpoints import split_endpoint
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -37,9 +40,9 @@ class AnalyzerHTMLParser:
             'details'
         ]
     
-    async def parse_html_report(self, file_path: str) -> Dict[str, Any]:
+    def parse_html_report(self, file_path: str) -> Dict[str, Any]:
         """
-        Основной метод парсинга HTML отчета
+        Основной метод парсинга HTML отчета (синхронный, BeautifulSoup)
         
         Args:
             file_path: Путь к HTML файлу
@@ -93,7 +96,6 @@ class AnalyzerHTMLParser:
                 'udp_ports_count': udp_ports_count,
                 'network_interfaces': network_interfaces,
                 'change_history': change_history,
-                'raw_html': html_content[:1000],  # Первые 1000 символов для отладки
                 'parsing_timestamp': datetime.utcnow().isoformat()
             }
             
@@ -438,28 +440,13 @@ class AnalyzerHTMLParser:
                     else:
                         connection['connection_type'] = 'unknown'
                     
-                    # Парсим локальный и удаленный адреса для извлечения портов
-                    if ':' in local_address and local_address != '*:*':
-                        try:
-                            if local_address.startswith('*:'):
-                                connection['local_port'] = local_address.split(':')[-1]
-                            else:
-                                addr_parts = local_address.rsplit(':', 1)
-                                connection['local_ip'] = addr_parts[0]
-                                connection['local_port'] = addr_parts[1]
-                        except (IndexError, ValueError):
-                            pass
-                    
-                    if ':' in remote_address and remote_address != '*:*':
-                        try:
-                            if remote_address.startswith('*:'):
-                                connection['remote_port'] = remote_address.split(':')[-1]
-                            else:
-                                addr_parts = remote_address.rsplit(':', 1)
-                                connection['remote_ip'] = addr_parts[0]
-                                connection['remote_port'] = addr_parts[1]
-                        except (IndexError, ValueError):
-                            pass
+                    # Разбираем адреса на IP и порт (с учетом IPv6)
+                    for side, address in (('local', local_address), ('remote', remote_address)):
+                        ip, port = split_endpoint(address)
+                        if ip is not None:
+                            connection[f'{side}_ip'] = ip
+                        if port is not None:
+                            connection[f'{side}_port'] = port
                     
                     # Определяем состояние соединения
                     if remote_address == '*:*':
@@ -824,25 +811,58 @@ class AnalyzerHTMLParser:
 html_parser = AnalyzerHTMLParser()
 
 
-async def parse_analyzer_html_file(file_path: str) -> Dict[str, Any]:
+def parse_analyzer_html(file_path: str) -> Dict[str, Any]:
     """
     Высокоуровневая функция для парсинга HTML файла анализатора
     
+    Синхронная: из асинхронного кода вызывается через asyncio.to_thread.
+    
     Args:
         file_path: Путь к HTML файлу
         
     Returns:
         Структурированные данные отчета
     """
-    return await html_parser.parse_html_report(file_path)
+    return html_parser.parse_html_report(file_path)
+
+
+async def parse_analyzer_html_file(file_path: str) -> Dict[str, Any]:
+    """Асинхронная обертка parse_analyzer_html: парсинг в потоке, вне event loop"""
+    return await asyncio.to_thread(parse_analyzer_html, file_path)
+
+
+# Начало документа, в котором ищется hostname без полного разбора
+_SNIFF_BYTES = 64 * 1024
+_META_TAG = re.compile(rb"<meta\b[^>]*>", re.IGNORECASE)
+_META_ATTR = re.compile(rb"""\b(name|content)\s*=\s*(?:"([^"]*)"|'([^']*)')""", re.IGNORECASE)
+_TITLE_TAG = re.compile(rb"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+
+
+def sniff_hostname(content: bytes) -> str:
+    """
+    Hostname отчета по метатегу analyzer-hostname или title без BeautifulSoup
+
+    Используется там, где нужен только ключ хоста (секция очереди приема),
+    а полный парсинг выполняется позже.
+    """
+    head = content[:_SNIFF_BYTES]
+    for tag in _META_TAG.findall(head):
+        attrs = {m.group(1).lower(): m.group(2) if m.group(2) is not None else m.group(3) for m in _META_ATTR.finditer(tag)}
+        if attrs.get(b"name") == b"analyzer-hostname" and attrs.get(b"content"):
+            return html.unescape(attrs[b"content"].decode("utf-8", "replace")).strip()
+
+    title = _TITLE_TAG.search(head)
+    if title:
+        text = html.unescape(title.group(1).decode("utf-8", "replace")).strip()
+        if " - " in text:
+            return text.split(" - ")[-1].strip() or "unknown"
+    return "unknown"
 
 
 if __name__ == "__main__":
     """
     Тестирование парсера HTML отчетов
     """
-    import asyncio
-    
     async def test_parser():
         test_file = "../Mac_darwin_report_analyzer.html"
         
@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+"""
+Распределенный прием отчетов через Redis Streams
+
+API сохраняет загруженный файл в общее хранилище (UPLOAD_DIR/incoming)
+и добавляет сообщение в один из INGEST_PARTITIONS потоков, выбранный по
+hostname. Парсинг и сохранение в БД выполняют воркеры приема - отдельные
+процессы ingest_worker.py на любых узлах и, если INGEST_API_WORKER,
+воркеры API.
+
+- Порядок. Поток разбирает один воркер (аренда ключа в Redis), сообщения
+  обрабатываются последовательно, поэтому отчеты одного хоста сохраняются
+  в порядке загрузки. Потоки делятся между живыми воркерами поровну.
+- Подтверждение. Сообщение подтверждается (XACK) и удаляется только после
+  коммита в БД; до этого оно в списке ожидающих группы потребителей.
+- Повторы. Временная ошибка повторяется на месте с растущей паузой - поток
+  не обгоняет сообщение. После INGEST_MAX_ATTEMPTS попыток или при
+  постоянной ошибке (IngestError: файл не разбирается) сообщение уходит
+  в поток недоставленных; файл остается для повторной отправки.
+- Зависшие сообщения. Получив поток, воркер забирает (XAUTOCLAIM) все
+  ожидающие сообщения прежнего владельца: его аренда истекла, значит он
+  упал. Сообщения, которые другой потребитель держит дольше
+  INGEST_CLAIM_IDLE_MS, забираются периодически.
+
+Повторная обработка безопасна: отчет сохраняется upsert по хешу.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import socket
+import uuid
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from core import database
+from core import redis_client
+from core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+INGEST_GROUP = "ingest"
+STATUS_CATEGORY = "ingest_status"
+
+STATE_QUEUED = "queued"
+STATE_PROCESSING = "processing"
+STATE_RETRYING = "retrying"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+# Поля результата приема в статусе загрузки
+_RESULT_FIELDS = ("report_id", "report_hash", "hostname", "saved_as", "connections_count", "is_replacement")
+
+# Продление и снятие аренды только ее владельцем
+_RENEW_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class IngestError(ValueError):
+    """Постоянная ошибка приема: повтор не поможет, сообщение недоставляемо"""
+
+
+def _redis():
+    client = redis_client.redis_client
+    if client is None:
+        raise RuntimeError("Redis не инициализирован")
+    return client
+
+
+def _key(suffix: str) -> str:
+    return f"{settings.CACHE_PREFIX}ingest:{suffix}"
+
+
+def stream_key(partition: int) -> str:
+    return _key(str(partition))
+
+
+def _lease_key(partition: int) -> str:
+    return _key(f"lease:{partition}")
+
+
+DEAD_STREAM = _key("dead")
+WORKERS_KEY = _key("workers")
+
+
+def partition_for(hostname: str) -> int:
+    """Поток очереди хоста (стабилен между процессами, в отличие от hash())"""
+    return zlib.crc32((hostname or "unknown").encode()) % settings.INGEST_PARTITIONS
+
+
+def incoming_dir() -> str:
+    return os.path.join(settings.UPLOAD_DIR, "incoming")
+
+
+def _decode_fields(fields: Dict[bytes, bytes]) -> Dict[str, str]:
+    return {key.decode(): value.decode() for key, value in fields.items()}
+
+
+async def ensure_groups() -> None:
+    """Создает потоки и группу потребителей (BUSYGROUP - группа уже есть)"""
+    client = _redis()
+    for partition in range(settings.INGEST_PARTITIONS):
+        try:
+            await client.xgroup_create(stream_key(partition), INGEST_GROUP, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+
+# Статус загрузки
+
+async def set_upload_status(upload_id: str, state: str, **fields: Any) -> None:
+    """Обновляет статус загрузки (хранится в кэше, INGEST_STATUS_TTL)"""
+    from core.redis_client import cache
+
+    status = await cache.get(STATUS_CATEGORY, upload_id) or {"upload_id": upload_id}
+    status.update(fields)
+    status["state"] = state
+    status["updated_at"] = datetime.utcnow().isoformat()
+    await cache.set(STATUS_CATEGORY, upload_id, status, ttl=settings.INGEST_STATUS_TTL)
+
+
+async def get_upload_status(upload_id: str) -> Optional[Dict[str, Any]]:
+    """Статус загрузки или None (неизвестна или истекла)"""
+    from core.redis_client import cache
+
+    return await cache.get(STATUS_CATEGORY, upload_id)
+
+
+async def enqueue_upload(path: str, filename: str, file_size: int, hostname: str, upload_id: str) -> Dict[str, Any]:
+    """
+    Ставит сохраненный файл загрузки в очередь приема
+
+    Returns:
+        Статус загрузки (upload_id, partition, message_id)
+    """
+    client = _redis()
+    partition = partition_for(hostname)
+    job = {
+        "upload_id": upload_id,
+        "path": path,
+        "filename": filename,
+        "file_size": str(file_size),
+        "hostname": hostname,
+        "enqueued_at": datetime.utcnow().isoformat(),
+    }
+    # Статус до XADD: воркер может взять сообщение сразу
+    await set_upload_status(
+        upload_id, STATE_QUEUED,
+        filename=filename, hostname=hostname, partition=partition, attempts=0, enqueued_at=job["enqueued_at"]
+    )
+    message_id = (await client.xadd(stream_key(partition), job)).decode()
+    return {"upload_id": upload_id, "partition": partition, "message_id": message_id, "state": STATE_QUEUED}
+
+
+# Обработка сообщения
+
+async def ingest_job(job: Dict[str, str], **status_fields: Any) -> Dict[str, Any]:
+    """
+    Парсит файл загрузки и сохраняет отчет; повторный вызов безопасен
+
+    Raises:
+        IngestError: Файл пропал или не разбирается
+    """
+    from services.delta import notify_delta_worker
+    from services.html_parser import parse_analyzer_html
+    from services.port_index import refresh_hosts
+    from services.report_deduplication import create_hash_based_filename, generate_report_hash
+    from services.report_ingest import upsert_parsed_report
+    from core.redis_client import invalidate_report_cache
+
+    upload_id, path = job["upload_id"], job["path"]
+    if not os.path.exists(path):
+        # Файл уже перемещен - отчет сохранен, потерялось только подтверждение
+        status = await get_upload_status(upload_id)
+        if status and status.get("state") == STATE_DONE:
+            return {key: status.get(key) for key in _RESULT_FIELDS}
+        raise IngestError(f"Файл загрузки не найден: {path}")
+
+    await set_upload_status(upload_id, STATE_PROCESSING, **status_fields)
+    try:
+        # Парсинг BeautifulSoup синхронный - выполняем вне event loop
+        parsed_data = await asyncio.to_thread(parse_analyzer_html, path)
+        report_hash = parsed_data.get("report_hash") or await asyncio.to_thread(generate_report_hash, path, parsed_data)
+    except Exception as e:
+        raise IngestError(f"Ошибка парсинга HTML отчета: {e}")
+
+    final_file_path = os.path.join(settings.UPLOAD_DIR, create_hash_based_filename(report_hash, job["filename"]))
+    async with database.async_session_factory() as session:
+        new_melt, replaced = await upsert_parsed_report(
+            session,
+            parsed_data,
+            report_hash=report_hash,
+            file_path=final_file_path,
+            file_size=int(job["file_size"]),
+            report_id=parsed_data.get("report_id")
+        )
+        await session.commit()
+        report_id, hostname = str(new_melt.id), new_melt.hostname
+        notify_delta_worker()
+        try:
+            await refresh_hosts(session, [hostname, (replaced or {}).get("hostname")])
+        except Exception as e:
+            logger.warning(f"⚠️ Индекс портов не обновлен: {e}")
+
+    # Файл занимает итоговое место только после коммита
+    os.replace(path, final_file_path)
+    if replaced:
+        old_file_path = replaced.get("file_path")
+        if old_file_path and os.path.abspath(old_file_path) != os.path.abspath(final_file_path) and os.path.exists(old_file_path):
+            try:
+                os.remove(old_file_path)
+            except OSError as e:
+                logger.warning(f"⚠️ Ошибка удаления старого файла {old_file_path}: {e}")
+        await invalidate_report_cache(replaced["id"])
+    await invalidate_report_cache(report_id)
+
+    return {
+        "report_id": report_id,
+        "report_hash": report_hash,
+        "hostname": hostname,
+        "saved_as": os.path.basename(final_file_path),
+        "connections_count": parsed_data.get("total_connections", 0),
+        "is_replacement": bool(replaced),
+    }
+
+
+class IngestWorker:
+    """
+    Воркер приема: арендует часть потоков и разбирает их по одному сообщению
+
+    Каждый воркер регистрируется в zset WORKERS_KEY (счет - срок жизни) и
+    держит не больше ceil(INGEST_PARTITIONS / живых воркеров) потоков:
+    новый воркер получает потоки, которые остальные отпускают при
+    следующем продлении аренд.
+    """
+
+    def __init__(self, name: Optional[str] = None):
+        self.consumer = name or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._leases: Dict[int, str] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._attempts: Dict[bytes, int] = {}
+        self.counters: Dict[str, int] = {
+            "processed": 0,
+            "retried": 0,
+            "dead_lettered": 0,
+            "claimed": 0,
+            "partitions_acquired": 0,
+            "partitions_lost": 0,
+        }
+
+    def owns(self, partition: int) -> bool:
+        return partition in self._leases
+
+    async def run(self, stop: Optional[asyncio.Event] = None) -> None:
+        """Цикл продления аренд до stop (или отмены задачи)"""
+        stop = stop or asyncio.Event()
+        await ensure_groups()
+        logger.info(f"📥 Воркер приема {self.consumer}: {settings.INGEST_PARTITIONS} потоков очереди")
+        try:
+            while not stop.is_set():
+                try:
+                    await self._heartbeat()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"❌ Ошибка продления аренд очереди приема: {e}")
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=settings.INGEST_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self._shutdown()
+
+    async def _heartbeat(self) -> None:
+        client = _redis()
+        now_ms = int(datetime.utcnow().timestamp() * 1000)
+        await client.zadd(WORKERS_KEY, {self.consumer: now_ms + settings.INGEST_LEASE_MS})
+        await client.zremrangebyscore(WORKERS_KEY, "-inf", now_ms)
+
+        for partition, token in list(self._leases.items()):
+            renewed = await client.eval(_RENEW_LEASE_SCRIPT, 1, _lease_key(partition), token, settings.INGEST_LEASE_MS)
+            if not renewed:
+                # Аренда истекла и, возможно, уже у другого воркера
+                logger.warning(f"⚠️ Поток приема {partition} потерян воркером {self.consumer}")
+                self.counters["partitions_lost"] += 1
+                self._leases.pop(partition, None)
+
+        for partition, task in list(self._tasks.items()):
+            if task.done() and not self.owns(partition):
+                self._tasks.pop(partition, None)
+
+        live_workers = max(1, await client.zcard(WORKERS_KEY))
+        target = math.ceil(settings.INGEST_PARTITIONS / live_workers)
+
+        # Лишние потоки отпускаются: задача доделывает текущее сообщение и снимает аренду
+        for partition in sorted(self._leases, reverse=True)[:max(0, len(self._leases) - target)]:
+            self._leases.pop(partition, None)
+
+        if len(self._leases) < target:
+            # Начинаем с разных потоков, чтобы воркеры не сталкивались на одних ключах
+            offset = zlib.crc32(self.consumer.encode()) % settings.INGEST_PARTITIONS
+            for step in range(settings.INGEST_PARTITIONS):
+                if len(self._leases) >= target:
+                    break
+                partition = (offset + step) % settings.INGEST_PARTITIONS
+                if self.owns(partition) or partition in self._tasks:
+                    continue
+                await self._try_acquire(partition)
+
+        for partition in self._leases:
+            await self._claim(partition, settings.INGEST_CLAIM_IDLE_MS)
+
+    async def _try_acquire(self, partition: int) -> None:
+        client = _redis()
+        token = uuid.uuid4().hex
+        if not await client.set(_lease_key(partition), token, nx=True, px=settings.INGEST_LEASE_MS):
+            return
+        self._leases[partition] = token
+        self.counters["partitions_acquired"] += 1
+        self._tasks[partition] = asyncio.create_task(self._consume(partition, token))
+        logger.info(f"📥 Поток приема {partition} у воркера {self.consumer}")
+
+    async def _claim(self, partition: int, min_idle_ms: int) -> int:
+        """Забирает ожидающие сообщения других потребителей (XAUTOCLAIM)"""
+        client = _redis()
+        claimed, start_id = 0, "0-0"
+        while True:
+            # С JUSTID redis-py возвращает только ID, без курсора - берем сообщения целиком
+            reply = await client.xautoclaim(
+                stream_key(partition), INGEST_GROUP, self.consumer, min_idle_ms, start_id=start_id, count=100
+            )
+            start_id = reply[0]
+            claimed += len(reply[1])
+            if start_id in (b"0-0", "0-0"):
+                break
+        if claimed:
+            self.counters["claimed"] += claimed
+            logger.info(f"♻️ Поток приема {partition}: забрано {claimed} зависших сообщений")
+        return claimed
+
+    async def _consume(self, partition: int, token: str) -> None:
+        """Последовательный разбор потока, пока воркер им владеет"""
+        client = _redis()
+        stream = stream_key(partition)
+        recovered = False
+        try:
+            while self._leases.get(partition) == token:
+                try:
+                    if not recovered:
+                        # Прежний владелец потерял аренду - его ожидающие сообщения наши
+                        await self._claim(partition, 0)
+                        recovered = True
+                    # Сначала свои неподтвержденные (повторы и забранные), потом новые
+                    reply = await client.xreadgroup(INGEST_GROUP, self.consumer, {stream: "0"}, count=1)
+                    if not reply or not reply[0][1]:
+                        reply = await client.xreadgroup(
+                            INGEST_GROUP, self.consumer, {stream: ">"}, count=1, block=settings.INGEST_BLOCK_MS
+                        )
+                    for _, messages in reply or []:
+                        for message_id, fields in messages:
+                            if self._leases.get(partition) != token:
+                                break
+                            await self._handle(partition, message_id, fields)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"❌ Ошибка чтения потока приема {partition}: {e}")
+                    await asyncio.sleep(settings.INGEST_RETRY_BASE_SECONDS)
+        finally:
+            if self._leases.get(partition) == token:
+                self._leases.pop(partition, None)
+            try:
+                await client.eval(_RELEASE_LEASE_SCRIPT, 1, _lease_key(partition), token)
+            except Exception as e:
+                logger.debug(f"Аренда потока приема {partition} не снята: {e}")
+
+    async def _finish(self, stream: str, message_id: bytes) -> None:
+        client = _redis()
+        await client.xack(stream, INGEST_GROUP, message_id)
+        await client.xdel(stream, message_id)
+        self._attempts.pop(message_id, None)
+
+    async def _delivery_count(self, stream: str, message_id: bytes) -> int:
+        pending = await _redis().xpending_range(stream, INGEST_GROUP, message_id, message_id, 1)
+        return int(pending[0]["times_delivered"]) if pending else 0
+
+    async def _handle(self, partition: int, message_id: bytes, fields: Optional[Dict[bytes, bytes]]) -> None:
+        stream = stream_key(partition)
+        if not fields:
+            # Сообщение удалено, пока было в списке ожидающих
+            await self._finish(stream, message_id)
+            return
+
+        job = _decode_fields(fields)
+        upload_id = job.get("upload_id", message_id.decode())
+        # Падения воркеров тоже попытки: XAUTOCLAIM увеличивает счетчик доставок
+        attempt = max(self._attempts.get(message_id, 0) + 1, await self._delivery_count(stream, message_id))
+        self._attempts[message_id] = attempt
+
+        try:
+            result = await ingest_job(job, attempts=attempt, worker=self.consumer)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if not isinstance(e, IngestError) and attempt < settings.INGEST_MAX_ATTEMPTS:
+                self.counters["retried"] += 1
+                delay = min(settings.INGEST_RETRY_BASE_SECONDS * 2 ** (attempt - 1), settings.INGEST_RETRY_MAX_SECONDS)
+                logger.warning(f"⚠️ Прием {upload_id}: попытка {attempt} не удалась ({e}), повтор через {delay:.1f} с")
+                try:
+                    await set_upload_status(upload_id, STATE_RETRYING, attempts=attempt, error=str(e))
+                except Exception:
+                    pass
+                # Повтор на месте: следующие сообщения потока ждут
+                await asyncio.sleep(delay)
+                return
+            await self._dead_letter(partition, message_id, job, attempt, e)
+            return
+
+        # Статус до подтверждения: повторная доставка без файла узнает по нему,
+        # что отчет уже сохранен
+        await set_upload_status(upload_id, STATE_DONE, attempts=attempt, error=None, **result)
+        await self._finish(stream, message_id)
+        self.counters["processed"] += 1
+        logger.info(f"✅ Прием {upload_id}: отчет {result['report_id']} ({result['hostname']})")
+
+    async def _dead_letter(self, partition: int, message_id: bytes, job: Dict[str, str], attempts: int, error: Exception) -> None:
+        client = _redis()
+        await client.xadd(
+            DEAD_STREAM,
+            {
+                **job,
+                "partition": str(partition),
+                "message_id": message_id.decode(),
+                "attempts": str(attempts),
+                "error": str(error)[:1000],
+                "failed_at": datetime.utcnow().isoformat(),
+            },
+            maxlen=settings.INGEST_DEAD_MAXLEN,
+            approximate=True
+        )
+        await self._finish(stream_key(partition), message_id)
+        self.counters["dead_lettered"] += 1
+        await set_upload_status(job.get("upload_id", message_id.decode()), STATE_FAILED, attempts=attempts, error=str(error))
+        logger.error(f"❌ Прием {job.get('upload_id')}: недоставляемо после {attempts} попыток: {error}")
+
+    async def _shutdown(self) -> None:
+        """Отпускает потоки: задачи доделывают текущие сообщения, аренды снимаются"""
+        self._leases.clear()
+        tasks = list(self._tasks.values())
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=settings.INGEST_BLOCK_MS / 1000 + 1)
+            for task in pending:
+                # Неподтвержденное сообщение заберет следующий владелец потока
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        try:
+            await _redis().zrem(WORKERS_KEY, self.consumer)
+        except Exception:
+            pass
+        logger.info(f"📥 Воркер приема {self.consumer} остановлен")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "consumer": self.consumer,
+            "partitions": sorted(self._leases),
+            **self.counters,
+        }
+
+
+# Воркер приема этого процесса (если запущен)
+ingest_worker: Optional[IngestWorker] = None
+
+
+async def ingest_worker_loop(stop: Optional[asyncio.Event] = None) -> None:
+    """Воркер приема процесса; ошибки Redis переживаются перезапуском цикла"""
+    global ingest_worker
+    ingest_worker = IngestWorker()
+    while stop is None or not stop.is_set():
+        try:
+            await ingest_worker.run(stop)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Воркер приема остановлен с ошибкой: {e}")
+            await asyncio.sleep(settings.INGEST_HEARTBEAT_SECONDS)
+
+
+# Состояние очереди и недоставленные сообщения
+
+async def get_ingest_queue_stats() -> Dict[str, Any]:
+    """Глубина потоков, ожидающие сообщения, владельцы и недоставленные"""
+    client = _redis()
+    now_ms = int(datetime.utcnow().timestamp() * 1000)
+    partitions: List[Dict[str, Any]] = []
+    for partition in range(settings.INGEST_PARTITIONS):
+        stream = stream_key(partition)
+        try:
+            pending = (await client.xpending(stream, INGEST_GROUP))["pending"]
+        except Exception:
+            pending = 0  # Поток еще не создан
+        partitions.append({
+            "partition": partition,
+            "length": await client.xlen(stream),
+            "pending": pending,
+            "leased": bool(await client.exists(_lease_key(partition))),
+        })
+
+    workers = await client.zrangebyscore(WORKERS_KEY, now_ms, "+inf")
+    return {
+        "partitions": partitions,
+        "queued": sum(p["length"] for p in partitions),
+        "pending": sum(p["pending"] for p in partitions),
+        "dead_letters": await client.xlen(DEAD_STREAM),
+        "workers": [worker.decode() for worker in workers],
+        "local_worker": ingest_worker.get_stats() if ingest_worker else None,
+    }
+
+
+async def get_dead_letters(limit: int = 100) -> List[Dict[str, Any]]:
+    """Последние недоставленные сообщения"""
+    entries = await _redis().xrevrange(DEAD_STREAM, count=limit)
+    return [{"id": entry_id.decode(), **_decode_fields(fields)} for entry_id, fields in entries]
+
+
+async def redrive_dead_letters(limit: int = 100) -> Dict[str, int]:
+    """
+    Возвращает недоставленные сообщения в очередь (после исправления причины)
+
+    Сообщения без файла загрузки удаляются - повторять нечего.
+    """
+    client = _redis()
+    redriven = dropped = 0
+    for entry_id, fields in await client.xrange(DEAD_STREAM, count=limit):
+        job = _decode_fields(fields)
+        if os.path.exists(job.get("path", "")):
+            await enqueue_upload(job["path"], job["filename"], int(job["file_size"]), job["hostname"], job["upload_id"])
+            redriven += 1
+        else:
+            dropped += 1
+        await client.xdel(DEAD_STREAM, entry_id)
+    return {"redriven": redriven, "dropped": dropped}
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Интернирование повторяющихся строк в справочные таблицы
+
+Имена процессов, адреса, имена хостов и описания портов повторяются в тысячах
+отчетов. Строки соединений и портов хранят только целочисленные ключи, а
+соответствие значение -> ключ кэшируется в процессе на время жизни воркера.
+"""
+
+import logging
+from typing import Dict, Iterable, Optional, Type
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from core import database
+from core.config import get_settings
+from models.report import NetworkAddress, PortDescription, ProcessName, RemoteHostname
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+class DimensionInterner:
+    """
+    Кэш ключей справочников
+
+    Справочники только пополняются, поэтому закэшированный ключ не устаревает.
+    Новые значения вставляются отдельной короткой транзакцией: откат приема
+    отчета не оставляет в кэше ключей, которых нет в БД.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None):
+        self.max_entries = max_entries or settings.INTERN_CACHE_SIZE
+        self._cache: Dict[str, Dict[str, int]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        """Статистика кэша для мониторинга"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            **{f"{table}_entries": len(values) for table, values in self._cache.items()},
+        }
+
+    async def intern_many(self, model: Type, values: Iterable[Optional[str]]) -> Dict[str, int]:
+        """
+        Возвращает ключи для набора значений, добавляя недостающие в справочник
+
+        Пустые значения пропускаются - в строках фактов им соответствует NULL.
+        """
+        table_cache = self._cache.setdefault(model.__tablename__, {})
+        result: Dict[str, int] = {}
+        missing = set()
+
+        for value in values:
+            if not value:
+                continue
+            key = table_cache.get(value)
+            if key is None:
+                missing.add(value)
+            else:
+                result[value] = key
+
+        self.hits += len(result)
+        if not missing:
+            return result
+
+        self.misses += len(missing)
+        resolved = await self._resolve(model, sorted(missing))
+
+        if len(table_cache) + len(resolved) > self.max_entries:
+            # Кэш переполнен - начинаем заново, горячие значения вернутся быстро
+            table_cache.clear()
+        table_cache.update(resolved)
+        result.update(resolved)
+        return result
+
+    async def _resolve(self, model: Type, values: list) -> Dict[str, int]:
+        """Вставляет недостающие значения и читает ключи одним проходом по пачкам"""
+        resolved: Dict[str, int] = {}
+
+        async with database.async_engine.begin() as conn:
+            for start in range(0, len(values), settings.INGEST_INSERT_CHUNK):
+                chunk = values[start:start + settings.INGEST_INSERT_CHUNK]
+
+                inserted = await conn.execute(
+                    pg_insert(model.__table__)
+                    .values([{"value": value} for value in chunk])
+                    .on_conflict_do_nothing(index_elements=["value"])
+                    .returning(model.id, model.value)
+                )
+                resolved.update({row.value: row.id for row in inserted})
+
+                # Значения, уже существовавшие в справочнике, RETURNING не возвращает
+                existing = [value for value in chunk if value not in resolved]
+                if existing:
+                    rows = await conn.execute(
+                        select(model.id, model.value).where(model.value.in_(existing))
+                    )
+                    resolved.update({row.value: row.id for row in rows})
+
+        return resolved
+
+    async def intern_connections(self, connections: list) -> Dict[str, Dict[str, int]]:
+        """Ключи всех справочных значений пачки соединений"""
+        addresses = await self.intern_many(
+            NetworkAddress,
+            [c.get("local_address") for c in connections] + [c.get("remote_address") for c in connections]
+        )
+        return {
+            "addresses": addresses,
+            "hostnames": await self.intern_many(RemoteHostname, [c.get("remote_hostname") for c in connections]),
+            "processes": await self.intern_many(ProcessName, [c.get("process_name") for c in connections]),
+        }
+
+    async def intern_ports(self, ports: list) -> Dict[str, Dict[str, int]]:
+        """Ключи всех справочных значений пачки портов"""
+        return {
+            "descriptions": await self.intern_many(PortDescription, [p.get("description") for p in ports]),
+            "processes": await self.intern_many(ProcessName, [p.get("process_name") for p in ports]),
+        }
+
+
+# Глобальный кэш справочников воркера
+interner = DimensionInterner()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Временные ряды числовых показателей хостов
+
+Счетчики отчета (total_connections, tcp_ports_count и т.д.) сворачиваются
+при приеме в часовые и суточные корзины host_metric_rollups: min, max и
+последнее значение на метрику. Корзина пересчитывается по отчетам хоста в
+ее интервале, поэтому замена отчета и прием не по порядку не искажают ее.
+
+Ряд для графика строится на сервере: корзины группируются в шаг step,
+так что год по суткам - не больше нескольких сотен точек.
+"""
+
+import logging
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, literal_column, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import get_settings
+from models.report import HostMetricRollup, Melt
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Числовые колонки Melt, которые сворачиваются в ряды
+SERIES_METRICS = (
+    "total_connections",
+    "tcp_connections",
+    "udp_connections",
+    "icmp_connections",
+    "incoming_connections",
+    "outgoing_connections",
+    "tcp_ports_count",
+    "udp_ports_count",
+)
+
+RESOLUTION_HOUR = "hour"
+RESOLUTION_DAY = "day"
+
+_STEP_PATTERN = re.compile(r"^(\d+)([hdw])$")
+_STEP_UNITS = {"h": 3600, "d": 86400, "w": 7 * 86400}
+
+
+class SeriesQueryError(ValueError):
+    """Некорректные параметры ряда"""
+
+
+def bucket_start(value: datetime, resolution: str) -> datetime:
+    """Начало часовой или суточной корзины"""
+    if resolution == RESOLUTION_HOUR:
+        return value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _aggregate(rows: list, start: datetime, end: datetime) -> Dict[str, Dict[str, Any]]:
+    """min/max/последнее по отчетам интервала [start, end) для каждой метрики"""
+    bucket = [row for row in rows if start <= row.generated_at < end]
+    if not bucket:
+        return {}
+    latest = max(bucket, key=lambda row: row.generated_at)
+    result = {}
+    for metric in SERIES_METRICS:
+        values = [getattr(row, metric) or 0 for row in bucket]
+        result[metric] = {
+            "min_value": min(values),
+            "max_value": max(values),
+            "last_value": getattr(latest, metric) or 0,
+            "last_at": latest.generated_at,
+            "samples": len(bucket),
+        }
+    return result
+
+
+async def refresh_metric_rollups(db: AsyncSession, hostname: str, timestamps: Iterable[datetime]) -> None:
+    """
+    Пересчитывает часовые и суточные корзины хоста, содержащие timestamps
+
+    Вызывается в транзакции приема отчета (services/report_ingest.py).
+    Отчетов хоста за сутки немного, поэтому корзины считаются по строкам
+    Melt этих суток (idx_reports_hostname_date).
+    """
+    days = {bucket_start(value, RESOLUTION_DAY) for value in timestamps if value}
+    for day in days:
+        day_end = day + timedelta(days=1)
+        rows = (await db.execute(
+            select(Melt.generated_at, *(getattr(Melt, metric) for metric in SERIES_METRICS))
+            .where(Melt.hostname == hostname, Melt.generated_at >= day, Melt.generated_at < day_end)
+        )).fetchall()
+
+        buckets: List[Tuple[str, datetime, datetime]] = [(RESOLUTION_DAY, day, day_end)]
+        hours = {bucket_start(value, RESOLUTION_HOUR) for value in timestamps if value and day <= value < day_end}
+        buckets += [(RESOLUTION_HOUR, hour, hour + timedelta(hours=1)) for hour in hours]
+
+        for resolution, start, end in buckets:
+            aggregated = _aggregate(rows, start, end)
+            if not aggregated:
+                # Единственный отчет корзины перенесен или удален
+                await db.execute(delete(HostMetricRollup).where(
+                    HostMetricRollup.hostname == hostname,
+                    HostMetricRollup.resolution == resolution,
+                    HostMetricRollup.bucket_start == start,
+                ))
+                continue
+
+            rollup_insert = pg_insert(HostMetricRollup).values([
+                {"hostname": hostname, "metric": metric, "resolution": resolution, "bucket_start": start, **values}
+                for metric, values in aggregated.items()
+            ])
+            await db.execute(rollup_insert.on_conflict_do_update(
+                index_elements=[
+                    HostMetricRollup.hostname, HostMetricRollup.metric,
+                    HostMetricRollup.resolution, HostMetricRollup.bucket_start,
+                ],
+                set_={
+                    column: rollup_insert.excluded[column]
+                    for column in ("min_value", "max_value", "last_value", "last_at", "samples")
+                }
+            ))
+
+
+def parse_step(step: Optional[str]) -> Optional[int]:
+    """
+    Шаг ряда в секундах из "6h", "1d", "2w" или числа секунд
+
+    Raises:
+        SeriesQueryError: Некорректный шаг
+    """
+    if not step:
+        return None
+    step = step.strip().lower()
+    if step.isdigit():
+        seconds = int(step)
+    else:
+        match = _STEP_PATTERN.match(step)
+        if not match:
+            raise SeriesQueryError(f"Некорректный шаг: {step}")
+        seconds = int(match.group(1)) * _STEP_UNITS[match.group(2)]
+    if seconds < 3600 or seconds % 3600:
+        raise SeriesQueryError("Шаг должен быть кратен часу")
+    return seconds
+
+
+def _choose_step(start: datetime, end: datetime) -> int:
+    """Наименьший шаг (час, сутки или кратный суткам), при котором точек не больше SERIES_MAX_POINTS"""
+    span = max((end - start).total_seconds(), 1)
+    hours = -(-span // 3600)
+    if hours <= settings.SERIES_MAX_POINTS:
+        return 3600
+    days = -(-span // 86400)
+    return int(86400 * max(1, -(-days // settings.SERIES_MAX_POINTS)))
+
+
+async def get_host_series(
+    db: AsyncSession,
+    hostname: str,
+    metric: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    step: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Ряд метрики хоста: точки (начало шага, min, max, последнее)
+
+    Шаг меньше суток читается из часовых корзин, иначе из суточных;
+    группировка корзин в шаг выполняется в запросе.
+    """
+    if metric not in SERIES_METRICS:
+        raise SeriesQueryError(f"Неизвестная метрика: {metric}. Доступны: {', '.join(SERIES_METRICS)}")
+
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(days=30)
+    if start >= end:
+        raise SeriesQueryError("Начало периода позже конца")
+
+    step_seconds = parse_step(step) or _choose_step(start, end)
+    points_estimate = (end - start).total_seconds() / step_seconds
+    if points_estimate > settings.SERIES_MAX_POINTS * 10:
+        raise SeriesQueryError("Слишком мелкий шаг для периода")
+
+    resolution = RESOLUTION_DAY if step_seconds % 86400 == 0 else RESOLUTION_HOUR
+    epoch = func.extract("epoch", HostMetricRollup.bucket_start)
+    step_start = func.timezone("UTC", func.to_timestamp(func.floor(epoch / step_seconds) * step_seconds))
+
+    rows = (await db.execute(
+        select(
+            step_start.label("step_start"),
+            func.min(HostMetricRollup.min_value).label("min"),
+            func.max(HostMetricRollup.max_value).label("max"),
+            array_agg(aggregate_order_by(HostMetricRollup.last_value, HostMetricRollup.last_at.desc()))[1].label("last"),
+            func.sum(HostMetricRollup.samples).label("samples"),
+        )
+        .where(
+            HostMetricRollup.hostname == hostname,
+            HostMetricRollup.metric == metric,
+            HostMetricRollup.resolution == resolution,
+            HostMetricRollup.bucket_start >= bucket_start(start, resolution),
+            HostMetricRollup.bucket_start < end,
+        )
+        .group_by(literal_column("step_start"))
+        .order_by(literal_column("step_start"))
+    )).fetchall()
+
+    return {
+        "hostname": hostname,
+        "metric": metric,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "step_seconds": step_seconds,
+        "resolution": resolution,
+        "points": [
+            {
+                "t": row.step_start.isoformat(),
+                "min": row.min,
+                "max": row.max,
+                "last": row.last,
+                "samples": int(row.samples or 0),
+            }
+            for row in rows
+        ],
+    }
+
+
+async def prune_hourly_rollups(db: AsyncSession, cutoff: datetime) -> int:
+    """Удаляет часовые корзины старше cutoff (суточные хранятся дольше отчетов)"""
+    result = await db.execute(
+        delete(HostMetricRollup).where(
+            HostMetricRollup.resolution == RESOLUTION_HOUR,
+            HostMetricRollup.bucket_start < cutoff,
+        )
+    )
+    return result.rowcount or 0
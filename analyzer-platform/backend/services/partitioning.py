@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Управление секциями отчетов
+system_reports и дочерние таблицы секционированы по месяцу generated_at
+"""
+
+import logging
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from core import database
+from core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+PARENT_TABLE = "system_reports"
+
+# Ключ advisory lock: DDL секций из нескольких воркеров выполняется по очереди
+PARTITION_LOCK_KEY = 726_002
+
+_PARTITION_SUFFIX = re.compile(r"_p(\d{4})(\d{2})$")
+
+# Месяцы, для которых секции уже гарантированно созданы в этом процессе
+_known_months: Set[Tuple[int, int]] = set()
+
+
+def child_tables() -> List[str]:
+    """
+    Секционированные дочерние таблицы отчетов
+
+    Определяются по метаданным моделей (postgresql_partition_by), порядок
+    зависимостей сохраняется.
+    """
+    import models.report  # noqa: F401 - регистрирует модели в метаданных
+
+    return [
+        table.name
+        for table in database.Base.metadata.sorted_tables
+        if table.name != PARENT_TABLE and table.dialect_options["postgresql"].get("partition_by")
+    ]
+
+
+def month_start(value: datetime) -> datetime:
+    """Начало месяца, к которому относится дата"""
+    return datetime(value.year, value.month, 1)
+
+
+def next_month(value: datetime) -> datetime:
+    """Начало следующего месяца"""
+    if value.month == 12:
+        return datetime(value.year + 1, 1, 1)
+    return datetime(value.year, value.month + 1, 1)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    """Имя секции вида system_reports_p202501"""
+    return f"{table}_p{month.year:04d}{month.month:02d}"
+
+
+def partition_month(relname: str) -> Optional[datetime]:
+    """Месяц секции по ее имени или None, если имя не из этой схемы"""
+    match = _PARTITION_SUFFIX.search(relname)
+    if not match:
+        return None
+    return datetime(int(match.group(1)), int(match.group(2)), 1)
+
+
+def month_partition_ddl(table: str, month: datetime) -> str:
+    """
+    CREATE TABLE секции таблицы для месяца
+
+    Единственное место, где заданы имя и границы секции: его используют и
+    воркеры, и миграции (core.migrations.create_child_partitions).
+    """
+    start = month_start(month)
+    end = next_month(start)
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, start)} "
+        f"PARTITION OF {table} "
+        f"FOR VALUES FROM ('{start.isoformat(sep=' ')}') TO ('{end.isoformat(sep=' ')}')"
+    )
+
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    """Проверяет, секционирована ли system_reports (после миграции)"""
+    result = await conn.execute(text("""
+        SELECT EXISTS (
+            SELECT 1
+            FROM pg_partitioned_table pt
+            JOIN pg_class c ON c.oid = pt.partrelid
+            WHERE c.relname = :table
+        )
+    """), {"table": PARENT_TABLE})
+    return bool(result.scalar())
+
+
+async def create_month_partitions(conn: AsyncConnection, month: datetime) -> None:
+    """Создает секции всех таблиц отчетов для указанного месяца"""
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+
+    # Родительская таблица идет первой: секции дочерних таблиц ссылаются на нее
+    for table in (PARENT_TABLE, *child_tables()):
+        await conn.execute(text(month_partition_ddl(table, month)))
+
+
+async def ensure_partitions_for(value: datetime) -> None:
+    """
+    Гарантирует наличие секций для даты отчета
+
+    Вызывается перед вставкой Melt: отчеты могут приходить с датой
+    из прошлого, для которой заранее созданной секции нет. DDL выполняется
+    отдельным соединением и ждет ACCESS EXCLUSIVE на system_reports, поэтому
+    вызывать нужно до того, как транзакция приема обратится к этой таблице.
+    """
+    key = (value.year, value.month)
+    if key in _known_months:
+        return
+
+    if not database.async_engine:
+        raise RuntimeError("База данных не инициализирована")
+
+    async with database.async_engine.begin() as conn:
+        await create_month_partitions(conn, value)
+
+    _known_months.add(key)
+
+
+async def ensure_future_partitions(months_ahead: Optional[int] = None) -> int:
+    """
+    Создает секции текущего месяца и нескольких следующих
+
+    Returns:
+        Количество обработанных месяцев
+    """
+    months_ahead = settings.PARTITION_PREMAKE_MONTHS if months_ahead is None else months_ahead
+
+    if not database.async_engine:
+        raise RuntimeError("База данных не инициализирована")
+
+    async with database.async_engine.begin() as conn:
+        if not await is_partitioned(conn):
+            logger.warning("⚠️ system_reports не секционирована - выполните 'alembic upgrade head'")
+            return 0
+
+        month = month_start(datetime.utcnow())
+        for _ in range(months_ahead + 1):
+            await create_month_partitions(conn, month)
+            _known_months.add((month.year, month.month))
+            month = next_month(month)
+
+    logger.info(f"📅 Секции отчетов подготовлены на {months_ahead + 1} мес.")
+    return months_ahead + 1
+
+
+async def list_partition_months(conn: AsyncConnection) -> List[datetime]:
+    """Месяцы, для которых существуют секции system_reports"""
+    result = await conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :table
+    """), {"table": PARENT_TABLE})
+
+    months = [partition_month(relname) for (relname,) in result.fetchall()]
+    return sorted(month for month in months if month is not None)
+
+
+async def drop_month_partition(conn: AsyncConnection, month: datetime) -> Dict[str, Any]:
+    """
+    Удаляет отчеты месяца целиком, удаляя его секции
+
+    DROP секции не оставляет мертвых кортежей, в отличие от DELETE.
+    Секции дочерних таблиц удаляются первыми из-за внешних ключей.
+
+    Returns:
+        Идентификаторы, хосты и пути файлов удаленных отчетов
+    """
+    start = month_start(month)
+    end = next_month(start)
+    parent_partition = partition_name(PARENT_TABLE, start)
+
+    result = await conn.execute(text(f"SELECT id, hostname, html_file_path FROM {parent_partition}"))
+    rows = result.fetchall()
+
+    await conn.execute(
+        text("DELETE FROM report_hashes WHERE generated_at >= :start AND generated_at < :end"),
+        {"start": start, "end": end}
+    )
+
+    for table in reversed(child_tables()):
+        await conn.execute(text(f"DROP TABLE IF EXISTS {partition_name(table, start)}"))
+    await conn.execute(text(f"DROP TABLE IF EXISTS {parent_partition}"))
+
+    _known_months.discard((start.year, start.month))
+
+    logger.info(f"🗑️ Удалена секция {parent_partition}: {len(rows)} отчетов")
+    return {
+        "partition": parent_partition,
+        "report_ids": [str(row.id) for row in rows],
+        "hostnames": sorted({row.hostname for row in rows if row.hostname}),
+        "file_paths": [row.html_file_path for row in rows if row.html_file_path],
+    }
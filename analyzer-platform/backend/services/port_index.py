@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Индекс открытых портов парка: порт -> хосты и хост -> порты
+
+Строится по последнему отчету каждого хоста и живет в памяти воркера.
+Каждому хосту выдается номер бита, каждому порту (протокол, номер) -
+битовая карта хостов в виде целого Python: пересечение, объединение и
+разность ("22, но не 443") выполняются операциями &, |, & ~ над
+целыми, а число хостов - int.bit_count(), без обхода строк.
+
+Обновление:
+- прием, удаление и очистка отчетов отмечают хосты в журнале изменений
+  Redis: счетчик версии и zset хост -> версия изменения (одним скриптом);
+  воркер, изменивший хост, обновляет его у себя сразу;
+- остальные воркеры по версии забирают из журнала хосты, измененные после
+  их последней синхронизации, и перечитывают их; хост без отчетов
+  убирается из индекса;
+- периодически индекс перестраивается целиком и сохраняется снимком в
+  Redis, из которого новые воркеры прогреваются при старте.
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from itertools import islice
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core import database, redis_client
+from core.config import get_settings
+from core.redis_client import cache
+from models.report import Melt, NetworkPort
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+PortKey = Tuple[str, int]
+
+_SNAPSHOT_CATEGORY = "port_index"
+_SNAPSHOT_KEY = "snapshot"
+# Журнал изменений: версия и хосты с версией последнего изменения.
+# Член zset - имя хоста, поэтому размер журнала ограничен размером парка
+_VERSION_KEY = f"{settings.CACHE_PREFIX}port_index:version"
+_CHANGES_KEY = f"{settings.CACHE_PREFIX}port_index:changes"
+
+# Новая версия и отметка хостов атомарно: читатель, увидевший версию,
+# видит и все хосты, измененные до нее
+_MARK_CHANGED_SCRIPT = """
+local version = redis.call('incr', KEYS[1])
+for _, hostname in ipairs(ARGV) do
+    redis.call('zadd', KEYS[2], version, hostname)
+end
+return version
+"""
+
+
+class PortIndexError(ValueError):
+    """Некорректный запрос к индексу портов"""
+
+
+def parse_port_key(value: str, default_protocol: str = "tcp") -> PortKey:
+    """
+    Порт из строки "22" или "udp/53"
+
+    Raises:
+        PortIndexError: Некорректный порт или протокол
+    """
+    value = value.strip().lower()
+    protocol, _, number = value.rpartition("/")
+    protocol = protocol or default_protocol
+    if protocol not in ("tcp", "udp"):
+        raise PortIndexError(f"Неизвестный протокол: {protocol}")
+    try:
+        port = int(number)
+    except ValueError:
+        raise PortIndexError(f"Некорректный порт: {value}")
+    if not 0 <= port <= 65535:
+        raise PortIndexError(f"Порт вне диапазона: {port}")
+    return protocol, port
+
+
+def _bits(bitmap: int) -> Iterable[int]:
+    """Номера установленных битов по возрастанию (поиск по строке bin() - в C)"""
+    digits = bin(bitmap)[:1:-1]
+    position = digits.find("1")
+    while position >= 0:
+        yield position
+        position = digits.find("1", position + 1)
+
+
+class PortExposureIndex:
+    """
+    Битовые карты хостов по портам для последних отчетов парка
+    """
+
+    def __init__(self):
+        self._host_bits: Dict[str, int] = {}
+        self._hostnames: List[Optional[str]] = []
+        self._free_bits: List[int] = []
+        self._host_ports: Dict[str, FrozenSet[PortKey]] = {}
+        self._host_reports: Dict[str, Tuple[str, datetime]] = {}
+        self._ports: Dict[PortKey, int] = {}
+        self._all_hosts = 0
+
+        self.version = 0
+        self.built_at: Optional[datetime] = None
+        self.ready = False
+
+    # Обновление
+
+    def _bit_for(self, hostname: str) -> int:
+        bit = self._host_bits.get(hostname)
+        if bit is None:
+            if self._free_bits:
+                bit = self._free_bits.pop()
+                self._hostnames[bit] = hostname
+            else:
+                bit = len(self._hostnames)
+                self._hostnames.append(hostname)
+            self._host_bits[hostname] = bit
+        return bit
+
+    def set_host(self, hostname: str, report_id: str, generated_at: datetime, ports: Iterable[PortKey]) -> None:
+        """Заменяет порты хоста портами его последнего отчета"""
+        bit = self._bit_for(hostname)
+        mask = 1 << bit
+        new_ports = frozenset(ports)
+        old_ports = self._host_ports.get(hostname, frozenset())
+
+        for key in old_ports - new_ports:
+            remaining = self._ports[key] & ~mask
+            if remaining:
+                self._ports[key] = remaining
+            else:
+                del self._ports[key]
+        for key in new_ports - old_ports:
+            self._ports[key] = self._ports.get(key, 0) | mask
+
+        self._host_ports[hostname] = new_ports
+        self._host_reports[hostname] = (report_id, generated_at)
+        self._all_hosts |= mask
+
+    def remove_host(self, hostname: str) -> None:
+        """Убирает хост без отчетов из индекса"""
+        bit = self._host_bits.pop(hostname, None)
+        if bit is None:
+            return
+        mask = 1 << bit
+        for key in self._host_ports.pop(hostname, frozenset()):
+            remaining = self._ports[key] & ~mask
+            if remaining:
+                self._ports[key] = remaining
+            else:
+                del self._ports[key]
+        self._host_reports.pop(hostname, None)
+        self._all_hosts &= ~mask
+        self._hostnames[bit] = None
+        self._free_bits.append(bit)
+
+    def _replace(self, other: "PortExposureIndex") -> None:
+        """Атомарно (между await) подменяет содержимое перестроенным индексом"""
+        for name in ("_host_bits", "_hostnames", "_free_bits", "_host_ports", "_host_reports", "_ports", "_all_hosts"):
+            setattr(self, name, getattr(other, name))
+
+    # Запросы
+
+    def hosts_bitmap(self, key: PortKey) -> int:
+        return self._ports.get(key, 0)
+
+    def query(
+        self,
+        all_of: Sequence[PortKey] = (),
+        any_of: Sequence[PortKey] = (),
+        none_of: Sequence[PortKey] = ()
+    ) -> int:
+        """
+        Битовая карта хостов: слушают все all_of, хотя бы один any_of и ни одного none_of
+
+        Без all_of и any_of исходное множество - все хосты индекса.
+        """
+        result = self._all_hosts
+        for key in all_of:
+            result &= self._ports.get(key, 0)
+            if not result:
+                return 0
+        if any_of:
+            union = 0
+            for key in any_of:
+                union |= self._ports.get(key, 0)
+            result &= union
+        for key in none_of:
+            result &= ~self._ports.get(key, 0)
+        return result
+
+    def hostnames(self, bitmap: int, offset: int = 0, limit: Optional[int] = None) -> List[str]:
+        """Имена хостов битовой карты (в порядке номеров битов)"""
+        bits = islice(_bits(bitmap), offset, offset + limit if limit is not None else None)
+        return [self._hostnames[bit] for bit in bits]
+
+    def host_ports(self, hostname: str) -> Optional[Dict[str, Any]]:
+        """Порты хоста по его последнему отчету"""
+        if hostname not in self._host_ports:
+            return None
+        report_id, generated_at = self._host_reports[hostname]
+        return {
+            "hostname": hostname,
+            "report_id": report_id,
+            "generated_at": generated_at.isoformat(),
+            "ports": [f"{protocol}/{port}" for protocol, port in sorted(self._host_ports[hostname])],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "hosts": len(self._host_ports),
+            "ports": len(self._ports),
+            "built_at": self.built_at.isoformat() if self.built_at else None,
+            "version": self.version,
+        }
+
+    # Снимок
+
+    def to_snapshot(self) -> Dict[str, Any]:
+        """Компактный снимок: хост -> отчет и список портов"""
+        return {
+            "built_at": self.built_at.isoformat() if self.built_at else None,
+            "version": self.version,
+            "hosts": {
+                hostname: [report_id, generated_at.isoformat(), [f"{p}/{n}" for p, n in sorted(ports)]]
+                for hostname, ports in self._host_ports.items()
+                for report_id, generated_at in (self._host_reports[hostname],)
+            },
+        }
+
+    def load_snapshot(self, snapshot: Dict[str, Any]) -> None:
+        rebuilt = PortExposureIndex()
+        for hostname, (report_id, generated_at, ports) in snapshot.get("hosts", {}).items():
+            rebuilt.set_host(
+                hostname, report_id, datetime.fromisoformat(generated_at),
+                (parse_port_key(port) for port in ports)
+            )
+        self._replace(rebuilt)
+        self.built_at = datetime.fromisoformat(snapshot["built_at"]) if snapshot.get("built_at") else None
+        self.version = int(snapshot.get("version") or 0)
+        self.ready = True
+
+
+port_index = PortExposureIndex()
+
+
+async def _latest_reports(db: AsyncSession, hostnames: Optional[Sequence[str]] = None) -> list:
+    """Последний отчет каждого хоста (DISTINCT ON по idx_reports_hostname_date)"""
+    query = select(Melt.hostname, Melt.id, Melt.generated_at)
+    if hostnames is not None:
+        query = query.where(Melt.hostname.in_(hostnames))
+    query = query.distinct(Melt.hostname).order_by(Melt.hostname, Melt.generated_at.desc())
+    return (await db.execute(query)).fetchall()
+
+
+async def _load_hosts(db: AsyncSession, index: PortExposureIndex, hostnames: Optional[Sequence[str]] = None) -> int:
+    """Загружает порты последних отчетов хостов в индекс"""
+    reports = await _latest_reports(db, hostnames)
+    if hostnames is not None:
+        for hostname in set(hostnames) - {row.hostname for row in reports}:
+            index.remove_host(hostname)
+
+    for start in range(0, len(reports), settings.PORT_INDEX_BATCH_SIZE):
+        batch = reports[start:start + settings.PORT_INDEX_BATCH_SIZE]
+        ports: Dict[Any, set] = {row.id: set() for row in batch}
+        rows = await db.execute(
+            select(NetworkPort.report_id, NetworkPort.protocol, NetworkPort.port_number)
+            .where(tuple_(NetworkPort.report_id, NetworkPort.report_generated_at).in_(
+                [(row.id, row.generated_at) for row in batch]
+            ))
+        )
+        for row in rows:
+            ports[row.report_id].add(((row.protocol or "tcp").lower(), row.port_number))
+        for row in batch:
+            index.set_host(row.hostname, str(row.id), row.generated_at, ports[row.id])
+    return len(reports)
+
+
+async def _current_version() -> int:
+    client = redis_client.redis_client
+    if client is None:
+        raise RuntimeError("Redis не инициализирован")
+    return int(await client.get(_VERSION_KEY) or 0)
+
+
+async def mark_hosts_changed(hostnames: Iterable[Optional[str]]) -> None:
+    """
+    Отмечает хосты в журнале изменений для остальных воркеров
+
+    Вызывается после коммита приема, удаления или очистки отчетов.
+    Ошибка Redis не пробрасывается: изменение подхватит перестройка индекса.
+    """
+    hostnames = sorted({hostname for hostname in hostnames if hostname})
+    client = redis_client.redis_client
+    if not hostnames or client is None:
+        return
+    try:
+        await client.eval(_MARK_CHANGED_SCRIPT, 2, _VERSION_KEY, _CHANGES_KEY, *hostnames)
+    except Exception as e:
+        logger.warning(f"⚠️ Индекс портов: хосты не отмечены в журнале изменений: {e}")
+
+
+async def refresh_hosts(db: AsyncSession, hostnames: Sequence[Optional[str]]) -> int:
+    """
+    Отмечает хосты измененными и обновляет их в индексе этого воркера
+
+    Вызывается после коммита: хосты без отчетов убираются из индекса.
+    """
+    hostnames = sorted({hostname for hostname in hostnames if hostname})
+    if not hostnames:
+        return 0
+    await mark_hosts_changed(hostnames)
+    if not port_index.ready:
+        return 0
+    return await _load_hosts(db, port_index, hostnames)
+
+
+async def rebuild_port_index() -> int:
+    """Перестраивает индекс целиком и сохраняет снимок в Redis"""
+    started_at = datetime.utcnow()
+    # Версия до чтения БД: изменения во время сборки повторит синхронизация
+    version = await _current_version()
+    rebuilt = PortExposureIndex()
+    async with database.async_session_factory() as session:
+        hosts = await _load_hosts(session, rebuilt)
+
+    port_index._replace(rebuilt)
+    port_index.built_at = started_at
+    port_index.version = version
+    port_index.ready = True
+
+    await cache.set(_SNAPSHOT_CATEGORY, _SNAPSHOT_KEY, port_index.to_snapshot(), settings.PORT_INDEX_SNAPSHOT_TTL)
+    logger.info(f"🗺️ Индекс портов перестроен: {hosts} хостов, {len(port_index._ports)} портов")
+    return hosts
+
+
+async def warm_port_index() -> None:
+    """Прогрев индекса: из снимка Redis, если он есть, иначе полная сборка"""
+    snapshot = await cache.get(_SNAPSHOT_CATEGORY, _SNAPSHOT_KEY)
+    if isinstance(snapshot, dict) and snapshot.get("hosts") is not None:
+        port_index.load_snapshot(snapshot)
+        logger.info(f"🗺️ Индекс портов загружен из снимка: {len(port_index._host_ports)} хостов")
+    else:
+        await rebuild_port_index()
+
+
+async def sync_port_index() -> int:
+    """Перечитывает хосты, измененные в журнале после версии индекса"""
+    version = await _current_version()
+    if version < port_index.version:
+        # Счетчик сброшен (Redis очищен) - журналу больше нельзя доверять
+        logger.warning("⚠️ Индекс портов: версия журнала изменений сброшена, перестраиваем индекс")
+        return await rebuild_port_index()
+    if version == port_index.version:
+        return 0
+
+    hostnames = [
+        hostname.decode() if isinstance(hostname, bytes) else hostname
+        for hostname in await redis_client.redis_client.zrangebyscore(
+            _CHANGES_KEY, f"({port_index.version}", version
+        )
+    ]
+    refreshed = 0
+    if hostnames:
+        async with database.async_session_factory() as session:
+            refreshed = await _load_hosts(session, port_index, hostnames)
+    port_index.version = version
+    return refreshed
+
+
+async def port_index_loop() -> None:
+    """Прогрев, инкрементальная синхронизация и периодическая перестройка индекса"""
+    while not port_index.ready:
+        try:
+            await warm_port_index()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка прогрева индекса портов: {e}")
+            await asyncio.sleep(settings.PORT_INDEX_SYNC_INTERVAL_SECONDS)
+
+    while True:
+        await asyncio.sleep(settings.PORT_INDEX_SYNC_INTERVAL_SECONDS)
+        try:
+            age = datetime.utcnow() - (port_index.built_at or datetime.min)
+            if age.total_seconds() >= settings.PORT_INDEX_REBUILD_INTERVAL_SECONDS:
+                await rebuild_port_index()
+            else:
+                refreshed = await sync_port_index()
+                if refreshed:
+                    logger.debug(f"🗺️ Индекс портов: обновлено {refreshed} хостов")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка синхронизации индекса портов: {e}")
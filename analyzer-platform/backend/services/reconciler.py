@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Фоновая сверка хранилища HTML файлов и базы данных
+Находит файлы без записи в БД (переприем) и записи без файла (пометка),
+обходя хранилище и таблицу отчетов по курсорам небольшими пачками
+"""
+
+import asyncio
+import logging
+import os
+import re
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from sqlalchemy import select, text, tuple_, update
+
+from core import database
+from core.config import get_settings
+from models.report import Melt, ReportHash
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Ключ advisory lock: сверку ведет один воркер, остальные ждут
+RECONCILE_LOCK_KEY = 726_003
+
+# Имя файла, созданное create_hash_based_filename
+_HASH_FILENAME = re.compile(r"^report_([0-9A-Za-z]+)\.html$")
+
+# Сколько примеров расхождений хранить в отчете
+_SAMPLE_SIZE = 100
+
+STATUS_FILE_MISSING = "file_missing"
+STATUS_PROCESSED = "processed"
+
+
+class StorageReconciler:
+    """
+    Инкрементальная сверка файлов и строк Melt
+
+    За один шаг обрабатывается не более RECONCILE_BATCH_SIZE файлов и строк:
+    - файловый курсор - итератор os.scandir, живущий между шагами;
+    - курсор БД - последний обработанный report_hash (keyset по report_hashes).
+    Когда курсор доходит до конца, начинается следующий проход.
+    """
+
+    def __init__(self, uploads_dir: Optional[str] = None):
+        self.uploads_dir = uploads_dir or settings.UPLOAD_DIR
+        self.batch_size = settings.RECONCILE_BATCH_SIZE
+
+        self._storage_iter: Optional[Iterator[os.DirEntry]] = None
+        self._db_cursor: str = ""
+        self._reingest_semaphore = asyncio.Semaphore(settings.RECONCILE_REINGEST_CONCURRENCY)
+        self._reingest_tasks: Dict[str, asyncio.Task] = {}
+
+        self.orphan_files: Deque[str] = deque(maxlen=_SAMPLE_SIZE)
+        self.missing_files: Deque[Dict[str, Any]] = deque(maxlen=_SAMPLE_SIZE)
+        self.failed_files: Deque[Dict[str, Any]] = deque(maxlen=_SAMPLE_SIZE)
+        self.counters: Dict[str, int] = {
+            "storage_sweeps": 0,
+            "db_sweeps": 0,
+            "files_checked": 0,
+            "rows_checked": 0,
+            "orphans_found": 0,
+            "orphans_reingested": 0,
+            "orphans_relinked": 0,
+            "duplicate_files": 0,
+            "reingest_failed": 0,
+            "rows_flagged_missing": 0,
+            "rows_restored": 0,
+        }
+        self.last_step_at: Optional[str] = None
+
+    def get_drift_report(self) -> Dict[str, Any]:
+        """Текущее состояние расхождений между хранилищем и БД"""
+        return {
+            "uploads_dir": self.uploads_dir,
+            "last_step_at": self.last_step_at,
+            "storage_cursor_active": self._storage_iter is not None,
+            "db_cursor": self._db_cursor,
+            "reingest_in_progress": len(self._reingest_tasks),
+            "counters": dict(self.counters),
+            "orphan_files": list(self.orphan_files),
+            "missing_files": list(self.missing_files),
+            "failed_files": list(self.failed_files),
+        }
+
+    async def step(self) -> Dict[str, Any]:
+        """Один шаг сверки: пачка файлов и пачка строк"""
+        await self._reconcile_storage_batch()
+        await self._reconcile_db_batch()
+        self.last_step_at = datetime.utcnow().isoformat()
+        return self.get_drift_report()
+
+    def _next_storage_batch(self) -> List[os.DirEntry]:
+        """Следующая пачка файлов из файлового курсора"""
+        if self._storage_iter is None:
+            if not os.path.isdir(self.uploads_dir):
+                return []
+            self._storage_iter = os.scandir(self.uploads_dir)
+
+        batch = []
+        for entry in self._storage_iter:
+            if entry.name.endswith(".html") and not entry.name.startswith("temp_") and entry.is_file():
+                batch.append(entry)
+                if len(batch) >= self.batch_size:
+                    return batch
+
+        # Проход по хранилищу завершен
+        self._storage_iter.close()
+        self._storage_iter = None
+        self.counters["storage_sweeps"] += 1
+        return batch
+
+    async def _reconcile_storage_batch(self) -> None:
+        """Ищет файлы, которые не привязаны ни к одной строке Melt"""
+        entries = await asyncio.to_thread(self._next_storage_batch)
+        if not entries:
+            return
+
+        self.counters["files_checked"] += len(entries)
+
+        paths_by_hash: Dict[str, str] = {}
+        unnamed_paths: List[str] = []
+        for entry in entries:
+            match = _HASH_FILENAME.match(entry.name)
+            if match:
+                paths_by_hash[match.group(1)] = entry.path
+            else:
+                unnamed_paths.append(entry.path)
+
+        tracked_paths = set()
+        if paths_by_hash:
+            async with database.async_session_factory() as session:
+                result = await session.execute(
+                    select(ReportHash.report_hash, Melt.html_file_path)
+                    .join(Melt, tuple_(Melt.id, Melt.generated_at) == tuple_(ReportHash.report_id, ReportHash.generated_at))
+                    .where(ReportHash.report_hash.in_(list(paths_by_hash)))
+                )
+                for row in result:
+                    if row.html_file_path == paths_by_hash[row.report_hash]:
+                        tracked_paths.add(row.html_file_path)
+
+        # Файлы со старыми именами не содержат хеш - их хеш выясняется при переприеме
+        for path in [*paths_by_hash.values(), *unnamed_paths]:
+            if path not in tracked_paths:
+                self._schedule_reingest(path)
+
+    def _schedule_reingest(self, path: str) -> None:
+        """Ставит файл-сироту в фоновый переприем"""
+        if path in self._reingest_tasks:
+            return
+
+        self.counters["orphans_found"] += 1
+        self.orphan_files.append(path)
+        task = asyncio.create_task(self._reingest_file(path))
+        self._reingest_tasks[path] = task
+        task.add_done_callback(lambda _: self._reingest_tasks.pop(path, None))
+
+    async def _reingest_file(self, path: str) -> None:
+        """Парсит файл-сироту и сохраняет его в БД либо привязывает к существующей строке"""
+        from services.html_parser import parse_analyzer_html
+        from services.report_deduplication import generate_report_hash
+        from services.partitioning import ensure_partitions_for
+        from services.port_index import refresh_hosts
+        from services.report_ingest import lock_report_hash, resolve_generated_at, save_parsed_report
+        from core.redis_client import invalidate_report_cache
+
+        async with self._reingest_semaphore:
+            try:
+                # Парсинг BeautifulSoup синхронный - выполняем вне event loop
+                parsed_data = await asyncio.to_thread(parse_analyzer_html, path)
+                report_hash = parsed_data.get("report_hash") or await asyncio.to_thread(
+                    generate_report_hash, path, parsed_data
+                )
+
+                # Секция до транзакции: ниже она читает system_reports
+                await ensure_partitions_for(resolve_generated_at(parsed_data))
+
+                async with database.async_session_factory() as session:
+                    # Загрузка того же отчета через API ждет конца этой транзакции
+                    await lock_report_hash(session, report_hash)
+                    existing = (await session.execute(
+                        select(Melt)
+                        .join(ReportHash, tuple_(ReportHash.report_id, ReportHash.generated_at) == tuple_(Melt.id, Melt.generated_at))
+                        .where(ReportHash.report_hash == report_hash)
+                    )).scalar_one_or_none()
+
+                    if existing is None:
+                        new_melt = await save_parsed_report(
+                            session,
+                            parsed_data,
+                            report_hash=report_hash,
+                            file_path=path,
+                            file_size=os.path.getsize(path),
+                            report_id=parsed_data.get("report_id")
+                        )
+                        await session.commit()
+                        await invalidate_report_cache(str(new_melt.id))
+                        try:
+                            await refresh_hosts(session, [new_melt.hostname])
+                        except Exception as e:
+                            logger.warning(f"⚠️ Индекс портов не обновлен: {e}")
+                        self.counters["orphans_reingested"] += 1
+                        logger.info(f"♻️ Сверка: файл {os.path.basename(path)} переприят в БД")
+
+                    elif not existing.html_file_path or not os.path.exists(existing.html_file_path):
+                        # Строка потеряла свой файл - привязываем найденный
+                        existing.html_file_path = path
+                        existing.processing_status = STATUS_PROCESSED
+                        await session.commit()
+                        self.counters["orphans_relinked"] += 1
+                        logger.info(f"🔗 Сверка: файл {os.path.basename(path)} привязан к отчету {existing.id}")
+
+                    else:
+                        # Копия уже учтенного отчета - не удаляем автоматически
+                        self.counters["duplicate_files"] += 1
+                        logger.info(f"📄 Сверка: {os.path.basename(path)} дублирует {existing.html_file_path}")
+
+            except Exception as e:
+                self.counters["reingest_failed"] += 1
+                self.failed_files.append({"path": path, "error": str(e)})
+                logger.warning(f"⚠️ Сверка: не удалось переприять {path}: {e}")
+
+    async def _reconcile_db_batch(self) -> None:
+        """Помечает строки, чьи файлы пропали, и снимает пометку с восстановленных"""
+        async with database.async_session_factory() as session:
+            result = await session.execute(
+                select(
+                    ReportHash.report_hash,
+                    Melt.id,
+                    Melt.generated_at,
+                    Melt.html_file_path,
+                    Melt.processing_status
+                )
+                .join(Melt, tuple_(Melt.id, Melt.generated_at) == tuple_(ReportHash.report_id, ReportHash.generated_at))
+                .where(ReportHash.report_hash > self._db_cursor)
+                .order_by(ReportHash.report_hash)
+                .limit(self.batch_size)
+            )
+            rows = result.fetchall()
+
+            if len(rows) < self.batch_size:
+                # Проход по БД завершен - следующий шаг начнет сначала
+                self._db_cursor = ""
+                self.counters["db_sweeps"] += 1
+            else:
+                self._db_cursor = rows[-1].report_hash
+
+            if not rows:
+                return
+
+            self.counters["rows_checked"] += len(rows)
+
+            paths = [row.html_file_path for row in rows]
+            exists = await asyncio.to_thread(lambda: [bool(p) and os.path.exists(p) for p in paths])
+
+            missing_keys = []
+            restored_keys = []
+            for row, file_exists in zip(rows, exists):
+                key = (row.id, row.generated_at)
+                if not file_exists and row.processing_status != STATUS_FILE_MISSING:
+                    missing_keys.append(key)
+                    self.missing_files.append({
+                        "report_id": str(row.id),
+                        "report_hash": row.report_hash,
+                        "html_file_path": row.html_file_path,
+                    })
+                elif file_exists and row.processing_status == STATUS_FILE_MISSING:
+                    restored_keys.append(key)
+
+            for keys, new_status in ((missing_keys, STATUS_FILE_MISSING), (restored_keys, STATUS_PROCESSED)):
+                if keys:
+                    await session.execute(
+                        update(Melt)
+                        .where(tuple_(Melt.id, Melt.generated_at).in_(keys))
+                        .values(processing_status=new_status)
+                    )
+            await session.commit()
+
+            changed = [str(report_id) for report_id, _ in missing_keys + restored_keys]
+            if changed:
+                from core.redis_client import cache
+
+                # Признак наличия файла входит в сводки и детали отчетов
+                await cache.delete_many("summaries", changed)
+                await cache.delete_many("reports", changed)
+
+            self.counters["rows_flagged_missing"] += len(missing_keys)
+            self.counters["rows_restored"] += len(restored_keys)
+
+
+# Глобальный экземпляр сверки
+storage_reconciler = StorageReconciler()
+
+
+async def publish_drift_report(report: Dict[str, Any]) -> None:
+    """Публикует отчет о расхождениях для всех воркеров API"""
+    try:
+        from core.redis_client import cache
+
+        await cache.set("maintenance", "reconcile_drift", report, ttl=settings.RECONCILE_INTERVAL_SECONDS * 10)
+    except Exception as e:
+        logger.debug(f"Не удалось опубликовать отчет сверки: {e}")
+
+
+async def get_drift_report() -> Dict[str, Any]:
+    """Отчет о расхождениях: от ведущего воркера через кэш или локальный"""
+    from core.redis_client import cache
+
+    report = await cache.get("maintenance", "reconcile_drift")
+    return report or storage_reconciler.get_drift_report()
+
+
+async def reconcile_loop() -> None:
+    """
+    Фоновая сверка хранилища и БД
+
+    Сверку ведет воркер, удерживающий advisory lock; остальные периодически
+    пытаются его захватить и продолжают, если ведущий воркер остановился.
+    """
+    while True:
+        try:
+            async with database.async_engine.connect() as conn:
+                locked = (await conn.execute(
+                    text("SELECT pg_try_advisory_lock(:key)"), {"key": RECONCILE_LOCK_KEY}
+                )).scalar()
+                await conn.commit()
+
+                if locked:
+                    logger.info("🔍 Воркер ведет фоновую сверку хранилища и БД")
+                    try:
+                        while True:
+                            report = await storage_reconciler.step()
+                            await publish_drift_report(report)
+                            await asyncio.sleep(settings.RECONCILE_INTERVAL_SECONDS)
+                    finally:
+                        await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": RECONCILE_LOCK_KEY})
+                        await conn.commit()
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка фоновой сверки: {e}")
+
+        await asyncio.sleep(settings.RECONCILE_INTERVAL_SECONDS)
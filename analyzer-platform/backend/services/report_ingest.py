@@ -0,0 +1,805 @@
+#!/usr/bin/env python3
+"""
+Сервис сохранения распарсенных отчетов в базе данных
+Общий путь записи для загрузки через API и фонового переприема файлов
+"""
+
+import logging
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, insert, literal_column, or_, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import get_settings
+from models.report import (
+    AnomalyFinding, ChangeHistory, DeltaQueue, HostDelta, Melt, NetworkConnection, NetworkInterface, NetworkPort,
+    RemoteHost, ReportHash, ReportRawData, RuleAlert
+)
+from services.endpoints import is_local_ip, parse_endpoint
+from services.anomalies import evaluate_report
+from services.graph import apply_report_edges, retract_report_edges
+from services.interning import interner
+from services.metrics import refresh_metric_rollups
+from services.partitioning import ensure_partitions_for
+from services.rules import evaluate_rules
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Ключи результата парсинга, не сохраняемые в report_raw_data:
+# соединения, порты, интерфейсы и история изменений уже лежат в дочерних таблицах
+RAW_DATA_EXCLUDED_KEYS = ("connections", "ports", "change_history", "network_interfaces")
+
+# Пространство advisory lock по хешу отчета (второй ключ - hashtext(report_hash))
+REPORT_HASH_LOCK_NAMESPACE = 726_005
+
+# Колонки, по которым дочерние строки сравниваются при замене отчета.
+# IP и порты выводятся из адресов и в сравнении не нужны
+CONNECTION_IDENTITY = (
+    "connection_type", "local_address_id", "remote_address_id", "remote_hostname_id",
+    "process_name_id", "protocol", "first_seen", "last_seen", "packet_count",
+)
+PORT_IDENTITY = ("port_number", "protocol", "description_id", "service_name", "process_name_id", "status")
+REMOTE_HOST_IDENTITY = ("ip_address", "hostname", "connection_count", "first_seen", "last_seen", "is_local")
+INTERFACE_IDENTITY = ("interface_name", "packets_in", "packets_out", "bytes_in", "bytes_out")
+CHANGE_IDENTITY = ("measurement_id", "change_timestamp", "is_first_run", "changed_categories", "change_details")
+
+
+def serialize_datetime_for_json(obj):
+    """Сериализует datetime объекты для JSON"""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    elif isinstance(obj, dict):
+        return {k: serialize_datetime_for_json(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [serialize_datetime_for_json(item) for item in obj]
+    else:
+        return obj
+
+
+def build_raw_data(parsed_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Сырые данные отчета без частей, нормализованных в дочерние таблицы"""
+    return serialize_datetime_for_json({
+        key: value for key, value in parsed_data.items()
+        if key not in RAW_DATA_EXCLUDED_KEYS
+    })
+
+
+async def load_raw_data(db: AsyncSession, melt: Melt) -> Optional[Dict[str, Any]]:
+    """Сырые данные отчета (отдельный запрос к report_raw_data)"""
+    result = await db.execute(
+        select(ReportRawData.data).where(
+            ReportRawData.report_id == melt.id,
+            ReportRawData.report_generated_at == melt.generated_at
+        )
+    )
+    return result.scalar_one_or_none()
+
+
+def resolve_generated_at(parsed_data: Dict[str, Any]) -> datetime:
+    """
+    Определяет дату генерации отчета
+
+    Порядок: метатег analyzer-generated-at, last_update, first_run, текущее время.
+    Результат приводится к UTC без часового пояса (ключ секционирования).
+    """
+    generated_at = datetime.utcnow()  # По умолчанию
+
+    # Пробуем получить дату из analyzer-generated-at метатега
+    if parsed_data.get("generated_at"):
+        try:
+            # Дата в формате ISO (2024-12-25T10:30:45.123456)
+            generated_at = datetime.fromisoformat(parsed_data["generated_at"].replace('Z', '+00:00'))
+        except Exception as date_parse_error:
+            logger.warning(f"⚠️ Ошибка парсинга даты из метаданных: {date_parse_error}")
+
+    # Если не получилось, пробуем из header_info
+    elif parsed_data.get("last_update"):
+        generated_at = parsed_data["last_update"]
+
+    # Если и это не сработало, пробуем из first_run
+    elif parsed_data.get("first_run"):
+        generated_at = parsed_data["first_run"]
+
+    if isinstance(generated_at, datetime) and generated_at.tzinfo:
+        generated_at = generated_at.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return generated_at
+
+
+def count_ports(parsed_data: Dict[str, Any]) -> Tuple[int, int]:
+    """Количество TCP и UDP портов из распарсенных данных"""
+    tcp_ports_count = 0
+    udp_ports_count = 0
+
+    ports_data = parsed_data.get("ports")
+
+    # Если ports - это словарь с tcp/udp ключами
+    if isinstance(ports_data, dict):
+        tcp_ports_count = len(ports_data.get("tcp", []))
+        udp_ports_count = len(ports_data.get("udp", []))
+
+    # Если ports - это плоский список (новый формат API)
+    elif isinstance(ports_data, list):
+        for port in ports_data:
+            if isinstance(port, dict):
+                protocol = port.get('protocol', '').upper()
+                if protocol == 'TCP':
+                    tcp_ports_count += 1
+                elif protocol == 'UDP':
+                    udp_ports_count += 1
+
+    # Если не нашли в "ports", ищем в прямых полях
+    if tcp_ports_count == 0 and udp_ports_count == 0:
+        tcp_ports_count = parsed_data.get("tcp_ports_count", 0)
+        udp_ports_count = parsed_data.get("udp_ports_count", 0)
+
+    return tcp_ports_count, udp_ports_count
+
+
+def _parse_timestamp(value: Any) -> Optional[datetime]:
+    """ISO время из отчета в datetime UTC (None при ошибке)"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except Exception:
+        return None
+    # Колонки без часового пояса - храним UTC
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def build_connection_rows(connections_raw: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Нормализует соединения из отчета (строковые значения еще не интернированы)"""
+    rows = []
+    for i, conn in enumerate(connections_raw or []):
+        try:
+            # Определяем тип соединения
+            connection_type = conn.get('connection_type', 'unknown')
+            if not connection_type or connection_type == 'unknown':
+                direction = conn.get('direction', '')
+                if '📥' in direction or 'входящее' in direction.lower():
+                    connection_type = 'incoming'
+                elif '📤' in direction or 'исходящее' in direction.lower():
+                    connection_type = 'outgoing'
+                else:
+                    connection_type = 'unknown'
+
+            local_address = (conn.get('local_address') or '')[:100]  # Ограничиваем длину
+            remote_address = (conn.get('remote_address') or '')[:100]
+            local_ip, local_port = parse_endpoint(local_address)
+            remote_ip, remote_port = parse_endpoint(remote_address)
+
+            rows.append({
+                "connection_type": connection_type,
+                "local_address": local_address,
+                "remote_address": remote_address,
+                "local_ip": local_ip,
+                "local_port": local_port,
+                "remote_ip": remote_ip,
+                "remote_port": remote_port,
+                "remote_hostname": (conn.get('remote_hostname') or '')[:255],
+                "process_name": (conn.get('process_name') or '')[:255],
+                "protocol": (conn.get('protocol') or 'unknown')[:10],
+                "first_seen": _parse_timestamp(conn.get('first_seen')),
+                "last_seen": _parse_timestamp(conn.get('last_seen')),
+                "packet_count": conn.get('packet_count', 0),
+            })
+        except Exception as conn_error:
+            logger.warning(f"⚠️ Ошибка разбора соединения {i}: {conn_error}")
+    return rows
+
+
+def build_port_rows(ports_raw: Any) -> List[Dict[str, Any]]:
+    """Нормализует TCP/UDP порты из отчета"""
+    rows = []
+    if not isinstance(ports_raw, dict):
+        return rows
+
+    for protocol in ('tcp', 'udp'):
+        for port_info in ports_raw.get(protocol, []):
+            try:
+                port_number = port_info.get('port_number') if isinstance(port_info, dict) else port_info
+                if not isinstance(port_number, int):
+                    continue
+
+                default_description = f'{protocol.upper()} порт {port_number}'
+                details = port_info if isinstance(port_info, dict) else {}
+                rows.append({
+                    "port_number": port_number,
+                    "protocol": protocol,
+                    "description": (details.get('description') or default_description)[:500],
+                    "service_name": (details.get('service_name') or '')[:100],
+                    "process_name": (details.get('process_name') or '')[:255],
+                })
+            except Exception as port_error:
+                logger.warning(f"⚠️ Ошибка разбора {protocol.upper()} порта: {port_error}")
+    return rows
+
+
+def build_change_rows(changes_raw: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Нормализует историю изменений из отчета (записи без времени пропускаются)"""
+    rows = []
+    for change in changes_raw or []:
+        timestamp = change.get('change_timestamp')
+        if not isinstance(timestamp, datetime):
+            timestamp = _parse_timestamp(timestamp)
+        elif timestamp.tzinfo:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        if timestamp is None:
+            continue
+
+        rows.append({
+            "measurement_id": change.get('measurement_id'),
+            "change_timestamp": timestamp,
+            "is_first_run": bool(change.get('is_first_run')),
+            "changed_categories": list(change.get('changed_categories') or []),
+            "change_details": change.get('change_details') or None,
+        })
+    return rows
+
+
+def build_remote_host_rows(connection_rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Агрегаты удаленных хостов отчета за один проход по соединениям
+
+    Ключ - удаленный IP; считаются число соединений, самое раннее и самое
+    позднее время, имя хоста - самое частое из встреченных.
+    """
+    hosts: Dict[Any, Dict[str, Any]] = {}
+    for row in connection_rows:
+        ip = row.get("remote_ip")
+        if ip is None:
+            continue
+
+        host = hosts.get(ip)
+        if host is None:
+            host = hosts[ip] = {"count": 0, "first_seen": None, "last_seen": None, "hostnames": Counter()}
+        host["count"] += 1
+
+        first_seen = row.get("first_seen") or row.get("last_seen")
+        last_seen = row.get("last_seen") or row.get("first_seen")
+        if first_seen and (host["first_seen"] is None or first_seen < host["first_seen"]):
+            host["first_seen"] = first_seen
+        if last_seen and (host["last_seen"] is None or last_seen > host["last_seen"]):
+            host["last_seen"] = last_seen
+        if row.get("remote_hostname"):
+            host["hostnames"][row["remote_hostname"]] += 1
+
+    return [
+        {
+            "ip_address": str(ip),
+            "hostname": host["hostnames"].most_common(1)[0][0] if host["hostnames"] else None,
+            "connection_count": host["count"],
+            "first_seen": host["first_seen"],
+            "last_seen": host["last_seen"],
+            "is_local": is_local_ip(ip),
+        }
+        for ip, host in hosts.items()
+    ]
+
+
+def build_interface_rows(interfaces_raw: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Нормализует сетевые интерфейсы из отчета"""
+    rows = []
+    for interface in interfaces_raw or []:
+        name = (interface.get('interface_name') or '').strip()
+        if not name:
+            continue
+        rows.append({
+            "interface_name": name[:100],
+            "packets_in": interface.get('packets_in', 0) or 0,
+            "packets_out": interface.get('packets_out', 0) or 0,
+            "bytes_in": interface.get('bytes_in', 0) or 0,
+            "bytes_out": interface.get('bytes_out', 0) or 0,
+        })
+    return rows
+
+
+def child_values(melt_id: uuid.UUID, generated_at: datetime, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Строки дочерней таблицы отчета без справочных значений"""
+    return [
+        {"id": uuid.uuid4(), "report_id": melt_id, "report_generated_at": generated_at, **row}
+        for row in rows
+    ]
+
+
+async def _insert_chunked(db: AsyncSession, model, rows: List[Dict[str, Any]]) -> None:
+    """Вставка пачками одной командой INSERT на пачку"""
+    chunk_size = settings.INGEST_INSERT_CHUNK
+    for start in range(0, len(rows), chunk_size):
+        await db.execute(insert(model), rows[start:start + chunk_size])
+
+
+async def connection_values(melt_id: uuid.UUID, generated_at: datetime, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Строки network_connections отчета со строками, замененными ключами справочников"""
+    if not rows:
+        return []
+
+    keys = await interner.intern_connections(rows)
+    addresses, hostnames, processes = keys["addresses"], keys["hostnames"], keys["processes"]
+
+    return [
+        {
+            "id": uuid.uuid4(),
+            "report_id": melt_id,
+            "report_generated_at": generated_at,
+            "connection_type": row["connection_type"],
+            "local_address_id": addresses.get(row["local_address"]),
+            "remote_address_id": addresses.get(row["remote_address"]),
+            "remote_hostname_id": hostnames.get(row["remote_hostname"]),
+            "process_name_id": processes.get(row["process_name"]),
+            "protocol": row["protocol"],
+            "local_ip": row["local_ip"],
+            "local_port": row["local_port"],
+            "remote_ip": row["remote_ip"],
+            "remote_port": row["remote_port"],
+            "first_seen": row["first_seen"],
+            "last_seen": row["last_seen"],
+            "packet_count": row["packet_count"],
+            "connection_status": "active",
+            "bytes_sent": 0,
+            "bytes_received": 0,
+        }
+        for row in rows
+    ]
+
+
+async def port_values(melt_id: uuid.UUID, generated_at: datetime, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Строки network_ports отчета со строками, замененными ключами справочников"""
+    if not rows:
+        return []
+
+    keys = await interner.intern_ports(rows)
+    descriptions, processes = keys["descriptions"], keys["processes"]
+
+    return [
+        {
+            "id": uuid.uuid4(),
+            "report_id": melt_id,
+            "report_generated_at": generated_at,
+            "port_number": row["port_number"],
+            "protocol": row["protocol"],
+            "description_id": descriptions.get(row["description"]),
+            "service_name": row["service_name"],
+            "process_name_id": processes.get(row["process_name"]),
+            "status": "listening",
+        }
+        for row in rows
+    ]
+
+
+async def insert_connections(db: AsyncSession, melt: Melt, rows: List[Dict[str, Any]]) -> None:
+    """Вставляет соединения отчета, заменяя строки ключами справочников"""
+    await _insert_chunked(db, NetworkConnection, await connection_values(melt.id, melt.generated_at, rows))
+
+
+async def insert_ports(db: AsyncSession, melt: Melt, rows: List[Dict[str, Any]]) -> None:
+    """Вставляет порты отчета, заменяя строки ключами справочников"""
+    await _insert_chunked(db, NetworkPort, await port_values(melt.id, melt.generated_at, rows))
+
+
+def build_melt_values(
+    parsed_data: Dict[str, Any],
+    report_hash: str,
+    file_path: str,
+    file_size: int
+) -> Dict[str, Any]:
+    """Значения колонок system_reports для распарсенного отчета"""
+    hostname = parsed_data.get("hostname", "unknown")
+    report_generated_at = resolve_generated_at(parsed_data)
+    tcp_ports_count, udp_ports_count = count_ports(parsed_data)
+
+    logger.debug(f"📅 Дата отчета {hostname}: {report_generated_at}, порты TCP={tcp_ports_count}, UDP={udp_ports_count}")
+
+    return {
+        "report_hash": report_hash,
+        "hostname": hostname,
+        "report_title": f"Отчет анализатора - {hostname}",
+        "generated_at": report_generated_at,
+        "os_name": parsed_data.get("os_name", ""),
+        "os_version": parsed_data.get("os_version", ""),
+        "html_file_path": file_path,
+        "file_size": file_size,
+        "total_connections": parsed_data.get("total_connections", 0),
+        "incoming_connections": parsed_data.get("incoming_connections", 0),
+        "outgoing_connections": parsed_data.get("outgoing_connections", 0),
+        # Соединения по протоколам (из stat-card элементов)
+        "tcp_connections": parsed_data.get("tcp_connections", 0),
+        "udp_connections": parsed_data.get("udp_connections", 0),
+        "icmp_connections": parsed_data.get("icmp_connections", 0),
+        "unique_processes": parsed_data.get("unique_processes", 0),
+        "unique_hosts": parsed_data.get("unique_hosts", 0),
+        # Порты (отдельно от соединений)
+        "tcp_ports_count": tcp_ports_count,
+        "udp_ports_count": udp_ports_count,
+        "change_events_count": parsed_data.get("change_events_count", 0),
+        "processing_status": "processed",
+    }
+
+
+async def schedule_host_delta(db: AsyncSession, melt_id: uuid.UUID, hostname: str, generated_at: datetime) -> None:
+    """
+    Ставит отчет в очередь вычисления дельты (services/delta.py)
+
+    Устаревают дельта самого отчета, дельты с ним в качестве базы и дельты
+    более поздних отчетов хоста, база которых старше этого отчета (отчет
+    принят не по порядку). Они удаляются и ставятся в очередь заново.
+    """
+    stale = (await db.execute(
+        delete(HostDelta)
+        .where(
+            HostDelta.hostname == hostname,
+            or_(
+                HostDelta.report_id == melt_id,
+                HostDelta.against_report_id == melt_id,
+                and_(
+                    HostDelta.report_generated_at > generated_at,
+                    or_(HostDelta.against_generated_at.is_(None), HostDelta.against_generated_at < generated_at),
+                ),
+            ),
+        )
+        .returning(HostDelta.report_id, HostDelta.report_generated_at)
+    )).fetchall()
+
+    queued = {melt_id: generated_at, **{row.report_id: row.report_generated_at for row in stale}}
+    queue_insert = pg_insert(DeltaQueue).values([
+        {"report_id": report_id, "report_generated_at": report_generated_at, "enqueued_at": datetime.utcnow()}
+        for report_id, report_generated_at in queued.items()
+    ])
+    await db.execute(queue_insert.on_conflict_do_update(
+        index_elements=[DeltaQueue.report_id],
+        set_={"report_generated_at": queue_insert.excluded.report_generated_at, "attempts": 0, "last_error": None}
+    ))
+
+
+async def _insert_report(
+    db: AsyncSession,
+    parsed_data: Dict[str, Any],
+    values: Dict[str, Any],
+    melt_id: Optional[uuid.UUID]
+) -> Melt:
+    """
+    Вставляет строку отчета, сырые данные и дочерние строки
+
+    Секция месяца отчета создается вызывающим кодом до первого обращения
+    транзакции к system_reports (см. ensure_partitions_for).
+    """
+    new_melt = Melt(id=melt_id, **values)
+    db.add(new_melt)
+    await db.flush()  # Получаем ID без коммита
+
+    db.add(ReportRawData(
+        report_id=new_melt.id,
+        report_generated_at=new_melt.generated_at,
+        data=build_raw_data(parsed_data)
+    ))
+
+    # Сохраняем связанные данные (соединения, порты) в той же транзакции
+    connection_rows = build_connection_rows(parsed_data.get("connections", []))
+    port_rows = build_port_rows(parsed_data.get("ports", {}))
+    
+    change_rows = build_change_rows(parsed_data.get("change_history", []))
+    host_rows = build_remote_host_rows(connection_rows)
+    interface_rows = build_interface_rows(parsed_data.get("network_interfaces", []))
+    
+    connections = await connection_values(new_melt.id, new_melt.generated_at, connection_rows)
+    await _insert_chunked(db, NetworkConnection, connections)
+    ports = await port_values(new_melt.id, new_melt.generated_at, port_rows)
+    await _insert_chunked(db, NetworkPort, ports)
+    for model, rows in ((ChangeHistory, change_rows), (RemoteHost, host_rows), (NetworkInterface, interface_rows)):
+        await _insert_chunked(db, model, child_values(new_melt.id, new_melt.generated_at, rows))
+    
+    await schedule_host_delta(db, new_melt.id, new_melt.hostname, new_melt.generated_at)
+    await refresh_metric_rollups(db, new_melt.hostname, [new_melt.generated_at])
+    await apply_report_edges(db, new_melt.hostname, new_melt.generated_at, connections)
+    await evaluate_report(db, new_melt.id, new_melt.generated_at, new_melt.hostname, connections, ports)
+    await evaluate_rules(db, new_melt, connections, ports)
+    
+    logger.debug(
+        f"🔗 Сохранено {len(connection_rows)} соединений, {len(port_rows)} портов, {len(change_rows)} изменений, "
+        f"{len(host_rows)} удаленных хостов, {len(interface_rows)} интерфейсов"
+    )
+    
+    return new_melt
+
+
+async def save_parsed_report(
+    db: AsyncSession,
+    parsed_data: Dict[str, Any],
+    report_hash: str,
+    file_path: str,
+    file_size: int,
+    report_id: Optional[str] = None
+) -> Melt:
+    """
+    Сохраняет новый отчет и связанные данные в текущей транзакции
+
+    Коммит выполняет вызывающий код. Для отчета, хеш которого может уже
+    существовать, используйте upsert_parsed_report. Если транзакция уже
+    читала system_reports, секцию месяца отчета нужно создать заранее
+    (ensure_partitions_for) - иначе DDL ждет эту же транзакцию.
+
+    Args:
+        db: Сессия БД
+        parsed_data: Результат parse_analyzer_html_file
+        report_hash: Хеш отчета (из метаданных или сгенерированный)
+        file_path: Путь к HTML файлу в хранилище
+        file_size: Размер HTML файла
+        report_id: ID отчета из HTML метаданных (если есть)
+
+    Returns:
+        Созданный Melt (после flush)
+    """
+    values = build_melt_values(parsed_data, report_hash, file_path, file_size)
+    await ensure_partitions_for(values["generated_at"])
+
+    # Создаем новую запись Melt используя ID из HTML если есть
+    new_melt = await _insert_report(db, parsed_data, values, uuid.UUID(report_id) if report_id else None)
+
+    db.add(ReportHash(
+        report_hash=report_hash,
+        report_id=new_melt.id,
+        generated_at=new_melt.generated_at
+    ))
+    
+    return new_melt
+
+
+async def lock_report_hash(db: AsyncSession, report_hash: str) -> None:
+    """
+    Блокировка хеша до конца транзакции
+
+    Параллельные загрузки одного отчета (API, сверка) выполняются по очереди.
+    """
+    await db.execute(
+        text("SELECT pg_advisory_xact_lock(:namespace, hashtext(:report_hash))"),
+        {"namespace": REPORT_HASH_LOCK_NAMESPACE, "report_hash": report_hash}
+    )
+
+
+def _identity_key(values) -> tuple:
+    """Хешируемый ключ строки (массивы - кортежами)"""
+    return tuple(tuple(value) if isinstance(value, list) else value for value in values)
+
+
+async def _replace_children(
+    db: AsyncSession,
+    model,
+    report_id: uuid.UUID,
+    generated_at: datetime,
+    new_rows: List[Dict[str, Any]],
+    identity: Tuple[str, ...]
+) -> Dict[str, int]:
+    """
+    Заменяет дочерние строки отчета разностью множеств
+
+    Строки сравниваются по колонкам identity как мультимножества: совпавшие
+    остаются на месте, лишние удаляются, недостающие вставляются.
+    """
+    result = await db.execute(
+        select(model.id, *(getattr(model, column) for column in identity))
+        .where(model.report_id == report_id, model.report_generated_at == generated_at)
+    )
+    existing: Dict[tuple, List[uuid.UUID]] = defaultdict(list)
+    for row in result:
+        existing[_identity_key(row[1:])].append(row.id)
+
+    to_insert = []
+    for values in new_rows:
+        ids = existing.get(_identity_key(values[column] for column in identity))
+        if ids:
+            ids.pop()
+        else:
+            to_insert.append(values)
+
+    stale_ids = [row_id for ids in existing.values() for row_id in ids]
+    chunk_size = settings.INGEST_INSERT_CHUNK
+    for start in range(0, len(stale_ids), chunk_size):
+        await db.execute(
+            delete(model).where(
+                model.report_generated_at == generated_at,
+                model.id.in_(stale_ids[start:start + chunk_size])
+            )
+        )
+    await _insert_chunked(db, model, to_insert)
+
+    return {
+        "kept": len(new_rows) - len(to_insert),
+        "deleted": len(stale_ids),
+        "inserted": len(to_insert),
+    }
+
+
+async def _clear_rule_alerts(db: AsyncSession, melt_id: uuid.UUID, generated_at: datetime) -> None:
+    """
+    Удаляет оповещения прежней версии отчета, заменяемого на месте
+
+    Строка отчета не удаляется, поэтому каскад внешнего ключа их не снимает,
+    а повторная проверка правилами дублировала бы их.
+    """
+    await db.execute(
+        delete(RuleAlert).where(RuleAlert.report_id == melt_id, RuleAlert.report_generated_at == generated_at)
+    )
+
+
+async def _take_findings(db: AsyncSession, melt_id: uuid.UUID, generated_at: datetime) -> List[Dict[str, Any]]:
+    """
+    Находки отчета до удаления его строки каскадом
+
+    Базовая линия уже учла отчет, и повторная проверка новых находок не даст
+    (см. evaluate_report) - находки переносятся к строке с новой датой.
+    """
+    rows = (await db.execute(
+        select(AnomalyFinding).where(
+            AnomalyFinding.report_id == melt_id,
+            AnomalyFinding.report_generated_at == generated_at
+        )
+    )).scalars().all()
+    return [
+        {column.name: getattr(row, column.key) for column in AnomalyFinding.__table__.columns}
+        for row in rows
+    ]
+
+
+async def _replace_report_in_place(
+    db: AsyncSession,
+    parsed_data: Dict[str, Any],
+    values: Dict[str, Any],
+    melt_id: uuid.UUID
+) -> Melt:
+    """Обновляет отчет с тем же ключом секции: строка, сырые данные и разность дочерних строк"""
+    generated_at = values["generated_at"]
+
+    await db.execute(
+        update(Melt)
+        .where(Melt.id == melt_id, Melt.generated_at == generated_at)
+        .values(**values, updated_at=datetime.utcnow())
+    )
+
+    raw_insert = pg_insert(ReportRawData).values(
+        report_id=melt_id,
+        report_generated_at=generated_at,
+        data=build_raw_data(parsed_data)
+    )
+    await db.execute(raw_insert.on_conflict_do_update(
+        index_elements=[ReportRawData.report_id, ReportRawData.report_generated_at],
+        set_={"data": raw_insert.excluded.data}
+    ))
+
+    connection_rows = build_connection_rows(parsed_data.get("connections", []))
+    port_rows = build_port_rows(parsed_data.get("ports", {}))
+
+    # Вклад прежней версии в граф вычитается до замены соединений
+    await retract_report_edges(db, values["hostname"], melt_id, generated_at)
+    new_connections = await connection_values(melt_id, generated_at, connection_rows)
+    connections = await _replace_children(
+        db, NetworkConnection, melt_id, generated_at, new_connections, CONNECTION_IDENTITY
+    )
+    new_ports = await port_values(melt_id, generated_at, port_rows)
+    ports = await _replace_children(db, NetworkPort, melt_id, generated_at, new_ports, PORT_IDENTITY)
+    derived = {
+        "changes": (ChangeHistory, build_change_rows(parsed_data.get("change_history", [])), CHANGE_IDENTITY),
+        "remote_hosts": (RemoteHost, build_remote_host_rows(connection_rows), REMOTE_HOST_IDENTITY),
+        "interfaces": (NetworkInterface, build_interface_rows(parsed_data.get("network_interfaces", [])), INTERFACE_IDENTITY),
+    }
+    replaced = {
+        name: await _replace_children(db, model, melt_id, generated_at, child_values(melt_id, generated_at, rows), identity)
+        for name, (model, rows, identity) in derived.items()
+    }
+    logger.debug(f"🔁 Соединения {connections}, порты {ports}, {replaced}")
+    await schedule_host_delta(db, melt_id, values["hostname"], generated_at)
+    await refresh_metric_rollups(db, values["hostname"], [generated_at])
+    await apply_report_edges(db, values["hostname"], generated_at, new_connections)
+
+    result = await db.execute(
+        select(Melt)
+        .where(Melt.id == melt_id, Melt.generated_at == generated_at)
+        .execution_options(populate_existing=True)
+    )
+    melt = result.scalar_one()
+
+    # Те же проверки, что при вставке. Отчет уже учтен в базовой линии -
+    # evaluate_report его пропускает, и находки первой проверки остаются;
+    # правила проверяются заново
+    await _clear_rule_alerts(db, melt_id, generated_at)
+    await evaluate_report(db, melt_id, generated_at, melt.hostname, new_connections, new_ports)
+    await evaluate_rules(db, melt, new_connections, new_ports)
+    return melt
+
+
+async def upsert_parsed_report(
+    db: AsyncSession,
+    parsed_data: Dict[str, Any],
+    report_hash: str,
+    file_path: str,
+    file_size: int,
+    report_id: Optional[str] = None
+) -> Tuple[Melt, Optional[Dict[str, Any]]]:
+    """
+    Сохраняет отчет, заменяя существующий с тем же хешем, в текущей транзакции
+
+    Хеш регистрируется через INSERT ... ON CONFLICT (report_hash) под
+    advisory lock хеша. При замене отчет сохраняет свой ID; если дата
+    отчета (ключ секции) не изменилась, строка обновляется на месте,
+    а дочерние строки заменяются разностью множеств. Иначе старая строка
+    удаляется каскадом в БД и вставляется новая. Между удалением и вставкой
+    нет окна без данных - все в одной транзакции, коммит выполняет
+    вызывающий код.
+
+    Returns:
+        (Melt, сведения о замененном отчете или None)
+    """
+    values = build_melt_values(parsed_data, report_hash, file_path, file_size)
+    generated_at = values["generated_at"]
+    # DDL секции идет отдельным соединением и требует ACCESS EXCLUSIVE на
+    # system_reports: до первого обращения транзакции к таблице, иначе
+    # соединение ждет само себя (удаление старой строки при замене)
+    await ensure_partitions_for(generated_at)
+
+    await lock_report_hash(db, report_hash)
+
+    new_id = uuid.UUID(report_id) if report_id else uuid.uuid4()
+
+    registry_insert = pg_insert(ReportHash).values(
+        report_hash=report_hash,
+        report_id=new_id,
+        generated_at=generated_at
+    )
+    registered = (await db.execute(
+        registry_insert.on_conflict_do_update(
+            index_elements=[ReportHash.report_hash],
+            set_={"report_hash": registry_insert.excluded.report_hash}
+        ).returning(
+            ReportHash.report_id,
+            ReportHash.generated_at,
+            literal_column("xmax = 0").label("inserted")
+        )
+    )).one()
+
+    if registered.inserted:
+        return await _insert_report(db, parsed_data, values, new_id), None
+
+    melt_id, previous_generated_at = registered.report_id, registered.generated_at
+    previous = (await db.execute(
+        select(Melt.hostname, Melt.html_file_path)
+        .where(Melt.id == melt_id, Melt.generated_at == previous_generated_at)
+    )).one_or_none()
+
+    replaced = {
+        "id": str(melt_id),
+        "hostname": previous.hostname if previous else None,
+        "generated_at": previous_generated_at.isoformat(),
+        "file_path": previous.html_file_path if previous else None,
+        "report_hash": report_hash,
+    }
+
+    if previous is not None and previous_generated_at == generated_at:
+        return await _replace_report_in_place(db, parsed_data, values, melt_id), replaced
+
+    # Дата отчета изменилась (другая секция) или строка реестра осиротела:
+    # удаляем старую строку каскадом в БД и вставляем новую с тем же ID
+    if previous is not None:
+        await retract_report_edges(db, previous.hostname, melt_id, previous_generated_at)
+    findings = await _take_findings(db, melt_id, previous_generated_at)
+    await db.execute(delete(Melt).where(Melt.id == melt_id, Melt.generated_at == previous_generated_at))
+    await db.execute(
+        update(ReportHash)
+        .where(ReportHash.report_hash == report_hash)
+        .values(generated_at=generated_at)
+    )
+    new_melt = await _insert_report(db, parsed_data, values, melt_id)
+    if findings:
+        await db.execute(insert(AnomalyFinding), [
+            {**finding, "report_generated_at": generated_at} for finding in findings
+        ])
+    if previous is not None:
+        # Корзины прежней даты отчета теряют его значения
+        await refresh_metric_rollups(db, previous.hostname, [previous_generated_at])
+    return new_melt, replaced
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Движок хранения (retention) отчетов анализатора
+Удаляет устаревшие Melt целыми месячными секциями (или пачками ограниченного
+размера, если схема еще не секционирована), освобождает HTML файлы
+и обновляет агрегаты по парку хостов
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from core import database
+from core.config import get_settings
+from services import partitioning
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Ключ advisory lock, чтобы очистку выполнял только один воркер uvicorn
+RETENTION_LOCK_KEY = 726_001
+
+
+def _report_child_tables() -> List[str]:
+    """
+    Возвращает таблицы, ссылающиеся на system_reports
+
+    Каскад в БД не объявлен (он есть только в ORM), поэтому дочерние строки
+    удаляются явно перед удалением самих отчетов.
+    """
+    import models.report  # noqa: F401 - регистрирует модели в метаданных
+
+    child_tables = []
+    for table in database.Base.metadata.sorted_tables:
+        if any(fk.column.table.name == "system_reports" for fk in table.foreign_keys):
+            child_tables.append(table.name)
+    return child_tables
+
+
+class RetentionEngine:
+    """
+    Очистка устаревших отчетов
+
+    В секционированной схеме месяц удаляется целиком через DROP секций -
+    без мертвых кортежей и VACUUM. Месяц удаляется, когда срок хранения
+    истек для всех его отчетов (по generated_at).
+
+    Без секций каждая пачка удаляется в отдельной короткой транзакции
+    (SKIP LOCKED), поэтому длинных блокировок и всплесков WAL нет.
+    Файлы в обоих режимах освобождаются асинхронно.
+    """
+
+    def __init__(self):
+        self.batch_size = settings.RETENTION_BATCH_SIZE
+        self.batch_pause = settings.RETENTION_BATCH_PAUSE_MS / 1000
+        self.archive_dir = settings.RETENTION_ARCHIVE_DIR
+        self._file_semaphore = asyncio.Semaphore(settings.RETENTION_FILE_CONCURRENCY)
+        self._run_lock = asyncio.Lock()
+        self._file_tasks: List[asyncio.Task] = []
+        self._started_monotonic = 0.0
+
+        self.progress: Dict[str, Any] = self._empty_progress()
+        self.last_run: Optional[Dict[str, Any]] = None
+        self.totals: Dict[str, int] = {
+            "runs": 0,
+            "reports_deleted": 0,
+            "rows_deleted": 0,
+            "files_removed": 0,
+            "files_archived": 0,
+            "files_failed": 0,
+        }
+
+    def _empty_progress(self) -> Dict[str, Any]:
+        return {
+            "running": False,
+            "mode": None,
+            "started_at": None,
+            "cutoff": None,
+            "batches": 0,
+            "partitions_dropped": [],
+            "reports_deleted": 0,
+            "rows_deleted": {},
+            "files_removed": 0,
+            "files_archived": 0,
+            "files_failed": 0,
+        }
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Прогресс текущего запуска, итог прошлого и накопленные счетчики"""
+        progress = dict(self.progress)
+        if progress["running"]:
+            elapsed = time.monotonic() - self._started_monotonic
+            progress["elapsed_seconds"] = round(elapsed, 3)
+            progress["reports_per_second"] = round(progress["reports_deleted"] / elapsed, 2) if elapsed > 0 else 0.0
+
+        return {
+            "enabled": settings.RETENTION_ENABLED,
+            "retention_days": settings.REPORT_CLEANUP_DAYS,
+            "batch_size": self.batch_size,
+            "archive_dir": self.archive_dir,
+            "current": progress,
+            "last_run": self.last_run,
+            "totals": dict(self.totals),
+        }
+
+    async def run(self, days: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Удаляет отчеты старше указанного количества дней
+
+        Args:
+            days: Срок хранения, по умолчанию REPORT_CLEANUP_DAYS
+
+        Returns:
+            Итог запуска
+        """
+        if not database.async_session_factory:
+            raise RuntimeError("База данных не инициализирована")
+
+        days = days if days is not None else settings.REPORT_CLEANUP_DAYS
+
+        async with self._run_lock:
+            cutoff = datetime.utcnow() - timedelta(days=days)
+            started = self._started_monotonic = time.monotonic()
+            self.progress = self._empty_progress()
+            self.progress.update({
+                "running": True,
+                "started_at": datetime.utcnow().isoformat(),
+                "cutoff": cutoff.isoformat(),
+            })
+
+            try:
+                async with database.async_engine.connect() as conn:
+                    partitioned = await partitioning.is_partitioned(conn)
+
+                if partitioned:
+                    self.progress["mode"] = "partitions"
+                    await self._drop_expired_partitions(cutoff)
+                else:
+                    self.progress["mode"] = "batches"
+                    await self._delete_in_batches(cutoff)
+
+                await self._prune_metric_rollups()
+
+                # Ждем освобождения файлов текущего запуска
+                if self._file_tasks:
+                    await asyncio.gather(*self._file_tasks, return_exceptions=True)
+                    self._file_tasks = []
+
+            finally:
+                elapsed = time.monotonic() - started
+                self.progress["running"] = False
+
+                summary = {
+                    **self.progress,
+                    "finished_at": datetime.utcnow().isoformat(),
+                    "elapsed_seconds": round(elapsed, 3),
+                    "reports_per_second": round(self.progress["reports_deleted"] / elapsed, 2) if elapsed > 0 else 0.0,
+                }
+                self.last_run = summary
+
+                self.totals["runs"] += 1
+                self.totals["reports_deleted"] += self.progress["reports_deleted"]
+                self.totals["rows_deleted"] += sum(self.progress["rows_deleted"].values())
+                for counter in ("files_removed", "files_archived", "files_failed"):
+                    self.totals[counter] += self.progress[counter]
+
+            logger.info(
+                f"🧹 Retention: удалено {summary['reports_deleted']} отчетов старше {days} дней "
+                f"за {summary['batches']} пачек ({summary['elapsed_seconds']}s)"
+            )
+            return summary
+
+    async def _drop_expired_partitions(self, cutoff: datetime) -> None:
+        """Удаляет месячные секции, целиком вышедшие за срок хранения"""
+        async with database.async_engine.connect() as conn:
+            months = await partitioning.list_partition_months(conn)
+
+        for month in months:
+            if partitioning.next_month(month) > cutoff:
+                break
+
+            async with database.async_engine.begin() as conn:
+                dropped = await partitioning.drop_month_partition(conn, month)
+
+            self.progress["batches"] += 1
+            self.progress["partitions_dropped"].append(dropped["partition"])
+            self.progress["reports_deleted"] += len(dropped["report_ids"])
+
+            await self._refresh_aggregates(dropped["report_ids"], dropped["hostnames"])
+            self._schedule_file_reclaim(dropped["file_paths"])
+
+    async def _delete_in_batches(self, cutoff: datetime) -> None:
+        """Удаляет отчеты пачками (схема без секций)"""
+        child_tables = _report_child_tables()
+
+        while True:
+            deleted = await self._delete_batch(cutoff, child_tables)
+            if not deleted:
+                break
+
+            await self._refresh_aggregates(
+                [report_id for report_id, _, _ in deleted],
+                [hostname for _, hostname, _ in deleted]
+            )
+            self._schedule_file_reclaim([path for _, _, path in deleted if path])
+
+            if len(deleted) < self.batch_size:
+                break
+            await asyncio.sleep(self.batch_pause)
+
+    async def _delete_batch(self, cutoff: datetime, child_tables: List[str]) -> List[Tuple[str, str, Optional[str]]]:
+        """Удаляет одну пачку отчетов в отдельной транзакции"""
+        async with database.async_session_factory() as session:
+            async with session.begin():
+                result = await session.execute(
+                    text("""
+                        SELECT id, hostname, html_file_path, report_hash
+                        FROM system_reports
+                        WHERE generated_at < :cutoff
+                        ORDER BY generated_at
+                        LIMIT :batch_size
+                        FOR UPDATE SKIP LOCKED
+                    """),
+                    {"cutoff": cutoff, "batch_size": self.batch_size}
+                )
+                rows = result.fetchall()
+                if not rows:
+                    return []
+
+                report_ids = [row.id for row in rows]
+
+                for table_name in child_tables:
+                    child_result = await session.execute(
+                        text(f"DELETE FROM {table_name} WHERE report_id = ANY(:ids)"),
+                        {"ids": report_ids}
+                    )
+                    rows_deleted = self.progress["rows_deleted"]
+                    rows_deleted[table_name] = rows_deleted.get(table_name, 0) + (child_result.rowcount or 0)
+
+                await session.execute(
+                    text("DELETE FROM system_reports WHERE id = ANY(:ids)"),
+                    {"ids": report_ids}
+                )
+                await session.execute(
+                    text("DELETE FROM report_hashes WHERE report_hash = ANY(:hashes)"),
+                    {"hashes": [row.report_hash for row in rows]}
+                )
+
+        self.progress["batches"] += 1
+        self.progress["reports_deleted"] += len(rows)
+        rows_deleted = self.progress["rows_deleted"]
+        rows_deleted["system_reports"] = rows_deleted.get("system_reports", 0) + len(rows)
+
+        return [(str(row.id), row.hostname, row.html_file_path) for row in rows]
+
+    async def _prune_metric_rollups(self) -> None:
+        """Удаляет устаревшие часовые корзины рядов (суточные не трогаются)"""
+        from services.metrics import prune_hourly_rollups
+
+        cutoff = datetime.utcnow() - timedelta(days=settings.SERIES_HOURLY_RETENTION_DAYS)
+        async with database.async_session_factory() as session:
+            deleted = await prune_hourly_rollups(session, cutoff)
+            await session.commit()
+        if deleted:
+            logger.info(f"🧹 Retention: удалено {deleted} часовых корзин рядов")
+
+    async def _refresh_aggregates(self, report_ids: List[str], hostnames: List[str]) -> None:
+        """Обновляет после удаления отчетов указатели дельт, кэш агрегатов и индекс портов"""
+        try:
+            from services.delta import forget_deleted_reports
+
+            async with database.async_session_factory() as session:
+                pointers = await forget_deleted_reports(session, report_ids)
+                await session.commit()
+            if pointers:
+                logger.info(f"🔀 Retention: пересчитано указателей дельт: {pointers}")
+        except Exception as e:
+            logger.warning(f"⚠️ Retention: не удалось обновить указатели дельт: {e}")
+
+        try:
+            from core.redis_client import cache
+
+            await cache.delete_many("reports", report_ids)
+            await cache.delete_many("summaries", report_ids)
+            await cache.clear_category("stats")
+            await cache.clear_category("search")
+        except Exception as e:
+            logger.warning(f"⚠️ Retention: не удалось обновить кэш агрегатов: {e}")
+
+        try:
+            from services.port_index import refresh_hosts
+
+            async with database.async_session_factory() as session:
+                await refresh_hosts(session, hostnames)
+        except Exception as e:
+            logger.warning(f"⚠️ Retention: индекс портов не обновлен: {e}")
+
+    def _schedule_file_reclaim(self, paths: List[str]) -> None:
+        """Запускает освобождение файлов в фоне"""
+        for path in paths:
+            self._file_tasks.append(asyncio.create_task(self._reclaim_file(path)))
+
+    async def _reclaim_file(self, path: str) -> None:
+        """Удаляет файл отчета или переносит его в архивное хранилище"""
+        async with self._file_semaphore:
+            try:
+                if self.archive_dir:
+                    await asyncio.to_thread(self._archive_file, path)
+                    self.progress["files_archived"] += 1
+                else:
+                    await asyncio.to_thread(os.remove, path)
+                    self.progress["files_removed"] += 1
+            except FileNotFoundError:
+                # Файл уже отсутствует - освобождать нечего
+                pass
+            except Exception as e:
+                self.progress["files_failed"] += 1
+                logger.warning(f"⚠️ Retention: ошибка освобождения файла {path}: {e}")
+
+    def _archive_file(self, path: str) -> None:
+        os.makedirs(self.archive_dir, exist_ok=True)
+        shutil.move(path, os.path.join(self.archive_dir, os.path.basename(path)))
+
+
+# Глобальный экземпляр движка хранения
+retention_engine = RetentionEngine()
+
+
+async def run_retention_once(days: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Запускает очистку, если ее не выполняет другой воркер
+
+    Returns:
+        Итог запуска или None, если блокировку держит другой процесс
+    """
+    if not database.async_engine:
+        raise RuntimeError("База данных не инициализирована")
+
+    async with database.async_engine.connect() as conn:
+        locked = (await conn.execute(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": RETENTION_LOCK_KEY}
+        )).scalar()
+        await conn.commit()
+
+        if not locked:
+            logger.debug("🔒 Retention уже выполняется другим воркером")
+            return None
+
+        try:
+            await partitioning.ensure_future_partitions()
+            return await retention_engine.run(days)
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": RETENTION_LOCK_KEY})
+            await conn.commit()
+
+
+async def retention_loop() -> None:
+    """Периодически применяет REPORT_CLEANUP_DAYS"""
+    while True:
+        try:
+            await run_retention_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка фоновой очистки отчетов: {e}")
+
+        await asyncio.sleep(settings.RETENTION_INTERVAL_SECONDS)
@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+"""
+Пользовательские правила оповещений по отчетам
+
+Правило - JSON определение одного из видов:
+- port:       {"type": "port", "ports": ["23", "udp/161"]}
+- connection: {"type": "connection", "process": ["nc"], "direction": "outgoing",
+               "remote_cidrs": [...], "exclude_cidrs": ["10.0.0.0/8"], "remote_ports": ["1-1024"]}
+- metric:     {"type": "metric", "metric": "total_connections", "op": ">", "value": 500}
+Любое правило может ограничиваться хостами: "hosts": ["web-*"].
+
+Включенные правила компилируются в сопоставители: порты - словарь
+порт -> правила, процессы - интернированные ключи справочника,
+подсети - префиксное дерево по всем правилам сразу, пороги метрик -
+отсортированные массивы с бинарным поиском. Отчет проверяется один раз
+при приеме по уже построенным строкам соединений и портов; стоимость
+зависит от числа различных соединений отчета, а не от числа правил.
+"""
+
+import fnmatch
+import ipaddress
+import logging
+import re
+import uuid
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import desc, func, insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import get_settings
+from models.report import AlertRule, Melt, ProcessName, RuleAlert
+from services.changes import ChangeQueryError, decode_cursor, encode_cursor
+from services.interning import interner
+from services.metrics import SERIES_METRICS
+from services.port_index import PortIndexError, parse_port_key
+from services.search import SearchQueryError, parse_cidr, parse_port_range
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+RULE_TYPES = ("port", "connection", "metric")
+SEVERITIES = ("info", "warning", "critical")
+_METRIC_OPS = (">", ">=", "<", "<=", "==")
+_DIRECTIONS = ("incoming", "outgoing")
+
+
+class RuleError(ValueError):
+    """Некорректное определение правила или параметры выборки"""
+
+
+def _as_list(value: Any, field: str) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, (str, int)):
+        return [str(value)]
+    if isinstance(value, list) and all(isinstance(item, (str, int)) for item in value):
+        return [str(item) for item in value]
+    raise RuleError(f"Поле {field} должно быть строкой или списком строк")
+
+
+def validate_definition(definition: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Проверяет и нормализует определение правила
+
+    Raises:
+        RuleError: Некорректное определение
+    """
+    if not isinstance(definition, dict):
+        raise RuleError("Определение правила должно быть объектом")
+    rule_type = definition.get("type")
+    if rule_type not in RULE_TYPES:
+        raise RuleError(f"Неизвестный тип правила: {rule_type}. Доступны: {', '.join(RULE_TYPES)}")
+
+    normalized: Dict[str, Any] = {"type": rule_type}
+    hosts = _as_list(definition.get("hosts"), "hosts")
+    if hosts:
+        normalized["hosts"] = hosts
+
+    try:
+        if rule_type == "port":
+            ports = [parse_port_key(port) for port in _as_list(definition.get("ports"), "ports")]
+            if not ports:
+                raise RuleError("Правило port требует ports")
+            normalized["ports"] = [f"{protocol}/{port}" for protocol, port in ports]
+
+        elif rule_type == "connection":
+            processes = [p for p in _as_list(definition.get("process"), "process") if p]
+            direction = definition.get("direction")
+            if direction is not None and direction not in _DIRECTIONS:
+                raise RuleError(f"direction: {', '.join(_DIRECTIONS)}")
+            include = [str(parse_cidr(c)) for c in _as_list(definition.get("remote_cidrs"), "remote_cidrs")]
+            exclude = [str(parse_cidr(c)) for c in _as_list(definition.get("exclude_cidrs"), "exclude_cidrs")]
+            port_ranges = [parse_port_range(r) for r in _as_list(definition.get("remote_ports"), "remote_ports")]
+            if not (processes or include or exclude or port_ranges):
+                raise RuleError("Правило connection требует хотя бы одно условие")
+            normalized.update({
+                "process": processes,
+                "direction": direction,
+                "remote_cidrs": include,
+                "exclude_cidrs": exclude,
+                "remote_ports": [f"{low}-{high}" for low, high in port_ranges],
+            })
+
+        else:
+            metric, op, value = definition.get("metric"), definition.get("op"), definition.get("value")
+            if metric not in SERIES_METRICS:
+                raise RuleError(f"Неизвестная метрика: {metric}. Доступны: {', '.join(SERIES_METRICS)}")
+            if op not in _METRIC_OPS:
+                raise RuleError(f"Неизвестный оператор: {op}. Доступны: {' '.join(_METRIC_OPS)}")
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                raise RuleError("value должно быть числом")
+            normalized.update({"metric": metric, "op": op, "value": value})
+
+    except (PortIndexError, SearchQueryError) as e:
+        raise RuleError(str(e))
+
+    return normalized
+
+
+class PrefixTrie:
+    """
+    Префиксное дерево подсетей: IP -> значения всех содержащих его подсетей
+
+    Дерево сжато по уровням: хранятся только длины префиксов, для которых
+    есть подсети, и на каждой такой длине - словарь "префикс -> значения".
+    Поиск - по одному обращению к словарю на занятую длину (обычно единицы),
+    а не 32/128 шагов по битам.
+    """
+
+    def __init__(self):
+        self._levels: Dict[int, Dict[int, Dict[int, Set[Any]]]] = {4: {}, 6: {}}
+
+    def insert(self, network: "ipaddress._BaseNetwork", value: Any) -> None:
+        level = self._levels[network.version].setdefault(network.prefixlen, {})
+        prefix = int(network.network_address) >> (network.max_prefixlen - network.prefixlen)
+        level.setdefault(prefix, set()).add(value)
+
+    def match(self, version: int, value: int) -> Set[Any]:
+        """Значения всех подсетей, содержащих адрес (версия и целое значение адреса)"""
+        found: Set[Any] = set()
+        bits = 32 if version == 4 else 128
+        for prefixlen, level in self._levels[version].items():
+            values = level.get(value >> (bits - prefixlen))
+            if values:
+                found |= values
+        return found
+
+
+class _ConnectionMatcher:
+    __slots__ = ("rule_id", "direction", "include", "exclude", "port_ranges")
+
+    def __init__(self, rule_id: int, definition: Dict[str, Any]):
+        self.rule_id = rule_id
+        self.direction = definition.get("direction")
+        self.include = bool(definition.get("remote_cidrs"))
+        self.exclude = bool(definition.get("exclude_cidrs"))
+        self.port_ranges = tuple(parse_port_range(r) for r in definition.get("remote_ports") or ())
+
+
+class CompiledRules:
+    """Сопоставители всех включенных правил"""
+
+    def __init__(self, version: Tuple[Any, ...] = ()):
+        self.version = version
+        self.rules: Dict[int, Dict[str, Any]] = {}
+        self.host_patterns: Dict[int, "re.Pattern"] = {}
+        self.ports: Dict[Tuple[str, int], List[int]] = defaultdict(list)
+        self.metrics: Dict[Tuple[str, str], Tuple[List[float], List[int]]] = {}
+        self.connections: Dict[Optional[int], List[_ConnectionMatcher]] = defaultdict(list)
+        self.cidrs = PrefixTrie()
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def _host_allowed(self, rule_id: int, hostname: str, memo: Dict[int, bool]) -> bool:
+        pattern = self.host_patterns.get(rule_id)
+        if pattern is None:
+            return True
+        allowed = memo.get(rule_id)
+        if allowed is None:
+            allowed = memo[rule_id] = bool(pattern.match(hostname))
+        return allowed
+
+    def evaluate(
+        self,
+        hostname: str,
+        metrics: Dict[str, Any],
+        connection_values: Sequence[Dict[str, Any]],
+        port_values: Sequence[Dict[str, Any]]
+    ) -> Dict[int, List[Dict[str, Any]]]:
+        """Правила, сработавшие на отчете: ключ правила -> примеры совпадений"""
+        matched: Dict[int, List[Dict[str, Any]]] = {}
+        host_memo: Dict[int, bool] = {}
+        sample_limit = settings.RULES_SAMPLES_PER_ALERT
+
+        def accept(rule_id: int) -> Optional[List[Dict[str, Any]]]:
+            """Список примеров правила или None, если хост не подходит или примеров достаточно"""
+            samples = matched.get(rule_id)
+            if samples is None:
+                if not self._host_allowed(rule_id, hostname, host_memo):
+                    return None
+                samples = matched[rule_id] = []
+            return samples if len(samples) < sample_limit else None
+
+        def hit(rule_id: int, sample: Dict[str, Any]) -> None:
+            samples = accept(rule_id)
+            if samples is not None:
+                samples.append(sample)
+
+        if self.ports:
+            for row in port_values:
+                key = ((row.get("protocol") or "tcp").lower(), row["port_number"])
+                for rule_id in self.ports.get(key, ()):
+                    hit(rule_id, {"port": f"{key[0]}/{key[1]}"})
+
+        for (metric, op), (thresholds, rule_ids) in self.metrics.items():
+            value = metrics.get(metric) or 0
+            if op == ">":
+                selected = rule_ids[:bisect_left(thresholds, value)]
+            elif op == ">=":
+                selected = rule_ids[:bisect_right(thresholds, value)]
+            elif op == "<":
+                selected = rule_ids[bisect_right(thresholds, value):]
+            elif op == "<=":
+                selected = rule_ids[bisect_left(thresholds, value):]
+            else:
+                selected = rule_ids[bisect_left(thresholds, value):bisect_right(thresholds, value)]
+            sample = {metric: value}
+            for rule_id in selected:
+                hit(rule_id, sample)
+
+        if self.connections:
+            any_process = self.connections.get(None, ())
+            cidr_memo: Dict[Tuple[int, int], Set[Tuple[int, str]]] = {}
+            seen: Set[tuple] = set()
+            for row in connection_values:
+                process_id = row.get("process_name_id")
+                candidates = self.connections.get(process_id, ()) if process_id else ()
+                if not candidates and not any_process:
+                    continue
+                direction, remote_ip, remote_port = row.get("connection_type"), row.get("remote_ip"), row.get("remote_port")
+                # Хеш ipaddress-объекта дорогой - адрес сравнивается как (версия, целое)
+                address = (remote_ip.version, int(remote_ip)) if remote_ip is not None else None
+                key = (process_id, direction, address, remote_port)
+                if key in seen:
+                    continue
+                seen.add(key)
+
+                cidr_hits = None
+                for matchers in (candidates, any_process):
+                    for matcher in matchers:
+                        if matcher.direction and matcher.direction != direction:
+                            continue
+                        if matcher.port_ranges and not (
+                            remote_port is not None
+                            and any(low <= remote_port <= high for low, high in matcher.port_ranges)
+                        ):
+                            continue
+                        if matcher.include or matcher.exclude:
+                            if address is None:
+                                continue
+                            if cidr_hits is None:
+                                cidr_hits = cidr_memo.get(address)
+                                if cidr_hits is None:
+                                    cidr_hits = cidr_memo[address] = self.cidrs.match(*address)
+                            if matcher.include and (matcher.rule_id, "in") not in cidr_hits:
+                                continue
+                            if matcher.exclude and (matcher.rule_id, "out") in cidr_hits:
+                                continue
+                        samples = accept(matcher.rule_id)
+                        if samples is not None:
+                            samples.append({
+                                "process_name_id": process_id,
+                                "direction": direction,
+                                "remote": f"{remote_ip}:{remote_port}" if remote_ip is not None else None,
+                            })
+
+        return {rule_id: samples for rule_id, samples in matched.items() if samples}
+
+
+async def compile_rules(rules: Iterable[AlertRule], version: Tuple[Any, ...] = ()) -> CompiledRules:
+    """Компилирует правила; имена процессов интернируются в справочник"""
+    compiled = CompiledRules(version)
+    rules = list(rules)
+
+    process_names = {name for rule in rules for name in (rule.definition or {}).get("process") or ()}
+    process_ids = await interner.intern_many(ProcessName, process_names) if process_names else {}
+
+    metric_rules: Dict[Tuple[str, str], List[Tuple[float, int]]] = defaultdict(list)
+    for rule in rules:
+        definition = rule.definition or {}
+        compiled.rules[rule.id] = {"name": rule.name, "severity": rule.severity}
+        if definition.get("hosts"):
+            pattern = "|".join(fnmatch.translate(host) for host in definition["hosts"])
+            compiled.host_patterns[rule.id] = re.compile(pattern)
+
+        rule_type = definition.get("type")
+        if rule_type == "port":
+            for port in definition.get("ports") or ():
+                compiled.ports[parse_port_key(port)].append(rule.id)
+
+        elif rule_type == "connection":
+            matcher = _ConnectionMatcher(rule.id, definition)
+            for cidr in definition.get("remote_cidrs") or ():
+                compiled.cidrs.insert(ipaddress.ip_network(cidr), (rule.id, "in"))
+            for cidr in definition.get("exclude_cidrs") or ():
+                compiled.cidrs.insert(ipaddress.ip_network(cidr), (rule.id, "out"))
+            names = definition.get("process") or ()
+            if names:
+                for name in names:
+                    compiled.connections[process_ids[name]].append(matcher)
+            else:
+                compiled.connections[None].append(matcher)
+
+        elif rule_type == "metric":
+            metric_rules[(definition["metric"], definition["op"])].append((definition["value"], rule.id))
+
+    for key, entries in metric_rules.items():
+        entries.sort()
+        compiled.metrics[key] = ([value for value, _ in entries], [rule_id for _, rule_id in entries])
+
+    return compiled
+
+
+class RuleEngine:
+    """Скомпилированные правила воркера, перекомпилируются при изменении набора правил"""
+
+    def __init__(self):
+        self._compiled = CompiledRules()
+        self.compilations = 0
+
+    async def _version(self, db: AsyncSession) -> Tuple[Any, ...]:
+        row = (await db.execute(
+            select(func.count(AlertRule.id), func.max(AlertRule.updated_at))
+        )).one()
+        return tuple(row)
+
+    async def get(self, db: AsyncSession) -> CompiledRules:
+        version = await self._version(db)
+        if version != self._compiled.version:
+            rules = (await db.execute(select(AlertRule).where(AlertRule.enabled.is_(True)))).scalars().all()
+            self._compiled = await compile_rules(rules, version)
+            self.compilations += 1
+            logger.info(f"📐 Скомпилировано правил оповещений: {len(self._compiled)}")
+        return self._compiled
+
+
+rule_engine = RuleEngine()
+
+
+async def evaluate_rules(
+    db: AsyncSession,
+    melt: Melt,
+    connection_values: Sequence[Dict[str, Any]],
+    port_values: Sequence[Dict[str, Any]]
+) -> int:
+    """
+    Проверяет отчет правилами и сохраняет оповещения (в транзакции приема)
+
+    Returns:
+        Число сработавших правил
+    """
+    compiled = await rule_engine.get(db)
+    if not len(compiled):
+        return 0
+
+    metrics = {metric: getattr(melt, metric) for metric in SERIES_METRICS}
+    matched = compiled.evaluate(melt.hostname, metrics, connection_values, port_values)
+    if not matched:
+        return 0
+
+    created_at = datetime.utcnow()
+    await db.execute(insert(RuleAlert), [
+        {
+            "id": uuid.uuid4(),
+            "report_id": melt.id,
+            "report_generated_at": melt.generated_at,
+            "rule_id": rule_id,
+            "rule_name": compiled.rules[rule_id]["name"],
+            "severity": compiled.rules[rule_id]["severity"],
+            "hostname": melt.hostname,
+            "details": {"samples": samples},
+            "created_at": created_at,
+        }
+        for rule_id, samples in matched.items()
+    ])
+    logger.info(f"🔔 Хост {melt.hostname}: сработало правил {len(matched)}")
+    return len(matched)
+
+
+# Хранилище правил
+
+def rule_item(rule: AlertRule) -> Dict[str, Any]:
+    return {
+        "id": rule.id,
+        "name": rule.name,
+        "description": rule.description,
+        "severity": rule.severity,
+        "enabled": rule.enabled,
+        "definition": rule.definition,
+        "created_at": rule.created_at.isoformat() if rule.created_at else None,
+        "updated_at": rule.updated_at.isoformat() if rule.updated_at else None,
+    }
+
+
+def _validate_severity(severity: str) -> str:
+    if severity not in SEVERITIES:
+        raise RuleError(f"Неизвестная важность: {severity}. Доступны: {', '.join(SEVERITIES)}")
+    return severity
+
+
+async def list_rules(db: AsyncSession) -> List[Dict[str, Any]]:
+    rows = (await db.execute(select(AlertRule).order_by(AlertRule.id))).scalars().all()
+    return [rule_item(rule) for rule in rows]
+
+
+async def get_rule(db: AsyncSession, rule_id: int) -> Optional[AlertRule]:
+    return await db.get(AlertRule, rule_id)
+
+
+async def create_rule(
+    db: AsyncSession,
+    name: str,
+    definition: Dict[str, Any],
+    severity: str = "warning",
+    enabled: bool = True,
+    description: Optional[str] = None
+) -> AlertRule:
+    """
+    Создает правило (коммит выполняет вызывающий код)
+
+    Raises:
+        RuleError: Некорректное определение или превышен лимит правил
+    """
+    if enabled:
+        enabled_count = (await db.execute(
+            select(func.count(AlertRule.id)).where(AlertRule.enabled.is_(True))
+        )).scalar_one()
+        if enabled_count >= settings.RULES_MAX_ENABLED:
+            raise RuleError(f"Включенных правил не может быть больше {settings.RULES_MAX_ENABLED}")
+
+    rule = AlertRule(
+        name=name,
+        description=description,
+        severity=_validate_severity(severity),
+        enabled=enabled,
+        definition=validate_definition(definition),
+    )
+    db.add(rule)
+    await db.flush()
+    return rule
+
+
+async def update_rule(db: AsyncSession, rule: AlertRule, changes: Dict[str, Any]) -> AlertRule:
+    """Изменяет поля правила; определение проверяется заново"""
+    changes = {field: value for field, value in changes.items() if value is not None or field == "description"}
+    if "definition" in changes:
+        changes["definition"] = validate_definition(changes["definition"])
+    if "severity" in changes:
+        _validate_severity(changes["severity"])
+    for field in ("name", "description", "severity", "enabled", "definition"):
+        if field in changes:
+            setattr(rule, field, changes[field])
+    rule.updated_at = datetime.utcnow()
+    await db.flush()
+    return rule
+
+
+async def get_alerts(
+    db: AsyncSession,
+    rule_id: Optional[int] = None,
+    hostname: Optional[str] = None,
+    since: Optional[datetime] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """Оповещения от новых к старым, страницы по ключу (created_at, id)"""
+    conditions = []
+    if rule_id is not None:
+        conditions.append(RuleAlert.rule_id == rule_id)
+    if hostname:
+        conditions.append(RuleAlert.hostname == hostname)
+    if since:
+        conditions.append(RuleAlert.created_at >= since)
+    if cursor:
+        try:
+            timestamp, key = decode_cursor(cursor)
+            key = uuid.UUID(key)
+        except (ChangeQueryError, ValueError):
+            raise RuleError("Некорректный курсор")
+        conditions.append(tuple_(RuleAlert.created_at, RuleAlert.id) < tuple_(timestamp, key))
+
+    rows = (await db.execute(
+        select(RuleAlert)
+        .where(*conditions)
+        .order_by(desc(RuleAlert.created_at), desc(RuleAlert.id))
+        .limit(limit + 1)
+    )).scalars().all()
+
+    page, has_more = rows[:limit], len(rows) > limit
+    return {
+        "items": [
+            {
+                "id": str(row.id),
+                "rule_id": row.rule_id,
+                "rule_name": row.rule_name,
+                "severity": row.severity,
+                "hostname": row.hostname,
+                "report_id": str(row.report_id),
+                "details": row.details,
+                "created_at": row.created_at.isoformat(),
+            }
+            for row in page
+        ],
+        "next_cursor": encode_cursor(page[-1].created_at, page[-1].id) if has_more else None,
+    }
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Поиск по хостам, процессам, адресам и портам
+
+Текстовые запросы используют trigram индексы (pg_trgm): по system_reports.hostname
+напрямую, по процессам и адресам - через справочники, затем по btree ключам
+в таблицах соединений. Порты ищутся по btree индексу port_number. Фильтры соединений по подсетям и
+диапазонам портов используют типизированные колонки inet/integer.
+Результаты кэшируются в Redis по хешу запроса; прием и удаление отчетов
+сбрасывают кэш поиска.
+"""
+
+import hashlib
+import ipaddress
+import json
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from sqlalchemy import cast, desc, func, select
+from sqlalchemy.dialects.postgresql import CIDR
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import get_settings
+from core.redis_client import cache_search_results, get_cached_search_results
+from models.report import Melt, NetworkAddress, NetworkConnection, NetworkPort, ProcessName
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+SEARCH_TYPES = ("hosts", "processes", "addresses", "ports")
+
+IPNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+class SearchQueryError(ValueError):
+    """Некорректный поисковый запрос"""
+
+
+def _like_pattern(query: str) -> str:
+    """Шаблон ILIKE с экранированием спецсимволов"""
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def make_query_hash(query: str, types: Sequence[str], page: int, page_size: int) -> str:
+    """Хеш нормализованного запроса - ключ кэша результатов"""
+    payload = json.dumps(
+        {"q": query.strip().lower(), "types": sorted(types), "page": page, "page_size": page_size},
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _report_fields(melt_row) -> Dict[str, Any]:
+    """Общие поля отчета в результатах поиска"""
+    return {
+        "report_id": str(melt_row.report_id),
+        "hostname": melt_row.hostname,
+        "generated_at": melt_row.generated_at.isoformat() if melt_row.generated_at else None,
+    }
+
+
+async def _paginate(db: AsyncSession, stmt, page: int, page_size: int):
+    """Общее количество и строки запрошенной страницы"""
+    total = (await db.execute(select(func.count()).select_from(stmt.order_by(None).subquery()))).scalar() or 0
+    rows = (await db.execute(stmt.limit(page_size).offset((page - 1) * page_size))).fetchall()
+    return total, rows
+
+
+async def _dimension_ids(db: AsyncSession, model, query: str) -> List[int]:
+    """Ключи справочника, совпавшие с запросом (trigram индекс)"""
+    result = await db.execute(
+        select(model.id)
+        .where(model.value.ilike(_like_pattern(query)))
+        .limit(settings.SEARCH_MAX_DIMENSION_MATCHES)
+    )
+    return [row.id for row in result]
+
+
+async def search_hosts(db: AsyncSession, query: str, page: int, page_size: int) -> Dict[str, Any]:
+    """Отчеты, hostname которых содержит запрос"""
+    stmt = (
+        select(Melt.id.label("report_id"), Melt.hostname, Melt.generated_at, Melt.os_name)
+        .where(Melt.hostname.ilike(_like_pattern(query)))
+        .order_by(desc(Melt.generated_at))
+    )
+    total, rows = await _paginate(db, stmt, page, page_size)
+    return {
+        "total": total,
+        "hits": [{**_report_fields(row), "os_name": row.os_name} for row in rows],
+    }
+
+
+async def _connection_hits(db: AsyncSession, conditions: list, page: int, page_size: int) -> Dict[str, Any]:
+    """Страница соединений по условиям со значениями справочников"""
+    stmt = (
+        select(
+            NetworkConnection.id,
+            NetworkConnection.report_id,
+            NetworkConnection.report_generated_at.label("generated_at"),
+            NetworkConnection.process_name_id,
+            NetworkConnection.local_address_id,
+            NetworkConnection.remote_address_id,
+            NetworkConnection.local_ip,
+            NetworkConnection.local_port,
+            NetworkConnection.remote_ip,
+            NetworkConnection.remote_port,
+            NetworkConnection.protocol,
+            NetworkConnection.connection_type,
+            Melt.hostname,
+        )
+        .join(Melt, (Melt.id == NetworkConnection.report_id) & (Melt.generated_at == NetworkConnection.report_generated_at))
+        .where(*conditions)
+        .order_by(desc(NetworkConnection.report_generated_at))
+    )
+    total, rows = await _paginate(db, stmt, page, page_size)
+
+    # Значения справочников для страницы - одним запросом на справочник
+    process_ids = {row.process_name_id for row in rows if row.process_name_id}
+    address_ids = {row.local_address_id for row in rows if row.local_address_id} | \
+        {row.remote_address_id for row in rows if row.remote_address_id}
+    processes = dict((await db.execute(
+        select(ProcessName.id, ProcessName.value).where(ProcessName.id.in_(process_ids))
+    )).fetchall()) if process_ids else {}
+    addresses = dict((await db.execute(
+        select(NetworkAddress.id, NetworkAddress.value).where(NetworkAddress.id.in_(address_ids))
+    )).fetchall()) if address_ids else {}
+
+    return {
+        "total": total,
+        "hits": [
+            {
+                **_report_fields(row),
+                "connection_id": str(row.id),
+                "process_name": processes.get(row.process_name_id),
+                "local_address": addresses.get(row.local_address_id),
+                "remote_address": addresses.get(row.remote_address_id),
+                "local_ip": str(row.local_ip) if row.local_ip is not None else None,
+                "local_port": row.local_port,
+                "remote_ip": str(row.remote_ip) if row.remote_ip is not None else None,
+                "remote_port": row.remote_port,
+                "protocol": row.protocol,
+                "connection_type": row.connection_type,
+            }
+            for row in rows
+        ],
+    }
+
+
+async def _search_connections(db: AsyncSession, column, ids: List[int], page: int, page_size: int) -> Dict[str, Any]:
+    """Соединения, ссылающиеся на найденные значения справочника"""
+    if not ids:
+        return {"total": 0, "hits": []}
+    return await _connection_hits(db, [column.in_(ids)], page, page_size)
+
+
+async def search_processes(db: AsyncSession, query: str, page: int, page_size: int) -> Dict[str, Any]:
+    """Соединения процессов, имя которых содержит запрос"""
+    ids = await _dimension_ids(db, ProcessName, query)
+    return await _search_connections(db, NetworkConnection.process_name_id, ids, page, page_size)
+
+
+async def search_addresses(db: AsyncSession, query: str, page: int, page_size: int) -> Dict[str, Any]:
+    """Соединения с удаленными адресами, содержащими запрос"""
+    ids = await _dimension_ids(db, NetworkAddress, query)
+    return await _search_connections(db, NetworkConnection.remote_address_id, ids, page, page_size)
+
+
+async def search_ports(db: AsyncSession, query: str, page: int, page_size: int) -> Dict[str, Any]:
+    """Отчеты с открытым портом с заданным номером"""
+    stmt = (
+        select(
+            NetworkPort.report_id,
+            NetworkPort.report_generated_at.label("generated_at"),
+            NetworkPort.port_number,
+            NetworkPort.protocol,
+            NetworkPort.service_name,
+            Melt.hostname,
+        )
+        .join(Melt, (Melt.id == NetworkPort.report_id) & (Melt.generated_at == NetworkPort.report_generated_at))
+        .where(NetworkPort.port_number == int(query))
+        .order_by(desc(NetworkPort.report_generated_at))
+    )
+    total, rows = await _paginate(db, stmt, page, page_size)
+    return {
+        "total": total,
+        "hits": [
+            {
+                **_report_fields(row),
+                "port_number": row.port_number,
+                "protocol": row.protocol,
+                "service_name": row.service_name,
+            }
+            for row in rows
+        ],
+    }
+
+
+_SEARCHERS = {
+    "hosts": search_hosts,
+    "processes": search_processes,
+    "addresses": search_addresses,
+    "ports": search_ports,
+}
+
+
+async def search(
+    db: AsyncSession,
+    query: str,
+    types: Sequence[str] = SEARCH_TYPES,
+    page: int = 1,
+    page_size: int = 50
+) -> Dict[str, Any]:
+    """
+    Выполняет поиск по выбранным типам с кэшированием результатов
+
+    Порты ищутся только для числового запроса; текстовые типы требуют
+    не менее SEARCH_MIN_QUERY_LENGTH символов (иначе trigram индекс бесполезен).
+
+    Raises:
+        SearchQueryError: Пустой, слишком короткий запрос или неизвестный тип
+    """
+    query = query.strip()
+    unknown = set(types) - set(SEARCH_TYPES)
+    if unknown:
+        raise SearchQueryError(f"Неизвестные типы поиска: {', '.join(sorted(unknown))}")
+
+    # Порты ищутся только по номеру, текст - от SEARCH_MIN_QUERY_LENGTH символов
+    is_port = query.isdigit() and int(query) <= 65535
+    text_allowed = len(query) >= settings.SEARCH_MIN_QUERY_LENGTH
+    active_types = [t for t in types if (is_port if t == "ports" else text_allowed)]
+    if not active_types:
+        raise SearchQueryError(
+            f"Запрос должен содержать не менее {settings.SEARCH_MIN_QUERY_LENGTH} символов или номер порта"
+        )
+
+    query_hash = make_query_hash(query, active_types, page, page_size)
+    cached = await get_cached_search_results(query_hash)
+    if cached is not None:
+        logger.debug(f"🔍 Поиск '{query}' из кэша")
+        return cached
+
+    results = {
+        search_type: await _SEARCHERS[search_type](db, query, page, page_size)
+        for search_type in active_types
+    }
+
+    response = {
+        "query": query,
+        "types": active_types,
+        "page": page,
+        "page_size": page_size,
+        "total": sum(section["total"] for section in results.values()),
+        "results": results,
+    }
+
+    await cache_search_results(query_hash, response, ttl=settings.SEARCH_CACHE_TTL)
+    return response
+
+
+def parse_cidr(value: str) -> IPNetwork:
+    """
+    Подсеть фильтра (10.0.0.0/8, 2001:db8::/32, одиночный адрес)
+
+    Raises:
+        SearchQueryError: Некорректная подсеть
+    """
+    try:
+        return ipaddress.ip_network(value.strip(), strict=False)
+    except ValueError:
+        raise SearchQueryError(f"Некорректная подсеть: {value}")
+
+
+def parse_port_range(value: str) -> Tuple[int, int]:
+    """
+    Диапазон портов фильтра: "443" или "1-1024"
+
+    Raises:
+        SearchQueryError: Некорректный диапазон
+    """
+    start, _, end = value.strip().partition("-")
+    end = end or start
+    if not (start.strip().isdigit() and end.strip().isdigit()):
+        raise SearchQueryError(f"Некорректный диапазон портов: {value}")
+    low, high = int(start), int(end)
+    if low > high or high > 65535:
+        raise SearchQueryError(f"Некорректный диапазон портов: {value}")
+    return low, high
+
+
+async def filter_connections(
+    db: AsyncSession,
+    remote_cidr: Optional[str] = None,
+    local_cidr: Optional[str] = None,
+    remote_ports: Optional[str] = None,
+    local_ports: Optional[str] = None,
+    protocol: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 50
+) -> Dict[str, Any]:
+    """
+    Соединения по подсетям и диапазонам портов
+
+    Подсети проверяются оператором <<= (GiST inet_ops индекс), порты -
+    BETWEEN (btree индекс); несколько условий объединяются планировщиком
+    через BitmapAnd.
+
+    Raises:
+        SearchQueryError: Некорректный фильтр или ни одного фильтра адреса/порта
+    """
+    conditions = []
+
+    for column, value in ((NetworkConnection.remote_ip, remote_cidr), (NetworkConnection.local_ip, local_cidr)):
+        if value:
+            conditions.append(column.op("<<=")(cast(str(parse_cidr(value)), CIDR)))
+
+    for column, value in ((NetworkConnection.remote_port, remote_ports), (NetworkConnection.local_port, local_ports)):
+        if value:
+            low, high = parse_port_range(value)
+            conditions.append(column.between(low, high))
+
+    if not conditions:
+        raise SearchQueryError("Укажите подсеть или диапазон портов")
+
+    if protocol:
+        conditions.append(func.lower(NetworkConnection.protocol) == protocol.strip().lower())
+
+    result = await _connection_hits(db, conditions, page, page_size)
+    return {
+        "filters": {
+            "remote_cidr": remote_cidr,
+            "local_cidr": local_cidr,
+            "remote_ports": remote_ports,
+            "local_ports": local_ports,
+            "protocol": protocol,
+        },
+        "page": page,
+        "page_size": page_size,
+        **result,
+    }
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Краткие сведения об отчетах (строки списков) с пакетным кэшем
+
+Страница отчетов читается из кэша одним MGET; отсутствующие в кэше
+строки загружаются одним запросом к БД и сохраняются одним конвейером.
+Число обращений к Redis и БД не зависит от размера страницы. Запись
+сбрасывает invalidate_report_cache при замене или удалении отчета.
+"""
+
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import get_settings
+from core.redis_client import cache
+from models.report import Melt
+from services.reconciler import STATUS_FILE_MISSING
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+SUMMARY_CATEGORY = "summaries"
+
+
+def melt_summary(melt: Melt) -> Dict[str, Any]:
+    """Строка списка отчетов (поля MeltSummary)"""
+    return {
+        "id": str(melt.id),
+        "hostname": melt.hostname,
+        "filename": os.path.basename(melt.html_file_path) if melt.html_file_path else "unknown.html",
+        "generated_at": melt.generated_at.isoformat() if melt.generated_at else "",
+        "os_name": melt.os_name or "Неизвестная ОС",
+        "total_connections": melt.total_connections or 0,
+        "file_size": melt.file_size or 0,
+        "report_hash": melt.report_hash,
+        "tcp_ports_count": int(melt.tcp_ports_count or 0),
+        "udp_ports_count": int(melt.udp_ports_count or 0),
+        # Наличие файла отслеживает фоновая сверка
+        "file_exists": bool(melt.html_file_path) and melt.processing_status != STATUS_FILE_MISSING,
+        "processing_status": melt.processing_status or "unknown",
+    }
+
+
+async def get_report_summaries(
+    db: AsyncSession,
+    report_ids: Sequence[Union[str, uuid.UUID]],
+    generated_at: Optional[Sequence[datetime]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Сводки отчетов в порядке report_ids (неизвестные ID пропускаются)
+
+    generated_at - даты этих отчетов, если они известны: условие по ключу
+    секционирования ограничивает запрос промахов нужными секциями.
+    """
+    keys = list(dict.fromkeys(str(report_id) for report_id in report_ids))
+    summaries = await cache.get_many(SUMMARY_CATEGORY, keys)
+
+    missing = [key for key in keys if key not in summaries]
+    if missing:
+        stmt = select(Melt).where(Melt.id.in_([uuid.UUID(key) for key in missing]))
+        if generated_at:
+            stmt = stmt.where(Melt.generated_at.in_(set(generated_at)))
+        loaded = {str(melt.id): melt_summary(melt) for melt in (await db.execute(stmt)).scalars()}
+        if loaded:
+            await cache.set_many(SUMMARY_CATEGORY, loaded, settings.SUMMARY_CACHE_TTL)
+        summaries.update(loaded)
+        logger.debug(f"📋 Сводки отчетов: {len(keys) - len(missing)} из кэша, {len(loaded)} из БД")
+
+    return [summaries[key] for key in keys if key in summaries]
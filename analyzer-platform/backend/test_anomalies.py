@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Тесты базовой линии хоста и находок (services/anomalies.py)
+"""
+
+import ipaddress
+import uuid
+from datetime import datetime, timedelta
+
+from core.config import get_settings
+from models.report import HostBaseline
+from services.anomalies import (
+    KIND_NEW_ENDPOINT, KIND_NEW_PORT, KIND_NEW_PROCESS, merge_into_baseline, observe_report
+)
+
+settings = get_settings()
+DAY = datetime(2024, 5, 1, 12, 0)
+
+
+def _baseline():
+    return HostBaseline(hostname="web-01", ports={}, endpoints={}, processes={}, report_ids={}, reports_seen=0)
+
+
+def _observed(*ports, endpoint=None):
+    port_values = [{"protocol": "tcp", "port_number": port, "process_name_id": 7} for port in ports]
+    connection_values = []
+    if endpoint:
+        connection_values.append({
+            "protocol": "tcp",
+            "connection_type": "outgoing",
+            "process_name_id": 9,
+            "remote_ip": ipaddress.ip_address(endpoint),
+            "remote_port": 443,
+        })
+    return observe_report(connection_values, port_values)
+
+
+def _train(baseline):
+    """Обучает линию до зрелости отчетами с портом 22"""
+    for day in range(settings.ANOMALY_MIN_BASELINE_REPORTS):
+        assert merge_into_baseline(baseline, uuid.uuid4(), DAY + timedelta(days=day), _observed(22)) == []
+
+
+def test_observe_report_keys():
+    observed = _observed(22, endpoint="2001:db8::1")
+    assert set(observed[KIND_NEW_PORT]) == {"tcp/22"}
+    assert set(observed[KIND_NEW_ENDPOINT]) == {"[2001:db8::1]:443/tcp"}
+    assert set(observed[KIND_NEW_PROCESS]) == {"7", "9"}
+
+
+def test_young_baseline_only_learns():
+    baseline = _baseline()
+    _train(baseline)
+    assert baseline.reports_seen == settings.ANOMALY_MIN_BASELINE_REPORTS
+    assert "tcp/22" in baseline.ports
+
+
+def test_new_items_found_once_mature():
+    baseline = _baseline()
+    _train(baseline)
+    findings = merge_into_baseline(baseline, uuid.uuid4(), DAY + timedelta(days=10), _observed(22, 8080))
+    assert [(f["kind"], f["value"]) for f in findings] == [(KIND_NEW_PORT, "tcp/8080")]
+
+
+def test_same_report_merged_once():
+    baseline = _baseline()
+    _train(baseline)
+    report_id = uuid.uuid4()
+    generated_at = DAY + timedelta(days=10)
+
+    findings = merge_into_baseline(baseline, report_id, generated_at, _observed(22, 8080))
+    assert len(findings) == 1
+    state = (dict(baseline.ports), baseline.reports_seen)
+
+    # Повторный прием (замена по хешу) не меняет линию и не отменяет находки
+    assert merge_into_baseline(baseline, report_id, generated_at, _observed(22, 8080)) is None
+    assert (dict(baseline.ports), baseline.reports_seen) == state
+    assert str(report_id) in baseline.report_ids
+
+
+def test_decayed_items_are_new_again():
+    baseline = _baseline()
+    _train(baseline)
+    later = DAY + timedelta(days=settings.ANOMALY_BASELINE_DECAY_DAYS + 5)
+    findings = merge_into_baseline(baseline, uuid.uuid4(), later, _observed(22))
+    assert {(f["kind"], f["value"]) for f in findings} == {(KIND_NEW_PORT, "tcp/22"), (KIND_NEW_PROCESS, "7")}
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Тесты пакетных операций кэша и пакетных сводок отчетов
+(core/redis_client.py, services/summaries.py)
+
+Redis заменяется fakeredis, обращения к нему подсчитываются.
+"""
+
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+
+from core import redis_client
+from core.redis_client import CacheManager
+from services import summaries
+from services.summaries import SUMMARY_CATEGORY, get_report_summaries
+
+
+class _CountingRedis(fakeredis.FakeAsyncRedis):
+    """fakeredis, считающий обращения: MGET и выполнение конвейеров"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.round_trips = []
+
+    async def mget(self, *args, **kwargs):
+        self.round_trips.append("mget")
+        return await super().mget(*args, **kwargs)
+
+    def pipeline(self, *args, **kwargs):
+        pipe = super().pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def counted_execute(*execute_args, **execute_kwargs):
+            self.round_trips.append(f"pipeline:{len(pipe.command_stack)}")
+            return await execute(*execute_args, **execute_kwargs)
+
+        pipe.execute = counted_execute
+        return pipe
+
+
+class _Session:
+    """Сессия: отдает отчеты с запрошенными ID и записывает запросы"""
+
+    def __init__(self, melts):
+        self.melts = {melt.id: melt for melt in melts}
+        self.queries = []
+
+    async def execute(self, statement):
+        requested = next(
+            value for value in statement.compile().params.values()
+            if isinstance(value, list) and value and isinstance(value[0], uuid.UUID)
+        )
+        self.queries.append(requested)
+        found = [self.melts[report_id] for report_id in requested if report_id in self.melts]
+        return SimpleNamespace(scalars=lambda: found)
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    client = _CountingRedis()
+    monkeypatch.setattr(redis_client, "redis_client", client)
+    return client
+
+
+@pytest.fixture
+def cache(monkeypatch, redis):
+    manager = CacheManager()
+    monkeypatch.setattr(summaries, "cache", manager)
+    return manager
+
+
+def _melt(number):
+    return SimpleNamespace(
+        id=uuid.UUID(int=number), hostname=f"web-{number:02d}", html_file_path=f"/data/report_{number}.html",
+        generated_at=datetime(2024, 5, number), os_name="Linux", total_connections=number, file_size=100,
+        report_hash=f"h{number}", tcp_ports_count=1, udp_ports_count=0, processing_status="processed",
+    )
+
+
+@pytest.mark.asyncio
+async def test_many_operations_use_one_round_trip(redis, cache):
+    values = {f"r{i}": {"n": i} for i in range(50)}
+
+    assert await cache.set_many("reports", values)
+    assert await cache.get_many("reports", [*values, "absent", "r1"]) == values
+    assert await cache.delete_many("reports", ["r1", "r2", "absent"]) == 2
+
+    # По одному обращению на операцию (поколение категории закэшировано в воркере)
+    assert redis.round_trips == ["pipeline:54", "mget", "pipeline:3"]
+    assert await cache.get_many("reports", ["r1", "r3"]) == {"r3": {"n": 3}}
+    assert await cache.count_keys("reports") == 48
+
+
+@pytest.mark.asyncio
+async def test_summaries_page_loads_only_misses(redis, cache):
+    melts = [_melt(number) for number in (1, 2, 3)]
+    session = _Session(melts)
+    await cache.set_many(SUMMARY_CATEGORY, {str(melts[0].id): summaries.melt_summary(melts[0])})
+    redis.round_trips.clear()
+
+    page = await get_report_summaries(session, [melt.id for melt in melts] + [uuid.UUID(int=99)])
+
+    assert [row["hostname"] for row in page] == ["web-01", "web-02", "web-03"]
+    # Один MGET, один запрос к БД для промахов, один конвейер записи
+    assert session.queries == [[melts[1].id, melts[2].id, uuid.UUID(int=99)]]
+    assert [trip.split(":")[0] for trip in redis.round_trips] == ["mget", "pipeline"]
+
+    again = await get_report_summaries(session, [melt.id for melt in melts])
+    assert again == page
+    assert len(session.queries) == 1
+
+
+def test_summary_flags_missing_file():
+    melt = _melt(1)
+    assert summaries.melt_summary(melt)["file_exists"] is True
+    melt.processing_status = summaries.STATUS_FILE_MISSING
+    assert summaries.melt_summary(melt)["file_exists"] is False
+    melt.html_file_path = None
+    assert summaries.melt_summary(melt)["filename"] == "unknown.html"
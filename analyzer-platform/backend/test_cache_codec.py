@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Тесты кодеков значений кэша (core/cache_codec.py)
+"""
+
+import datetime as dt
+import ipaddress
+import json
+import uuid
+from decimal import Decimal
+
+import pytest
+
+from core import cache_codec
+from core.cache_codec import CacheCodecError, decode, encode
+
+
+def _format(data: bytes) -> int:
+    return data[1] & ~cache_codec._COMPRESSED
+
+
+def test_json_roundtrip():
+    value = {"hostname": "web-01", "ports": [22, 443], "ratio": 0.5, "ok": True, "none": None}
+    data = encode(value)
+    assert _format(data) == cache_codec.FORMAT_JSON
+    assert decode(data) == value
+
+
+def test_text_and_bytes_kept_as_is():
+    assert _format(encode("строка")) == cache_codec.FORMAT_TEXT
+    assert decode(encode("строка")) == "строка"
+    assert _format(encode(b"\x00\x01")) == cache_codec.FORMAT_BYTES
+    assert decode(encode(b"\x00\x01")) == b"\x00\x01"
+
+
+def test_msgpack_restores_types():
+    value = {
+        "generated_at": dt.datetime(2024, 5, 1, 12, 30),
+        "day": dt.date(2024, 5, 1),
+        "id": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+        "ports": {22, 443},
+        "size": Decimal("1.50"),
+        "ip": ipaddress.ip_address("10.0.0.1"),
+        "ip6": ipaddress.ip_address("::1"),
+        1: "нестроковый ключ",
+    }
+    data = encode(value)
+    assert _format(data) == cache_codec.FORMAT_MSGPACK
+    assert decode(data) == value
+
+
+def test_large_values_compressed():
+    value = {"rows": ["повторяющаяся строка"] * 500}
+    data = encode(value)
+    assert data[1] & cache_codec._COMPRESSED
+    assert len(data) < len(json.dumps(value, ensure_ascii=False).encode())
+    assert decode(data) == value
+
+
+def test_legacy_json_without_header():
+    assert decode(json.dumps({"a": 1}).encode()) == {"a": 1}
+    assert decode('{"a": 1}') == {"a": 1}
+
+
+def test_unsupported_type_rejected():
+    with pytest.raises(CacheCodecError):
+        encode(object())
+
+
+def test_corrupted_entry_rejected():
+    with pytest.raises(CacheCodecError):
+        decode(bytes((cache_codec._MAGIC, cache_codec.FORMAT_JSON | cache_codec._COMPRESSED)) + b"not zlib")
+    with pytest.raises(CacheCodecError):
+        decode(bytes((cache_codec._MAGIC, 0x7F)) + b"{}")
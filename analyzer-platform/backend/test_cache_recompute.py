@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Тесты защиты от лавины пересчетов в CacheManager.get_or_compute
+(core/redis_client.py)
+
+Redis заменяется fakeredis; второй CacheManager изображает другой воркер.
+"""
+
+import asyncio
+import time
+
+import fakeredis
+import pytest
+
+from core import redis_client
+from core.redis_client import CacheManager
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(redis_client, "redis_client", fakeredis.FakeAsyncRedis())
+    monkeypatch.setattr(redis_client.settings, "CACHE_LOCK_POLL_SECONDS", 0.01)
+    return CacheManager()
+
+
+def _counting(value, delay=0.0):
+    calls = []
+
+    async def compute():
+        calls.append(value)
+        await asyncio.sleep(delay)
+        return value
+
+    return compute, calls
+
+
+async def _wait_inflight(cache):
+    await asyncio.gather(*list(cache._inflight.values()))
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_compute_once(cache):
+    compute, calls = _counting({"total": 5}, delay=0.05)
+
+    results = await asyncio.gather(*(cache.get_or_compute("stats", "fleet", compute, ttl=60) for _ in range(5)))
+
+    assert results == [{"total": 5}] * 5
+    assert len(calls) == 1
+    assert cache.recompute_stats["coalesced"] == 4
+    assert await cache.get_or_compute("stats", "fleet", compute, ttl=60) == {"total": 5}
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_other_worker_waits_for_lock_holder(cache):
+    other = CacheManager()
+    token = await cache._acquire_lock("stats", "fleet")
+    compute, calls = _counting("computed by other")
+
+    waiting = asyncio.ensure_future(other.get_or_compute("stats", "fleet", compute, ttl=60))
+    await asyncio.sleep(0.03)
+    await cache._compute_and_store("stats", "fleet", _counting("computed by holder")[0], 60, 60)
+    await cache._release_lock("stats", "fleet", token)
+
+    assert await waiting == "computed by holder"
+    assert calls == []
+    assert other.recompute_stats["lock_waits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_stuck_lock_holder_does_not_block(cache, monkeypatch):
+    monkeypatch.setattr(redis_client.settings, "CACHE_LOCK_WAIT_SECONDS", 0.05)
+    await cache._acquire_lock("stats", "fleet")
+    compute, calls = _counting("own")
+
+    assert await CacheManager().get_or_compute("stats", "fleet", compute, ttl=60) == "own"
+    assert calls == ["own"]
+
+
+@pytest.mark.asyncio
+async def test_stale_value_served_while_refreshing(cache):
+    await cache.set("stats", "fleet", {"value": "old", "fresh_until": time.time() - 1, "compute_seconds": 0.1}, 120)
+    compute, calls = _counting("new")
+
+    assert await cache.get_or_compute("stats", "fleet", compute, ttl=60) == "old"
+    await _wait_inflight(cache)
+
+    assert calls == ["new"]
+    assert cache.recompute_stats["stale_served"] == 1
+    assert await cache.get_or_compute("stats", "fleet", compute, ttl=60) == "new"
+
+
+@pytest.mark.asyncio
+async def test_fresh_value_not_recomputed(cache):
+    await cache.set("stats", "fleet", {"value": "cached", "fresh_until": time.time() + 600, "compute_seconds": 0}, 900)
+    compute, calls = _counting("new")
+
+    assert await cache.get_or_compute("stats", "fleet", compute, ttl=60) == "cached"
+    assert calls == []
+    assert not cache._inflight
+
+
+@pytest.mark.asyncio
+async def test_lock_released_only_by_owner(cache):
+    token = await cache._acquire_lock("stats", "fleet")
+    assert await cache._acquire_lock("stats", "fleet") is None
+
+    await cache._release_lock("stats", "fleet", "someone-else")
+    assert await redis_client.redis_client.get(cache._lock_key("stats", "fleet")) == token.encode()
+
+    await cache._release_lock("stats", "fleet", token)
+    assert await cache._acquire_lock("stats", "fleet")
+
+
+@pytest.mark.asyncio
+async def test_compute_error_not_cached(cache):
+    async def failing():
+        raise RuntimeError("database unavailable")
+
+    with pytest.raises(RuntimeError):
+        await cache.get_or_compute("stats", "fleet", failing, ttl=60)
+
+    assert not cache._inflight
+    assert await redis_client.redis_client.get(cache._lock_key("stats", "fleet")) is None
+    compute, _ = _counting("recovered")
+    assert await cache.get_or_compute("stats", "fleet", compute, ttl=60) == "recovered"
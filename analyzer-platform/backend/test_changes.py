@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Тесты истории изменений (services/changes.py, build_change_rows)
+"""
+
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from services.changes import (
+    ChangeQueryError, _filters, _validate_categories, decode_cursor, encode_cursor, get_host_timeline,
+    get_report_changes
+)
+from services.report_ingest import build_change_rows
+
+CHANGED_AT = datetime(2024, 5, 1, 12, 0)
+
+
+class _Session:
+    def __init__(self, rows):
+        self.rows = rows
+        self.statements = []
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        return SimpleNamespace(fetchall=lambda: self.rows)
+
+
+def _change(minutes, measurement_id):
+    return SimpleNamespace(
+        id=uuid.uuid4(),
+        measurement_id=measurement_id,
+        measurement_key=measurement_id,
+        change_timestamp=CHANGED_AT - timedelta(minutes=minutes),
+        is_first_run=0,
+        changed_categories=["ports"],
+        change_details={"ports": 1},
+        report_id=uuid.uuid4(),
+    )
+
+
+def test_cursor_roundtrip():
+    key = uuid.uuid4()
+    assert decode_cursor(encode_cursor(CHANGED_AT, key)) == (CHANGED_AT, str(key))
+    with pytest.raises(ChangeQueryError):
+        decode_cursor("not-a-cursor")
+
+
+def test_category_and_period_validation():
+    assert _validate_categories([" Ports", "", "network"]) == ["ports", "network"]
+    with pytest.raises(ChangeQueryError):
+        _validate_categories(["processes"])
+    with pytest.raises(ChangeQueryError):
+        _filters(CHANGED_AT, CHANGED_AT - timedelta(days=1), [])
+    assert len(_filters(CHANGED_AT, None, ["ports"])) == 2
+
+
+def test_change_rows_normalized_to_utc():
+    rows = build_change_rows([
+        {"measurement_id": 1, "change_timestamp": "2024-05-01T15:00:00+03:00", "changed_categories": ["ports"]},
+        {"measurement_id": 2, "change_timestamp": datetime(2024, 5, 1, 12, tzinfo=timezone.utc), "is_first_run": 1},
+        {"measurement_id": 3, "change_timestamp": "garbage"},
+        {"measurement_id": 4},
+    ])
+    assert [(row["measurement_id"], row["change_timestamp"]) for row in rows] == [(1, CHANGED_AT), (2, CHANGED_AT)]
+    assert rows[1]["is_first_run"] is True
+    assert rows[1]["changed_categories"] == []
+    assert rows[1]["change_details"] is None
+
+
+@pytest.mark.asyncio
+async def test_report_changes_page_and_cursor():
+    rows = [_change(minutes, minutes) for minutes in range(3)]
+    melt = SimpleNamespace(id=uuid.uuid4(), hostname="web-01", generated_at=CHANGED_AT)
+
+    page = await get_report_changes(_Session(rows), melt, limit=2)
+
+    assert [item["measurement_id"] for item in page["items"]] == [0, 1]
+    assert decode_cursor(page["next_cursor"]) == (rows[1].change_timestamp, str(rows[1].id))
+
+    last = await get_report_changes(_Session(rows[2:]), melt, limit=2, cursor=page["next_cursor"])
+    assert last["next_cursor"] is None
+
+
+@pytest.mark.asyncio
+async def test_timeline_deduplicates_and_pages_by_measurement():
+    rows = [_change(minutes, minutes) for minutes in range(2)]
+    session = _Session(rows)
+
+    page = await get_host_timeline(session, "web-01", limit=1)
+
+    assert page["items"][0]["report_id"] == str(rows[0].report_id)
+    assert decode_cursor(page["next_cursor"]) == (CHANGED_AT, "0")
+    assert "DISTINCT ON" in str(session.statements[0].compile(dialect=postgresql.dialect()))
+
+    with pytest.raises(ChangeQueryError):
+        await get_host_timeline(session, "web-01", cursor=encode_cursor(CHANGED_AT, "not-a-number"))
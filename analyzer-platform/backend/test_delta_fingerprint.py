@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Тесты канонической формы отчета и сравнения дельт (services/delta.py)
+"""
+
+import ipaddress
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from services import delta
+from services.delta import FingerprintCache, MeltFingerprint, _connection_key, _diff, _limited, melt_version_key
+
+
+def _row(**fields):
+    values = {
+        "protocol": "TCP",
+        "connection_type": "outgoing",
+        "process_name_id": 7,
+        "local_ip": ipaddress.ip_address("10.0.0.1"),
+        "local_port": 51000,
+        "remote_ip": ipaddress.ip_address("203.0.113.9"),
+        "remote_port": 443,
+    }
+    values.update(fields)
+    return SimpleNamespace(**values)
+
+
+def _melt(report_hash="abc", updated_at=datetime(2024, 5, 1, 12, 0)):
+    return SimpleNamespace(report_hash=report_hash, updated_at=updated_at)
+
+
+def test_outgoing_key_ignores_ephemeral_local_port():
+    assert _connection_key(_row(local_port=51000)) == _connection_key(_row(local_port=52000))
+    assert _connection_key(_row()) == ("tcp", "outgoing", 7, "10.0.0.1", None, "203.0.113.9", 443)
+
+
+def test_incoming_key_ignores_ephemeral_remote_port():
+    incoming = dict(connection_type="incoming", local_port=22)
+    assert _connection_key(_row(remote_port=40000, **incoming)) == _connection_key(_row(remote_port=41000, **incoming))
+    assert _connection_key(_row(local_port=22, connection_type="incoming")) != _connection_key(
+        _row(local_port=2222, connection_type="incoming")
+    )
+
+
+def test_key_without_addresses_or_direction():
+    key = _connection_key(_row(connection_type=None, local_ip=None, remote_ip=None, protocol=None))
+    assert key == ("", "unknown", 7, None, 51000, None, 443)
+
+
+def test_diff_added_removed_changed():
+    before = {("tcp", 22): (1, "sshd"), ("tcp", 80): (2, "nginx"), ("tcp", 443): (2, "nginx")}
+    after = {("tcp", 22): (1, "sshd"), ("tcp", 443): (3, "haproxy"), ("udp", 53): (4, None)}
+    added, removed, changed = _diff(before, after)
+    assert added == [("udp", 53)]
+    assert removed == [("tcp", 80)]
+    assert changed == [("tcp", 443)]
+
+
+def test_limited_is_deterministic():
+    keys = [("tcp", port) for port in (443, 22, 80)]
+    assert _limited(keys, 2) == _limited(reversed(keys), 2)
+    assert _limited(keys, 2)[1] is True
+    assert _limited(keys, 3)[1] is False
+
+
+def test_version_key_changes_on_replacement():
+    original = _melt()
+    replaced = _melt(updated_at=datetime(2024, 5, 2, 8, 0))
+    assert melt_version_key(original) != melt_version_key(replaced)
+
+    # Две замены в пределах одной секунды
+    assert melt_version_key(_melt(updated_at=datetime(2024, 5, 1, 12, 0, 0, 1000))) != melt_version_key(
+        _melt(updated_at=datetime(2024, 5, 1, 12, 0, 0, 2000))
+    )
+    assert melt_version_key(_melt(updated_at=None)) == "abc@0"
+
+
+@pytest.mark.asyncio
+async def test_fingerprint_cache_lru(monkeypatch):
+    built = []
+
+    async def build_fingerprint(db, melt):
+        built.append(melt.report_hash)
+        return MeltFingerprint()
+
+    monkeypatch.setattr(delta, "build_fingerprint", build_fingerprint)
+    cache = FingerprintCache(max_entries=2)
+    first, second, third = _melt("a"), _melt("b"), _melt("c")
+
+    fingerprint = await cache.get(None, first)
+    assert await cache.get(None, first) is fingerprint
+    await cache.get(None, second)
+    await cache.get(None, first)
+    await cache.get(None, third)  # Вытесняет b - давно не использованный
+    await cache.get(None, second)
+
+    assert built == ["a", "b", "c", "b"]
+    assert (cache.hits, cache.misses) == (2, 4)
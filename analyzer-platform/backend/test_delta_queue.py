@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Тесты предвычисления дельт при приеме (services/delta.py, schedule_host_delta)
+
+Сессии БД заменяются заглушками, записывающими запросы.
+"""
+
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from core import database
+from services import delta
+from services.delta import process_delta_queue, store_host_delta
+from services.report_ingest import schedule_host_delta
+
+GENERATED_AT = datetime(2024, 5, 1, 12, 0)
+
+
+class _Result:
+    def __init__(self, value=None, rows=()):
+        self.value = value
+        self.rows = list(rows)
+
+    def scalar_one_or_none(self):
+        return self.value
+
+    def fetchall(self):
+        return self.rows
+
+
+class _Session:
+    """Сессия, записывающая SQL; результаты выдаются по порядку"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.statements = []
+        self.params = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    async def execute(self, statement, params=None):
+        compiled = statement.compile(dialect=postgresql.dialect())
+        self.statements.append(str(compiled))
+        self.params.append(compiled.params)
+        return self.results.pop(0) if self.results else _Result()
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+
+def _melt(hours=0):
+    return SimpleNamespace(id=uuid.uuid4(), hostname="web-01", generated_at=GENERATED_AT + timedelta(hours=hours))
+
+
+@pytest.mark.asyncio
+async def test_first_report_stores_empty_delta(monkeypatch):
+    async def get_previous_melt(db, melt):
+        return None
+
+    monkeypatch.setattr(delta, "get_previous_melt", get_previous_melt)
+    session = _Session()
+
+    assert await store_host_delta(session, _melt()) is None
+
+    delta_sql, pointer_sql = session.statements
+    assert delta_sql.startswith("INSERT INTO host_deltas")
+    assert pointer_sql.startswith("INSERT INTO host_latest_deltas")
+    # Поздно обработанный старый отчет не перетирает указатель
+    assert "WHERE host_latest_deltas.report_generated_at <= excluded.report_generated_at" in pointer_sql
+
+
+@pytest.mark.asyncio
+async def test_delta_total_counts_all_sections(monkeypatch):
+    previous, melt = _melt(), _melt(hours=1)
+    computed = {"summary": {"connections": {"added": 2, "removed": 1}, "ports": {"added": 0, "changed": 3}}}
+
+    async def get_previous_melt(db, current):
+        return previous
+
+    async def compute_delta(db, current, against):
+        assert (current, against) == (melt, previous)
+        return computed
+
+    monkeypatch.setattr(delta, "get_previous_melt", get_previous_melt)
+    monkeypatch.setattr(delta, "compute_delta", compute_delta)
+    session = _Session()
+
+    assert await store_host_delta(session, melt) is computed
+
+    delta_params, pointer_params = session.params
+    assert delta_params["total_changes"] == pointer_params["total_changes"] == 6
+    assert delta_params["against_report_id"] == pointer_params["against_report_id"] == previous.id
+
+
+@pytest.mark.asyncio
+async def test_queue_item_removed_on_success_and_retried_on_error(monkeypatch):
+    good, bad = _melt(), _melt(hours=1)
+    items = [
+        SimpleNamespace(report_id=good.id, report_generated_at=good.generated_at),
+        SimpleNamespace(report_id=bad.id, report_generated_at=bad.generated_at),
+    ]
+    sessions = [
+        _Session(_Result(items[0]), _Result(good)),
+        _Session(_Result(items[1]), _Result(bad)),
+        _Session(_Result(None)),
+    ]
+    used = list(sessions)
+
+    @asynccontextmanager
+    async def factory():
+        yield sessions.pop(0)
+
+    async def store(db, melt):
+        if melt is bad:
+            raise RuntimeError("diff failed")
+
+    monkeypatch.setattr(database, "async_session_factory", factory)
+    monkeypatch.setattr(delta, "store_host_delta", store)
+
+    assert await process_delta_queue(batch_size=5) == 1
+
+    claim = used[0].statements[0]
+    assert "FOR UPDATE SKIP LOCKED" in claim
+    assert "delta_queue.attempts <" in claim
+    assert used[0].statements[-1].startswith("DELETE FROM delta_queue")
+    assert used[0].commits == 1
+
+    assert used[1].rollbacks == 1
+    assert used[1].statements[-1].startswith("UPDATE delta_queue SET attempts=(delta_queue.attempts +")
+    assert used[1].commits == 1
+    assert not sessions
+
+
+@pytest.mark.asyncio
+async def test_schedule_requeues_stale_deltas():
+    melt = _melt()
+    stale = SimpleNamespace(report_id=uuid.uuid4(), report_generated_at=GENERATED_AT + timedelta(days=1))
+    session = _Session(_Result(rows=[stale]))
+
+    await schedule_host_delta(session, melt.id, melt.hostname, melt.generated_at)
+
+    stale_sql, queue_sql = session.statements
+    assert stale_sql.startswith("DELETE FROM host_deltas")
+    assert "host_deltas.against_report_id =" in stale_sql
+    assert queue_sql.startswith("INSERT INTO delta_queue")
+    assert "ON CONFLICT (report_id) DO UPDATE" in queue_sql
+    # Сам отчет и каждая устаревшая дельта - по строке очереди
+    assert queue_sql.count("enqueued_at_m") == 2
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Тесты разбора адресов соединений и фильтров по подсетям
+(services/endpoints.py, services/search.py)
+"""
+
+import ipaddress
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from services import search as search_module
+from services.endpoints import parse_endpoint, split_endpoint
+from services.search import SearchQueryError, filter_connections, parse_cidr, parse_port_range
+
+
+@pytest.mark.parametrize("address,expected", [
+    ("10.0.0.5:443", ("10.0.0.5", 443)),
+    ("[2001:db8::1]:22", ("2001:db8::1", 22)),
+    ("*:53", (None, 53)),
+    ("0.0.0.0:*", (None, None)),
+    ("::1.631", ("::1", 631)),
+    ("::1:631", ("::1", 631)),
+    ("fe80::1%eth0:546", ("fe80::1", 546)),
+    ("[::ffff:10.0.0.1]:80", ("10.0.0.1", 80)),
+    ("2001:db8::1", ("2001:db8::1", None)),
+    ("192.168.1.1", ("192.168.1.1", None)),
+    ("localhost:80", (None, None)),
+    ("10.0.0.5:99999", (None, None)),
+    ("", (None, None)),
+    (None, (None, None)),
+])
+def test_split_endpoint(address, expected):
+    assert split_endpoint(address) == expected
+
+
+def test_parse_endpoint_returns_typed_ip():
+    ip, port = parse_endpoint("[2001:db8::1]:22")
+    assert ip == ipaddress.ip_address("2001:db8::1")
+    assert port == 22
+
+
+def test_parse_cidr_and_port_range():
+    assert parse_cidr("10.1.2.3/8") == ipaddress.ip_network("10.0.0.0/8")
+    assert parse_cidr("2001:db8::1") == ipaddress.ip_network("2001:db8::1/128")
+    assert parse_port_range("443") == (443, 443)
+    assert parse_port_range(" 1-1024 ") == (1, 1024)
+    for value in ("1024-1", "0-70000", "http", "-5"):
+        with pytest.raises(SearchQueryError):
+            parse_port_range(value)
+    with pytest.raises(SearchQueryError):
+        parse_cidr("10.0.0.0/33")
+
+
+@pytest.mark.asyncio
+async def test_filter_connections_builds_range_conditions(monkeypatch):
+    captured = []
+
+    async def connection_hits(db, conditions, page, page_size):
+        captured.extend(conditions)
+        return {"total": 0, "hits": []}
+
+    monkeypatch.setattr(search_module, "_connection_hits", connection_hits)
+
+    response = await filter_connections(None, remote_cidr="10.0.0.0/8", remote_ports="1-1024", protocol=" TCP ")
+
+    compiled = [c.compile(dialect=postgresql.dialect()) for c in captured]
+    sql = [str(c) for c in compiled]
+    assert sql[0] == "network_connections.remote_ip <<= CAST(%(param_1)s AS CIDR)"
+    assert sql[1] == "network_connections.remote_port BETWEEN %(remote_port_1)s::INTEGER AND %(remote_port_2)s::INTEGER"
+    assert sql[2] == "lower(network_connections.protocol) = %(lower_1)s::VARCHAR"
+    assert [c.params for c in compiled] == [
+        {"param_1": "10.0.0.0/8"}, {"remote_port_1": 1, "remote_port_2": 1024}, {"lower_1": "tcp"}
+    ]
+    assert response["filters"]["remote_cidr"] == "10.0.0.0/8"
+
+
+@pytest.mark.asyncio
+async def test_filter_connections_requires_address_or_port():
+    with pytest.raises(SearchQueryError):
+        await filter_connections(None, protocol="tcp")
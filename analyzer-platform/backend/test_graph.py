@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Тесты графа связей парка (services/graph.py)
+"""
+
+import ipaddress
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from services.graph import (
+    GraphQueryError, aggregate_edges, apply_report_edges, decode_edge_cursor, encode_edge_cursor, get_subgraph,
+    parse_node, retract_report_edges
+)
+
+SEEN_AT = datetime(2024, 5, 1, 12, 0)
+
+
+class _Session:
+    """Сессия: каждый запрос получает следующую пачку строк"""
+
+    def __init__(self, *batches):
+        self.batches = list(batches)
+        self.statements = []
+
+    async def execute(self, statement, params=None):
+        self.statements.append((str(statement.compile(dialect=postgresql.dialect())), params))
+        rows = self.batches.pop(0) if self.batches else []
+        return SimpleNamespace(fetchall=lambda: rows)
+
+
+def _connection(remote_ip, direction="outgoing", local_port=51000, remote_port=443, **fields):
+    return {
+        "connection_type": direction,
+        "remote_ip": ipaddress.ip_address(remote_ip) if remote_ip else None,
+        "local_port": local_port,
+        "remote_port": remote_port,
+        "protocol": "TCP",
+        **fields,
+    }
+
+
+def _edge(hostname, remote_ip, report_count=1):
+    return SimpleNamespace(
+        hostname=hostname, remote_ip=ipaddress.ip_address(remote_ip), port=443, protocol="tcp",
+        direction="outgoing", process_name=None, first_seen=None, last_seen=None,
+        report_count=report_count, connection_count=1, packet_total=0,
+    )
+
+
+def test_edges_keyed_by_service_port():
+    edges = aggregate_edges([
+        _connection("203.0.113.9", local_port=51000, packet_count=5, last_seen=SEEN_AT),
+        _connection("203.0.113.9", local_port=52000, packet_count=7, first_seen=SEEN_AT - timedelta(hours=1)),
+        _connection("198.51.100.7", direction="incoming", local_port=22, remote_port=40000),
+        _connection(None),
+    ])
+
+    outgoing = edges[("outgoing", ipaddress.ip_address("203.0.113.9"), 443, "tcp")]
+    assert (outgoing["connections"], outgoing["packets"]) == (2, 12)
+    assert (outgoing["first_seen"], outgoing["last_seen"]) == (SEEN_AT - timedelta(hours=1), SEEN_AT)
+    assert ("incoming", ipaddress.ip_address("198.51.100.7"), 22, "tcp") in edges
+    assert len(edges) == 2
+
+
+@pytest.mark.asyncio
+async def test_apply_and_retract_statements():
+    session = _Session()
+
+    assert await apply_report_edges(session, "web-01", SEEN_AT, [_connection("203.0.113.9")]) == 1
+    upsert, _ = session.statements[0]
+    assert upsert.startswith("INSERT INTO fleet_edges")
+    assert "report_count = (fleet_edges.report_count + %(report_count_1)s::INTEGER)" in upsert
+
+    await retract_report_edges(session, "web-01", "r1", SEEN_AT)
+    (update_sql, params), (delete_sql, _) = session.statements[1:]
+    assert "SET report_count = e.report_count - 1" in update_sql
+    assert params == {"report_id": "r1", "generated_at": SEEN_AT, "hostname": "web-01"}
+    # Ребра без отчетов удаляются после вычитания
+    assert delete_sql.startswith("DELETE FROM fleet_edges")
+    assert "fleet_edges.report_count <= " in delete_sql
+
+
+def test_parse_node():
+    assert parse_node("host:web-01") == ("host", "web-01")
+    assert parse_node(" IP:[2001:db8::1] ") == ("ip", "2001:db8::1")
+    for node in ("host:", "ip:not-an-ip", "web-01", "user:root"):
+        with pytest.raises(GraphQueryError):
+            parse_node(node)
+
+
+def test_edge_cursor_roundtrip():
+    cursor = encode_edge_cursor(["10.0.0.1", 443, "tcp", "outgoing"])
+    assert decode_edge_cursor(cursor, 4) == ["10.0.0.1", 443, "tcp", "outgoing"]
+    with pytest.raises(GraphQueryError):
+        decode_edge_cursor(cursor, 3)
+    with pytest.raises(GraphQueryError):
+        decode_edge_cursor("%%%", 4)
+
+
+@pytest.mark.asyncio
+async def test_subgraph_walks_bipartite_levels():
+    session = _Session(
+        [_edge("web-01", "203.0.113.9"), _edge("web-01", "198.51.100.7")],
+        [_edge("web-01", "203.0.113.9"), _edge("web-02", "203.0.113.9")],
+    )
+
+    graph = await get_subgraph(session, "host:web-01", depth=2)
+
+    depths = {node["id"]: node["depth"] for node in graph["nodes"]}
+    assert depths == {"host:web-01": 0, "ip:203.0.113.9": 1, "ip:198.51.100.7": 1, "host:web-02": 2}
+    assert len(graph["edges"]) == 3
+    assert graph["truncated"] is False
+    assert len(session.statements) == 2
+
+
+@pytest.mark.asyncio
+async def test_subgraph_truncated_at_max_nodes():
+    session = _Session([_edge("web-01", f"203.0.113.{i}") for i in range(5)])
+
+    graph = await get_subgraph(session, "host:web-01", depth=3, max_nodes=3)
+
+    assert len(graph["nodes"]) == 3
+    assert len(graph["edges"]) == 2
+    assert graph["truncated"] is True
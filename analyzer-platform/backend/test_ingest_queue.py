@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Тесты очереди приема на Redis Streams (services/ingest_queue.py)
+
+Redis заменяется fakeredis, разбор файла (ingest_job) - записывающей заглушкой.
+"""
+
+import asyncio
+
+import fakeredis
+import pytest
+
+from core import redis_client
+from services import ingest_queue
+from services.ingest_queue import (
+    DEAD_STREAM, INGEST_GROUP, STATE_DONE, STATE_FAILED, STATE_QUEUED, IngestError, IngestWorker,
+    enqueue_upload, ensure_groups, get_upload_status, partition_for, redrive_dead_letters, stream_key
+)
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    client = fakeredis.FakeAsyncRedis()
+    monkeypatch.setattr(redis_client, "redis_client", client)
+    monkeypatch.setattr(ingest_queue.settings, "INGEST_PARTITIONS", 2)
+    monkeypatch.setattr(ingest_queue.settings, "INGEST_BLOCK_MS", 10)
+    monkeypatch.setattr(ingest_queue.settings, "INGEST_RETRY_BASE_SECONDS", 0)
+    monkeypatch.setattr(ingest_queue.settings, "INGEST_MAX_ATTEMPTS", 3)
+    return client
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    """Заглушка ingest_job: записывает задания, ошибки берет из failures"""
+    handled, failures = [], []
+
+    async def fake_ingest_job(job, **status_fields):
+        handled.append((job["upload_id"], status_fields["attempts"]))
+        if failures:
+            raise failures.pop(0)
+        return {
+            "report_id": f"report-{job['upload_id']}", "report_hash": "h", "hostname": job["hostname"],
+            "saved_as": job["filename"], "connections_count": 0, "is_replacement": False,
+        }
+
+    monkeypatch.setattr(ingest_queue, "ingest_job", fake_ingest_job)
+    return handled, failures
+
+
+async def _enqueue(upload_id, hostname="web-01", path="/data/incoming/x.html"):
+    return await enqueue_upload(path, f"{upload_id}.html", 100, hostname, upload_id)
+
+
+async def _read(worker, partition):
+    reply = await redis_client.redis_client.xreadgroup(INGEST_GROUP, worker.consumer, {stream_key(partition): ">"}, count=1)
+    return reply[0][1][0]
+
+
+def test_partition_stable_per_host():
+    assert partition_for("web-01") == partition_for("web-01")
+    assert 0 <= partition_for("web-01") < ingest_queue.settings.INGEST_PARTITIONS
+    assert partition_for(None) == partition_for("unknown")
+
+
+@pytest.mark.asyncio
+async def test_enqueue_adds_message_and_status(redis):
+    await ensure_groups()
+    await ensure_groups()  # BUSYGROUP - группа уже есть
+
+    queued = await _enqueue("u1")
+
+    partition = partition_for("web-01")
+    assert queued["partition"] == partition
+    entries = await redis.xrange(stream_key(partition))
+    assert [entry_id.decode() for entry_id, _ in entries] == [queued["message_id"]]
+    assert entries[0][1][b"upload_id"] == b"u1"
+    status = await get_upload_status("u1")
+    assert (status["state"], status["attempts"]) == (STATE_QUEUED, 0)
+
+
+@pytest.mark.asyncio
+async def test_consumer_processes_host_messages_in_order(redis, jobs):
+    handled, _ = jobs
+    await ensure_groups()
+    for upload_id in ("u1", "u2", "u3"):
+        await _enqueue(upload_id)
+    worker = IngestWorker("w1")
+    partition = partition_for("web-01")
+
+    await worker._try_acquire(partition)
+    for _ in range(100):
+        if worker.counters["processed"] == 3:
+            break
+        await asyncio.sleep(0.01)
+    await worker._shutdown()
+
+    assert [upload_id for upload_id, _ in handled] == ["u1", "u2", "u3"]
+    # Подтвержденные сообщения удалены, аренда снята
+    assert await redis.xlen(stream_key(partition)) == 0
+    assert (await redis.xpending(stream_key(partition), INGEST_GROUP))["pending"] == 0
+    assert not await redis.exists(ingest_queue._lease_key(partition))
+    assert (await get_upload_status("u3"))["report_id"] == "report-u3"
+
+
+@pytest.mark.asyncio
+async def test_lease_held_by_one_worker(redis):
+    await ensure_groups()
+    first, second = IngestWorker("w1"), IngestWorker("w2")
+
+    await first._try_acquire(0)
+    await second._try_acquire(0)
+
+    assert first.owns(0) and not second.owns(0)
+    await first._shutdown()
+    await second._try_acquire(0)
+    assert second.owns(0)
+    await second._shutdown()
+
+
+@pytest.mark.asyncio
+async def test_transient_error_retried_then_dead_lettered(redis, jobs):
+    handled, failures = jobs
+    await ensure_groups()
+    await _enqueue("u1")
+    partition = partition_for("web-01")
+    worker = IngestWorker("w1")
+    message_id, fields = await _read(worker, partition)
+    failures.extend([ConnectionError("db down")] * 3)
+
+    for _ in range(3):
+        await worker._handle(partition, message_id, fields)
+
+    assert handled == [("u1", 1), ("u1", 2), ("u1", 3)]
+    assert worker.counters["retried"] == 2
+    assert worker.counters["dead_lettered"] == 1
+    dead = await ingest_queue.get_dead_letters()
+    assert (dead[0]["upload_id"], dead[0]["attempts"], dead[0]["error"]) == ("u1", "3", "db down")
+    assert await redis.xlen(stream_key(partition)) == 0
+    assert (await get_upload_status("u1"))["state"] == STATE_FAILED
+
+
+@pytest.mark.asyncio
+async def test_permanent_error_not_retried(redis, jobs):
+    handled, failures = jobs
+    await ensure_groups()
+    await _enqueue("u1")
+    partition = partition_for("web-01")
+    worker = IngestWorker("w1")
+    failures.append(IngestError("broken html"))
+
+    await worker._handle(partition, *await _read(worker, partition))
+
+    assert handled == [("u1", 1)]
+    assert worker.counters == {**worker.counters, "retried": 0, "dead_lettered": 1}
+    assert await redis.xlen(DEAD_STREAM) == 1
+
+
+@pytest.mark.asyncio
+async def test_pending_messages_of_crashed_worker_claimed(redis, jobs):
+    handled, _ = jobs
+    await ensure_groups()
+    await _enqueue("u1")
+    partition = partition_for("web-01")
+    crashed, successor = IngestWorker("crashed"), IngestWorker("successor")
+    await _read(crashed, partition)  # Доставлено, но не подтверждено
+
+    assert await successor._claim(partition, 0) == 1
+    reply = await redis.xreadgroup(INGEST_GROUP, successor.consumer, {stream_key(partition): "0"}, count=1)
+    message_id, fields = reply[0][1][0]
+    await successor._handle(partition, message_id, fields)
+
+    # Доставки считаются попытками: упавшему воркеру, XAUTOCLAIM и чтение своих ожидающих
+    assert handled == [("u1", 3)]
+    assert (await get_upload_status("u1"))["state"] == STATE_DONE
+    assert successor.counters["claimed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_redrive_requeues_only_existing_files(redis, tmp_path):
+    await ensure_groups()
+    upload = tmp_path / "u1.html"
+    upload.write_text("<html></html>")
+    for upload_id, path in (("u1", str(upload)), ("u2", str(tmp_path / "gone.html"))):
+        await redis.xadd(DEAD_STREAM, {
+            "upload_id": upload_id, "path": path, "filename": f"{upload_id}.html", "file_size": "13", "hostname": "web-01",
+        })
+
+    assert await redrive_dead_letters() == {"redriven": 1, "dropped": 1}
+    assert await redis.xlen(DEAD_STREAM) == 0
+    assert await redis.xlen(stream_key(partition_for("web-01"))) == 1
+    assert (await get_upload_status("u1"))["state"] == STATE_QUEUED
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Тесты кэша справочников (services/interning.py)
+"""
+
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+
+from core import database
+from models.report import NetworkAddress, ProcessName
+from services.interning import DimensionInterner
+
+
+class _Conn:
+    """Справочник в памяти: INSERT ... RETURNING отдает только новые значения"""
+
+    def __init__(self, table):
+        self.table = table
+        self.statements = []
+
+    async def execute(self, statement):
+        values = []
+        for value in statement.compile().params.values():
+            values.extend(value if isinstance(value, list) else [value])
+        self.statements.append((statement.is_insert, values))
+        if statement.is_insert:
+            new = [value for value in values if value not in self.table]
+            for value in new:
+                self.table[value] = len(self.table) + 1
+            return [SimpleNamespace(id=self.table[value], value=value) for value in new]
+        return [SimpleNamespace(id=self.table[value], value=value) for value in values if value in self.table]
+
+
+class _Engine:
+    def __init__(self, table):
+        self.conn = _Conn(table)
+
+    @asynccontextmanager
+    async def begin(self):
+        yield self.conn
+
+
+@pytest.fixture
+def interner(monkeypatch):
+    resolved = []
+
+    async def resolve(model, values):
+        resolved.append((model.__tablename__, values))
+        return {value: len(value) for value in values}
+
+    interner = DimensionInterner(max_entries=3)
+    monkeypatch.setattr(interner, "_resolve", resolve)
+    interner.resolved = resolved
+    return interner
+
+
+@pytest.mark.asyncio
+async def test_cached_values_skip_database(interner):
+    assert await interner.intern_many(ProcessName, ["sshd", None, "", "nginx"]) == {"sshd": 4, "nginx": 5}
+    assert await interner.intern_many(ProcessName, ["nginx", "sshd"]) == {"nginx": 5, "sshd": 4}
+
+    assert interner.resolved == [("dim_process_names", ["nginx", "sshd"])]
+    assert (interner.hits, interner.misses) == (2, 2)
+
+
+@pytest.mark.asyncio
+async def test_tables_cached_separately(interner):
+    await interner.intern_many(ProcessName, ["sshd"])
+    await interner.intern_many(NetworkAddress, ["sshd"])
+    assert [table for table, _ in interner.resolved] == ["dim_process_names", "dim_addresses"]
+
+
+@pytest.mark.asyncio
+async def test_overflow_clears_table_cache(interner):
+    await interner.intern_many(ProcessName, ["a", "b"])
+    await interner.intern_many(ProcessName, ["c", "d"])
+    assert interner.get_stats()["dim_process_names_entries"] == 2
+
+    await interner.intern_many(ProcessName, ["a"])
+    assert interner.resolved[-1] == ("dim_process_names", ["a"])
+
+
+@pytest.mark.asyncio
+async def test_resolve_reads_existing_after_conflict(monkeypatch):
+    engine = _Engine({"sshd": 1})
+    monkeypatch.setattr(database, "async_engine", engine)
+
+    resolved = await DimensionInterner()._resolve(ProcessName, ["nginx", "sshd"])
+
+    assert resolved == {"nginx": 2, "sshd": 1}
+    # Ключ существовавшего значения дочитывается отдельным SELECT
+    assert engine.conn.statements == [(True, ["nginx", "sshd"]), (False, ["sshd"])]
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Тесты локального уровня кэша и инвалидации между воркерами
+(core/local_cache.py, core/redis_client.py)
+
+Redis заменяется fakeredis: два CacheManager на одном сервере изображают
+два воркера, сообщения канала инвалидации доставляются вручную.
+"""
+
+import fakeredis
+import pytest
+
+from core import local_cache, redis_client
+from core.local_cache import MISSING, LocalCache
+from core.redis_client import CacheManager
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis_client, "redis_client", fakeredis.FakeAsyncRedis(server=server))
+    return server
+
+
+def _worker():
+    worker = CacheManager()
+    worker.listening = True
+    return worker
+
+
+async def _subscribe(channel):
+    pubsub = redis_client.redis_client.pubsub()
+    await pubsub.subscribe(channel)
+    await pubsub.get_message(timeout=0.1)  # Подтверждение подписки
+    return pubsub
+
+
+async def _deliver(pubsub, *workers):
+    """Доставляет накопленные сообщения канала инвалидации воркерам"""
+    while True:
+        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0.01)
+        if message is None:
+            return
+        for worker in workers:
+            worker.handle_invalidation(message["data"])
+
+
+def test_lru_evicts_by_entries_and_bytes():
+    cache = LocalCache(max_entries=2, max_bytes=100, ttl=60)
+    cache.set("a", 1, 10)
+    cache.set("b", 2, 10)
+    cache.get("a")
+    cache.set("c", 3, 10)  # Вытесняет b - давно не читанный
+    assert cache.get("b") is MISSING
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+    cache.set("d", 4, 95)
+    assert len(cache) == 1
+    assert cache.get_stats()["evictions"] == 3
+
+
+def test_entry_expires_and_large_entry_skipped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(local_cache.time, "monotonic", lambda: now[0])
+    cache = LocalCache(ttl=30)
+
+    cache.set("short", "value", 1, ttl=5)
+    cache.set("none", None, 1)
+    assert cache.get("none") is None
+    now[0] += 6
+    assert cache.get("short") is MISSING
+    assert cache.get("none") is None
+
+    cache.set("huge", "value", local_cache.settings.CACHE_LOCAL_MAX_ENTRY_BYTES + 1)
+    assert cache.get("huge") is MISSING
+
+
+def test_discard_advances_epoch():
+    cache = LocalCache()
+    cache.set("analyzer:reports:0:a", 1, 1)
+    cache.set("analyzer:stats:0:a", 2, 1)
+    epoch = cache.epoch
+
+    assert cache.discard_prefix("analyzer:reports:") == 1
+    assert cache.epoch == epoch + 1
+    assert cache.get("analyzer:stats:0:a") == 2
+
+
+@pytest.mark.asyncio
+async def test_hot_read_served_locally(server):
+    worker = _worker()
+    await worker.set("reports", "r1", {"hostname": "web-01"})
+    await redis_client.redis_client.flushall()
+
+    # Запись удалена из Redis, но воркер отдает свою копию
+    assert await worker.get("reports", "r1") == {"hostname": "web-01"}
+    assert worker.get_stats()["local"]["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_write_invalidates_other_workers(server):
+    first, second = _worker(), _worker()
+    pubsub = await _subscribe(first.channel)
+
+    await first.set("reports", "r1", {"version": 1})
+    assert await second.get("reports", "r1") == {"version": 1}
+
+    await first.set("reports", "r1", {"version": 2})
+    await _deliver(pubsub, first, second)
+    assert await second.get("reports", "r1") == {"version": 2}
+
+    await first.delete("reports", "r1")
+    await _deliver(pubsub, first, second)
+    assert await second.get("reports", "r1") is None
+    await pubsub.aclose()
+
+
+@pytest.mark.asyncio
+async def test_category_reset_reaches_other_workers(server):
+    first, second = _worker(), _worker()
+    pubsub = await _subscribe(first.channel)
+
+    await first.set("stats", "web-01", {"total": 1})
+    assert await second.get("stats", "web-01") == {"total": 1}
+
+    await first.clear_category("stats")
+    await _deliver(pubsub, first, second)
+
+    assert second._generations["stats"][0] == 1
+    assert await second.get("stats", "web-01") is None
+    await pubsub.aclose()
+
+
+@pytest.mark.asyncio
+async def test_local_tier_off_without_subscription(server):
+    worker = CacheManager()
+    await worker.set("reports", "r1", {"hostname": "web-01"})
+    await redis_client.redis_client.flushall()
+
+    # Без подписки пропущенная инвалидация не должна оставить копию
+    assert await worker.get("reports", "r1") is None
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Тесты рядов метрик хоста (services/metrics.py)
+"""
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from core.config import get_settings
+from services.metrics import (
+    RESOLUTION_DAY, RESOLUTION_HOUR, SERIES_METRICS, SeriesQueryError, _aggregate, _choose_step, bucket_start,
+    get_host_series, parse_step, refresh_metric_rollups
+)
+
+settings = get_settings()
+DAY = datetime(2024, 5, 1)
+
+
+class _Session:
+    """Сессия: SELECT возвращает заданные строки, остальные запросы записываются"""
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.statements = []
+
+    async def execute(self, statement):
+        compiled = statement.compile(dialect=postgresql.dialect())
+        self.statements.append((str(compiled), compiled.params))
+        return SimpleNamespace(fetchall=lambda: self.rows)
+
+
+def _report(hour, minute, total):
+    return SimpleNamespace(
+        generated_at=DAY.replace(hour=hour, minute=minute),
+        **{metric: total if metric == "total_connections" else None for metric in SERIES_METRICS}
+    )
+
+
+def test_bucket_start():
+    value = datetime(2024, 5, 1, 13, 45, 10, 500)
+    assert bucket_start(value, RESOLUTION_HOUR) == datetime(2024, 5, 1, 13)
+    assert bucket_start(value, RESOLUTION_DAY) == DAY
+
+
+def test_aggregate_min_max_last():
+    rows = [_report(10, 30, 50), _report(10, 5, 80), _report(11, 0, 10)]
+
+    hour = _aggregate(rows, DAY.replace(hour=10), DAY.replace(hour=11))
+
+    assert hour["total_connections"] == {
+        "min_value": 50, "max_value": 80, "last_value": 50, "last_at": DAY.replace(hour=10, minute=30), "samples": 2,
+    }
+    assert hour["tcp_connections"]["max_value"] == 0
+    assert _aggregate(rows, DAY.replace(hour=12), DAY.replace(hour=13)) == {}
+
+
+def test_parse_step():
+    assert parse_step(None) is None
+    assert parse_step("6h") == 6 * 3600
+    assert parse_step(" 2W ") == 14 * 86400
+    assert parse_step("7200") == 7200
+    for value in ("30m", "1800", "5400", "day"):
+        with pytest.raises(SeriesQueryError):
+            parse_step(value)
+
+
+def test_choose_step_limits_points():
+    assert _choose_step(DAY, DAY + timedelta(days=1)) == 3600
+    long_step = _choose_step(DAY, DAY + timedelta(days=365 * 3))
+    assert long_step % 86400 == 0
+    assert timedelta(days=365 * 3).total_seconds() / long_step <= settings.SERIES_MAX_POINTS
+
+
+@pytest.mark.asyncio
+async def test_refresh_upserts_touched_buckets_and_drops_empty():
+    session = _Session([_report(10, 30, 50)])
+
+    await refresh_metric_rollups(session, "web-01", [DAY.replace(hour=10, minute=30), DAY.replace(hour=14)])
+
+    written = [
+        (sql.split(" ")[0], params.get("resolution_m0") or params.get("resolution_1"))
+        for sql, params in session.statements[1:]
+    ]
+    # Суточная и часовая корзины с отчетом пишутся, корзина 14:00 без отчетов удаляется
+    assert sorted(written) == [("DELETE", RESOLUTION_HOUR), ("INSERT", RESOLUTION_DAY), ("INSERT", RESOLUTION_HOUR)]
+    upsert = next(sql for sql, _ in session.statements if sql.startswith("INSERT"))
+    assert "ON CONFLICT (hostname, metric, resolution, bucket_start) DO UPDATE" in upsert
+
+
+@pytest.mark.asyncio
+async def test_series_reads_daily_rollups_for_daily_step():
+    session = _Session([SimpleNamespace(step_start=DAY, min=1, max=9, last=4, samples=3)])
+
+    series = await get_host_series(session, "web-01", "total_connections", DAY - timedelta(days=7), DAY, step="1d")
+
+    assert series["resolution"] == RESOLUTION_DAY
+    assert series["points"] == [{"t": DAY.isoformat(), "min": 1, "max": 9, "last": 4, "samples": 3}]
+    assert session.statements[0][1]["resolution_1"] == RESOLUTION_DAY
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("metric,start,step", [
+    ("load_average", DAY - timedelta(days=1), None),
+    ("total_connections", DAY + timedelta(days=1), None),
+    ("total_connections", DAY - timedelta(days=365 * 10), "1h"),
+])
+async def test_series_rejects_invalid_queries(metric, start, step):
+    with pytest.raises(SeriesQueryError):
+        await get_host_series(_Session(), "web-01", metric, start, DAY, step=step)
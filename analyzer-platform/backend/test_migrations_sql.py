@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Тесты разбора SQL скриптов миграций (core/migrations.py)
+"""
+
+from core.migrations import SQL_DIR, split_sql_statements
+
+
+def test_splits_on_semicolons():
+    sql = "CREATE TABLE a (id int);\n\nCREATE INDEX idx_a ON a (id);\n"
+    assert split_sql_statements(sql) == ["CREATE TABLE a (id int)", "CREATE INDEX idx_a ON a (id)"]
+
+
+def test_last_statement_without_semicolon():
+    assert split_sql_statements("SELECT 1; SELECT 2") == ["SELECT 1", "SELECT 2"]
+
+
+def test_semicolons_in_strings_and_comments():
+    sql = (
+        "-- комментарий; не команда\n"
+        "INSERT INTO t VALUES ('a;b', 'it''s; fine');\n"
+        "SELECT 1; -- хвост;\n"
+    )
+    assert split_sql_statements(sql) == ["INSERT INTO t VALUES ('a;b', 'it''s; fine')", "SELECT 1"]
+
+
+def test_dollar_quoted_blocks_kept_whole():
+    body = "BEGIN\n    PERFORM 1;\n    RAISE NOTICE 'x;y';\nEND"
+    sql = (
+        f"DO $$\n{body}\n$$;\n"
+        f"CREATE FUNCTION f() RETURNS void AS $fn$\n{body}\n$fn$ LANGUAGE plpgsql;\n"
+    )
+    statements = split_sql_statements(sql)
+    assert statements == [
+        f"DO $$\n{body}\n$$",
+        f"CREATE FUNCTION f() RETURNS void AS $fn$\n{body}\n$fn$ LANGUAGE plpgsql",
+    ]
+
+
+def test_positional_parameters_are_not_dollar_tags():
+    sql = "PREPARE q AS SELECT $1, $2; SELECT 3"
+    assert split_sql_statements(sql) == ["PREPARE q AS SELECT $1, $2", "SELECT 3"]
+
+
+def test_empty_and_comment_only_scripts():
+    assert split_sql_statements("") == []
+    assert split_sql_statements(";;\n-- только комментарий\n") == []
+
+
+def test_bundled_scripts_split_into_statements():
+    for path in sorted(SQL_DIR.glob("*.sql")):
+        statements = split_sql_statements(path.read_text(encoding="utf-8"))
+        assert statements, path.name
+        assert all(statement and not statement.startswith("--") for statement in statements), path.name
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Тесты имен и границ месячных секций (services/partitioning.py)
+"""
+
+from contextlib import asynccontextmanager
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from core import database
+from core.database import Base
+from services import partitioning
+from services.partitioning import (
+    month_partition_ddl, month_start, next_month, partition_month, partition_name
+)
+from services.report_ingest import resolve_generated_at
+
+
+def test_month_bounds():
+    assert month_start(datetime(2024, 5, 17, 13, 45)) == datetime(2024, 5, 1)
+    assert next_month(datetime(2024, 5, 1)) == datetime(2024, 6, 1)
+    assert next_month(datetime(2024, 12, 1)) == datetime(2025, 1, 1)
+
+
+def test_partition_name_roundtrip():
+    name = partition_name("network_connections", datetime(2025, 1, 1))
+    assert name == "network_connections_p202501"
+    assert partition_month(name) == datetime(2025, 1, 1)
+    assert partition_month("system_reports_default") is None
+    assert partition_month("system_reports_p2025") is None
+
+
+def test_partition_ddl_covers_whole_month():
+    ddl = month_partition_ddl("system_reports", datetime(2024, 12, 31, 23, 59))
+    assert ddl == (
+        "CREATE TABLE IF NOT EXISTS system_reports_p202412 PARTITION OF system_reports "
+        "FOR VALUES FROM ('2024-12-01 00:00:00') TO ('2025-01-01 00:00:00')"
+    )
+
+
+class _Conn:
+    """Соединение, записывающее SQL; SELECT возвращает заданные строки"""
+
+    def __init__(self, statements, rows=()):
+        self.statements = statements
+        self.rows = list(rows)
+
+    async def execute(self, statement, params=None):
+        sql = " ".join(str(statement).split())
+        self.statements.append(sql)
+        return SimpleNamespace(fetchall=lambda: self.rows)
+
+
+class _Engine:
+    def __init__(self):
+        self.statements = []
+
+    @asynccontextmanager
+    async def begin(self):
+        yield _Conn(self.statements)
+
+
+def test_child_tables_share_partition_key():
+    tables = partitioning.child_tables()
+    assert "system_reports" not in tables
+    assert {"network_connections", "anomaly_findings", "rule_alerts"} <= set(tables)
+    for table in tables:
+        keys = [
+            [column.name for column in fk.columns]
+            for fk in Base.metadata.tables[table].foreign_key_constraints
+            if fk.referred_table.name == "system_reports"
+        ]
+        assert keys == [["report_id", "report_generated_at"]], table
+
+
+@pytest.mark.asyncio
+async def test_ensure_partitions_once_per_month(monkeypatch):
+    engine = _Engine()
+    monkeypatch.setattr(database, "async_engine", engine)
+    monkeypatch.setattr(partitioning, "_known_months", set())
+
+    await partitioning.ensure_partitions_for(datetime(2023, 7, 3))
+    await partitioning.ensure_partitions_for(datetime(2023, 7, 28))
+
+    assert engine.statements[0].startswith("SELECT pg_advisory_xact_lock")
+    created = engine.statements[1:]
+    # Родительская секция первой: секции дочерних таблиц ссылаются на нее
+    assert created[0] == month_partition_ddl("system_reports", datetime(2023, 7, 1))
+    assert len(created) == 1 + len(partitioning.child_tables())
+
+
+@pytest.mark.asyncio
+async def test_drop_month_removes_children_first():
+    statements = []
+    conn = _Conn(statements, [SimpleNamespace(id="r1", hostname="web-01", html_file_path="/data/r1.html")])
+
+    dropped = await partitioning.drop_month_partition(conn, datetime(2023, 7, 15))
+
+    assert dropped["report_ids"] == ["r1"]
+    assert dropped["hostnames"] == ["web-01"]
+    drops = [sql for sql in statements if sql.startswith("DROP TABLE")]
+    assert drops[-1] == "DROP TABLE IF EXISTS system_reports_p202307"
+    assert len(drops) == 1 + len(partitioning.child_tables())
+
+
+def test_generated_at_is_naive_utc():
+    assert resolve_generated_at({"generated_at": "2024-05-01T12:00:00+03:00"}) == datetime(2024, 5, 1, 9, 0)
+    assert resolve_generated_at({"last_update": datetime(2024, 5, 2)}) == datetime(2024, 5, 2)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Тесты битовых карт индекса открытых портов (services/port_index.py)
+"""
+
+from datetime import datetime
+
+import pytest
+
+from services.port_index import PortExposureIndex, PortIndexError, _bits, parse_port_key
+
+GENERATED_AT = datetime(2024, 5, 1, 12, 0)
+
+
+def _index(hosts):
+    index = PortExposureIndex()
+    for number, (hostname, ports) in enumerate(hosts.items()):
+        index.set_host(hostname, f"report-{number}", GENERATED_AT, [parse_port_key(port) for port in ports])
+    return index
+
+
+@pytest.fixture
+def index():
+    return _index({
+        "web-01": ["22", "80", "443"],
+        "web-02": ["22", "443"],
+        "db-01": ["22", "5432"],
+        "dns-01": ["udp/53"],
+    })
+
+
+def test_parse_port_key():
+    assert parse_port_key("22") == ("tcp", 22)
+    assert parse_port_key(" UDP/53 ") == ("udp", 53)
+    for value in ("icmp/1", "abc", "70000"):
+        with pytest.raises(PortIndexError):
+            parse_port_key(value)
+
+
+def test_bits():
+    assert list(_bits(0)) == []
+    assert list(_bits(0b101001)) == [0, 3, 5]
+
+
+def test_query_set_operations(index):
+    ssh = ("tcp", 22)
+    https = ("tcp", 443)
+    assert index.hostnames(index.query(all_of=[ssh, https])) == ["web-01", "web-02"]
+    assert index.hostnames(index.query(all_of=[ssh], none_of=[https])) == ["db-01"]
+    assert index.hostnames(index.query(any_of=[("tcp", 5432), ("udp", 53)])) == ["db-01", "dns-01"]
+    assert index.hostnames(index.query(none_of=[ssh])) == ["dns-01"]
+    assert index.query(all_of=[("tcp", 3389)]) == 0
+    assert index.query(all_of=[ssh]).bit_count() == 3
+
+
+def test_hostnames_pagination(index):
+    bitmap = index.hosts_bitmap(("tcp", 22))
+    assert index.hostnames(bitmap, offset=1, limit=1) == ["web-02"]
+    assert index.hostnames(bitmap, offset=5) == []
+
+
+def test_set_host_replaces_ports(index):
+    index.set_host("web-02", "report-new", GENERATED_AT, [("tcp", 80)])
+    assert index.hostnames(index.hosts_bitmap(("tcp", 443))) == ["web-01"]
+    assert index.hostnames(index.hosts_bitmap(("tcp", 80))) == ["web-01", "web-02"]
+    assert index.host_ports("web-02")["ports"] == ["tcp/80"]
+
+
+def test_remove_host_frees_bit(index):
+    index.remove_host("db-01")
+    assert index.host_ports("db-01") is None
+    assert index.hosts_bitmap(("tcp", 5432)) == 0
+    assert "db-01" not in index.hostnames(index.query())
+
+    # Освободившийся бит достается новому хосту
+    index.set_host("db-02", "report-new", GENERATED_AT, [("tcp", 5432)])
+    assert index.hostnames(index.hosts_bitmap(("tcp", 5432))) == ["db-02"]
+    assert index.stats()["hosts"] == 4
+
+    index.remove_host("unknown")
+
+
+def test_snapshot_roundtrip(index):
+    index.built_at = GENERATED_AT
+    index.version = 7
+    restored = PortExposureIndex()
+    restored.load_snapshot(index.to_snapshot())
+
+    assert restored.ready
+    assert restored.version == 7
+    assert restored.built_at == GENERATED_AT
+    for hostname in ("web-01", "web-02", "db-01", "dns-01"):
+        assert restored.host_ports(hostname) == index.host_ports(hostname)
+    assert restored.hostnames(restored.query(all_of=[("tcp", 22)], none_of=[("tcp", 80)])) == ["web-02", "db-01"]
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Тесты маршрутизации чтения на реплики (core/database.py)
+
+Движки и фабрики сессий заменяются заглушками, отставание задается напрямую.
+"""
+
+import itertools
+
+import pytest
+from sqlalchemy.exc import DBAPIError
+
+from core import database
+from core.config import Settings, get_settings
+
+settings = get_settings()
+
+
+class _Session:
+    def __init__(self, name):
+        self.name = name
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def rollback(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+def _factory(name):
+    return lambda: _Session(name)
+
+
+def _state(host, healthy=True):
+    return {"host": host, "healthy": healthy, "lag_seconds": None, "checked_at": None, "error": None}
+
+
+@pytest.fixture
+def replicas(monkeypatch):
+    state = [_state("replica-1:5432"), _state("replica-2:5432")]
+    monkeypatch.setattr(database, "async_session_factory", _factory("primary"))
+    monkeypatch.setattr(database, "replica_engines", ["replica-1", "replica-2"])
+    monkeypatch.setattr(database, "replica_session_factories", [_factory("replica-1"), _factory("replica-2")])
+    monkeypatch.setattr(database, "replica_state", state)
+    monkeypatch.setattr(database, "read_routing_stats", {"replica": 0, "primary_fallback": 0})
+    monkeypatch.setattr(database, "_replica_cursor", itertools.count())
+    return state
+
+
+async def _read_session():
+    sessions = database.get_read_db()
+    session = await sessions.__anext__()
+    await sessions.aclose()
+    return session.name
+
+
+def test_replica_urls_default_port():
+    config = Settings(POSTGRES_REPLICA_HOSTS=" replica-1, replica-2:6432 ,", POSTGRES_PORT=5432)
+    hosts = [url.rsplit("@", 1)[1] for url in config.replica_database_urls]
+    assert hosts == [f"replica-1:5432/{config.POSTGRES_DB}", f"replica-2:6432/{config.POSTGRES_DB}"]
+
+
+@pytest.mark.asyncio
+async def test_lag_check_excludes_lagging_and_failed(monkeypatch, replicas):
+    database.replica_engines.append("replica-3")
+    database.replica_engines.append("replica-4")
+    replicas.extend([_state("replica-3:5432"), _state("replica-4:5432")])
+    lags = {
+        "replica-1": 0.5,
+        "replica-2": settings.DB_REPLICA_MAX_LAG_SECONDS + 1,
+        "replica-3": None,
+    }
+
+    async def measure(engine):
+        if engine not in lags:
+            raise ConnectionError("connection refused")
+        return lags[engine]
+
+    monkeypatch.setattr(database, "_measure_replica_lag", measure)
+
+    await database.check_replica_lag()
+
+    assert [state["healthy"] for state in replicas] == [True, False, False, False]
+    assert replicas[0]["lag_seconds"] == 0.5
+    assert replicas[3]["error"] == "connection refused"
+    assert all(state["checked_at"] for state in replicas)
+
+
+@pytest.mark.asyncio
+async def test_reads_rotate_over_healthy_replicas(replicas):
+    replicas[1]["healthy"] = False
+    database.replica_state.append(_state("replica-3:5432"))
+    database.replica_session_factories.append(_factory("replica-3"))
+
+    assert [await _read_session() for _ in range(4)] == ["replica-1", "replica-3", "replica-1", "replica-3"]
+    assert database.read_routing_stats == {"replica": 4, "primary_fallback": 0}
+
+
+@pytest.mark.asyncio
+async def test_falls_back_to_primary_without_healthy_replicas(replicas):
+    for state in replicas:
+        state["healthy"] = False
+
+    assert await _read_session() == "primary"
+    assert database.read_routing_stats == {"replica": 0, "primary_fallback": 1}
+
+
+@pytest.mark.asyncio
+async def test_invalidated_connection_excludes_replica(replicas):
+    sessions = database.get_read_db()
+    await sessions.__anext__()
+    error = DBAPIError("SELECT 1", None, ConnectionError("reset"), connection_invalidated=True)
+
+    with pytest.raises(DBAPIError):
+        await sessions.athrow(error)
+
+    assert replicas[0]["healthy"] is False
+    assert await _read_session() == "replica-2"
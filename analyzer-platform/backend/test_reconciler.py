@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Тесты сверки хранилища и БД (services/reconciler.py)
+
+Сессии БД заменяются заглушками, файлы создаются во временном каталоге.
+"""
+
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from core import database, redis_client
+from services.reconciler import STATUS_FILE_MISSING, STATUS_PROCESSED, StorageReconciler
+
+
+class _Result(list):
+    def fetchall(self):
+        return list(self)
+
+
+class _Session:
+    """Сессия: SELECT возвращает заданные строки, остальные запросы записываются"""
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.updates = []
+        self.committed = False
+
+    async def execute(self, statement):
+        if statement.is_select:
+            return _Result(self.rows)
+        self.updates.append(statement.compile().params)
+        return _Result()
+
+    async def commit(self):
+        self.committed = True
+
+
+def _use_session(monkeypatch, session):
+    @asynccontextmanager
+    async def factory():
+        yield session
+
+    monkeypatch.setattr(database, "async_session_factory", factory)
+
+
+def _write(path, name):
+    report = path / name
+    report.write_text("<html></html>")
+    return str(report)
+
+
+def test_storage_cursor_walks_in_batches(tmp_path):
+    for name in ("report_a.html", "report_b.html", "report_c.html", "temp_x.html", "notes.txt"):
+        _write(tmp_path, name)
+    reconciler = StorageReconciler(str(tmp_path))
+    reconciler.batch_size = 2
+
+    first = reconciler._next_storage_batch()
+    second = reconciler._next_storage_batch()
+
+    assert len(first) == 2 and len(second) == 1
+    assert {entry.name for entry in first + second} == {"report_a.html", "report_b.html", "report_c.html"}
+    assert reconciler.counters["storage_sweeps"] == 1
+    # Следующий вызов начинает новый проход
+    assert len(reconciler._next_storage_batch()) == 2
+
+
+@pytest.mark.asyncio
+async def test_untracked_files_are_scheduled(monkeypatch, tmp_path):
+    tracked = _write(tmp_path, "report_aaa.html")
+    moved = _write(tmp_path, "report_bbb.html")
+    legacy = _write(tmp_path, "legacy.html")
+    session = _Session([
+        SimpleNamespace(report_hash="aaa", html_file_path=tracked),
+        # Строка ссылается на другой путь - файл в каталоге ничей
+        SimpleNamespace(report_hash="bbb", html_file_path="/elsewhere/report_bbb.html"),
+    ])
+    _use_session(monkeypatch, session)
+    reconciler = StorageReconciler(str(tmp_path))
+    scheduled = []
+    monkeypatch.setattr(reconciler, "_schedule_reingest", scheduled.append)
+
+    await reconciler._reconcile_storage_batch()
+
+    assert sorted(scheduled) == sorted([moved, legacy])
+    assert reconciler.counters["files_checked"] == 3
+
+
+@pytest.mark.asyncio
+async def test_db_batch_flags_missing_and_restored(monkeypatch, tmp_path):
+    present = _write(tmp_path, "report_bbb.html")
+    missing_id, restored_id, ok_id = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    generated_at = datetime(2024, 5, 1)
+    session = _Session([
+        SimpleNamespace(report_hash="aaa", id=missing_id, generated_at=generated_at,
+                        html_file_path=str(tmp_path / "gone.html"), processing_status=STATUS_PROCESSED),
+        SimpleNamespace(report_hash="bbb", id=restored_id, generated_at=generated_at,
+                        html_file_path=present, processing_status=STATUS_FILE_MISSING),
+        SimpleNamespace(report_hash="ccc", id=ok_id, generated_at=generated_at,
+                        html_file_path=present, processing_status=STATUS_PROCESSED),
+    ])
+    _use_session(monkeypatch, session)
+    invalidated = []
+
+    async def delete_many(category, keys):
+        invalidated.append((category, keys))
+
+    monkeypatch.setattr(redis_client.cache, "delete_many", delete_many)
+    reconciler = StorageReconciler(str(tmp_path))
+    reconciler.batch_size = 3
+
+    await reconciler._reconcile_db_batch()
+
+    assert [params["processing_status"] for params in session.updates] == [STATUS_FILE_MISSING, STATUS_PROCESSED]
+    assert session.committed
+    assert reconciler.counters["rows_flagged_missing"] == 1
+    assert reconciler.counters["rows_restored"] == 1
+    assert reconciler.missing_files[0]["report_id"] == str(missing_id)
+    assert invalidated[0] == ("summaries", [str(missing_id), str(restored_id)])
+
+    # Полная пачка - курсор продолжает с последнего хеша
+    assert reconciler._db_cursor == "ccc"
+    assert reconciler.counters["db_sweeps"] == 0
+
+
+@pytest.mark.asyncio
+async def test_db_cursor_restarts_after_short_batch(monkeypatch, tmp_path):
+    _use_session(monkeypatch, _Session())
+    reconciler = StorageReconciler(str(tmp_path))
+    reconciler._db_cursor = "zzz"
+
+    await reconciler._reconcile_db_batch()
+
+    assert reconciler._db_cursor == ""
+    assert reconciler.counters["db_sweeps"] == 1
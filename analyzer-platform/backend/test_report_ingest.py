@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Тесты сохранения распарсенных отчетов (services/report_ingest.py)
+
+Сессия БД заменяется заглушкой, записывающей запросы.
+"""
+
+import ipaddress
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from models.report import Melt, NetworkPort
+from services import partitioning, report_ingest
+from services.endpoints import is_local_ip
+from services.report_ingest import (
+    REPORT_HASH_LOCK_NAMESPACE, _identity_key, _replace_children, build_interface_rows, build_melt_values,
+    build_raw_data, build_remote_host_rows, load_raw_data, upsert_parsed_report
+)
+
+GENERATED_AT = datetime(2024, 5, 1, 12, 0)
+
+
+class _Result:
+    def __init__(self, value=None, rows=()):
+        self.value = value
+        self.rows = list(rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def one(self):
+        return self.value
+
+    def one_or_none(self):
+        return self.value
+
+    def scalar_one_or_none(self):
+        return self.value
+
+
+class _Row(tuple):
+    """Строка результата: id и колонки identity по позиции"""
+
+    def __new__(cls, row, identity):
+        instance = super().__new__(cls, (row.id, *(getattr(row, column) for column in identity)))
+        instance.id = row.id
+        return instance
+
+
+class _Session:
+    """Сессия, записывающая запросы; execute отдает заранее заданные результаты"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.statements = []
+
+    async def execute(self, statement, params=None):
+        self.statements.append((statement, params))
+        return self.results.pop(0) if self.results else _Result()
+
+
+def test_raw_data_excludes_normalized_parts():
+    parsed = {
+        "hostname": "web-01",
+        "last_update": GENERATED_AT,
+        "connections": [{"local": "10.0.0.1:22"}],
+        "ports": {"tcp": [22]},
+        "change_history": [{"event": "x"}],
+        "network_interfaces": [{"name": "eth0"}],
+        "system_info": {"boot": [GENERATED_AT]},
+    }
+    assert build_raw_data(parsed) == {
+        "hostname": "web-01",
+        "last_update": "2024-05-01T12:00:00",
+        "system_info": {"boot": ["2024-05-01T12:00:00"]},
+    }
+
+
+def test_raw_data_loaded_only_explicitly():
+    assert Melt.raw.property.lazy == "raise"
+    assert "report_raw_data" in partitioning.child_tables()
+
+
+@pytest.mark.asyncio
+async def test_load_raw_data_reads_side_table():
+    melt = SimpleNamespace(id=uuid.uuid4(), generated_at=GENERATED_AT)
+    session = _Session(_Result({"hostname": "web-01"}))
+
+    assert await load_raw_data(session, melt) == {"hostname": "web-01"}
+
+    statement, _ = session.statements[0]
+    assert [column.name for column in statement.selected_columns] == ["data"]
+    assert statement.compile().params == {"report_id_1": melt.id, "report_generated_at_1": GENERATED_AT}
+
+
+@pytest.fixture
+def upsert_calls(monkeypatch):
+    """Заменяет секции, вставку и замену на месте записью вызовов"""
+    calls = []
+
+    async def ensure_partitions_for(generated_at):
+        calls.append(("partitions", generated_at))
+
+    async def insert_report(db, parsed_data, values, melt_id):
+        calls.append(("insert", melt_id))
+        return SimpleNamespace(id=melt_id)
+
+    async def replace_in_place(db, parsed_data, values, melt_id):
+        calls.append(("replace", melt_id))
+        return SimpleNamespace(id=melt_id)
+
+    monkeypatch.setattr(report_ingest, "ensure_partitions_for", ensure_partitions_for)
+    monkeypatch.setattr(report_ingest, "_insert_report", insert_report)
+    monkeypatch.setattr(report_ingest, "_replace_report_in_place", replace_in_place)
+    return calls
+
+
+def _parsed():
+    return {"hostname": "web-01", "generated_at": GENERATED_AT.isoformat(), "ports": {"tcp": [22], "udp": [53, 123]}}
+
+
+def test_melt_values():
+    values = build_melt_values(_parsed(), "h1", "/data/report_h1.html", 1024)
+    assert values["generated_at"] == GENERATED_AT
+    assert (values["tcp_ports_count"], values["udp_ports_count"]) == (1, 2)
+    assert values["report_hash"] == "h1"
+    assert values["processing_status"] == "processed"
+
+
+@pytest.mark.asyncio
+async def test_new_hash_locks_then_registers(upsert_calls):
+    report_id = uuid.uuid4()
+    registered = SimpleNamespace(report_id=report_id, generated_at=GENERATED_AT, inserted=True)
+    session = _Session(_Result(), _Result(registered))
+
+    melt, replaced = await upsert_parsed_report(session, _parsed(), "h1", "/data/report_h1.html", 1024, str(report_id))
+
+    assert replaced is None
+    assert melt.id == report_id
+    assert upsert_calls == [("partitions", GENERATED_AT), ("insert", report_id)]
+
+    # Блокировка хеша - первый запрос транзакции, до регистрации в реестре
+    lock, params = session.statements[0]
+    assert "pg_advisory_xact_lock" in str(lock)
+    assert params == {"namespace": REPORT_HASH_LOCK_NAMESPACE, "report_hash": "h1"}
+    registry = str(session.statements[1][0])
+    assert registry.startswith("INSERT INTO report_hashes")
+    assert "ON CONFLICT (report_hash) DO UPDATE" in registry
+
+
+@pytest.mark.asyncio
+async def test_same_date_replaced_in_place(upsert_calls):
+    report_id = uuid.uuid4()
+    registered = SimpleNamespace(report_id=report_id, generated_at=GENERATED_AT, inserted=False)
+    previous = SimpleNamespace(hostname="web-01", html_file_path="/data/old.html")
+    session = _Session(_Result(), _Result(registered), _Result(previous))
+
+    melt, replaced = await upsert_parsed_report(session, _parsed(), "h1", "/data/report_h1.html", 1024)
+
+    # Замена сохраняет ID отчета, даже если новый ID не передан
+    assert melt.id == report_id
+    assert upsert_calls[-1] == ("replace", report_id)
+    assert replaced == {
+        "id": str(report_id),
+        "hostname": "web-01",
+        "generated_at": GENERATED_AT.isoformat(),
+        "file_path": "/data/old.html",
+        "report_hash": "h1",
+    }
+
+
+def test_identity_key_hashes_arrays():
+    assert _identity_key([1, ["ports", "processes"], None]) == (1, ("ports", "processes"), None)
+    hash(_identity_key([["a"]]))
+
+
+@pytest.mark.asyncio
+async def test_replace_children_keeps_matching_rows(monkeypatch):
+    inserted = []
+
+    async def insert_chunked(db, model, rows):
+        inserted.extend(rows)
+
+    monkeypatch.setattr(report_ingest, "_insert_chunked", insert_chunked)
+    identity = ("port_number", "protocol")
+    existing = [
+        SimpleNamespace(id=1, port_number=22, protocol="tcp"),
+        SimpleNamespace(id=2, port_number=22, protocol="tcp"),
+        SimpleNamespace(id=3, port_number=80, protocol="tcp"),
+    ]
+    session = _Session(_Result(rows=[_Row(row, identity) for row in existing]))
+    new_rows = [{"port_number": 22, "protocol": "tcp"}, {"port_number": 443, "protocol": "tcp"}]
+
+    counts = await _replace_children(session, NetworkPort, uuid.uuid4(), GENERATED_AT, new_rows, identity)
+
+    # Одна из двух строк 22/tcp остается, вторая и 80/tcp удаляются
+    assert counts == {"kept": 1, "deleted": 2, "inserted": 1}
+    assert inserted == [{"port_number": 443, "protocol": "tcp"}]
+    deleted_ids = session.statements[1][0].compile().params["id_1"]
+    assert sorted(deleted_ids) == [1, 3]
+
+
+def test_remote_hosts_aggregated_by_ip():
+    ip, local_ip = ipaddress.ip_address("203.0.113.9"), ipaddress.ip_address("10.0.0.5")
+    earlier, later = GENERATED_AT - timedelta(hours=1), GENERATED_AT
+    rows = build_remote_host_rows([
+        {"remote_ip": ip, "remote_hostname": "cdn.example", "first_seen": later, "last_seen": later},
+        {"remote_ip": ip, "remote_hostname": "edge.example", "first_seen": earlier},
+        {"remote_ip": ip, "remote_hostname": "cdn.example", "last_seen": later},
+        {"remote_ip": local_ip},
+        {"remote_ip": None, "remote_hostname": "ignored"},
+    ])
+    assert rows == [
+        {"ip_address": "203.0.113.9", "hostname": "cdn.example", "connection_count": 3,
+         "first_seen": earlier, "last_seen": later, "is_local": False},
+        {"ip_address": "10.0.0.5", "hostname": None, "connection_count": 1,
+         "first_seen": None, "last_seen": None, "is_local": True},
+    ]
+
+
+def test_local_networks():
+    local = ("10.1.2.3", "172.31.0.1", "192.168.1.1", "127.0.0.1", "169.254.1.1", "::1", "fd00::1", "fe80::1")
+    assert all(is_local_ip(ipaddress.ip_address(ip)) for ip in local)
+    assert not any(is_local_ip(ipaddress.ip_address(ip)) for ip in ("172.32.0.1", "8.8.8.8", "2001:db8::1"))
+    assert not is_local_ip(None)
+
+
+def test_interface_rows_skip_unnamed():
+    rows = build_interface_rows([
+        {"interface_name": " eth0 ", "packets_in": 10, "bytes_in": None},
+        {"interface_name": ""},
+        {"packets_in": 5},
+    ])
+    assert rows == [{"interface_name": "eth0", "packets_in": 10, "packets_out": 0, "bytes_in": 0, "bytes_out": 0}]
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Тесты движка хранения (services/retention.py)
+
+БД заменяется записывающими заглушками соединений и сессий: проверяются
+выбор секций и отчетов, порядок удаления и освобождение файлов.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from core import database
+from services import partitioning
+from services.retention import RetentionEngine, _report_child_tables
+
+
+class _Result:
+    def __init__(self, rows=(), rowcount=0):
+        self._rows = list(rows)
+        self.rowcount = rowcount
+
+    def fetchall(self):
+        return self._rows
+
+
+class _Session:
+    """Сессия, записывающая SQL; первый SELECT возвращает заданные строки"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.statements = []
+
+    @asynccontextmanager
+    async def begin(self):
+        yield
+
+    async def execute(self, statement, params=None):
+        sql = " ".join(str(statement).split())
+        self.statements.append((sql, params or {}))
+        if sql.startswith("SELECT"):
+            return _Result(self.rows)
+        return _Result(rowcount=len(self.rows))
+
+
+class _Engine:
+    @asynccontextmanager
+    async def connect(self):
+        yield SimpleNamespace()
+
+    begin = connect
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(database, "async_engine", _Engine())
+    return RetentionEngine()
+
+
+def test_child_tables_follow_foreign_keys():
+    tables = _report_child_tables()
+    assert {"network_connections", "network_ports", "host_deltas", "anomaly_findings", "rule_alerts"} <= set(tables)
+    assert "system_reports" not in tables
+    assert "host_latest_deltas" not in tables
+
+
+@pytest.mark.asyncio
+async def test_batch_selects_by_generated_at(monkeypatch, engine):
+    row = SimpleNamespace(id="r1", hostname="web-01", html_file_path="/data/r1.html", report_hash="h1")
+    session = _Session([row])
+
+    @asynccontextmanager
+    async def factory():
+        yield session
+
+    monkeypatch.setattr(database, "async_session_factory", factory)
+    cutoff = datetime(2024, 1, 1)
+
+    deleted = await engine._delete_batch(cutoff, ["network_connections", "network_ports"])
+
+    assert deleted == [("r1", "web-01", "/data/r1.html")]
+    select_sql, params = session.statements[0]
+    assert "WHERE generated_at < :cutoff" in select_sql
+    assert "ORDER BY generated_at" in select_sql
+    assert "FOR UPDATE SKIP LOCKED" in select_sql
+    assert params["cutoff"] == cutoff
+
+    # Дочерние строки удаляются раньше отчетов, реестр хешей - вместе с ними
+    order = [sql.split(" WHERE")[0] for sql, _ in session.statements[1:]]
+    assert order == [
+        "DELETE FROM network_connections",
+        "DELETE FROM network_ports",
+        "DELETE FROM system_reports",
+        "DELETE FROM report_hashes",
+    ]
+    assert engine.progress["reports_deleted"] == 1
+    assert engine.progress["rows_deleted"]["system_reports"] == 1
+
+
+@pytest.mark.asyncio
+async def test_batches_until_short_batch(monkeypatch, engine):
+    engine.batch_size = 2
+    engine.batch_pause = 0
+    batches = [
+        [("r1", "web-01", None), ("r2", "web-02", None)],
+        [("r3", "web-01", None)],
+        [("never", "web-09", None)],
+    ]
+    refreshed = []
+
+    async def delete_batch(cutoff, child_tables):
+        return batches.pop(0)
+
+    async def refresh_aggregates(report_ids, hostnames):
+        refreshed.append((report_ids, hostnames))
+
+    monkeypatch.setattr(engine, "_delete_batch", delete_batch)
+    monkeypatch.setattr(engine, "_refresh_aggregates", refresh_aggregates)
+
+    await engine._delete_in_batches(datetime(2024, 1, 1))
+
+    assert refreshed == [(["r1", "r2"], ["web-01", "web-02"]), (["r3"], ["web-01"])]
+    assert len(batches) == 1
+
+
+@pytest.mark.asyncio
+async def test_drops_only_fully_expired_months(monkeypatch, engine, tmp_path):
+    months = [datetime(2024, 1, 1), datetime(2024, 2, 1), datetime(2024, 3, 1)]
+    report_file = tmp_path / "r1.html"
+    report_file.write_text("<html></html>")
+    dropped, refreshed = [], []
+
+    async def list_partition_months(conn):
+        return months
+
+    async def drop_month_partition(conn, month):
+        dropped.append(month)
+        return {
+            "partition": partitioning.partition_name("system_reports", month),
+            "report_ids": [f"r{month.month}"],
+            "hostnames": ["web-01"],
+            "file_paths": [str(report_file)] if month.month == 1 else [],
+        }
+
+    async def refresh_aggregates(report_ids, hostnames):
+        refreshed.append(report_ids)
+
+    monkeypatch.setattr(partitioning, "list_partition_months", list_partition_months)
+    monkeypatch.setattr(partitioning, "drop_month_partition", drop_month_partition)
+    monkeypatch.setattr(engine, "_refresh_aggregates", refresh_aggregates)
+
+    # Февраль еще содержит отчеты новее срока - остается вместе с мартом
+    await engine._drop_expired_partitions(datetime(2024, 2, 20))
+
+    assert dropped == [datetime(2024, 1, 1)]
+    assert refreshed == [["r1"]]
+    assert engine.progress["partitions_dropped"] == ["system_reports_p202401"]
+
+    await asyncio.gather(*engine._file_tasks)
+    assert not report_file.exists()
+    assert engine.progress["files_removed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_reclaim_archives_or_ignores_missing(engine, tmp_path):
+    engine.archive_dir = str(tmp_path / "archive")
+    report_file = tmp_path / "r1.html"
+    report_file.write_text("<html></html>")
+
+    await engine._reclaim_file(str(report_file))
+    await engine._reclaim_file(str(tmp_path / "missing.html"))
+
+    assert (tmp_path / "archive" / "r1.html").exists()
+    assert engine.progress["files_archived"] == 1
+    assert engine.progress["files_failed"] == 0
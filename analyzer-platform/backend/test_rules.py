@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Тесты проверки и компиляции правил оповещений (services/rules.py)
+
+Правила без имен процессов компилируются без обращения к справочникам БД.
+"""
+
+import ipaddress
+
+import pytest
+
+from core.config import get_settings
+from models.report import AlertRule
+from services.rules import PrefixTrie, RuleError, compile_rules, validate_definition
+
+
+def _rule(rule_id, definition, severity="warning"):
+    return AlertRule(id=rule_id, name=f"rule-{rule_id}", severity=severity, definition=validate_definition(definition))
+
+
+def _connection(remote_ip, remote_port, direction="outgoing"):
+    return {
+        "process_name_id": None,
+        "connection_type": direction,
+        "remote_ip": ipaddress.ip_address(remote_ip),
+        "remote_port": remote_port,
+    }
+
+
+def test_validate_definition_normalizes():
+    assert validate_definition({"type": "port", "ports": ["23", "UDP/161"], "hosts": "web-*"}) == {
+        "type": "port",
+        "hosts": ["web-*"],
+        "ports": ["tcp/23", "udp/161"],
+    }
+    connection = validate_definition({"type": "connection", "remote_cidrs": "10.1.2.3/8", "remote_ports": 443})
+    assert connection["remote_cidrs"] == ["10.0.0.0/8"]
+    assert connection["remote_ports"] == ["443-443"]
+
+
+@pytest.mark.parametrize("definition", [
+    None,
+    {"type": "unknown"},
+    {"type": "port"},
+    {"type": "port", "ports": ["tcp/99999"]},
+    {"type": "connection"},
+    {"type": "connection", "direction": "sideways", "remote_ports": "22"},
+    {"type": "connection", "remote_cidrs": "not-a-network"},
+    {"type": "metric", "metric": "unknown", "op": ">", "value": 1},
+    {"type": "metric", "metric": "total_connections", "op": "!=", "value": 1},
+    {"type": "metric", "metric": "total_connections", "op": ">", "value": True},
+])
+def test_validate_definition_rejects(definition):
+    with pytest.raises(RuleError):
+        validate_definition(definition)
+
+
+def test_prefix_trie_matches_all_containing_networks():
+    trie = PrefixTrie()
+    trie.insert(ipaddress.ip_network("10.0.0.0/8"), "wide")
+    trie.insert(ipaddress.ip_network("10.1.0.0/16"), "narrow")
+    trie.insert(ipaddress.ip_network("2001:db8::/32"), "v6")
+
+    def match(address):
+        ip = ipaddress.ip_address(address)
+        return trie.match(ip.version, int(ip))
+
+    assert match("10.1.2.3") == {"wide", "narrow"}
+    assert match("10.2.0.1") == {"wide"}
+    assert match("192.168.0.1") == set()
+    assert match("2001:db8::1") == {"v6"}
+
+
+@pytest.mark.asyncio
+async def test_port_rules_respect_host_patterns():
+    compiled = await compile_rules([
+        _rule(1, {"type": "port", "ports": ["23"]}),
+        _rule(2, {"type": "port", "ports": ["23"], "hosts": ["db-*"]}),
+    ])
+    ports = [{"protocol": "TCP", "port_number": 23}, {"protocol": "tcp", "port_number": 80}]
+
+    assert compiled.evaluate("web-01", {}, [], ports) == {1: [{"port": "tcp/23"}]}
+    assert set(compiled.evaluate("db-01", {}, [], ports)) == {1, 2}
+
+
+@pytest.mark.asyncio
+async def test_metric_thresholds():
+    compiled = await compile_rules([
+        _rule(1, {"type": "metric", "metric": "total_connections", "op": ">", "value": 100}),
+        _rule(2, {"type": "metric", "metric": "total_connections", "op": ">", "value": 500}),
+        _rule(3, {"type": "metric", "metric": "total_connections", "op": "<=", "value": 100}),
+        _rule(4, {"type": "metric", "metric": "total_connections", "op": "==", "value": 100}),
+        _rule(5, {"type": "metric", "metric": "total_connections", "op": ">=", "value": 100}),
+    ])
+
+    def fired(value):
+        return set(compiled.evaluate("web-01", {"total_connections": value}, [], []))
+
+    assert fired(100) == {3, 4, 5}
+    assert fired(101) == {1, 5}
+    assert fired(1000) == {1, 2, 5}
+    assert fired(0) == {3}
+
+
+@pytest.mark.asyncio
+async def test_connection_rules_with_cidrs_ports_and_direction():
+    compiled = await compile_rules([
+        _rule(1, {"type": "connection", "direction": "outgoing", "exclude_cidrs": ["10.0.0.0/8"]}),
+        _rule(2, {"type": "connection", "remote_cidrs": ["203.0.113.0/24"], "remote_ports": ["1-1024"]}),
+    ])
+
+    assert compiled.evaluate("web-01", {}, [_connection("10.0.0.5", 443)], []) == {}
+    assert set(compiled.evaluate("web-01", {}, [_connection("198.51.100.7", 443)], [])) == {1}
+    assert set(compiled.evaluate("web-01", {}, [_connection("203.0.113.9", 22)], [])) == {1, 2}
+    assert set(compiled.evaluate("web-01", {}, [_connection("203.0.113.9", 8080, "incoming")], [])) == set()
+
+
+@pytest.mark.asyncio
+async def test_samples_limited_and_deduplicated():
+    compiled = await compile_rules([_rule(1, {"type": "connection", "remote_ports": ["1-65535"]})])
+    connections = [_connection("198.51.100.7", 443)] * 3 + [_connection(f"198.51.100.{i}", 443) for i in range(20)]
+
+    samples = compiled.evaluate("web-01", {}, connections, [])[1]
+    limit = get_settings().RULES_SAMPLES_PER_ALERT
+    assert len(samples) == limit
+    assert len({sample["remote"] for sample in samples}) == limit
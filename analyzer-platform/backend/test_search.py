@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Тесты поискового API (services/search.py)
+
+Поисковики по таблицам и кэш результатов заменяются заглушками.
+"""
+
+import pytest
+
+from core.config import get_settings
+from services import search as search_module
+from services.search import SearchQueryError, _like_pattern, make_query_hash, search
+
+settings = get_settings()
+
+
+@pytest.fixture
+def searched(monkeypatch):
+    """Записывает вызванные поисковики; кэш всегда пуст"""
+    calls = []
+    stored = {}
+
+    def searcher(search_type):
+        async def run(db, query, page, page_size):
+            calls.append((search_type, query, page, page_size))
+            return {"total": 2, "hits": []}
+        return run
+
+    async def get_cached(query_hash):
+        return stored.get(query_hash)
+
+    async def cache_results(query_hash, response, ttl):
+        stored[query_hash] = response
+
+    monkeypatch.setattr(search_module, "_SEARCHERS", {t: searcher(t) for t in search_module.SEARCH_TYPES})
+    monkeypatch.setattr(search_module, "get_cached_search_results", get_cached)
+    monkeypatch.setattr(search_module, "cache_search_results", cache_results)
+    return calls
+
+
+def test_like_pattern_escapes_wildcards():
+    assert _like_pattern("web_01") == "%web\\_01%"
+    assert _like_pattern("100%") == "%100\\%%"
+    assert _like_pattern("a\\b") == "%a\\\\b%"
+
+
+def test_query_hash_normalized():
+    assert make_query_hash(" Nginx ", ["processes", "hosts"], 1, 50) == make_query_hash("nginx", ["hosts", "processes"], 1, 50)
+    assert make_query_hash("nginx", ["hosts"], 1, 50) != make_query_hash("nginx", ["hosts"], 2, 50)
+
+
+@pytest.mark.asyncio
+async def test_numeric_query_searches_ports(searched):
+    response = await search(None, "443", page=2, page_size=10)
+    assert [call[0] for call in searched] == ["hosts", "processes", "addresses", "ports"]
+    assert response["total"] == 8
+    assert searched[-1] == ("ports", "443", 2, 10)
+
+
+@pytest.mark.asyncio
+async def test_text_query_skips_ports(searched):
+    response = await search(None, "  nginx ")
+    assert response["query"] == "nginx"
+    assert response["types"] == ["hosts", "processes", "addresses"]
+
+
+@pytest.mark.asyncio
+async def test_repeated_query_served_from_cache(searched):
+    first = await search(None, "nginx", types=["processes"])
+    assert await search(None, "NGINX ", types=["processes"]) == first
+    assert len(searched) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("query,types", [
+    ("", search_module.SEARCH_TYPES),
+    ("x" * (settings.SEARCH_MIN_QUERY_LENGTH - 1), ["hosts"]),
+    ("nginx", ["ports"]),
+    ("70000", ["ports"]),
+    ("nginx", ["users"]),
+])
+async def test_invalid_queries_rejected(searched, query, types):
+    with pytest.raises(SearchQueryError):
+        await search(None, query, types=types)
+    assert searched == []